@@ -3,6 +3,7 @@ import signal
 import useinstruments
 import qt
 import time
+from lib.sweepplan import SweepPlan, CanonicalWriter, ramp_cost, choose_order
 
 def createvectors(settings):
     global v_dac
@@ -102,80 +103,66 @@ def createplots(settings):
         global plot3d3
         plot3d3 = qt.Plot3D(data, name='measure3D_%s' %(settings['inputlabel'][2]), coorddim=(0,1), valdim=settings['number_of_sweeps']+2, style='image')
 
+def _dac_ramp_cost(dacname):
+    if int(dacname[3:]) == 0:
+        return None
+    try:
+        return ramp_cost(useinstruments.ivvi.get_parameter_options(dacname))
+    except Exception:
+        return None
+
+def createplan(settings):
+    '''
+    Compile the sweep into a SweepPlan. settings['sweep_order'] can be
+    'raster' (default), 'serpentine' or 'auto'; the latter chooses the
+    ordering with the least ramp time from the maxstep / stepdelay of
+    the dacs.
+    '''
+    nsweeps = settings['number_of_sweeps']
+    axes = vector_array[:nsweeps]
+    order = settings.get('sweep_order', 'raster')
+    if order == 'serpentine':
+        return SweepPlan(axes, serpentine=True)
+    elif order == 'auto':
+        costs = [_dac_ramp_cost(dac) for dac in instrument_array[:nsweeps]]
+        best = choose_order(axes, costs)
+        print 'Sweep order: serpentine %s, estimated ramp time %d s' % \
+            (best['serpentine'], best['dead_time'])
+        return SweepPlan(axes, serpentine=best['serpentine'])
+    return SweepPlan(axes)
+
 def measurementloop(settings):
-    number_of_traces = 1		
-    for idx in range(settings['number_of_sweeps']-1):
+    nsweeps = settings['number_of_sweeps']
+    plan = createplan(settings)
+    writer = CanonicalWriter(data, plan)
+
+    number_of_traces = 1
+    for idx in range(nsweeps-1):
         number_of_traces = number_of_traces*len(vector_array[idx+1])
 
-	print('total number of traces: %d' %(number_of_traces))
-	total_traces=number_of_traces
-	starttime = time.time()
-
-    for v1 in vector_array[settings['number_of_sweeps']-1]:
-        useinstruments.execute_set(settings,instrument_array[settings['number_of_sweeps']-1],v1)
-        if settings['number_of_sweeps'] > 1:
-            for v2 in vector_array[settings['number_of_sweeps']-2]:
-                useinstruments.execute_set(settings,instrument_array[settings['number_of_sweeps']-2],v2)
-                if settings['number_of_sweeps'] > 2:
-                    for v3 in vector_array[settings['number_of_sweeps']-3]:
-                        useinstruments.execute_set(settings,instrument_array[settings['number_of_sweeps']-3],v3)
-                        if settings['number_of_sweeps'] > 3:
-                            for v4 in vector_array[settings['number_of_sweeps']-4]:
-                                useinstruments.execute_set(settings,instrument_array[settings['number_of_sweeps']-2],v4)
-                                if settings['number_of_sweeps'] > 4:
-                                    for v5 in vector_array[settings['number_of_sweeps']-5]:
-                                        useinstruments.execute_set(settings,instrument_array[settings['number_of_sweeps']-5],v5)
-                                        useinstruments.measure_inputs(settings,I_gain)
-                                        data.add_data_point(v5,v4,v3,v2,v1,useinstruments.result[0],useinstruments.result[1],useinstruments.result[2])
-                                        qt.msleep(float(settings['pause2']))
-                                        update_2d_plots(settings)
-                                    data.new_block()
-                                    qt.msleep(float(settings['pause1']))
-                                    update_3d_plots(settings)
-                                    totaltime= number_of_traces*(time.time()-starttime)/(total_traces-number_of_traces+1)
-                                    print ('Time of measurement left: %d hours, %d minutes and %d seconds' %(floor(totaltime/3600),floor(fmod(totaltime,3600)/60),fmod(totaltime,60)))
-                                    number_of_traces= number_of_traces-1
-                                else:
-                                    useinstruments.measure_inputs(settings,I_gain)
-                                    data.add_data_point(v4,v3,v2,v1,useinstruments.result[0],useinstruments.result[1],useinstruments.result[2])
-                                    qt.msleep(float(settings['pause2']))
-                                    update_2d_plots(settings)
-                            if settings['number_of_sweeps'] == 4:
-                                data.new_block()
-                                qt.msleep(float(settings['pause1']))
-                                update_3d_plots(settings)
-                                totaltime= number_of_traces*(time.time()-starttime)/(total_traces-number_of_traces+1)
-                                print ('Time of measurement left: %d hours, %d minutes and %d seconds' %(floor(totaltime/3600),floor(fmod(totaltime,3600)/60),fmod(totaltime,60)))
-                                number_of_traces= number_of_traces-1
-                        else:
-                            useinstruments.measure_inputs(settings,I_gain)
-                            data.add_data_point(v3,v2,v1,useinstruments.result[0],useinstruments.result[1],useinstruments.result[2])
-                            qt.msleep(float(settings['pause2']))
-                            update_2d_plots(settings)
-                    if settings['number_of_sweeps']==3:
-                        data.new_block()
-                        qt.msleep(float(settings['pause1']))
-                        update_3d_plots(settings)                        
-                        totaltime= number_of_traces*(time.time()-starttime)/(total_traces-number_of_traces+1)
-                        print ('Time of measurement left: %d hours, %d minutes and %d seconds' %(floor(totaltime/3600),floor(fmod(totaltime,3600)/60),fmod(totaltime,60)))
-                        number_of_traces= number_of_traces-1
-                else:
-                    useinstruments.measure_inputs(settings,I_gain)
-                    data.add_data_point(v2,v1,useinstruments.result[0],useinstruments.result[1],useinstruments.result[2])
-                    qt.msleep(float(settings['pause2']))
-                    update_2d_plots(settings)                    
-            if settings['number_of_sweeps']==2:
+    print('total number of traces: %d' %(number_of_traces))
+    total_traces=number_of_traces
+    starttime = time.time()
+
+    # The outer sweeps are set first, only the values that change are set
+    for i in xrange(plan.get_npoints()):
+        for axis in reversed(plan.get_changed_axes(i)):
+            useinstruments.execute_set(settings, instrument_array[axis],
+                plan.get_coord(i, axis))
+
+        useinstruments.measure_inputs(settings,I_gain)
+        writer.add(i, useinstruments.result[0:3])
+        qt.msleep(float(settings['pause2']))
+        update_2d_plots(settings)
+
+        if nsweeps > 1 and (plan.is_block_end(i) or i == plan.get_npoints() - 1):
+            if i == plan.get_npoints() - 1:
                 data.new_block()
-                qt.msleep(float(settings['pause1']))
-                update_3d_plots(settings)                
-                totaltime= number_of_traces*(time.time()-starttime)/(total_traces-number_of_traces+1)
-                print ('Time of measurement left: %d hours, %d minutes and %d seconds' %(floor(totaltime/3600),floor(fmod(totaltime,3600)/60),fmod(totaltime,60)))
-                number_of_traces= number_of_traces-1
-        else:
-            useinstruments.measure_inputs(settings,I_gain)
-            data.add_data_point(v1,useinstruments.result[0],useinstruments.result[1],useinstruments.result[2])
-            qt.msleep(float(settings['pause2']))
-            update_2d_plots(settings)            
+            qt.msleep(float(settings['pause1']))
+            update_3d_plots(settings)
+            totaltime= number_of_traces*(time.time()-starttime)/(total_traces-number_of_traces+1)
+            print ('Time of measurement left: %d hours, %d minutes and %d seconds' %(floor(totaltime/3600),floor(fmod(totaltime,3600)/60),fmod(totaltime,60)))
+            number_of_traces= number_of_traces-1
 
     if settings['plot2d'][0] and settings['input'][0]!=0:
         plot2d1_end = qt.Plot2D(data, name='measure2D_%s_end' %(settings['inputlabel'][0]), coorddim=0, valdim=settings['number_of_sweeps'], maxpoints=1e6 ,maxtraces=1e3)
@@ -5,6 +5,7 @@ import time
 import signal
 from threading import Thread
 import pickle
+from lib.adaptive import Refiner2D, adaptive_sweep
 
 class Stabgui:
 	def __init__(self):
@@ -254,6 +255,11 @@ class Stabgui:
 		data.add_coordinate('V2 [mV]')
 		data.add_coordinate('V1 [mV]')
 		data.add_value('I [nA]')
+		# An adaptive scan measures every 2**level-th point first and
+		# only refines near features, see lib/adaptive.py
+		adaptive = self.settings.get('adaptive', False) and number_of_dynamic_dacs == 2
+		if adaptive:
+			data.add_value('refinement level')
 
 		# Ramp static dacs
 		for idx,dac in enumerate(v_dac):
@@ -273,12 +279,35 @@ class Stabgui:
 		if self.settings['plot2d']:
 			plot2d = qt.Plot2D(data, name='measure2D', coorddim=0, valdim=2, maxtraces=1)
 		if self.settings['plot3d']:
-			plot3d = qt.Plot3D(data, name='measure3D', coorddims=(0,1), valdim=2, style='image')
+			if adaptive:
+				plot3d = qt.Plot3D(data, name='measure3D', coorddims=(0,1), valdim=2, style='scatter')
+			else:
+				plot3d = qt.Plot3D(data, name='measure3D', coorddims=(0,1), valdim=2, style='image')
 
 		print 'measurement started'				
 		# preparation is done, now start the measurement.
 		# It is actually a simple loop.
-		if number_of_dynamic_dacs == 2:
+		if adaptive:
+			level = self.settings.get('adaptive_level', 3)
+			sweeps = []
+			for vec in (v_vec[1], v_vec[0]):
+				steps = (len(vec) - 1) / 2**level + 1
+				sweeps.append((vec[0], vec[(steps - 1) * 2**level], steps))
+			refiner = Refiner2D(sweeps[0], sweeps[1], max_level=level,
+				threshold=self.settings.get('adaptive_threshold', 0.05))
+			def measure_point(coords, level):
+				ivvi.set(v_dac[1], coords[0])
+				ivvi.set(v_dac[0], coords[1])
+				sleep(0.005)
+				result = NIDev1.get('ai0')*(1000/I_gain)
+				data.add_data_point(coords[0], coords[1], result, level)
+				return result
+			n = adaptive_sweep(refiner, measure_point,
+				max_points=self.settings.get('adaptive_points', None))
+			print 'adaptive scan: %d of %d points measured' % (n, len(v_vec[0])*len(v_vec[1]))
+			if self.settings['plot3d']:
+				plot3d.update()
+		elif number_of_dynamic_dacs == 2:
 			for v1 in v_vec[0]:
 				ivvi.set(v_dac[0],v1)
 				sleep(0.020)
@@ -310,7 +339,7 @@ class Stabgui:
 		# after the measurement ends, you need to close the data file.
 		data.close_file()
 
-		if self.settings['plot2d']:
+		if self.settings['plot2d'] and number_of_dynamic_dacs == 2 and not adaptive:
 			plot2d_end.save_png()
 		if self.settings['plot3d']:
 			plot3d.save_png()
@@ -20,8 +20,8 @@ from instrument import Instrument
 import visa
 import types
 import logging
-from numpy import frombuffer, float32
 import math
+from lib import visafunc
 
 class RS_FSL6(Instrument):
     '''
@@ -72,7 +72,7 @@ class RS_FSL6(Instrument):
         if 'B22' in self._installed_options:
             logging.info('Option B22 (RF amplifier) is installed')
 
-        self._visainstrument.write('FORM REAL, 32')
+        self.set_transfer_format('binary')
 
         # Add parameters
         # frequency section
@@ -210,6 +210,9 @@ class RS_FSL6(Instrument):
         self.add_function('init_IQ_measurement')
         self.add_function('init_zero_span')
         self.add_function('init_trace_readout')
+        self.add_function('set_transfer_format')
+        self.add_function('get_trace_data')
+        self.add_function('get_IQ_data')
         self.add_function('start_sweep')
         self.add_function('stop_power_measurement')
         self.add_function('convert_dBuV_to_V')  # works but apparently not 
@@ -298,12 +301,12 @@ class RS_FSL6(Instrument):
         else:
             logging.error('invalid type %s' % type)
 
-    def init_IQ_measurement(self):
+    def init_IQ_measurement(self, mode='binary'):
         '''
         Initializes an I/Q measurement
 
         Input:
-            None
+            mode (string) : data format, 'binary' (REAL,32) or 'ASCII'
 
         Output:
             None
@@ -324,9 +327,7 @@ class RS_FSL6(Instrument):
         #filter: NORM, RBW: 10MHz, sample rate: 32 MHz, trigger source: 
         # external (EXT) / internal (IMM), trigger slope: positive, 
         #pretrigger samples: 0, numer of samples: 512
-        self._visainstrument.write('FORMat ASC') # selects format of response 
-                                                 # data (either REAL,32 or 
-                                                 # ASC for ASCII)
+        self.set_transfer_format(mode) # selects format of response data
         self._visainstrument.write('FREQ:CONT OFF')
         #return self._visainstrument.write('TRAC:IQ:DATA?')         #starts measurements and reads results
         #self._visainstrument.write('INIT;*WAI')             #apparently not necessary
@@ -393,7 +394,7 @@ class RS_FSL6(Instrument):
         self._visainstrument.write('INIT')
         #self._visainstrument.write('*WAI')
 
-    def init_trace_readout(self):
+    def init_trace_readout(self, mode='binary'):
         '''
         Read a trace
         p. 230 operating manual
@@ -405,14 +406,7 @@ class RS_FSL6(Instrument):
             None
         '''
         logging.debug(__name__ + ' : initialization of trace readout')
-        self._visainstrument.write('FORM ASC')
-        #if mode == 'ASCII':
-        #    self._visainstrument.write('FORM ASC')         
-        #elif mode == 'binary':
-        #    self._visainstrument.write('FORM REAL,32')      
-        #else: 
-        #    print 'Not a valid mode, function requires mode as argument, parameter either ASC for ASCII file or binary for binary file'
-        #    # ASCII file format, alternative: FORMat REAL,32 (binary file) / FORM ASC for ASCII
+        self.set_transfer_format(mode)
         ##self._visainstrument.write('MMEM:STOR:TRAC 1,'TEMPTRACE.DAT'')   
         #    #the previous command just creates a file locally on the analyer
         ##self._visainstrument.write('TRAC? TRACE1')
@@ -843,15 +837,20 @@ class RS_FSL6(Instrument):
             None
 
         Output:
-            IQresult (string) : either REAL,32 or ASCII, depending on choice 
-                                in init_IQ_measurement
+            IQresult (string) : comma separated values, transferred as
+                                REAL,32 or ASCII depending on the choice
+                                in init_IQ_measurement. Use get_IQ_data()
+                                to get the result as numpy arrays.
         '''
         logging.debug(__name__ + 
                 ' : reading result of I/Q measurement from instrument')
         #self._visainstrument.write('INIT,*WAI')        
         #self._visainstrument.write('*CLS')
         self._visainstrument.write('INIT') 
-        return self._visainstrument.ask('TRAC:IQ:DATA?')
+        if not self._binary:
+            return self._visainstrument.ask('TRAC:IQ:DATA?')
+        data = self._query_values('TRAC:IQ:DATA?')
+        return ','.join(['%.7e' % v for v in data])
         #self._visainstrument.write('INIT,*WAI')        
         #return self._visainstrument.ask('TRAC:IQ:DATA:MEM? 0,4096')
 
@@ -880,24 +879,77 @@ class RS_FSL6(Instrument):
         settings = self._visainstrument.ask('TRAC:IQ:SET?').split(',')
         return int(settings[-2])
 
+    def set_transfer_format(self, mode):
+        '''
+        Select the format for trace and I/Q data transfers. Binary data is
+        transferred as little endian 32 bit floats, which is much faster
+        than ASCII for long traces.
+
+        Input:
+            mode (string) : 'binary' or 'ASCII'
+
+        Output:
+            None
+        '''
+        logging.debug(__name__ + ' : setting transfer format to %s' % mode)
+        if mode == 'binary':
+            self._visainstrument.write('FORM REAL,32')
+            self._visainstrument.write('FORM:BORD SWAP')
+            self._binary = True
+        elif mode == 'ASCII':
+            self._visainstrument.write('FORM ASC')
+            self._binary = False
+        else:
+            raise ValueError('Transfer format should be binary or ASCII')
+
+    def _query_values(self, cmd):
+        '''
+        Send a query and return the reply as a numpy array, using the
+        selected transfer format. Falls back to ASCII if the binary
+        transfer fails.
+        '''
+        if self._binary:
+            try:
+                return visafunc.read_binary_values(self._visainstrument,
+                        cmd, '<f4')
+            except Exception, e:
+                logging.warning(__name__ + ' : binary transfer failed ' +
+                        '(%s), falling back to ASCII' % e)
+                self.set_transfer_format('ASCII')
+        return visafunc.read_ascii_values(self._visainstrument, cmd)
+
     def get_trace_data(self, trace_number=1):
         '''
         read out trace data from device
 
         Input:
-            None
+            trace_number (int) : trace to read, default 1
 
         Output:
             trace_data (numpy array)
         '''
         logging.debug(__name__ + 
-                    ' : reading result of I/Q measurement from instrument')
+                    ' : reading trace {0:d} from instrument'.format(
+                        trace_number))
 #        self._visainstrument.write('INIT,*WAI')
-        self._visainstrument.write(
-                'TRAC?  TRACE{0:d}'.format(trace_number))
-        trace = self._visainstrument.read_raw() # header + data + termination
-        trace_start = 2 + int(trace[1]) # second character is header length
-        return frombuffer(trace[trace_start:-1], dtype=float32)
+        return self._query_values('TRAC? TRACE{0:d}'.format(trace_number))
+
+    def get_IQ_data(self):
+        '''
+        Start an I/Q measurement and read the result
+
+        Input:
+            None
+
+        Output:
+            (I, Q) (numpy arrays)
+        '''
+        logging.debug(__name__ +
+                ' : reading I/Q data from instrument')
+        self._visainstrument.write('INIT')
+        data = self._query_values('TRAC:IQ:DATA?')
+        n = len(data) // 2
+        return data[:n], data[n:]
 
     def do_get_channel_power(self):
         '''
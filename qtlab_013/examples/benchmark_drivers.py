@@ -0,0 +1,132 @@
+# Benchmark of the QTLab layers with simulated instruments, see
+# lib/simvisa.py. Like test_speed.py, but with drivers that talk to a
+# (simulated) device through the VISA layer, so the time spent in the
+# transport, the Instrument wrapper and the Data object can be compared.
+#
+# Change LATENCY, BANDWIDTH and JITTER to model different connections,
+# e.g. GPIB (~1 ms, 1 MB/s), serial (~10 ms, 1 kB/s) or LAN (~0.2 ms).
+
+import qt
+import time
+import random
+from lib import simvisa
+
+LATENCY = 0.001
+BANDWIDTH = 1e5
+JITTER = 0.0002
+N = 200
+
+results = []
+
+def get_wait_time():
+    return sum([st['wait_time'] for st in simvisa.get_stats().values()])
+
+def run(name, func, n=N, nvalues=1):
+    wait = -get_wait_time()
+    start = time.time()
+    for i in xrange(n):
+        func()
+    stop = time.time()
+    wait += get_wait_time()
+    dt = (stop - start) / n
+    results.append((name, dt, wait / n))
+    print '%-40s %8.3f ms / call %8.0f values / s  (%2.0f%% waiting)' % \
+        (name, dt * 1000, nvalues / dt, 100.0 * wait / (stop - start))
+
+def setup_devices():
+    simvisa.set_defaults(latency=LATENCY, bandwidth=BANDWIDTH,
+        jitter=JITTER, seed=0)
+
+    lockin = simvisa.add_instrument('GPIB::8').get_responder()
+    lockin.add(r'\*IDN\?', 'Stanford_Research_Systems,SR830,s/n00000,ver1.07')
+    lockin.add(r'OUTP\?\s*(\d)', lambda m: '%.6e' % random.gauss(1e-3, 1e-5))
+    lockin.add(r'SNAP\?\s*([\d,]+)', lambda m: ','.join(['%.6e' % \
+        random.gauss(1e-3, 1e-5) for ch in m.group(1).split(',')]))
+
+    for address in ('GPIB::16', 'GPIB::17'):
+        dmm = simvisa.add_instrument(address).get_responder()
+        dmm.add(r'(READ|FETCH|DATA|DATA:FRESH)\?',
+            lambda m: '%+.8E' % random.gauss(0.1, 1e-6))
+        dmm.add(r':?(SENS:)?FUNC\?', '"VOLT:DC"')
+        dmm.add(r'.*:(RANG|NPLC|DIG)\?', '1')
+        dmm.add(r'SYST:ERR\?', '+0,"No error"')
+        # Triggered readout (READ?) instead of continuous triggering
+        dmm.add(r':?INIT:CONT\s+(ON|1)',
+            lambda m, dmm=dmm: dmm.set_value(':INIT:CONT', '1'))
+        dmm.add(r':?INIT:CONT\s+(OFF|0)',
+            lambda m, dmm=dmm: dmm.set_value(':INIT:CONT', '0'))
+        dmm.add(r':?INIT:CONT\?', lambda m, dmm=dmm: \
+            dmm.get_value(':INIT:CONT'))
+        dmm.add(r':?TRIG:SOUR\?', 'IMM')
+        dmm.add(r':?TRIG:COUN\?', '1')
+
+    simvisa.add_instrument('ASRL1::INSTR', simvisa.IVVIResponder())
+
+setup_devices()
+
+print 'Transport layer, SR830 at %.1f ms latency' % (LATENCY * 1000)
+dev = simvisa.instrument('GPIB::8')
+run('ask OUTP?1', lambda: dev.ask('OUTP?1'))
+run('4 x ask OUTP?i', lambda: [dev.ask('OUTP?%d' % i) for i in range(1, 5)],
+    nvalues=4)
+run('ask OUTP?1;OUTP?2;OUTP?3;OUTP?4',
+    lambda: dev.ask('OUTP?1;OUTP?2;OUTP?3;OUTP?4'), nvalues=4)
+run('ask SNAP?1,2,3,4', lambda: dev.ask('SNAP?1,2,3,4'), nvalues=4)
+
+print
+print 'Instrument layer'
+lockin = qt.instruments.create('sim_lockin', 'SRS_SR830',
+    address='GPIB::8', visa='sim')
+k2000 = qt.instruments.create('sim_k2000', 'Keithley_2000',
+    address='GPIB::16', visa='sim')
+k2000.set_trigger_continuous(False)
+hp = qt.instruments.create('sim_hp34401a', 'HP_34401A',
+    address='GPIB::17', visa='sim')
+ivvi = qt.instruments.create('sim_ivvi', 'IVVI', address='ASRL1::INSTR',
+    numdacs=16, visa='sim')
+
+run('SR830 do_get_X', lambda: lockin._ins.do_get_X())
+run('SR830 get_X(fast=True)', lambda: lockin.get_X(fast=True))
+run('SR830 get_X', lambda: lockin.get_X())
+run('Keithley_2000 get_readval', lambda: k2000.get_readval())
+run('HP_34401A get_readval', lambda: hp.get_readval())
+
+# Without ramping, so that both rows send the same messages. The sign of
+# the values alternates, so every call changes all dacs.
+for i in range(16):
+    ivvi.set_parameter_options('dac%d' % (i + 1), maxstep=None)
+vals = [random.uniform(10, 100) for i in range(16)]
+def set_dac_each():
+    vals[:] = [-v for v in vals]
+    for i in range(16):
+        ivvi.set('dac%d' % (i + 1), vals[i])
+def set_dacs():
+    vals[:] = [-v for v in vals]
+    ivvi.set_dacs(dict([(i + 1, vals[i]) for i in range(16)]))
+run('IVVI 16 x set_dac', set_dac_each, n=N/10, nvalues=16)
+run('IVVI set_dacs', set_dacs, n=N/10, nvalues=16)
+
+print
+print 'Data layer'
+data = qt.Data(name='benchmark_drivers')
+data.add_coordinate('index')
+data.add_value('X')
+data.add_value('V')
+data.create_file()
+counter = [0]
+def measure_point():
+    counter[0] += 1
+    data.add_data_point(counter[0], lockin.get_X(), k2000.get_readval())
+run('get X, V + add_data_point', measure_point, nvalues=2)
+def measure_point_msleep():
+    measure_point()
+    qt.msleep(0)
+run('idem + qt.msleep(0)', measure_point_msleep, nvalues=2)
+data.close_file()
+
+print
+simvisa.print_stats()
+
+for ins in (lockin, k2000, hp, ivvi):
+    qt.instruments.remove(ins.get_name())
+simvisa.set_visa('pyvisa')
@@ -0,0 +1,28 @@
+# File name: buffered_iv_sweep.py
+#
+# IV curve using the hardware-buffered sweep of the Keithley 2400: the
+# source values are uploaded, the sweep runs on the instrument and the
+# readings are transferred back in one binary block.
+#
+# This example should be run with "execfile('buffered_iv_sweep.py')"
+
+import numpy
+
+smu = qt.instruments.create('smu', 'Keithley_2400', address='GPIB::24',
+        reset=False)
+
+v_vec = numpy.linspace(-1, 1, 1000)
+
+qt.mstart()
+
+data = qt.Data(name='iv_sweep')
+data.add_coordinate('V [V]')
+data.add_value('I [A]')
+data.create_file()
+plot = qt.Plot2D(data, name='iv_sweep', coorddim=0, valdim=1)
+
+# The readings are added to the data object as two numpy columns
+v, i = smu.sweep(v_vec, source='voltage', delay=0, data=data)
+
+data.close_file()
+qt.mend()
@@ -0,0 +1,44 @@
+# Script to check that IVVI.set_dacs() validates all values against the
+# dac bounds before anything is sent to the rack. Uses a simulated IVVI
+# rack, see lib/simvisa.py.
+
+import qt
+from lib import simvisa
+
+rack = simvisa.add_instrument('ASRL9::INSTR', simvisa.IVVIResponder(),
+    latency=0)
+ivvi = qt.instruments.create('test_ivvi', 'IVVI', address='ASRL9::INSTR',
+    numdacs=8, polarity=['BIP', 'POS'], visa='sim')
+
+def check_rejected(values, raw=False):
+    before = dict(rack.get_stats())
+    dacs = [ivvi.get('dac%d' % (i + 1), query=False) for i in range(8)]
+    try:
+        ivvi.set_dacs(values, raw=raw)
+    except ValueError, e:
+        print 'rejected %r: %s' % (values, e)
+    else:
+        raise AssertionError('set_dacs(%r) was not rejected' % (values, ))
+    after = rack.get_stats()
+    assert after['writes'] == before['writes'], 'data sent to the rack'
+    assert [ivvi.get('dac%d' % (i + 1), query=False) for i in range(8)] \
+        == dacs, 'dac values changed'
+
+# Outside the range of the rack polarity (BIP: -2000..2000 mV, POS:
+# 0..4000 mV); the valid value for dac1 must not be sent either.
+check_rejected({1: 100.0, 2: 2500.0})
+check_rejected({1: 100.0, 5: -10.0})
+
+# Outside user set bounds that are narrower than the polarity range
+ivvi.set_parameter_bounds('dac3', -500, 500)
+check_rejected({1: 100.0, 3: 600.0})
+check_rejected({3: 0, 4: 10}, raw=True)
+
+# Within bounds
+ivvi.set_dacs({1: 100.0, 3: 400.0, 5: 10.0})
+print 'dac1, dac3, dac5: %.2f, %.2f, %.2f mV' % (ivvi.get_dac1(),
+    ivvi.get_dac3(), ivvi.get_dac5())
+
+qt.instruments.remove('test_ivvi')
+simvisa.remove_instrument('ASRL9::INSTR')
+print 'OK'
@@ -0,0 +1,81 @@
+# Script to compare ASCII and binary trace transfer decoding speed.
+# A simulated instrument returns the same trace in different formats,
+# so only the parsing overhead on the QTLab side is measured.
+
+import time
+import numpy as np
+from lib import visafunc
+
+class SimulatedAnalyzer(object):
+    '''
+    Minimal stand-in for a visa instrument that returns a trace for any
+    query, in the format set with FORM.
+    '''
+
+    def __init__(self, npoints=10001, chunksize=None):
+        trace = -80 + 10 * np.random.randn(npoints)
+        self._replies = {
+            'ASC': ','.join(['%.6e' % v for v in trace]) + '\n',
+            'REAL,32': self._block(trace.astype('<f4').tostring()),
+            'REAL,64': self._block(trace.astype('<f8').tostring()),
+        }
+        self._format = 'ASC'
+        self._chunksize = chunksize
+        self._reply = ''
+
+    def _block(self, data):
+        length = str(len(data))
+        return '#%d%s%s\n' % (len(length), length, data)
+
+    def write(self, cmd):
+        if cmd.startswith('FORM'):
+            self._format = cmd.split(' ', 1)[1]
+        else:
+            self._reply = self._replies[self._format]
+
+    def read_raw(self):
+        if self._chunksize is None:
+            n = len(self._reply)
+        else:
+            n = self._chunksize
+        ret = self._reply[:n]
+        self._reply = self._reply[n:]
+        return ret
+
+    def ask(self, cmd):
+        self.write(cmd)
+        return self.read_raw().rstrip('\n')
+
+ins = SimulatedAnalyzer()
+N = 100
+
+def run(name, func):
+    start = time.time()
+    for i in range(N):
+        v = func()
+    stop = time.time()
+    print '%-30s %8.3f ms / trace' % (name, (stop - start) / N * 1000)
+    return v
+
+ins.write('FORM ASC')
+ref = run('ASCII, map(float)',
+    lambda: map(float, ins.ask('TRAC:DATA?').split(',')))
+run('ASCII, numpy',
+    lambda: visafunc.read_ascii_values(ins, 'TRAC:DATA?'))
+
+ins.write('FORM REAL,32')
+v32 = run('REAL,32',
+    lambda: visafunc.read_binary_values(ins, 'TRAC:DATA?', '<f4'))
+ins.write('FORM REAL,64')
+v64 = run('REAL,64',
+    lambda: visafunc.read_binary_values(ins, 'TRAC:DATA?', '<f8'))
+
+# Replies split over several reads, as happens when a termination
+# character occurs in the binary data.
+ins = SimulatedAnalyzer(chunksize=4096)
+ins.write('FORM REAL,32')
+run('REAL,32 (4 kB reads)',
+    lambda: visafunc.read_binary_values(ins, 'TRAC:DATA?', '<f4'))
+
+print 'max deviation REAL,32: %.3e' % np.max(np.abs(v32 - ref))
+print 'max deviation REAL,64: %.3e' % np.max(np.abs(v64 - ref))
@@ -21,9 +21,10 @@ from lib.dll_support import alazar
 import types
 import logging
 import socket
-from numpy import zeros, uint8, frombuffer, float32
+from numpy import zeros, uint8, frombuffer, float32, empty, array
 import struct
 import sys
+import qt
 
 class Alazar_ATS9440(Instrument):
     '''
@@ -135,6 +136,7 @@ class Alazar_ATS9440(Instrument):
         self._sample_rate = 125000000
         self._clock_source = 'internal'
         self._pre_trigger_samples = 0
+        self._acquisition = None
         self.set_defaults()
 
         self.get_all()
@@ -202,6 +204,7 @@ class Alazar_ATS9440(Instrument):
 
     def do_set_records_per_acquisition(self, records):
         alazar.set_records_per_capture(self._handle, records)
+        self._records_per_acquisition = records
 
     def do_set_trigger_delay(self, delay):
         '''
@@ -308,6 +311,110 @@ class Alazar_ATS9440(Instrument):
     def start_acquisition(self):
         alazar.start_capture(self._handle)
 
+    def start_async_acquisition(self, consumer, records_per_buffer=1,
+            buffers_per_acquisition=None, channels=(1, 2, 3, 4),
+            buffer_count=4, raw=False):
+        '''
+        Start an AutoDMA acquisition. The board fills a pool of buffer_count
+        buffers of records_per_buffer records each, and every filled buffer
+        is passed to consumer(data) in a separate thread while the next
+        buffers are acquired. data has shape (records, channels, samples)
+        and is reused after consumer returns.
+
+        Input:
+            consumer (callable)             : called with every buffer
+            records_per_buffer (int)        : records per buffer
+            buffers_per_acquisition (int)   : number of buffers to acquire,
+                                              None to run until stopped
+            channels (tuple)                : channel numbers to acquire
+            buffer_count (int)              : number of buffers in the pool
+            raw (bool)                      : pass uint16 samples instead of
+                                              volts
+        Output:
+            None
+        '''
+        if self._acquisition is not None and self._acquisition.is_running():
+            raise RuntimeError('An acquisition is already running')
+
+        samples = self.get_samples_per_record()
+        if not raw:
+            scale = array([self.get('ch%i_range' % ch) for ch in channels],
+                          dtype=float32)[None, :, None] / 2**16
+            volts = [None]
+            def _consumer(data):
+                if volts[0] is None or volts[0].shape != data.shape:
+                    volts[0] = empty(data.shape, dtype=float32)
+                volts[0][...] = data
+                volts[0] -= 2**15
+                volts[0] *= scale
+                consumer(volts[0])
+        else:
+            _consumer = consumer
+
+        self._acquisition = alazar.AsyncAcquisition(self._handle,
+            _consumer,
+            channels=''.join([self._channel_number_to_letter(ch)
+                              for ch in channels]),
+            samples_per_record=samples,
+            records_per_buffer=records_per_buffer,
+            buffers_per_acquisition=buffers_per_acquisition,
+            buffer_count=buffer_count,
+            pre_trig_samples=self.get_pre_trigger_samples())
+        self._acquisition.start()
+
+    def stop_async_acquisition(self):
+        '''Abort a running AutoDMA acquisition.'''
+        if self._acquisition is not None:
+            self._acquisition.stop()
+
+    def wait_async_acquisition(self):
+        '''
+        Wait for the AutoDMA acquisition to finish, keeping the main loop
+        responsive.
+        '''
+        while self._acquisition is not None and \
+                self._acquisition.is_running():
+            qt.msleep(0.05)
+        if self._acquisition is not None and \
+                self._acquisition.error is not None:
+            raise self._acquisition.error
+
+    def acquire_records(self, records, channels=(1, 2, 3, 4),
+            records_per_buffer=None, raw=False):
+        '''
+        Acquire a number of records of all given channels using AutoDMA.
+
+        Input:
+            records (int)               : total number of records
+            channels (tuple)            : channel numbers to acquire
+            records_per_buffer (int)    : records transferred per buffer,
+                                          must divide records
+            raw (bool)                  : return uint16 samples
+
+        Output:
+            data (numpy array) : shape (records, channels, samples)
+        '''
+        if records_per_buffer is None:
+            records_per_buffer = min(records, 100)
+        if records % records_per_buffer != 0:
+            raise ValueError('records_per_buffer has to divide records')
+
+        samples = self.get_samples_per_record()
+        out = empty((records, len(channels), samples),
+                    dtype=(raw and 'uint16' or float32))
+        position = [0]
+        def _store(data):
+            n = data.shape[0]
+            out[position[0]:position[0] + n] = data
+            position[0] += n
+
+        self.start_async_acquisition(_store,
+            records_per_buffer=records_per_buffer,
+            buffers_per_acquisition=records / records_per_buffer,
+            channels=channels, raw=raw)
+        self.wait_async_acquisition()
+        return out
+
     def _channel_number_to_letter(self, ch_number):
         if ch_number == 1:
             return 'A'
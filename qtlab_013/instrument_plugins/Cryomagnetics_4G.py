@@ -21,8 +21,8 @@ import types
 import logging
 import re
 import math
-import time
 import re
+from lib.wait import wait_until
 
 class Cryomagnetics_4G(Instrument):
 
@@ -325,8 +325,8 @@ class Cryomagnetics_4G(Instrument):
             self.sweep_down(channel)
 
         if wait:
-            while math.fabs(val - self.get('magnetout%s' % channel)) > self.MARGIN:
-                time.sleep(0.050)
+            wait_until((self, 'magnetout%s' % channel), val, self.MARGIN,
+                interval=0.05, max_interval=5)
 
         return True
 
@@ -18,9 +18,11 @@
 from instrument import Instrument
 import qt
 import telnetlib
+import socket
 import types
 import logging
 import numpy
+from lib import visafunc
 
 class FieldFox_N9918A(Instrument):
     '''
@@ -32,16 +34,22 @@ class FieldFox_N9918A(Instrument):
                                 port='<networkport>', timeout='<float>' reset='<bool>')
     '''
 
-    def __init__(self, name, ipaddress, port=5024, timeout=1, reset=False):
+    def __init__(self, name, ipaddress, port=5024, timeout=1, reset=False,
+            binary_port=5025):
         '''
         Initializes the FieldFox N9918A, and communicates with the wrapper.
 
+        The telnet session (port 5024) is not suitable for binary data, so
+        binary traces are read through the raw SCPI socket (binary_port).
+        Set binary_port=None to always transfer traces as ASCII.
+
         Input:self._create_invalid_ins
           name (string)    : name of the instrument
           address (string) : IP address
           port (integer)   : Network port
           timeout (float)  : Timeout in seconds
           reset (bool)     : resets to default values, default=False
+          binary_port (integer) : SCPI socket port for binary transfers
         '''
         logging.info(__name__ + ' : Initializing instrument FieldFox_N9918A')
         Instrument.__init__(self, name, tags=['physical'])
@@ -52,6 +60,9 @@ class FieldFox_N9918A(Instrument):
         self._timeout = timeout
         self._telnetinstrument = telnetlib.Telnet(self._ipaddress,self._port)
         self._telnetinstrument.read_until('\n')
+        self._binary_port = binary_port
+        self._socket = None
+        self._trace_format = None
 
 #        self.add_parameter('mean_power',
 #             flags=Instrument.FLAG_GET, units='', type=types.FloatType, tags=['measure'])
@@ -71,6 +82,9 @@ class FieldFox_N9918A(Instrument):
              flags=Instrument.FLAG_SET, type=types.BooleanType)
         self.add_parameter('sweep_time',
              flags=Instrument.FLAG_GET, units='s', minval=0, maxval=100, type=types.FloatType)
+        self.add_parameter('trace_format',
+             flags=Instrument.FLAG_GETSET, type=types.StringType,
+             option_list=('ASC', 'REAL,32', 'REAL,64'))
 
         #self.add_parameter('status',
         #    flags=Instrument.FLAG_GETSET, type=types.StringType)
@@ -89,6 +103,11 @@ class FieldFox_N9918A(Instrument):
         else:
             self.get_all()
 
+        if binary_port is not None:
+            self.set_trace_format('REAL,32')
+        else:
+            self.set_trace_format('ASC')
+
     def _bool_to_str(self, val):
         '''
         Function to convert boolean to 'ON' or 'OFF'
@@ -166,9 +185,7 @@ class FieldFox_N9918A(Instrument):
         '''
         resolution = float(self.get_resolution_bandwidth())
         rawdata = self.get_power()
-        data_mW = numpy.zeros(len(rawdata))
-        for i in range (0, len(rawdata)):
-            data_mW[i] = 10 ** (rawdata[i]/10) / resolution
+        data_mW = 10 ** (numpy.asarray(rawdata) / 10) / resolution
         meanpower_dBm = 10 * numpy.log10(numpy.mean(data_mW))
         meanpower_mW = numpy.mean(data_mW)
         if units == 'dBm':
@@ -299,8 +316,70 @@ class FieldFox_N9918A(Instrument):
             None
 
         Output:
-            ampl (?) : power in ?
+            ampl (numpy array) : trace data in the display units
         '''
         logging.debug(__name__ + ' : get power')
-        data = self._query('TRACE:DATA?')
-        return map(float,data.split(','))
+        tr_format = self.get_trace_format(query=False)
+        if tr_format != 'ASC' and self._binary_port is not None:
+            try:
+                return self._get_binary_trace(tr_format)
+            except Exception, e:
+                logging.warning(__name__ + ' : binary trace transfer ' +
+                    'failed (%s), falling back to ASCII' % e)
+                self._close_socket()
+                self._binary_port = None
+                self.set_trace_format('ASC')
+
+        if tr_format != 'ASC':
+            self.set_trace_format('ASC')
+        return visafunc.parse_ascii_values(self._query('TRACE:DATA?'))
+
+    def _get_socket(self):
+        '''
+        Return the raw SCPI socket, opening it if necessary.
+        '''
+        if self._socket is None:
+            self._socket = socket.create_connection(
+                    (self._ipaddress, self._binary_port), self._timeout)
+        return self._socket
+
+    def _close_socket(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+            self._socket = None
+
+    def _recv(self):
+        data = self._socket.recv(65536)
+        if data == '':
+            raise socket.error('Connection closed')
+        return data
+
+    def _get_binary_trace(self, tr_format):
+        '''
+        Reads the trace as a binary block through the SCPI socket.
+        The byte order is set to little endian (SWAPped).
+        '''
+        sock = self._get_socket()
+        sock.sendall('FORM:BORD SWAP;:TRACE:DATA?\n')
+        if tr_format == 'REAL,64':
+            dtype = '<f8'
+        else:
+            dtype = '<f4'
+        return visafunc.decode_values(visafunc.read_block(self._recv), dtype)
+
+    def do_set_trace_format(self, tr_format):
+        '''
+        Sets the data format used for traces, ASC, REAL,32 or REAL,64.
+        '''
+        logging.debug(__name__ + ' : set the trace format to %s' % tr_format)
+        self._telnetinstrument.write('FORM %s\n' % tr_format)
+        self._trace_format = tr_format
+
+    def do_get_trace_format(self):
+        '''
+        Returns the data format used for traces.
+        '''
+        return self._trace_format
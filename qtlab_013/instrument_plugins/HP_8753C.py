@@ -21,10 +21,10 @@ import visa
 import types
 import logging
 from time import sleep
-import struct
 import numpy
 
 import qt
+from lib import visafunc
 
 class HP_8753C(Instrument):
     '''
@@ -73,6 +73,12 @@ class HP_8753C(Instrument):
         self.add_parameter('start_freq', flags=Instrument.FLAG_GETSET, type=types.FloatType)
         self.add_parameter('stop_freq', flags=Instrument.FLAG_GETSET, type=types.FloatType)
         self.add_parameter('power', flags=Instrument.FLAG_GETSET, type=types.FloatType)
+        self.add_parameter('transfer_format', flags=Instrument.FLAG_GETSET,
+            type=types.StringType,
+            format_map={'FORM2' : '32 bit float',
+                        'FORM3' : '64 bit float',
+                        'FORM4' : 'ASCII'})
+        self._transfer_format = 'FORM2'
 
         self.add_function('set_freq_3GHz')
         self.add_function('set_freq_6GHz')
@@ -190,17 +196,33 @@ class HP_8753C(Instrument):
 
     def read(self):
         '''
-        Read the date from the instrument.
+        Read the date from the instrument. The instrument returns a pair of
+        values per point, only the first (the formatted value) is kept.
+        If a binary transfer fails the data is read again as ASCII.
 
         Input:
             None
 
         Output:
-            data (int)  : list of data points
-        '''
-        data = self._visainstrument.ask('FORM2;DISPDATA;OUTPFORM;')
-        d = [struct.unpack('>f', data[i:i+4])[0] for i in range(4, len(data),8)]
-        return d
+            data (numpy array)  : data points
+        '''
+        fmt = self._transfer_format
+        if fmt in ('FORM2', 'FORM3'):
+            if fmt == 'FORM2':
+                dtype = '>f4'
+            else:
+                dtype = '>f8'
+            try:
+                self._visainstrument.write('%s;DISPDATA;OUTPFORM;' % fmt)
+                block = visafunc.read_block(self._visainstrument.read_raw)
+                return visafunc.decode_values(block, dtype)[::2]
+            except Exception, e:
+                logging.warning(__name__ + ' : binary transfer failed ' +
+                    '(%s), falling back to ASCII' % e)
+                self.set_transfer_format('FORM4')
+
+        data = self._visainstrument.ask('FORM4;DISPDATA;OUTPFORM;')
+        return visafunc.parse_ascii_values(data.replace('\n', ','))[::2]
 
 ### Functions for doing measurements
 
@@ -243,7 +265,6 @@ class HP_8753C(Instrument):
 
         print 'reading out network analyzer'
         reply = self.read()
-        reply = numpy.array(reply)
 
         qt.mend()
 
@@ -457,6 +478,31 @@ class HP_8753C(Instrument):
 
 ### parameters
 
+    def do_set_transfer_format(self, fmt):
+        '''
+        Set the format used by read(). FORM2 and FORM3 are binary 32 and
+        64 bit floats, FORM4 is ASCII.
+
+        Input:
+            fmt (string)
+
+        Output:
+            None
+        '''
+        self._transfer_format = fmt
+
+    def do_get_transfer_format(self):
+        '''
+        Get the format used by read().
+
+        Input:
+            None
+
+        Output:
+            fmt (string)
+        '''
+        return self._transfer_format
+
     def do_set_IF_Bandwidth(self, bw):
         '''
         Set IF Bandwidth.
@@ -65,12 +65,16 @@ class IVVI(Instrument):
         else:
             logging.error('Number of dacs needs to be multiple of 4')
         self.pol_num = range(self._numdacs)
+
+        # Local mirror of the dac values as 16 bit integers, None if unknown
+        self._dac_bytes = [None] * self._numdacs
         
         
         # Add functions
         self.add_function('reset')
         self.add_function('get_all')
         self.add_function('set_dacs_zero')
+        self.add_function('set_dacs')
         self.add_function('get_numdacs')
 
         # Add parameters
@@ -165,8 +169,8 @@ class IVVI(Instrument):
 
     def get_all(self):
         '''
-        Gets all dacvalues from the device, all polarities from memory
-        and updates the wrapper.
+        Gets all dacvalues from the device (in a single read), all
+        polarities from memory and updates the wrapper.
 
         Input:
             None
@@ -175,6 +179,7 @@ class IVVI(Instrument):
             None
         '''
         logging.info('Get all')
+        self._get_dacs()
         for i in range(self._numdacs):
             self.get('dac%d' % (i+1))
 
@@ -182,6 +187,59 @@ class IVVI(Instrument):
         for i in range(self._numdacs):
             self.set('dac%d' % (i+1), 0)
 
+    def set_dacs(self, values, raw=False):
+        '''
+        Sets several dacs at once. The messages are sent together and the
+        replies are collected afterwards, so the dacs are updated within a
+        single round trip. Dacs that already have the requested value are
+        skipped. Note that the values are not ramped (maxstep is not
+        applied). All values are checked against the bounds of the dac
+        parameters first; if any is out of range nothing is sent.
+
+        Input:
+            values (dict) : {channel: value}, channel is the 1 based index
+                            of the dac
+            raw (bool)    : if True the values are 16 bit integers as
+                            returned by byte_limited_arange(..., 
+                            return_bytes=True), otherwise voltages in mV
+
+        Output:
+            None
+        '''
+        messages = []
+        channels = []
+        for channel, value in values.iteritems():
+            if raw:
+                bytevalue = int(value)
+                mvoltage = self._bytevalue_to_mvoltage(bytevalue, channel)
+            else:
+                bytevalue = self._mvoltage_to_bytevalue(
+                        value - self.pol_num[channel-1])
+                mvoltage = value
+            opts = self.get_parameter_options('dac%d' % channel)
+            if opts is None:
+                raise ValueError('Invalid dac channel %r' % (channel,))
+            if bytevalue < 0 or bytevalue > 65535 or \
+                    mvoltage < opts.get('minval', mvoltage) or \
+                    mvoltage > opts.get('maxval', mvoltage):
+                raise ValueError('Value %r out of range for dac%d' % \
+                        (value, channel))
+            if self._dac_bytes[channel-1] == bytevalue:
+                continue
+            messages.append("%c%c%c%c%c%c%c" % (7, 0, 2, 1, channel,
+                    bytevalue >> 8, bytevalue & 0xff))
+            channels.append((channel, bytevalue))
+
+        if len(messages) == 0:
+            return
+
+        logging.debug('Setting %d dacs', len(messages))
+        self._send_and_read_many(messages)
+        for channel, bytevalue in channels:
+            self._dac_bytes[channel-1] = bytevalue
+            self.update_value('dac%d' % channel,
+                    self._bytevalue_to_mvoltage(bytevalue, channel))
+
     # Conversion of data
     def _mvoltage_to_bytes(self, mvoltage):
         '''
@@ -194,25 +252,42 @@ class IVVI(Instrument):
         Output:
             (dataH, dataL) (int, int) : The high and low value byte equivalent
         '''
-        bytevalue = int(round(mvoltage/4000.0*65535))
+        bytevalue = self._mvoltage_to_bytevalue(mvoltage)
         dataH = int(bytevalue/256)
         dataL = bytevalue - dataH*256
         return (dataH, dataL)
 
+    def _mvoltage_to_bytevalue(self, mvoltage):
+        '''
+        Converts a mvoltage on a 0mV-4000mV scale to a 16-bit integer
+        '''
+        return int(round(mvoltage/4000.0*65535))
+
+    def _bytevalue_to_mvoltage(self, bytevalue, channel):
+        '''
+        Converts a 16-bit integer to the mvoltage of dac <channel>,
+        taking the polarity into account
+        '''
+        return bytevalue/65535.0*4000.0 + self.pol_num[channel-1]
+
     def _numbers_to_mvoltages(self, numbers):
         '''
         Converts a list of bytes to a list containing
-        the corresponding mvoltages
+        the corresponding mvoltages, and updates the local mirror
         '''
         values = range(self._numdacs)
         for i in range(self._numdacs):
-            values[i] = ((numbers[2 + 2*i]*256 + numbers[3 + 2*i])/65535.0*4000.0) + self.pol_num[i]
+            bytevalue = numbers[2 + 2*i]*256 + numbers[3 + 2*i]
+            self._dac_bytes[i] = bytevalue
+            values[i] = self._bytevalue_to_mvoltage(bytevalue, i+1)
         return values
 
     # Communication with device
     def do_get_dac(self, channel):
         '''
-        Returns the value of the specified dac
+        Returns the value of the specified dac from the local mirror. The
+        rack is only read if the value is unknown; use get_all() to
+        refresh all dacs with a single read.
 
         Input:
             channel (int) : 1 based index of the dac
@@ -221,8 +296,10 @@ class IVVI(Instrument):
             voltage (float) : dacvalue in mV
         '''
         logging.debug('Reading dac%s', channel)
-        mvoltages = self._get_dacs()
-        return mvoltages[channel - 1]
+        if self._dac_bytes[channel - 1] is None:
+            self._get_dacs()
+        return self._bytevalue_to_mvoltage(self._dac_bytes[channel - 1],
+                channel)
 
     def do_set_dac(self, mvoltage, channel):
         '''
@@ -239,6 +316,7 @@ class IVVI(Instrument):
         (DataH, DataL) = self._mvoltage_to_bytes(mvoltage - self.pol_num[channel-1])
         message = "%c%c%c%c%c%c%c" % (7, 0, 2, 1, channel, DataH, DataL)
         reply = self._send_and_read(message)
+        self._dac_bytes[channel-1] = DataH*256 + DataL
         return reply
 
     def _get_dacs(self):
@@ -281,12 +359,44 @@ class IVVI(Instrument):
 #            logging.error('Failed to receive reply from IVVI rack')
 #            return False
 
+        return self._read_reply()
+
+    def _send_and_read_many(self, messages):
+        '''
+        Send a list of messages in one write and read all answers. The
+        rack handles the messages in order, so the replies are read in
+        the same order.
+
+        Input:
+            messages (string[]) : strings conform the IVVI protocol
+
+        Output:
+            replies (int[][]) : list of return messages
+        '''
+        logging.debug('Sending %d messages', len(messages))
+
+        # clear input buffer
+        visafunc.read_all(self._vi)
+        vpp43.write(self._vi, ''.join(messages))
+
+        return [self._read_reply() for message in messages]
+
+    def _read_reply(self):
+        '''
+        Read one answer from the device.
+        Logs an error if one occurred
+        Returns a list of bytes
+        '''
         data1 = visafunc.readn(self._vi, 2)
         data1 = [ord(s) for s in data1]
 
         # 0 = no error, 32 = watchdog reset
         if data1[1] not in (0, 32):
             logging.error('Error while reading: %s', data1)
+        if data1[1] == 32:
+            # The dacs were reset, the mirror is no longer valid
+            logging.warning('IVVI watchdog reset, dac values unknown')
+            self._dac_bytes = [None] * self._numdacs
 
         data2 = visafunc.readn(self._vi, data1[0] - 2)
         data2 = [ord(s) for s in data2]
@@ -341,10 +451,14 @@ class IVVI(Instrument):
         else:
             return 'Invalid polarity in memory'
 
-    def byte_limited_arange(self, start, stop, step=1, pol=None, dacnr=None):
+    def byte_limited_arange(self, start, stop, step=1, pol=None, dacnr=None,
+            return_bytes=False):
         '''
         Creates array of mvoltages, in integer steps of the dac resolution. Either
         the dac polarity, or the dacnr needs to be specified.
+
+        With return_bytes=True the 16 bit dac values are returned instead,
+        which can be passed to set_dacs(..., raw=True) without conversion.
         '''
         if pol is not None and dacnr is not None:
             logging.error('byte_limited_arange: speficy "pol" OR "dacnr", NOT both!')
@@ -365,6 +479,8 @@ class IVVI(Instrument):
         start_byte = int(round((start-polnum)/4000.0*65535))
         stop_byte = int(round((stop-polnum)/4000.0*65535))
         byte_vec = numpy.arange(start_byte, stop_byte+1, step)
+        if return_bytes:
+            return byte_vec
         mvolt_vec = byte_vec/65535.0 * 4000.0 + polnum
         return mvolt_vec
 
@@ -21,8 +21,11 @@ from instrument import Instrument
 import visa
 import types
 import logging
+import time
 import qt
-from numpy import zeros, fromstring
+import numpy
+from numpy import zeros
+from lib import visafunc
 
 class Keithley_2400(Instrument):
     '''
@@ -196,6 +199,8 @@ class Keithley_2400(Instrument):
             minval=1, maxval=2500)
 			
         self.add_function('beep')
+        self.add_function('sweep')
+        self.add_function('get_trace_buffer_contents')
 
         if reset:
             if (self.get_output_state()):
@@ -827,25 +832,169 @@ class Keithley_2400(Instrument):
         logging.debug('Making a beep with %s.' %self.get_name())
         self._visainstrument.write('SYST:BEEP %f, %f' % (freq, length))
 
-    def get_trace_buffer_contents(self):
+    def get_trace_buffer_contents(self, nelements=None, reshape=False):
         '''
-        Get the contents of the buffer.
+        Get the contents of the buffer. The data is transferred as binary
+        32 bit floats.
 
-        Returns a numpy array
+        Input:
+            nelements (int) : number of values per reading, i.e. the number
+                              of format elements (see set_format_elements).
+                              If None it is read from the instrument.
+            reshape (bool)  : if True, return the values with shape
+                              (readings, nelements)
+
+        Returns a flat numpy array with the elements of all readings, or
+        a 2D array if reshape is True.
         '''
         n_readings = int(self._visainstrument.ask(':TRAC:POIN:ACT?'))
         logging.info('Number of stored readings in buffer: %i' % 
                         n_readings)
-        trace = zeros(int(n_readings))
+        if nelements is None:
+            elements = self._visainstrument.ask(':FORM:ELEM?')
+            nelements = elements.count(',') + 1
         if n_readings == 0:
-            return trace
+            trace = zeros(0)
         else:
-            self._visainstrument.timeout = 4
-            trace_data = self._visainstrument.ask(':TRAC:DATA?')
-        self._visainstrument.timeout = 1
-        trace = fromstring(trace_data, sep=',')
+            trace = self._read_trace(n_readings * nelements)
+        if reshape:
+            trace = trace.reshape(n_readings, nelements)
         return trace
 
+    def _read_trace(self, count):
+        '''
+        Read count values from the trace buffer as REAL,32. The format is
+        restored to ASCII afterwards, as expected by the other functions.
+        '''
+        self._visainstrument.write(':FORM:DATA REAL,32')
+        self._visainstrument.write(':FORM:BORD SWAP')
+        self._visainstrument.timeout = 4
+        try:
+            return visafunc.read_binary_values(self._visainstrument,
+                ':TRAC:DATA?', '<f4', count)
+        finally:
+            self._visainstrument.timeout = 1
+            self._visainstrument.write(':FORM:DATA ASC')
+
+    def _wait_for_buffer(self, count, duration):
+        '''
+        Wait until count readings are stored in the trace buffer. Most of
+        the estimated duration is waited with qt.msleep, so the
+        measurement can be stopped in the meantime.
+        '''
+        qt.msleep(0.9 * duration)
+        timeout = time.time() + max(1.0, duration)
+        while True:
+            n = int(self._visainstrument.ask(':TRAC:POIN:ACT?'))
+            if n >= count:
+                return
+            if time.time() > timeout:
+                raise ValueError('Sweep not finished, %d of %d readings' % \
+                        (n, count))
+            qt.msleep(0.05)
+
+    def sweep(self, values, source='voltage', delay=0.0, data=None):
+        '''
+        Hardware-buffered sweep: the instrument steps the source through
+        all values and measures at every point, storing the readings in
+        its trace buffer. The buffer is read back in one binary transfer
+        at the end, which is much faster than setting and reading every
+        point over the bus.
+
+        Equally spaced values use the linear sweep mode, other values are
+        uploaded as a source list. At most 2500 points are possible.
+
+        Note that the source is not ramped to the first value and returns
+        to its fixed level (get_source_voltage / get_source_current) after
+        the sweep.
+
+        Input:
+            values (array)    : source values in V or A
+            source (string)   : 'voltage' or 'current'
+            delay (float)     : source delay before each measurement in s
+            data (Data)       : if given, the source values and readings
+                                are added to this data object
+
+        Output:
+            (voltage, current) : numpy arrays
+        '''
+        values = numpy.asarray(values, dtype=numpy.float64)
+        npoints = len(values)
+        if npoints < 1 or npoints > 2500:
+            raise ValueError('Number of sweep points should be 1 - 2500')
+        if source == 'voltage':
+            func = 'VOLT'
+        elif source == 'current':
+            func = 'CURR'
+        else:
+            raise ValueError('Source should be voltage or current')
+
+        logging.debug(__name__ + ' : buffered %s sweep of %d points' % \
+                (source, npoints))
+        write = self._visainstrument.write
+        write(':SOUR:FUNC:MODE %s' % func)
+
+        steps = numpy.diff(values)
+        if npoints > 1 and steps[0] != 0 and \
+                numpy.allclose(steps, steps[0], rtol=1e-6, atol=0):
+            write(':SOUR:%s:STAR %e' % (func, values[0]))
+            write(':SOUR:%s:STOP %e' % (func, values[-1]))
+            write(':SOUR:SWE:SPAC LIN')
+            write(':SOUR:SWE:POIN %d' % npoints)
+            write(':SOUR:%s:MODE SWE' % func)
+        else:
+            # The list is uploaded in chunks to keep commands short
+            for i in range(0, npoints, 100):
+                chunk = ','.join(['%e' % v for v in values[i:i+100]])
+                if i == 0:
+                    write(':SOUR:LIST:%s %s' % (func, chunk))
+                else:
+                    write(':SOUR:LIST:%s:APP %s' % (func, chunk))
+            write(':SOUR:%s:MODE LIST' % func)
+
+        write(':SOUR:DEL %e' % delay)
+        elements = self._visainstrument.ask(':FORM:ELEM?')
+        write(':FORM:ELEM VOLT,CURR')
+        write(':TRIG:COUN %d' % npoints)
+        write(':TRAC:CLE')
+        write(':TRAC:POIN %d' % npoints)
+        write(':TRAC:FEED SENS')
+        write(':TRAC:FEED:CONT NEXT')
+
+        output_state = self.get_output_state(query=False)
+        if not output_state:
+            write(':OUTP 1')
+
+        nplc = self.get_integration_rate(query=False)
+        lfreq = self.get_line_frequency(query=False)
+        if nplc is None or not lfreq:
+            nplc, lfreq = 1, 50.0
+        if self.get_auto_zero(query=False):
+            nplc *= 3
+        duration = npoints * (delay + nplc / lfreq + 1e-3)
+
+        try:
+            write(':INIT')
+            self._wait_for_buffer(npoints, duration)
+            trace = self._read_trace(2 * npoints).reshape(npoints, 2)
+        finally:
+            if not output_state:
+                write(':OUTP 0')
+            write(':SOUR:%s:MODE FIX' % func)
+            write(':TRIG:COUN 1')
+            write(':TRAC:FEED:CONT NEV')
+            write(':FORM:ELEM %s' % elements)
+
+        voltage = trace[:, 0]
+        current = trace[:, 1]
+        if data is not None:
+            if source == 'voltage':
+                data.add_data_point(voltage, current)
+            else:
+                data.add_data_point(current, voltage)
+
+        return voltage, current
+
     def clear_trace_buffer(self):
         '''
         Clear the contents of the trace buffer.
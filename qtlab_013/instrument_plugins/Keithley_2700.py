@@ -24,9 +24,11 @@ from instrument import Instrument
 import visa
 import types
 import logging
+import time
 import numpy
 
 import qt
+from lib import visafunc
 
 def bool_to_str(val):
     '''
@@ -164,6 +166,7 @@ class Keithley_2700(Instrument):
 
         self.add_function('send_trigger')
         self.add_function('fetch')
+        self.add_function('scan')
 
         # Connect to measurement flow to detect start and stop of measurement
         qt.flow.connect('measurement-start', self._measurement_start_cb)
@@ -460,6 +463,113 @@ class Keithley_2700(Instrument):
         logging.debug('Resetting trigger')
         self._visainstrument.write(':ABOR')
 
+    def scan(self, channels, count=1, data=None):
+        '''
+        Hardware-buffered scan: the instrument scans the channel list
+        <count> times and stores all readings in its buffer, which is
+        read back in one binary transfer at the end. This avoids a bus
+        round trip per reading.
+
+        Input:
+            channels (list of int or string) : channels to scan, e.g.
+                [101, 102, 105] or '(@101:110)'
+            count (int) : number of times to scan the list
+            data (Data) : if given, the scan number and one column per
+                channel are added to this data object
+
+        Output:
+            readings (numpy array) : shape (count, number of channels)
+        '''
+        if type(channels) in (types.StringType, types.UnicodeType):
+            chanlist = channels
+            nchannels = len(self._expand_channels(channels))
+        else:
+            chanlist = '(@%s)' % ','.join(['%d' % c for c in channels])
+            nchannels = len(channels)
+        total = nchannels * count
+        if total < 1 or total > 55000:
+            raise ValueError('Number of readings should be 1 - 55000')
+
+        logging.debug('Buffered scan of %s, %d times' % (chanlist, count))
+        trigger_continuous = self.get_trigger_continuous(query=False)
+        trigger_count = self.get_trigger_count(query=False)
+        write = self._visainstrument.write
+        if trigger_continuous:
+            self.set_trigger_continuous(False)
+        write(':ABOR')
+        write(':FORM:ELEM READ')
+        write(':ROUT:SCAN %s' % chanlist)
+        write(':ROUT:SCAN:TSO IMM')
+        write(':ROUT:SCAN:LSEL INT')
+        write(':SAMP:COUN %d' % nchannels)
+        write(':TRIG:COUN %d' % count)
+        write(':TRAC:CLE')
+        write(':TRAC:POIN %d' % total)
+        write(':TRAC:FEED SENS')
+        write(':TRAC:FEED:CONT NEXT')
+
+        nplc = self.get_nplc(query=False)
+        if nplc is None:
+            nplc = 1
+        if self.get_autozero(query=False):
+            nplc *= 3
+        duration = total * (nplc / 50.0 + 5e-3)
+
+        try:
+            write(':INIT')
+            self._wait_for_buffer(total, duration)
+            write(':FORM:DATA SRE')
+            write(':FORM:BORD SWAP')
+            readings = visafunc.read_binary_values(self._visainstrument,
+                ':TRAC:DATA?', '<f4', total)
+        finally:
+            write(':FORM:DATA ASC')
+            write(':ROUT:SCAN:LSEL NONE')
+            write(':SAMP:COUN 1')
+            write(':TRAC:FEED:CONT NEV')
+            if trigger_count:
+                self.set_trigger_count(trigger_count)
+            if trigger_continuous:
+                self.set_trigger_continuous(True)
+
+        readings = readings.reshape(count, nchannels)
+        if data is not None:
+            columns = [readings[:, i] for i in range(nchannels)]
+            data.add_data_point(numpy.arange(count), *columns)
+
+        return readings
+
+    def _expand_channels(self, chanlist):
+        '''
+        Return the list of channels in a channel list string such as
+        '(@101:105,110)'.
+        '''
+        ret = []
+        for item in chanlist.strip('()@ ').split(','):
+            if ':' in item:
+                start, end = item.split(':')
+                ret.extend(range(int(start), int(end) + 1))
+            elif item.strip() != '':
+                ret.append(int(item))
+        return ret
+
+    def _wait_for_buffer(self, count, duration):
+        '''
+        Wait until count readings are stored in the buffer. Most of the
+        estimated duration is waited with qt.msleep, so the measurement
+        can be stopped in the meantime.
+        '''
+        qt.msleep(0.9 * duration)
+        timeout = time.time() + max(1.0, duration)
+        while True:
+            n = int(self._visainstrument.ask(':TRAC:POIN:ACT?'))
+            if n >= count:
+                return
+            if time.time() > timeout:
+                raise ValueError('Scan not finished, %d of %d readings' % \
+                        (n, count))
+            qt.msleep(0.05)
+
 
 # --------------------------------------
 #           parameters
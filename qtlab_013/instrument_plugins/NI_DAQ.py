@@ -139,6 +139,12 @@ class NI_DAQ(Instrument):
             )         
 
         self.add_function('reset')
+        self.add_function('start_stream')
+        self.add_function('stop_stream')
+        self.add_function('get_stream_data')
+        self.add_function('get_stream_average')
+
+        self._stream = None
 
         self.set_count_time(0.1)
         self.set_samples(samples)#Added by Jan
@@ -170,8 +176,55 @@ class NI_DAQ(Instrument):
 
     def reset(self):
         '''Reset device.'''
+        self.stop_stream()
+        nidaq.clear_tasks(self._id)
         nidaq.reset_device(self._id)
 
+    def start_stream(self, channel, buffer_size=100000, chunk=1000,
+            decimation=1, minvol=-10.0, maxvol=10.0, callback=None):
+        '''
+        Start continuous acquisition of channel (e.g. 'ai0' or 'ai0:3') at
+        the rate set by 'freq' into a ring buffer of buffer_size samples.
+        Blocks of chunk samples are averaged in groups of decimation
+        samples before they are stored.
+
+        Input:
+            channel (string)    : channel name(s)
+            buffer_size (int)   : number of (decimated) samples kept
+            chunk (int)         : samples per channel read per block
+            decimation (int)    : number of samples averaged per point
+            minvol, maxvol (float) : input range in V
+            callback (callable) : called with every decimated block (in V)
+
+        Output:
+            None
+        '''
+        self.stop_stream()
+        devchan = '%s/%s' % (self._id, channel)
+        self._stream = nidaq.AIStream(devchan, freq=self._freq,
+            buffer_size=buffer_size, chunk=chunk, decimation=decimation,
+            minv=minvol, maxv=maxvol, config=self._chan_config,
+            callback=callback)
+        self._stream.start()
+
+    def stop_stream(self):
+        '''Stop the continuous acquisition and release its task.'''
+        if self._stream is not None:
+            self._stream.clear()
+            self._stream = None
+
+    def get_stream_data(self, n=None):
+        '''Return the last n samples of the stream in mV, per channel.'''
+        if self._stream is None:
+            raise ValueError('No stream running, use start_stream first')
+        return self._stream.get_data(n) * 1000.0
+
+    def get_stream_average(self, n=None):
+        '''Return the mean of the last n samples of the stream in mV.'''
+        if self._stream is None:
+            raise ValueError('No stream running, use start_stream first')
+        return self._stream.get_average(n) * 1000.0
+
     def _get_input_channels(self):
         physical_input_channels = nidaq.get_physical_input_channels(self._id)
         if self.get_chan_config() == 'DIFF':
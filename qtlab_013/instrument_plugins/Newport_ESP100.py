@@ -19,7 +19,7 @@ from instrument import Instrument
 import types
 import logging
 import visa
-import time
+from lib.wait import wait_until
 
 class Newport_ESP100(Instrument):
   '''
@@ -72,9 +72,7 @@ class Newport_ESP100(Instrument):
     self._visainstrument.write('1MT-;WS\r')
 #    self._visainstrument.write('1PA-300;WS\r')
     print "Waiting for stage to have moved"
-    while self.do_get_ismoving():
-      print "  ... still moving ..."
-      time.sleep(1)
+    wait_until(self.do_get_ismoving, False, interval=0.1, max_interval=1)
     self._visainstrument.write('1DH;WS\r')
     print "Finished initialization ESP100"
     self.get_position()
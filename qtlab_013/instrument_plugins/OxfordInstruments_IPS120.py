@@ -23,6 +23,7 @@ import visa
 import types
 import logging
 import qt
+from lib.wait import wait_until
 
 class OxfordInstruments_IPS120(Instrument):
     '''
@@ -227,8 +228,8 @@ class OxfordInstruments_IPS120(Instrument):
             self.set_field_setpoint('{0:2.4f}'.format(value))
             self.to_setpoint()
             #print 'Sweeping magnetic field to %2.4f Tesla...' % value
-            while abs(self.get_field()-value) >= 0.00001:
-                qt.msleep(5)
+            wait_until(self.get_field, value, 0.00001, interval=1,
+                max_interval=30)
             self.hold()
             logging.info('Desired field reached. Wait 10s for the output ' +
                             'voltage to stabilize.')
@@ -249,8 +250,7 @@ class OxfordInstruments_IPS120(Instrument):
         qt.msleep(40)   #added by Chunming, wait 60s for heater off. 30s recommonded by the manual.
         self.to_zero()
         logging.info('Into persistent mode: Sweeping leads to zero...')
-        while abs(self.get_field()) >= 0.00001:
-            qt.msleep(1)
+        wait_until(self.get_field, 0, 0.00001, interval=1, max_interval=30)
         self.hold()
         value = self.get_persistent_field()  
         logging.info('Leads at zero. Persistent field {0:2.4f} Tesla.'.format(value))
@@ -265,8 +265,8 @@ class OxfordInstruments_IPS120(Instrument):
             self.set_field_setpoint('%2.4f' % persfield)
         self.to_setpoint()
         logging.info('Sweeping leads to persistent value...')
-        while abs(self.get_field() - persfield) >= 0.00001:
-            qt.msleep(1)
+        wait_until(self.get_field, persfield, 0.00001, interval=1,
+            max_interval=30)
         qt.msleep(5)
         self.heater_on()
         self.hold()    
@@ -281,8 +281,7 @@ class OxfordInstruments_IPS120(Instrument):
         self.set_sweeprate_field(0.1)
         self.to_zero()
         logging.info('Sweeping magnetic field quickly to zero...')
-        while abs(self.get_field()) >= 0.00001:
-            qt.msleep(1)
+        wait_until(self.get_field, 0, 0.00001, interval=1, max_interval=30)
 
         self.hold()    
         logging.info('Field at zero.')
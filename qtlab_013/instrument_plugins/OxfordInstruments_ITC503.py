@@ -22,6 +22,7 @@ import visa
 import types
 import logging
 import qt
+from lib.wait import wait_until, WaitTimeout
 
 class OxfordInstruments_ITC503(Instrument):
     '''
@@ -153,15 +154,21 @@ class OxfordInstruments_ITC503(Instrument):
         self.get_auto_pid_status()
 
     def set_temperature(self, channel, temperature, margin=0.01, 
-                        stabilization_time=120):
+                        stabilization_time=120, timeout=None):
         '''
         Sets the temperature and waits for stablization, default criteria 
         are 120 seconds within 0.01 Kelvin from the setpoint.
 
         Input:
-            ...
+            channel (int)             : sensor channel used for control
+            temperature (float)       : setpoint in K
+            margin (float)            : allowed deviation in K
+            stabilization_time (float): time in s the temperature should
+                                        stay within margin, at most 1200
+            timeout (float)           : give up after this many seconds,
+                                        default None (wait forever)
         Output:
-            ...
+            True if the temperature is stable, False otherwise
         '''
         #gasflow_low = self._gasflow_low
         #gasflow_high = self._gasflow_high
@@ -171,20 +178,19 @@ class OxfordInstruments_ITC503(Instrument):
         self.set_setpoint_temperature(temperature)
         self.set_heater_control(channel)
         self.set_pid_control(1)
-        count = 0
         print ('Waiting until set temperature (%s K) is reached and system '
                 'is stable...' % temperature)
 
-        while (count <= stabilization_time) and (count <= 1200):
-            abs_error = abs(_get_temperature() - temperature)
-            qt.msleep(1)
-            if (abs_error < margin):
-                count = count + 1
-            else:
-                count = 0
+        stable = True
+        try:
+            wait_until(_get_temperature, temperature, margin,
+                timeout=timeout, stable=min(stabilization_time, 1200),
+                interval=1, max_interval=10)
+        except WaitTimeout:
+            stable = False
 
         actual_temperature = _get_temperature()
-        if count >= 1200:
+        if not stable:
             print ('Warning: temperature seems to be not very stable. '
                    ' Temperature: ' + str(actual_temperature))
             return False
@@ -58,7 +58,12 @@ class Picoharp(Instrument):
         self.add_function('close')
         self.add_function('start')
         self.add_function('plot')
+        self.add_function('start_stream')
+        self.add_function('stop_stream')
+        self.add_function('get_g2')
+        self.add_function('plot_g2')
 
+        self._stream = None
         self.set_inttime(10)
 
         if reset:
@@ -116,6 +121,45 @@ class Picoharp(Instrument):
         x, trace = self._dev.get_block()
         qt.plot(trace, name='picoharp', clear=True)
 
+    def start_stream(self, mode='T2', filename=None, g2_range=100000,
+            g2_bins=1000):
+        '''
+        Start a T2 or T3 measurement of 'inttime' seconds. The FIFO is read
+        in the background, optionally written to filename, and live
+        statistics are kept (see picoquant_ph.TTTRStream).
+
+        Returns the stream object.
+        '''
+        if not self._dev:
+            return None
+        self.stop_stream()
+        modes = {'T2': picoquant_ph.MODE_T2, 'T3': picoquant_ph.MODE_T3}
+        self._dev.initialize(modes[mode])
+        self._stream = picoquant_ph.TTTRStream(self._dev, modes[mode],
+            filename=filename, g2_range=g2_range, g2_bins=g2_bins)
+        self._stream.start(int(self._inttime * 1000))
+        return self._stream
+
+    def stop_stream(self):
+        '''Stop a running T2/T3 measurement.'''
+        if self._stream is not None and self._stream.is_running():
+            self._stream.stop()
+
+    def get_g2(self):
+        '''
+        Returns the start-stop histogram (dt, counts) of the last T2 stream
+        '''
+        if self._stream is None:
+            return None
+        return self._stream.get_g2()
+
+    def plot_g2(self):
+        if self._stream is None:
+            return
+        import qt
+        dt, counts = self._stream.get_g2()
+        qt.plot(dt, counts, name='picoharp_g2', clear=True)
+
     def do_set_divider(self, value):
         if not self._dev:
             return
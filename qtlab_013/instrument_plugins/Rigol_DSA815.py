@@ -24,6 +24,7 @@ import pyvisa.vpp43 as vpp43
 import types
 import logging
 import numpy
+from lib import visafunc
 
 class Rigol_DSA815(Instrument):
     '''
@@ -34,19 +35,24 @@ class Rigol_DSA815(Instrument):
                                 port='<networkport>', timeout='<float>' reset='<bool>')
     '''
 
-    def __init__(self, name, address, reset=False):
+    def __init__(self, name, address, reset=False, binary=True):
         '''
         Initializes the Rigol DSA815, and communicates with the wrapper.
         
         The Rigol can be operated by LAN or USB. Only LAN functionality has
         been programmed into the wrapper.
 
+        With binary=True traces are transferred as 32 bit floats, which is
+        much faster than ASCII for long traces. If a binary transfer fails
+        the driver falls back to ASCII.
+
         Input:self._create_invalid_ins
           name (string)    : name of the instrument
           address (string) : IP address
           port (integer)   : Network port
           timeout (float)  : Timeout in seconds
           reset (blool)     : resets to default values, default=False
+          binary (bool)    : use binary trace transfer, default=True
         '''
         logging.info(__name__ + ' : Initializing instrument Rigol DSA815')
         Instrument.__init__(self, name)
@@ -182,6 +188,9 @@ class Rigol_DSA815(Instrument):
         else:
             self.get_all()
 
+        if binary:
+            self.set_trace_format('REAL')
+
     def _bool_to_str(self, val):
         '''
         Function to convert boolean to 'ON' or 'OFF'
@@ -318,9 +327,7 @@ class Rigol_DSA815(Instrument):
         '''
         resolution = float(self.get_resolution_bandwidth())
         rawdata = self.get_power()
-        data_mW = numpy.zeros(len(rawdata))
-        for i in range (0, len(rawdata)):
-            data_mW[i] = 10 ** (rawdata[i]/10) / resolution
+        data_mW = 10 ** (numpy.asarray(rawdata) / 10) / resolution
         meanpower_dBm = 10 * numpy.log10(numpy.mean(data_mW))
         meanpower_mW = numpy.mean(data_mW)
         return [meanpower_dBm, meanpower_mW]
@@ -535,11 +542,21 @@ class Rigol_DSA815(Instrument):
             None
 
         Output:
-            ampl (?) : power in ?
+            ampl (numpy array) : trace data in the display units
         '''
         logging.debug(__name__ + ' : get power')
-        data = self._visainstrument.ask(':TRACE:DATA? Trace1')[12:]
-        return map(float,data.split(','))
+        tr_format = self.get_trace_format(query=False)
+        if tr_format is not None and tr_format.upper().startswith('REAL'):
+            try:
+                return visafunc.read_binary_values(self._visainstrument,
+                        ':TRACE:DATA? Trace1', '<f4')
+            except Exception, e:
+                logging.warning(__name__ + ' : binary trace transfer ' +
+                    'failed (%s), falling back to ASCII' % e)
+                self.set_trace_format('ASCII')
+
+        return visafunc.read_ascii_values(self._visainstrument,
+                ':TRACE:DATA? Trace1')
 
     def do_get_tracking_generator_level(self):
         '''
@@ -579,5 +596,11 @@ level)
         return response.rstrip(',32')
 
     def do_set_trace_format(self, tr_format):
-        logging.debug(__name__ + ' : set the trace format to %s.')
+        '''
+        Sets the trace format. For REAL the byte order is set to little
+        endian (SWAPped), as expected by get_power().
+        '''
+        logging.debug(__name__ + ' : set the trace format to %s.' % tr_format)
         self._visainstrument.write(':FORM:TRAC:DATA %s' % tr_format)
+        if tr_format.upper().startswith('REAL'):
+            self._visainstrument.write(':FORM:BORD SWAP')
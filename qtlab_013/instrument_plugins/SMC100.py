@@ -23,6 +23,7 @@ from lib import visafunc
 import types
 import logging
 import time
+from lib.wait import wait_until, WaitTimeout
 
 class SMC100(Instrument):
 
@@ -134,7 +135,7 @@ class SMC100(Instrument):
         '''
         try:
             self.write(command)
-            time.sleep(0.020)
+            self._wait_reply()
             ret = self.raw_read()
 #            print 'Read: %r' % (ret, )
             if len(ret) > len(command):
@@ -145,6 +146,25 @@ class SMC100(Instrument):
             print 'Error: %s' % (e, )
             return False
 
+    def _wait_reply(self, timeout=0.5):
+        '''
+        Wait until a reply has arrived: data is available and no more is
+        coming in.
+        '''
+        last = [-1]
+        def complete():
+            navail = visafunc.get_navail(self._visa.vi)
+            done = navail > 0 and navail == last[0]
+            last[0] = navail
+            return done
+
+        try:
+            wait_until(complete, True, timeout=timeout, interval=0.002,
+                max_interval=0.02, sleep=time.sleep,
+                name='%s.reply' % self.get_name())
+        except WaitTimeout:
+            pass
+
     def write(self, command):
         '''
         Write a command to the device
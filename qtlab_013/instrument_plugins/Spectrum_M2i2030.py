@@ -26,6 +26,9 @@ import types
 import logging
 import numpy
 
+# DMA buffers are aligned to this boundary, as recommended by Spectrum
+_PAGE_SIZE = 4096
+
 class Spectrum_M2i2030(Instrument):
     '''
     This is the driver for the Spectrum M2i2030 data acquisition card
@@ -44,7 +47,7 @@ class Spectrum_M2i2030(Instrument):
     7) fix handling of timeout! (not enough triggers detected) (error nr 263)
     '''
 
-    def __init__(self, name):
+    def __init__(self, name, dll=None):
         '''
         Initializes the dataacquisition card, and communicates with the wrapper.
 
@@ -58,6 +61,8 @@ class Spectrum_M2i2030(Instrument):
 
         Input:
             name (string) : name of the instrument
+            dll (object)  : object to use instead of spcm_win32.dll, e.g.
+                            _Spectrum_M2i2030.simulated.SimulatedSpcm()
 
         Output:
             None
@@ -66,9 +71,13 @@ class Spectrum_M2i2030(Instrument):
         logging.info(__name__ + ' : Initializing instrument Spectrum')
         Instrument.__init__(self, name, tags=['physical'])
 
+        # Reusable DMA and conversion buffers
+        self._transfer_buffer = None
+        self._float_buffer = None
+
         # Load dll and open connection
         self._card_is_open = False
-        self._load_dll()
+        self._load_dll(dll)
         self._open()
 
         # add parameters
@@ -112,6 +121,9 @@ class Spectrum_M2i2030(Instrument):
         self.add_function('set_clockmode_pll')
         self.add_function('set_clockmode_quartz1')
         self.add_function('set_single_mode')
+        self.add_function('set_multi_mode')
+        self.add_function('set_fifo_single_mode')
+        self.add_function('set_fifo_multi_mode')
         self.add_function('trigger_mode_pos')
         self.add_function('trigger_mode_neg')
         self.add_function('set_trigger_ORmask_tmask_ext0')
@@ -137,16 +149,22 @@ class Spectrum_M2i2030(Instrument):
 ### init related functions
 ###########################
 
-    def _load_dll(self):
+    def _load_dll(self, dll=None):
         '''
         Loads the functions from spcm_win32.dll
 
         Input:
-            None
+            dll (object) : if given, this object is used instead of the dll.
+                           It has to provide the functions assigned below.
 
         Output:
             None
         '''
+        if dll is not None:
+            logging.debug(__name__ + ' : Using %r instead of spcm_win32.dll' % dll)
+            self._spcm_win32 = dll
+            return
+
         logging.debug(__name__ + ' : Loading spcm_win32.dll')
         self._spcm_win32 = windll.LoadLibrary('C:\\WINDOWS\\System32\\spcm_win32')
 
@@ -906,6 +924,35 @@ class Spectrum_M2i2030(Instrument):
         logging.debug(__name__ + ' : Set the card in multi mode readout status')
         self._set_param(_spcm_regs.SPC_CARDMODE, _spcm_regs.SPC_REC_STD_MULTI)
 
+    def set_fifo_single_mode(self):
+        '''
+        Sets the card in FIFO single shot mode: after the trigger the data
+        is streamed continuously to the pc, see readout_fifo_stream.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        logging.debug(__name__ + ' : Set the card in fifo single mode readout status')
+        self._set_param(_spcm_regs.SPC_CARDMODE, _spcm_regs.SPC_REC_FIFO_SINGLE)
+
+    def set_fifo_multi_mode(self):
+        '''
+        Sets the card in FIFO multiple recording mode: one segment is
+        recorded on every trigger event and streamed to the pc,
+        see readout_fifo_stream.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        logging.debug(__name__ + ' : Set the card in fifo multi mode readout status')
+        self._set_param(_spcm_regs.SPC_CARDMODE, _spcm_regs.SPC_REC_FIFO_MULTI)
+
 
 ##############
 ### Trigger
@@ -1114,32 +1161,90 @@ class Spectrum_M2i2030(Instrument):
 ### read data from card
 #######################
 
-    def readout_raw_buffer(self, nr_of_channels=1):
+    def _get_transfer_buffer(self, nbytes):
         '''
-        Reads out the buffer, and returns a list with the size of the
-        buffer. Contains only data if the channel is triggered.
+        Returns a page-aligned int8 array of nbytes that is handed to the
+        card for DMA. The array is reused by every readout and only
+        reallocated when the requested size changes.
 
         Input:
-            None
+            nbytes (int) : size of the buffer in bytes
 
         Output:
-            data (int[memsize]): The data of the buffer
+            buffer (numpy.ndarray) : int8 array
         '''
-        logging.debug(__name__ + ' : Readout raw buffer')
-        lMemsize = self.get_memsize()
-        lBufsize = lMemsize * nr_of_channels
+        buf = self._transfer_buffer
+        if buf is None or buf.size != nbytes:
+            logging.debug(__name__ + ' : Allocating transfer buffer of %d bytes' % nbytes)
+            raw = numpy.empty(nbytes + _PAGE_SIZE, dtype=numpy.int8)
+            start = -raw.ctypes.data % _PAGE_SIZE
+            buf = raw[start:start + nbytes]
+            self._transfer_buffer = buf
+        return buf
 
-        a = (c_int8 * lBufsize)()
-        p_data = pointer(a)
+    def _get_float_buffer(self, shape):
+        '''
+        Returns a float32 array of the given shape, reused between readouts
+        to hold the data converted to millivolts.
+        '''
+        buf = self._float_buffer
+        if buf is None or buf.shape != shape:
+            buf = numpy.empty(shape, dtype=numpy.float32)
+            self._float_buffer = buf
+        return buf
 
-        # setup buffer
-        err = self._spcm_win32.DefTransfer64(self._spcm_win32.handel, _spcm_regs.SPCM_BUF_DATA, 1,
-            0, p_data, c_int64(0), c_int64(lBufsize))
+    def _def_transfer(self, buf, notify_size=0):
+        '''
+        Registers buf as the data transfer buffer of the card.
+
+        Input:
+            buf (numpy.ndarray) : contiguous int8 array
+            notify_size (int)   : bytes after which the driver signals
+                                  availability of data, 0 for the end of
+                                  the transfer only
+
+        Output:
+            None
+        '''
+        err = self._spcm_win32.DefTransfer64(self._spcm_win32.handel,
+            _spcm_regs.SPCM_BUF_DATA, _spcm_regs.SPCM_DIR_CARDTOPC, notify_size,
+            buf.ctypes.data_as(c_void_p), c_int64(0), c_int64(buf.nbytes))
         if (err!=0):
             logging.error(__name__ + ' : Error setting up buffer')
             self._get_error()
             raise ValueError('Error communicating with device')
 
+    def _scale(self, raw, out, amp, offset):
+        '''
+        Converts raw samples to millivolts, writing into out.
+        '''
+        numpy.multiply(raw, 2.0 * amp / 255.0, out)
+        out += offset
+        return out
+
+    def readout_raw_buffer(self, nr_of_channels=1, copy=False):
+        '''
+        Reads out the buffer, and returns an array with the size of the
+        buffer. Contains only data if the channel is triggered.
+
+        The data is transferred by DMA directly into a reusable buffer,
+        which is returned without copying. It will be overwritten by the
+        next readout, so use copy=True to keep the data.
+
+        Input:
+            nr_of_channels (int) : number of enabled channels
+            copy (bool)          : return a copy of the transfer buffer
+
+        Output:
+            data (int8[memsize * nr_of_channels]): The data of the buffer
+        '''
+        logging.debug(__name__ + ' : Readout raw buffer')
+        lMemsize = self.get_memsize()
+        lBufsize = lMemsize * nr_of_channels
+
+        buf = self._get_transfer_buffer(lBufsize)
+        self._def_transfer(buf)
+
         # readout data
         err = self._spcm_win32.SetParam32(self._spcm_win32.handel, _spcm_regs.SPC_M2CMD,
             _spcm_regs.M2CMD_DATA_STARTDMA | _spcm_regs.M2CMD_DATA_WAITDMA)
@@ -1148,36 +1253,37 @@ class Spectrum_M2i2030(Instrument):
             self._get_error()
             raise ValueError('Error communicating with device')
 
-        data = p_data.contents[:]
-        return data
+        if copy:
+            return buf.copy()
+        return buf
 
-    def readout_singlechannel_singlemode_bin(self):
+    def readout_singlechannel_singlemode_bin(self, copy=False):
         '''
-        Reads out the buffer, and returns a list with the size of the
+        Reads out the buffer, and returns an array with the size of the
         buffer. Contains only data if the channel is triggered.
 
         Input:
-            None
+            copy (bool) : return a copy instead of the reusable buffer
 
         Output:
-            data (int[memsize]): The data of the buffer
+            data (int8[memsize]): The data of the buffer
         '''
         logging.debug(__name__ + ' : Readout binaries from buffer')
 
-        data = self.readout_raw_buffer()
+        data = self.readout_raw_buffer(copy=copy)
         return data
 
-    def readout_singlechannel_singlemode_float(self):
+    def readout_singlechannel_singlemode_float(self, copy=False):
         '''
         Reads out the buffer, and converts the data to the actual input voltage.
-        Returns a list with the size of the buffer.
+        Returns an array with the size of the buffer.
         Contains only data if the channel is triggered.
 
         Input:
-            None
+            copy (bool) : return a copy instead of the reusable buffer
 
         Output:
-            dataout (float[memsize]): The data of the buffer
+            dataout (float32[memsize]): The data of the buffer
         '''
         logging.debug(__name__ + ' : Readout float after converting from binaries')
 
@@ -1185,27 +1291,21 @@ class Spectrum_M2i2030(Instrument):
         offset = float(self.get_input_offset_ch0())
 
         data = self.readout_raw_buffer()
-        if data == 'timeout':
-            return data
-        data = numpy.array(data, numpy.float32)
-        data = []
-        data = 2.0 * amp * (data / 255.0) + offset
-        return data
+        out = self._scale(data, self._get_float_buffer(data.shape), amp, offset)
+        if copy:
+            return out.copy()
+        return out
 
-    def readout_singlechannel_multimode_bin(self):
+    def readout_singlechannel_multimode_bin(self, copy=False):
         lMemsize = self.get_memsize()
         lSegsize = self.get_segmentsize()
 
         lnumber_of_samples = lMemsize / lSegsize
 
-        data = self.readout_raw_buffer()
-        if data == 'timeout':
-            return data
-        data = numpy.array(data, numpy.int8)
-        data = numpy.reshape(data, (lnumber_of_samples, lSegsize))
-        return data
+        data = self.readout_raw_buffer(copy=copy)
+        return data.reshape((lnumber_of_samples, lSegsize))
 
-    def readout_singlechannel_multimode_float(self):
+    def readout_singlechannel_multimode_float(self, copy=False):
         lMemsize = self.get_memsize()
         lSegsize = self.get_segmentsize()
         amp = float(self.get_input_amp_ch0())
@@ -1214,52 +1314,108 @@ class Spectrum_M2i2030(Instrument):
         lnumber_of_samples = lMemsize / lSegsize
 
         data = self.readout_raw_buffer()
-        if data == 'timeout':
-            return data
-        data = numpy.array(data, numpy.float32)
-        data = numpy.reshape(data, (lnumber_of_samples, lSegsize))
-        data = 2.0 * amp * (data / 255.0) + offset
-        return data
+        data = data.reshape((lnumber_of_samples, lSegsize))
+        out = self._scale(data, self._get_float_buffer(data.shape), amp, offset)
+        if copy:
+            return out.copy()
+        return out
 
-    def readout_doublechannel_multimode_bin(self):
+    def readout_doublechannel_multimode_bin(self, copy=False):
         lMemsize = self.get_memsize()
         lSegsize = self.get_segmentsize()
 
         lnumber_of_samples = lMemsize / lSegsize
 
-        data = self.readout_raw_buffer(nr_of_channels=2)
-        if data == 'timeout':
-            return data
-        data = numpy.array(data, numpy.int8)
-        data = numpy.reshape(data, (lMemsize, 2))
-        data0 = data[:,0]
-        data1 = data[:,1]
-        data0 = numpy.reshape(data0, (lnumber_of_samples, lSegsize))
-        data1 = numpy.reshape(data1, (lnumber_of_samples, lSegsize))
-        return (data0, data1)
-
-    def readout_doublechannel_multimode_float(self):
+        # samples of both channels are interleaved
+        data = self.readout_raw_buffer(nr_of_channels=2, copy=copy)
+        data = data.reshape((lnumber_of_samples, lSegsize, 2))
+        return (data[:,:,0], data[:,:,1])
+
+    def readout_doublechannel_multimode_float(self, copy=False):
         lMemsize = self.get_memsize()
         lSegsize = self.get_segmentsize()
         amp0 = float(self.get_input_amp_ch0())
-        offset0 = float(self.get_input_offset_ch1())
-        amp1 = float(self.get_input_amp_ch0())
+        offset0 = float(self.get_input_offset_ch0())
+        amp1 = float(self.get_input_amp_ch1())
         offset1 = float(self.get_input_offset_ch1())
 
         lnumber_of_samples = lMemsize / lSegsize
 
         data = self.readout_raw_buffer(nr_of_channels=2)
-        if data == 'timeout':
-            return data
-        data = numpy.array(data, numpy.int8)
-        data = numpy.reshape(data, (lMemsize, 2))
-        data0 = data[:,0]
-        data1 = data[:,1]
-        data0 = numpy.reshape(data0, (lnumber_of_samples, lSegsize))
-        data1 = numpy.reshape(data1, (lnumber_of_samples, lSegsize))
-        data0 = 2.0 * amp0 * (data0 / 255.0) + offset0
-        data1 = 2.0 * amp1 * (data1 / 255.0) + offset1
-        return (data0, data1)
+        data = data.reshape((lnumber_of_samples, lSegsize, 2))
+        out = self._get_float_buffer(data.shape)
+        self._scale(data[:,:,0], out[:,:,0], amp0, offset0)
+        self._scale(data[:,:,1], out[:,:,1], amp1, offset1)
+        if copy:
+            out = out.copy()
+        return (out[:,:,0], out[:,:,1])
+
+    def readout_fifo_stream(self, consumer, nbytes=None, nr_of_channels=1,
+            notify_size=64*1024, nblocks=16):
+        '''
+        Starts the card in FIFO mode and streams the data to consumer until
+        nbytes have been transferred or consumer returns False.
+        Use set_fifo_single_mode or set_fifo_multi_mode first.
+
+        The card writes into a ring buffer of nblocks * notify_size bytes.
+        Each available segment is passed to consumer(data) as a view on
+        this ring buffer: an int8 array, of shape (n, 2) for two channels.
+        The segment is released to the card as soon as consumer returns, so
+        copy the data if it is needed afterwards.
+
+        Input:
+            consumer (callable) : function called with every segment
+            nbytes (int)        : total bytes to transfer, None for no limit
+            nr_of_channels (int): number of enabled channels
+            notify_size (int)   : segment size, multiple of 4096 bytes
+            nblocks (int)       : number of segments in the ring buffer
+
+        Output:
+            transferred (int) : number of bytes handed to consumer
+        '''
+        if notify_size % _PAGE_SIZE != 0:
+            raise ValueError('notify_size should be a multiple of %d' % _PAGE_SIZE)
+
+        logging.debug(__name__ + ' : Start fifo streaming')
+        buf = self._get_transfer_buffer(notify_size * nblocks)
+        self._def_transfer(buf, notify_size)
+        self._set_param(_spcm_regs.SPC_M2CMD,
+            _spcm_regs.M2CMD_CARD_START | _spcm_regs.M2CMD_CARD_ENABLETRIGGER |
+            _spcm_regs.M2CMD_DATA_STARTDMA)
+
+        transferred = 0
+        try:
+            while nbytes is None or transferred < nbytes:
+                if self._set_param(_spcm_regs.SPC_M2CMD,
+                        _spcm_regs.M2CMD_DATA_WAITDMA) != 0:
+                    break
+
+                avail = self._get_param(_spcm_regs.SPC_DATA_AVAIL_USER_LEN)
+                pos = self._get_param(_spcm_regs.SPC_DATA_AVAIL_USER_POS)
+
+                # Do not hand out data across the end of the ring buffer
+                length = min(avail, buf.size - pos)
+                if nbytes is not None:
+                    length = min(length, nbytes - transferred)
+
+                segment = buf[pos:pos + length]
+                if nr_of_channels > 1:
+                    segment = segment.reshape((-1, nr_of_channels))
+                ret = consumer(segment)
+                self._set_param(_spcm_regs.SPC_DATA_AVAIL_CARD_LEN, length)
+                transferred += length
+
+                if ret is False:
+                    break
+        finally:
+            self._set_param(_spcm_regs.SPC_M2CMD,
+                _spcm_regs.M2CMD_CARD_STOP | _spcm_regs.M2CMD_DATA_STOPDMA)
+
+        status = self._get_param(_spcm_regs.SPC_M2STATUS)
+        if status & _spcm_regs.M2STAT_DATA_OVERRUN:
+            logging.warning(__name__ + ' : FIFO overrun, data was lost')
+
+        return transferred
 
 
 ### test run
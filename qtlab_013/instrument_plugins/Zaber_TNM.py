@@ -26,6 +26,7 @@ import qt
 import logging
 import numpy
 import time
+from lib.wait import wait_until, WaitTimeout
 
 class Zaber_TNM(Instrument):
     '''
@@ -148,6 +149,9 @@ class Zaber_TNM(Instrument):
         if navail > 0:
             reply = vpp43.read(self._visa.vi, navail)
 
+    def _get_navail(self):
+        return vpp43.get_attribute(self._visa.vi, vpp43.VI_ATTR_ASRL_AVAIL_NUM)
+
     def _read_reply(self, max_sleeps=100):
         '''
         Read reply from the Zaber.
@@ -155,18 +159,18 @@ class Zaber_TNM(Instrument):
         100 for a maximum delay of 5 seconds.
         '''
 
-        i = 0
-        while i < max_sleeps:
-            navail = vpp43.get_attribute(self._visa.vi, vpp43.VI_ATTR_ASRL_AVAIL_NUM)
-            if navail >= 6:
-                reply = vpp43.read(self._visa.vi, navail)
-                reply = [ord(ch) for ch in reply]
-                return reply
-
-            i += 1
-            time.sleep(0.05)
+        try:
+            wait_until(lambda: self._get_navail() >= 6, True,
+                timeout=max_sleeps * 0.05, interval=0.005,
+                max_interval=0.05, sleep=time.sleep,
+                name='%s.reply' % self.get_name())
+        except WaitTimeout:
+            return None
 
-        return None
+        navail = self._get_navail()
+        reply = vpp43.read(self._visa.vi, navail)
+        reply = [ord(ch) for ch in reply]
+        return reply
 
     def _send_raw_cmd(self, data, get_reply=True):
         '''
@@ -187,7 +191,6 @@ class Zaber_TNM(Instrument):
             tosend += "%c" % ch
 
         self._visa.write(tosend)
-        time.sleep(0.01)
         if get_reply:
             return self._read_reply()
 
@@ -0,0 +1,147 @@
+# simulated.py, software stand-in for the spcm_win32 dll
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import ctypes
+import numpy
+
+from regs import regs as _spcm_regs
+from errors import errors as _spcm_errors
+
+def _value(arg):
+    '''Return the python value of a ctypes argument or a plain number.'''
+    return getattr(arg, 'value', arg)
+
+def sawtooth(nbytes, position):
+    '''
+    Default waveform: a byte counter, so every transferred byte can be
+    traced back to its position in the acquisition.
+    '''
+    idx = numpy.arange(position, position + nbytes, dtype=numpy.int64)
+    return ((idx % 256) - 128).astype(numpy.int8)
+
+class SimulatedSpcm(object):
+    '''
+    Mimics the subset of the spcm_win32 dll used by the Spectrum_M2i2030
+    driver: register access, DefTransfer64 and DMA in standard and FIFO
+    mode. Data is written into the memory that the driver registered with
+    DefTransfer64, exactly like the real card does.
+
+    Usage:
+    from _Spectrum_M2i2030.simulated import SimulatedSpcm
+    spc = qt.instruments.create('spc', 'Spectrum_M2i2030', dll=SimulatedSpcm())
+
+    The generated data can be changed by passing a function
+    waveform(nbytes, position) that returns an int8 array.
+    '''
+
+    def __init__(self, waveform=sawtooth, ramsize=64*1024*1024):
+        self.waveform = waveform
+        self.handel = 0
+        self._regs = {
+            _spcm_regs.SPC_PCIMEMSIZE: ramsize,
+            _spcm_regs.SPC_MEMSIZE: 2048,
+            _spcm_regs.SPC_SEGMENTSIZE: 2048,
+            _spcm_regs.SPC_TIMEOUT: 0,
+        }
+        self._address = None
+        self._length = 0
+        self._notify = 0
+        self._user_pos = 0
+        self._user_len = 0
+        self._produced = 0
+        self.transfers = 0
+
+    def open(self, name):
+        self.handel = 1
+        return self.handel
+
+    def close(self, handle):
+        self.handel = 0
+
+    def SetParam32(self, handle, regnum, regval):
+        regnum = _value(regnum)
+        regval = _value(regval)
+        if regnum == _spcm_regs.SPC_M2CMD:
+            return self._command(regval)
+        if regnum == _spcm_regs.SPC_DATA_AVAIL_CARD_LEN:
+            self._user_pos = (self._user_pos + regval) % self._length
+            self._user_len -= regval
+            return 0
+        self._regs[regnum] = regval
+        return 0
+
+    SetParam64 = SetParam32
+
+    def GetParam32(self, handle, regnum, p_value):
+        regnum = _value(regnum)
+        if regnum == _spcm_regs.SPC_DATA_AVAIL_USER_LEN:
+            val = self._user_len
+        elif regnum == _spcm_regs.SPC_DATA_AVAIL_USER_POS:
+            val = self._user_pos
+        else:
+            val = self._regs.get(regnum, 0)
+        p_value.contents.value = val
+        return 0
+
+    GetParam64 = GetParam32
+
+    def DefTransfer64(self, handle, buftype, direction, notify, p_data,
+            offset, length):
+        self._address = _value(p_data)
+        self._length = _value(length)
+        self._notify = _value(notify)
+        self._user_pos = 0
+        self._user_len = 0
+        self._produced = 0
+        return 0
+
+    def InValidateBuf(self, handle, buftype):
+        self._address = None
+        self._length = 0
+        return 0
+
+    def GetErrorInfo(self, handle, p_er1, p_er2, p_text):
+        return 0
+
+    def _fifo_mode(self):
+        mode = self._regs.get(_spcm_regs.SPC_CARDMODE, 0)
+        return bool(mode & (_spcm_regs.SPC_REC_FIFO_SINGLE |
+            _spcm_regs.SPC_REC_FIFO_MULTI))
+
+    def _write(self, pos, nbytes):
+        data = self.waveform(nbytes, self._produced)
+        ctypes.memmove(self._address + pos, data.ctypes.data, nbytes)
+        self._produced += nbytes
+        self.transfers += 1
+
+    def _command(self, cmd):
+        if cmd & _spcm_regs.M2CMD_DATA_STOPDMA:
+            return 0
+        if cmd & (_spcm_regs.M2CMD_DATA_STARTDMA |
+                _spcm_regs.M2CMD_DATA_WAITDMA):
+            if self._address is None:
+                return _spcm_errors.ERR_TIMEOUT
+            if not self._fifo_mode():
+                if cmd & _spcm_regs.M2CMD_DATA_STARTDMA:
+                    self._write(0, self._length)
+                return 0
+            if cmd & _spcm_regs.M2CMD_DATA_WAITDMA:
+                free = self._length - self._user_len
+                if free < self._notify:
+                    return _spcm_errors.ERR_TIMEOUT
+                pos = (self._user_pos + self._user_len) % self._length
+                self._write(pos, self._notify)
+                self._user_len += self._notify
+        return 0
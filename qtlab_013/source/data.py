@@ -269,6 +269,10 @@ class Data(SharedGObject):
         self._npoints_last_block = 0
         self._npoints_max_block = 0
 
+        # Preallocated storage for in-memory data, self._data is a view
+        self._buffer = None
+        self._capacity = 0
+
         self._comment = []
         self._localtime = time.localtime()
         self._timestamp = time.asctime(self._localtime)
@@ -878,10 +882,7 @@ class Data(SharedGObject):
         #   - a 1d tuple of numbers, for adding a single data point
         #   - a 2d tuple/list/array, for adding >1 data points
         if self._inmem:
-            if len(self._data) == 0:
-                self._data = numpy.atleast_2d(args)
-            else:
-                self._data = numpy.append(self._data, [args], axis=0)
+            self._append_inmem(args)
 
         if self._infile:
             if npoints == 1:
@@ -900,6 +901,40 @@ class Data(SharedGObject):
         else:
             self.emit('new-data-point')
 
+    def reserve(self, npoints):
+        '''
+        Preallocate memory for npoints data points. Only has an effect for
+        data that is kept in memory; data points are then added without
+        copying the existing data.
+        '''
+        self._capacity = max(int(npoints), 0)
+
+    def _append_inmem(self, args):
+        rows = numpy.atleast_2d(args)
+        if rows.dtype.kind not in 'biuf':
+            if len(self._data) == 0:
+                self._data = rows
+            else:
+                self._data = numpy.append(self._data, rows, axis=0)
+            return
+
+        n = len(self._data)
+        if self._buffer is None or self._data.base is not self._buffer \
+                or self._buffer.shape[1] != rows.shape[1]:
+            self._buffer = None
+            if n > 0:
+                self._data = numpy.atleast_2d(self._data)
+
+        if self._buffer is None or n + len(rows) > len(self._buffer):
+            size = max(self._capacity, 2 * (n + len(rows)), 16)
+            buf = numpy.empty((size, rows.shape[1]), dtype=numpy.float64)
+            if n > 0:
+                buf[:n] = self._data
+            self._buffer = buf
+
+        self._buffer[n:n+len(rows)] = rows
+        self._data = self._buffer[:n+len(rows)]
+
     def new_block(self):
         '''Start a new data block.'''
 
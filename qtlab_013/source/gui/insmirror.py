@@ -0,0 +1,213 @@
+# insmirror.py, local mirror of the instrument state for GUI clients
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Local copy of the instruments, their parameter options, cached values
+and functions, so GUI widgets do not need a remote call for each item.
+
+The mirror is filled with one Instruments.snapshot() call and kept up to
+date with the 'state-delta' signals of the server. If a delta is missed
+(the version numbers are not consecutive) a new snapshot is requested.
+'''
+
+import gobject
+import logging
+import types
+
+class InstrumentsMirror(gobject.GObject):
+    '''
+    Mirror of the server Instruments object. Emits the same signals as
+    Instruments, after the mirror has been updated, plus signals for
+    parameter changes: parameter-added, parameter-changed and
+    parameter-removed, with arguments (instrument name, parameter name).
+    '''
+
+    __gsignals__ = {
+        'instrument-added': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT])),
+        'instrument-removed': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT])),
+        'instrument-changed': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT])),
+        'parameter-added': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT])),
+        'parameter-changed': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT])),
+        'parameter-removed': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT])),
+        'tags-added': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT])),
+    }
+
+    def __init__(self, instruments):
+        '''
+        Input:
+            instruments: (proxy of the) server Instruments object
+        '''
+        gobject.GObject.__init__(self)
+
+        self._instruments = instruments
+        self._version = None
+        self._state = {}
+        self._tags = []
+
+        # Connect first, so no change between snapshot and delta is lost
+        self._instruments.connect('state-delta', self._state_delta_cb)
+        self.resync()
+
+    def resync(self):
+        '''Replace the mirror with a new snapshot from the server.'''
+        snapshot = self._instruments.snapshot()
+        old = self._state
+        self._version = snapshot['version']
+        self._state = snapshot['instruments']
+        self._add_tags(snapshot['tags'])
+
+        for name in old:
+            if name not in self._state:
+                self.emit('instrument-removed', name)
+        for name in self._state:
+            if name not in old:
+                self.emit('instrument-added', name)
+            else:
+                self.emit('instrument-changed', name, self.get_values(name))
+
+    def get_version(self):
+        return self._version
+
+    def _state_delta_cb(self, sender, version, delta):
+        if self._version is None or version <= self._version:
+            return
+        if version != self._version + 1:
+            logging.info('Missed instrument state update %d, resyncing',
+                self._version + 1)
+            self.resync()
+            return
+
+        self._version = version
+        for change in delta:
+            try:
+                self._apply(change)
+            except Exception, e:
+                logging.warning('Unable to apply instrument change %r: %s',
+                    change[:2], e)
+
+    def _apply(self, change):
+        # Changes are idempotent; the snapshot may already contain them
+        kind, name = change[0], change[1]
+        if kind == 'added':
+            self._state[name] = change[2]
+            self._add_tags(change[2]['tags'])
+            self.emit('instrument-added', name)
+        elif kind == 'removed':
+            if name in self._state:
+                del self._state[name]
+                self.emit('instrument-removed', name)
+        elif name not in self._state:
+            return
+        elif kind == 'values':
+            params = self._state[name]['parameters']
+            for param, val in change[2].iteritems():
+                if param in params:
+                    params[param][0]['value'] = val
+            self.emit('instrument-changed', name, change[2])
+        elif kind == 'parameter':
+            params = self._state[name]['parameters']
+            param = change[2]
+            added = param not in params
+            params[param] = change[3]
+            if added:
+                self.emit('parameter-added', name, param)
+            else:
+                self.emit('parameter-changed', name, param)
+        elif kind == 'parameter-removed':
+            if change[2] in self._state[name]['parameters']:
+                del self._state[name]['parameters'][change[2]]
+                self.emit('parameter-removed', name, change[2])
+
+    def _add_tags(self, tags):
+        new = [tag for tag in tags if tag not in self._tags]
+        if len(new) > 0:
+            self._tags += new
+            self.emit('tags-added', new)
+
+    def get_instrument_names(self):
+        names = self._state.keys()
+        names.sort()
+        return names
+
+    def has_instrument(self, name):
+        return name in self._state
+
+    def get_tags(self, name=None):
+        '''Return the tags of instrument name, or all tags.'''
+        if name is None:
+            return self._tags
+        return self._state[name]['tags']
+
+    def has_tag(self, name, tags):
+        '''Return whether instrument name has any tag in tags.'''
+        if type(tags) is not types.ListType:
+            tags = [tags]
+        for tag in tags:
+            if tag in self._state[name]['tags']:
+                return True
+        return False
+
+    def get_type(self, name):
+        return self._state[name]['type']
+
+    def get_parameter_names(self, name):
+        return self._state[name]['parameters'].keys()
+
+    def get_parameters(self, name):
+        '''Return dict of parameter name -> options of instrument name.'''
+        ret = {}
+        for param, state in self._state[name]['parameters'].iteritems():
+            ret[param] = state[0]
+        return ret
+
+    def get_parameter_options(self, name, param):
+        state = self._state[name]['parameters'].get(param, None)
+        if state is None:
+            return None
+        return state[0]
+
+    def get_value(self, name, param):
+        '''Return the cached value of a parameter.'''
+        return self._state[name]['parameters'][param][0].get('value', None)
+
+    def get_values(self, name):
+        ret = {}
+        for param, state in self._state[name]['parameters'].iteritems():
+            ret[param] = state[0].get('value', None)
+        return ret
+
+    def format_range(self, name, param):
+        return self._state[name]['parameters'][param][1]
+
+    def format_rate(self, name, param):
+        return self._state[name]['parameters'][param][2]
+
+    def get_functions(self, name):
+        return self._state[name]['functions']
@@ -22,6 +22,8 @@ for i in range(100):
     time.sleep(2)
 
 instruments = helper.find_object('%s:instruments1' % config['instance_name'])
+from insmirror import InstrumentsMirror
+mirror = InstrumentsMirror(instruments)
 plots = helper.find_object('%s:namedlist_plot' % config['instance_name'])
 data = helper.find_object('%s:namedlist_data' % config['instance_name'])
 interpreter = helper.find_object('%s:python_server' % config['instance_name'])
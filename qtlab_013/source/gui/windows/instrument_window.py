@@ -30,7 +30,7 @@ import qtclient as qt
 
 class QTInstrumentFrame(gtk.VBox):
 
-    def __init__(self, ins, show_range, show_rate, **kwargs):
+    def __init__(self, insname, show_range, show_rate, **kwargs):
         gtk.VBox.__init__(self, **kwargs)
 
         self._label = gtk.Label()
@@ -48,8 +48,8 @@ class QTInstrumentFrame(gtk.VBox):
         self._table.show()
         self.pack_start(self._table, False, False)
 
-        self._instrument = ins
-        self._instrument_name = ins.get_name()
+        self._instrument_name = insname
+        self._mirror = qt.mirror
         self._label_name = {}
         self._label_val = {}
         self._label_range = {}
@@ -64,9 +64,13 @@ class QTInstrumentFrame(gtk.VBox):
 
         self._add_parameters()
 
-        ins.connect('parameter-added', self._parameter_added_cb)
-        ins.connect('parameter-changed', self._parameter_changed_cb)
-        ins.connect('parameter-removed', self._parameter_removed_cb)
+        self._hids = [
+            self._mirror.connect('parameter-added', self._parameter_added_cb),
+            self._mirror.connect('parameter-changed',
+                self._parameter_changed_cb),
+            self._mirror.connect('parameter-removed',
+                self._parameter_removed_cb),
+        ]
 
         self.show_table(True)
         self.show()
@@ -80,7 +84,8 @@ class QTInstrumentFrame(gtk.VBox):
         if param in self._label_name:
             return
 
-        popts = self._instrument.get_shared_parameter_options(param)
+        popts = self._mirror.get_parameter_options(self._instrument_name,
+                param)
         self._parameter_options[param] = popts
         nrows = self._table.props.n_rows
         self._table.resize(nrows + 1, 5)
@@ -97,7 +102,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._table.attach(plabel, 1, 2, nrows, nrows + 1)
 
         vlabel = gtk.Label()
-        val = self._instrument.get(param, query=False)
+        val = self._mirror.get_value(self._instrument_name, param)
         self._cur_val[param] = val
         vlabel.set_markup('<b>%s</b>' % \
                 qt.format_parameter_value(self._parameter_options[param], val))
@@ -112,7 +117,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._label_val[param] = vlabel
 
     def _add_range_info(self, param, rownum):
-        text = self._instrument.format_range(param)
+        text = self._mirror.format_range(self._instrument_name, param)
         rlabel = gtk.Label(text)
         rlabel.set_justify(gtk.JUSTIFY_LEFT)
         rlabel.show()
@@ -121,7 +126,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._label_range[param] = rlabel
 
     def _add_rate_info(self, param, rownum):
-        text = self._instrument.format_rate(param)
+        text = self._mirror.format_rate(self._instrument_name, param)
         rlabel = gtk.Label(text)
         rlabel.set_justify(gtk.JUSTIFY_LEFT)
         rlabel.show()
@@ -130,14 +135,16 @@ class QTInstrumentFrame(gtk.VBox):
         self._label_rate[param] = rlabel
 
     def _add_parameters(self):
-        parameters = self._instrument.get_parameter_names()
+        parameters = self._mirror.get_parameter_names(self._instrument_name)
         parameters.sort()
         for param in parameters:
             self._add_parameter_by_name(param)
 
         self.show()
 
-    def _parameter_added_cb(self, sender, name):
+    def _parameter_added_cb(self, sender, insname, name):
+        if insname != self._instrument_name:
+            return
         self._add_parameter_by_name(name)
         self._delayed_reorder()
 
@@ -170,7 +177,9 @@ class QTInstrumentFrame(gtk.VBox):
             self._reorder_hid = gobject.timeout_add(500,
                     lambda: self._reorder_table(1))
 
-    def _parameter_removed_cb(self, sender, param):
+    def _parameter_removed_cb(self, sender, insname, param):
+        if insname != self._instrument_name or param not in self._label_name:
+            return
         for i in self._label_name, self._label_val, self._label_range, self._label_rate:
             self._table.remove(i[param])
             del i[param]
@@ -207,8 +216,8 @@ class QTInstrumentFrame(gtk.VBox):
         if force:
             self._cur_val[param] = None
 
-    def get_instrument(self):
-        return self._instrument
+    def get_instrument_name(self):
+        return self._instrument_name
 
     def show_range_column(self, show):
         for label in self._label_range.values():
@@ -224,14 +233,17 @@ class QTInstrumentFrame(gtk.VBox):
             else:
                 label.show()
 
-    def _parameter_changed_cb(self, sender, param):
-        if param not in self._label_range:
+    def _parameter_changed_cb(self, sender, insname, param):
+        if insname != self._instrument_name or param not in self._label_range:
             return False
 
-        self._label_range[param].set_text(self._instrument.format_range(param))
-        self._label_rate[param].set_text(self._instrument.format_rate(param))
-        self._parameter_options[param] = self._instrument.get_shared_parameter_options(param)
-        self.update_parameter(param, self._instrument.get(param), force=True)
+        name = self._instrument_name
+        self._label_range[param].set_text(self._mirror.format_range(name, param))
+        self._label_rate[param].set_text(self._mirror.format_rate(name, param))
+        self._parameter_options[param] = \
+                self._mirror.get_parameter_options(name, param)
+        self.update_parameter(param, self._mirror.get_value(name, param),
+                force=True)
 
     def show_table(self, show):
         '''Show or hide the parameter info table.'''
@@ -248,9 +260,9 @@ class QTInstrumentFrame(gtk.VBox):
         self.show_table(not self._table.props.visible)
 
     def remove(self):
-        #FIXME: required to kill all references to the instrument object.
-        #This also suggests that InstrumentFrames are leaked.
-        self._instrument = None
+        for hid in self._hids:
+            self._mirror.disconnect(hid)
+        self._hids = []
 
 class InstrumentWindow(qtwindow.QTWindow):
 
@@ -261,12 +273,12 @@ class InstrumentWindow(qtwindow.QTWindow):
 
         self.connect("delete-event", self._delete_event_cb)
 
-        self._instruments = qt.instruments
+        self._mirror = qt.mirror
 
-        qt.instruments.connect('instrument-added', self._instrument_added_cb)
-        qt.instruments.connect('instrument-removed', \
+        self._mirror.connect('instrument-added', self._instrument_added_cb)
+        self._mirror.connect('instrument-removed', \
             self._instrument_removed_cb)
-        qt.instruments.connect('instrument-changed', \
+        self._mirror.connect('instrument-changed', \
             self._instrument_changed_cb)
 
         self._tags_dropdown = dropdowns.TagsDropdown()
@@ -307,9 +319,10 @@ class InstrumentWindow(qtwindow.QTWindow):
         self._rate_toggle.emit('toggled')
         self.add(self._outer_vbox)
 
-    def _add_instrument(self, ins):
-        name = ins.get_name()
-        self._ins_widgets[name] = QTInstrumentFrame(ins,
+    def _add_instrument(self, name):
+        if name in self._ins_widgets:
+            self._remove_instrument(name)
+        self._ins_widgets[name] = QTInstrumentFrame(name,
             self._range_toggle.get_active(),
             self._rate_toggle.get_active())
         self._vbox.pack_start(self._ins_widgets[name], False, False)
@@ -326,20 +339,15 @@ class InstrumentWindow(qtwindow.QTWindow):
                 self._ins_widgets[insname].update_parameter(param, val)
 
     def _add_instruments(self):
-        for name in self._instruments.get_instrument_names():
-            ins = qt.get_instrument_proxy(name)
-            self._add_instrument(ins)
+        for name in self._mirror.get_instrument_names():
+            self._add_instrument(name)
 
     def _delete_event_cb(self, widget, event, data=None):
         self.hide()
         return True
 
     def _instrument_added_cb(self, sender, insname):
-        ins = qt.get_instrument_proxy(insname)
-        if ins is not None:
-            self._add_instrument(ins)
-        else:
-            logging.warning('Unable to locate added instrument %s', insname)
+        self._add_instrument(insname)
 
     def _instrument_removed_cb(self, sender, insname):
         self._remove_instrument(insname)
@@ -350,8 +358,8 @@ class InstrumentWindow(qtwindow.QTWindow):
     def _tag_changed_cb(self, sender):
         tag = self._tags_dropdown.get_active_text()
         for name, widget in self._ins_widgets.iteritems():
-            ins = widget.get_instrument()
-            if tag == dropdowns.TEXT_ALL or tag in ins.get_tags():
+            if tag == dropdowns.TEXT_ALL or \
+                    tag in self._mirror.get_tags(widget.get_instrument_name()):
                 widget.show_table(True)
             else:
                 widget.show_table(False)
@@ -27,6 +27,7 @@ import lib.gui as gui
 from lib.gui.qttable import QTTable
 from lib.gui import dropdowns, qtwindow
 from lib import temp
+from lib.periodic import PeriodicService
 
 import numpy as np
 
@@ -44,6 +45,123 @@ def timesec():
 def do_print(r):
     print 'ret: %r' % (r, )
 
+class _WatchTrace():
+    '''
+    Plot data of a watched parameter.
+
+    The last <npoints> rows are kept in a ring buffer. Each new row is
+    appended to a temporary file, and the plot shows only the last
+    <npoints> rows of that file using gnuplot's 'every'. When the file
+    reaches twice that size it is rewritten with the contents of the
+    ring buffer, so adding a row costs O(1) on average.
+
+    Rows contain the time and, for every value, the (decimated) value
+    followed by its moving average if enabled. Both are updated
+    incrementally.
+    '''
+
+    def __init__(self, npoints, ma_const=None, decimate=1):
+        self._npoints = int(npoints)
+        self._ma_const = ma_const
+        self._decimate = max(1, int(decimate))
+        self._file = temp.File(mode='w')
+        self.clear()
+
+    def clear(self):
+        self._ma = None
+        self._sum = None
+        self._nsum = 0
+        self._reset_rows(None)
+
+    def _reset_rows(self, ncols):
+        if ncols is None:
+            self._data = None
+        else:
+            self._data = np.zeros([self._npoints, ncols])
+        self._pos = 0
+        self._count = 0
+        self._nrows = 0
+        self._truncate()
+
+    def _truncate(self):
+        f = self._file.get_file()
+        f.seek(0)
+        f.truncate()
+        f.flush()
+
+    def get_filename(self):
+        return self._file.name
+
+    def get_ncols(self):
+        if self._data is None:
+            return None
+        return self._data.shape[1]
+
+    def get_every(self):
+        '''Gnuplot 'every' clause selecting the last <npoints> rows.'''
+        return '::%d' % max(0, self._nrows - self._npoints)
+
+    def get_data(self):
+        '''Return the rows in the ring buffer, oldest first.'''
+        if self._data is None:
+            return None
+        if self._count < self._npoints:
+            return self._data[:self._count]
+        return np.concatenate((self._data[self._pos:],
+            self._data[:self._pos]))
+
+    def add(self, val):
+        '''
+        Add a value (number or sequence of numbers).
+        Returns True if a row was added to the file.
+        '''
+        try:
+            vals = np.array(val, dtype=np.float).ravel()
+        except (TypeError, ValueError):
+            return False
+
+        if self._sum is None or len(self._sum) != len(vals):
+            self._sum = np.zeros_like(vals)
+            self._nsum = 0
+            self._ma = None
+        self._sum += vals
+        self._nsum += 1
+        if self._nsum < self._decimate:
+            return False
+        vals = self._sum / self._nsum
+        self._sum[:] = 0
+        self._nsum = 0
+
+        if self._ma_const is not None:
+            if self._ma is None:
+                self._ma = vals.copy()
+            else:
+                self._ma = self._ma * self._ma_const + \
+                    (1 - self._ma_const) * vals
+            vals = np.column_stack((vals, self._ma)).ravel()
+        row = np.concatenate(([timesec()], vals))
+
+        if self._data is None or self._data.shape[1] != len(row):
+            self._reset_rows(len(row))
+        self._data[self._pos] = row
+        self._pos = (self._pos + 1) % self._npoints
+        self._count = min(self._count + 1, self._npoints)
+
+        f = self._file.get_file()
+        if self._nrows >= 2 * self._npoints:
+            self._truncate()
+            np.savetxt(f, self.get_data())
+            self._nrows = self._count
+        else:
+            np.savetxt(f, row.reshape(1, -1))
+            self._nrows += 1
+        f.flush()
+        return True
+
+    def remove(self):
+        self._file.close()
+        self._file.remove()
+
 class WatchWindow(qtwindow.QTWindow):
 
     ORDERID = 22
@@ -56,6 +174,7 @@ class WatchWindow(qtwindow.QTWindow):
 
         self._watch = {}
         self._paused = False
+        self._periodic = PeriodicService()
 
         self._frame = gtk.Frame()
         self._frame.set_label(_L('Add variable'))
@@ -81,8 +200,13 @@ class WatchWindow(qtwindow.QTWindow):
         self._npoints.set_range(10, 1000)
         self._npoints.set_value(100)
         self._npoints.set_increments(1, 10)
-        graph = gui.pack_hbox([self._graph_check, label, self._npoints],
-                True, False)
+        dlabel = gtk.Label('Decimate')
+        self._decimate = gtk.SpinButton(climb_rate=1, digits=0)
+        self._decimate.set_range(1, 1000)
+        self._decimate.set_value(1)
+        self._decimate.set_increments(1, 10)
+        graph = gui.pack_hbox([self._graph_check, label, self._npoints,
+                dlabel, self._decimate], True, False)
 
         self._ma_check = gtk.CheckButton('Moving average')
         self._ma_check.set_active(False)
@@ -145,6 +269,7 @@ class WatchWindow(qtwindow.QTWindow):
         logging.info('Watch win: setting paused to %s', paused)
         self._pause_button.set_active(paused)
         self._paused = paused
+        self._periodic.set_paused(paused)
 
     def get_paused(self):
         return self._paused
@@ -168,6 +293,7 @@ class WatchWindow(qtwindow.QTWindow):
     def _graph_toggled_cb(self, widget):
         active = self._graph_check.get_active()
         self._npoints.set_sensitive(active)
+        self._decimate.set_sensitive(active)
 
     def _ma_toggled_cb(self, widget):
         active = self._ma_check.get_active()
@@ -200,11 +326,10 @@ class WatchWindow(qtwindow.QTWindow):
 
         return True
 
-    def _ins_changed_cb(self, sender, changes, param, ins_param):
-        if ins_param not in self._watch or param not in changes:
+    def _ins_changed_cb(self, sender, val, ins_param):
+        if ins_param not in self._watch:
             return
-        info = self._watch[ins_param]
-        self._update_cb(None, ins_param, changes[param])
+        self._update_cb(None, ins_param, val)
 
     def _add_clicked_cb(self, widget):
         ins = self._ins_combo.get_instrument()
@@ -227,50 +352,21 @@ class WatchWindow(qtwindow.QTWindow):
             'options': ins.get_shared_parameter_options(param),
             'graph': self._graph_check.get_active(),
             'points': self._npoints.get_value(),
+            'decimate': self._decimate.get_value(),
             'ma': self._ma_check.get_active(),
             'ma_const': self._ma_const.get_value(),
         }
 
         self._watch[ins_param] = info
         if delay != 0:
-            hid = gobject.timeout_add(int(delay), self._query_ins, ins_param)
+            hid = self._periodic.add(self._query_ins, delay / 1000.0,
+                    name=ins_param, args=(ins_param, ))
         else:
-            hid = ins.connect('changed', lambda sender, changes: \
-                    self._ins_changed_cb(sender, changes, param, ins_param))
+            hid = ins.connect('changed::%s' % param, self._ins_changed_cb,
+                    ins_param)
 
         self._watch[ins_param]['hid'] = hid
 
-    def _get_ncols(self, info, val):
-        nvals = 1
-        try:
-            nvals = len(val)
-        except:
-            pass
-        if info['ma']:
-            nvals *= 2
-        return nvals + 1
-
-    def _get_row(self, info, val, prevrow=None):
-        row = [timesec()]
-        mac = info['ma_const']
-        try:
-            for i, v in enumerate(val):
-                row.append(v)
-                if info['ma']:
-                    if prevrow is not None and info['ma']:
-                        row.append(prevrow[2*i+2] * mac + (1 - mac) * v)
-                    else:
-                        row.append(v)
-        except:
-            row.append(val)
-            if info['ma']:
-                if prevrow is not None:
-                    row.append(prevrow[2] * mac + (1 - mac) * val)
-                else:
-                    row.append(val)
-
-        return row
-
     def _update_cb(self, sender, ins_param, val):
         if ins_param not in self._watch:
             return
@@ -284,43 +380,38 @@ class WatchWindow(qtwindow.QTWindow):
         if not info.get('graph', False):
             return
 
-        cols = self._get_ncols(info, val)
-        plotname = 'watch_%s.%s' % (ins.get_name(), param)
+        if 'trace' not in info:
+            if info['ma']:
+                ma_const = info['ma_const']
+            else:
+                ma_const = None
+            info['trace'] = _WatchTrace(info['points'], ma_const=ma_const,
+                    decimate=info['decimate'])
 
-        # Create temp file and setup plotting
-        if 'tempfile' not in info:
-            info['tempfile'] = temp.File(mode='w')
+        trace = info['trace']
+        cols = trace.get_ncols()
+        if not trace.add(val):
+            return
 
-            cmd = 'qt.plot_file("%s", name="%s", clear=True)' % (info['tempfile'].name, plotname)
+        # Setup plotting for the first row or when the columns changed
+        fn = trace.get_filename()
+        plotname = 'watch_%s.%s' % (ins.get_name(), param)
+        if cols != trace.get_ncols():
+            cmd = 'qt.plot_file("%s", name="%s", clear=True, every="%s")' % \
+                    (fn, plotname, trace.get_every())
             qt.cmd(cmd, callback=lambda *x: True)
-            for i in range(cols - 2):
-                cmd = 'qt.plot_file("%s", name="%s", valdim=%d)' % (info['tempfile'].name, plotname, i+2)
+            for i in range(trace.get_ncols() - 2):
+                cmd = 'qt.plot_file("%s", name="%s", valdim=%d, every="%s")' \
+                        % (fn, plotname, i + 2, trace.get_every())
                 qt.cmd(cmd, callback=lambda *x: True)
         else:
-            info['tempfile'].reopen()
-
-        # Allocate array, fill xs and ys with first point, shift otherwise
-        if 'data' not in info or info['data'] is None:
-            d = np.ones([info['points'], cols])
-            info['data'] = d
-            r = self._get_row(info, val)
-            for i in range(cols):
-                d[:,i] = r[i]
-        else:
-            info['data'][:-1,:] = info['data'][1:,:]
-
-        r = self._get_row(info, val, prevrow=info['data'][-2,:])
-        info['data'][-1,:] = r
-
-        np.savetxt(info['tempfile'].get_file(), info['data'])
-        info['tempfile'].close()
-        cmd = 'qt.plots["%s"].update()' % (plotname, )
-        qt.cmd(cmd)
+            cmd = 'qt.plots["%s"].set_file_options("%s", every="%s")' % \
+                    (plotname, fn, trace.get_every())
+            qt.cmd(cmd, callback=lambda *x: True)
 
     def _set_delay(self, ins_param, delay):
         info = self._watch[ins_param]
-        gobject.source_remove(info['hid'])
-        info['hid'] = gobject.timeout_add(int(delay), self._query_ins, ins_param)
+        self._periodic.set_period(info['hid'], delay / 1000.0)
         info['delay'] = delay
         strval = '%d ms' % (delay,)
         self._tree_model.set(info['iter'], 1, strval)
@@ -334,9 +425,11 @@ class WatchWindow(qtwindow.QTWindow):
 
             info = self._watch[ins_param]
             if info['delay'] != 0:
-                gobject.source_remove(info['hid'])
+                self._periodic.remove(info['hid'])
             else:
-                info['ins'].disconnect(info['hid'])
+                info['instrument'].disconnect(info['hid'])
+            if 'trace' in info:
+                info['trace'].remove()
             del self._watch[ins_param]
 
     def _apply_clicked_cb(self, widget):
@@ -357,7 +450,8 @@ class WatchWindow(qtwindow.QTWindow):
             ins_param = model.get_value(iter, 0)
 
             info = self._watch[ins_param]
-            info['data'] = None
+            if 'trace' in info:
+                info['trace'].clear()
 
 Window = WatchWindow
 
@@ -21,6 +21,7 @@ import copy
 import time
 import math
 import inspect
+import threading
 from gettext import gettext as _L
 from lib import calltimer
 from lib.network.object_sharer import SharedGObject, cache_result
@@ -83,6 +84,10 @@ class Instrument(SharedGObject):
 
     RESERVED_NAMES = ('name', 'type')
 
+    # Remote clients only receive 'changed' if they connected to it; most
+    # only need single parameters, see connect_parameter().
+    _subscribed_signals = ('changed', )
+
     _lock_classes = {}
 
     def __init__(self, name, **kwargs):
@@ -92,8 +97,12 @@ class Instrument(SharedGObject):
         self._initialized = False
         self._locked = False
 
+        # Changes can be queued from measurement worker threads
         self._changed = {}
         self._changed_hid = None
+        self._changed_lock = threading.Lock()
+        self._parameter_callbacks = {}
+        self._last_parameter_hid = 0
 
         self._options = kwargs
         if 'tags' not in self._options:
@@ -138,6 +147,13 @@ class Instrument(SharedGObject):
         '''Return instrument options.'''
         return self._options
 
+    def get_lock_class(self):
+        '''
+        Return the lock class of the instrument. Instruments in the same
+        lock class share a bus and should not be accessed concurrently.
+        '''
+        return self._lock_class
+
     def get_tags(self):
         '''
         Returns array of tags
@@ -391,9 +407,9 @@ class Instrument(SharedGObject):
             insset = set([])
             inshids = []
             for (ins, param) in options['listen_to']:
-                inshids.append(ins.connect('changed', \
+                inshids.append(ins.connect_parameter(param, \
                         self._listen_parameter_changed_cb,
-                        param, options['get_func']))
+                        options['get_func']))
             options['listed_hids'] = inshids
 
         if 'group' in options:
@@ -1184,24 +1200,87 @@ class Instrument(SharedGObject):
         logging.warning('Set not implemented for %s.%s' % \
             (Instrument.get_type(self), name))
 
-    def _listen_parameter_changed_cb(self, sender, changed, \
-            listen_param, update_func):
+    def _listen_parameter_changed_cb(self, sender, value, update_func):
+        update_func()
 
-        if listen_param not in changed:
-            return
+    def connect(self, signal, *args, **kwargs):
+        '''
+        Connect to a signal. 'changed::<parameter>' connects to changes
+        of a single parameter, see connect_parameter().
+        '''
+        if signal.startswith('changed::'):
+            return self.connect_parameter(signal[9:], *args)
+        return SharedGObject.connect(self, signal, *args, **kwargs)
 
-        update_func()
+    def disconnect(self, hid):
+        if type(hid) is types.TupleType:
+            return self.disconnect_parameter(hid)
+        return SharedGObject.disconnect(self, hid)
+
+    def connect_parameter(self, name, callback, *args):
+        '''
+        Call callback(sender, value, *args) when the value of parameter
+        'name' changes. Unlike the 'changed' signal the callback is only
+        called for this parameter.
+
+        Remote clients connect to the 'changed::<name>' signal instead.
+        Both this and the 'changed' signal are only sent to the clients
+        that connected to them.
+
+        Input:
+            name (string): parameter name
+            callback (function)
+            args: extra arguments for callback
+
+        Output:
+            handler id, for disconnect_parameter()
+        '''
+        self._last_parameter_hid += 1
+        hid = ('changed', name, self._last_parameter_hid)
+        if name not in self._parameter_callbacks:
+            self._parameter_callbacks[name] = []
+        self._parameter_callbacks[name].append((hid, callback, args))
+        return hid
+
+    def disconnect_parameter(self, hid):
+        callbacks = self._parameter_callbacks.get(hid[1], [])
+        for i, (cbhid, callback, args) in enumerate(callbacks):
+            if cbhid == hid:
+                del callbacks[i]
+                break
+        if len(callbacks) == 0 and hid[1] in self._parameter_callbacks:
+            del self._parameter_callbacks[hid[1]]
+
+    def _emit_parameter_changed(self, name, value):
+        for hid, callback, args in self._parameter_callbacks.get(name, [])[:]:
+            try:
+                callback(self, value, *args)
+            except Exception, e:
+                logging.warning('Callback for %s.%s failed: %s',
+                        self.get_name(), name, e)
+        self.emit_subscribed('changed::%s' % name, value)
 
     def _do_emit_changed(self):
-        # was this a bug?
-        self.emit('changed', self._changed)
-        self._changed = {}
-        self._changed_hid = None
+        self._changed_lock.acquire()
+        try:
+            changed = self._changed
+            self._changed = {}
+            self._changed_hid = None
+        finally:
+            self._changed_lock.release()
+
+        self.emit('changed', changed)
+        for name, value in changed.iteritems():
+            self._emit_parameter_changed(name, value)
 
     def _queue_changed(self, changed):
-        self._changed.update(changed)
-        if self._changed_hid is None:
-            self._changed_hid = gobject.idle_add(self._do_emit_changed)
+        self._changed_lock.acquire()
+        try:
+            self._changed.update(changed)
+            if self._changed_hid is None:
+                self._changed_hid = gobject.idle_add(self._do_emit_changed)
+        finally:
+            self._changed_lock.release()
 
 class InvalidInstrument(Instrument):
     '''
@@ -101,7 +101,10 @@ class Instruments(SharedGObject):
                     ([gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT])),
         'tags-added': (gobject.SIGNAL_RUN_FIRST,
                     gobject.TYPE_NONE,
-                    ([gobject.TYPE_PYOBJECT]))
+                    ([gobject.TYPE_PYOBJECT])),
+        'state-delta': (gobject.SIGNAL_RUN_FIRST,
+                    gobject.TYPE_NONE,
+                    ([gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT]))
     }
 
     __id = 1
@@ -113,6 +116,11 @@ class Instruments(SharedGObject):
         self._instruments_info = {}
         self._tags = []
 
+        # State version and changes for the next 'state-delta' signal
+        self._version = 0
+        self._delta = []
+        self._delta_hid = None
+
     def __getitem__(self, key):
         return self.get(key)
 
@@ -135,8 +143,16 @@ class Instruments(SharedGObject):
         info['changed_hid'] = ins.connect('changed', self._instrument_changed_cb)
         info['removed_hid'] = ins.connect('removed', self._instrument_removed_cb)
         info['reload_hid'] = ins.connect('reload', self._instrument_reload_cb)
+        info['padd_hid'] = ins.connect('parameter-added',
+                self._parameter_changed_cb)
+        info['pchanged_hid'] = ins.connect('parameter-changed',
+                self._parameter_changed_cb)
+        info['premoved_hid'] = ins.connect('parameter-removed',
+                self._parameter_removed_cb)
         info['proxy'] = Proxy(ins.get_name())
         self._instruments_info[ins.get_name()] = info
+        self._queue_delta(('added', ins.get_name(),
+                self._get_instrument_state(ins)))
 
         newtags = []
         for tag in ins.get_tags():
@@ -267,6 +283,8 @@ class Instruments(SharedGObject):
                 (3) optional: keyword arguments.
                     (1) tags, array of strings representing tags
                     (2) many instruments require address=<address>
+                    (3) visa, 'pyvisa' or 'sim' to select the VISA
+                        provider, see lib/simvisa.py
 
         Output: Instrument object (Proxy)
         '''
@@ -279,30 +297,55 @@ class Instruments(SharedGObject):
             logging.warning('Instrument "%s" already exists, removing', name)
             self.remove(name)
 
-#        # Set VISA provider
-#        visa_driver = kwargs.get('visa', 'pyvisa')
-#        import visa
-#        visa.set_visa(visa_driver)
+        # Set VISA provider, e.g. visa='sim' for a simulated instrument,
+        # only while this instrument is created
+        create_args = dict(kwargs)
+        visa_provider = kwargs.pop('visa', None)
+        if visa_provider is not None:
+            from lib import simvisa
+            old_provider = simvisa.get_visa()
+            simvisa.set_visa(visa_provider)
+        try:
+            ins = self._create_driver(name, instype, **kwargs)
+        finally:
+            if visa_provider is not None:
+                simvisa.set_visa(old_provider)
+        if ins is None:
+            return self._create_invalid_ins(name, instype, **kwargs)
+
+        self.add(ins, create_args=create_args)
+        self.emit('instrument-added', name)
+        return self.get(name)
+
+    def _create_driver(self, name, instype, **kwargs):
+        '''
+        Load the driver module and create the Instrument object.
+
+        Input:  (1) name of the new instrument (string)
+                (2) type of instrument (string)
+                (3) keyword arguments for the driver
+
+        Output: Instrument object, or None if the driver could not be
+                loaded.
+        '''
 
         module = _get_driver_module(instype)
         if module is None:
-            return self._create_invalid_ins(name, instype, **kwargs)
+            return None
         reload(module)
         insclass = getattr(module, instype, None)
         if insclass is None:
             logging.error('Driver does not contain instrument class')
-            return self._create_invalid_ins(name, instype, **kwargs)
+            return None
 
         try:
             ins = insclass(name, **kwargs)
         except Exception, e:
             TB()
             logging.error('Error creating instrument %s', name)
-            return self._create_invalid_ins(name, instype, **kwargs)
+            return None
 
-        self.add(ins, create_args=kwargs)
-        self.emit('instrument-added', name)
-        return self.get(name)
+        return ins
 
     def reload_module(self, instype):
         module = _get_driver_module(instype, do_reload=True)
@@ -378,6 +421,7 @@ class Instruments(SharedGObject):
         if self._instruments.has_key(name):
             del self._instruments[name]
             del self._instruments_info[name]
+        self._queue_delta(('removed', name))
 
         self.emit('instrument-removed', name)
 
@@ -409,8 +453,84 @@ class Instruments(SharedGObject):
             None
         '''
 
+        self._queue_delta(('values', sender.get_name(), changes))
         self.emit('instrument-changed', sender.get_name(), changes)
 
+    def _parameter_changed_cb(self, sender, param):
+        ins = sender
+        self._queue_delta(('parameter', ins.get_name(), param,
+            self._get_parameter_state(ins, param)))
+
+    def _parameter_removed_cb(self, sender, param):
+        self._queue_delta(('parameter-removed', sender.get_name(), param))
+
+    def _get_parameter_state(self, ins, param):
+        return (ins.get_shared_parameter_options(param),
+                ins.format_range(param), ins.format_rate(param))
+
+    def _get_instrument_state(self, ins):
+        params = {}
+        for param in ins.get_parameter_names():
+            params[param] = self._get_parameter_state(ins, param)
+        return {
+            'type': ins.get_type(),
+            'tags': list(ins.get_tags()),
+            'parameters': params,
+            'functions': ins.get_functions(),
+        }
+
+    def snapshot(self):
+        '''
+        Return the state of all instruments in one message, for clients
+        that keep a local mirror (see gui/insmirror.py).
+
+        Output: dict with
+            version (int): state version, 'state-delta' signals with
+                a higher version contain the changes after this snapshot
+            tags (list): all instrument tags
+            instruments (dict): name -> dict with type, tags, functions
+                and parameters (name -> (options, range, rate)). The
+                options contain the cached value.
+        '''
+
+        state = {}
+        for name, ins in self._instruments.iteritems():
+            state[name] = self._get_instrument_state(ins)
+        return {
+            'version': self._version,
+            'tags': list(self._tags),
+            'instruments': state,
+        }
+
+    def get_version(self):
+        return self._version
+
+    def _queue_delta(self, change):
+        '''
+        Add a change to the next 'state-delta' signal. Changes are
+        collected until the main loop is idle and sent as one message;
+        value changes of the same instrument are merged.
+        '''
+
+        if change[0] == 'values':
+            if len(self._delta) > 0 and self._delta[-1][0] == 'values' \
+                    and self._delta[-1][1] == change[1]:
+                self._delta[-1][2].update(change[2])
+                return
+            change = ('values', change[1], dict(change[2]))
+
+        self._delta.append(change)
+        if self._delta_hid is None:
+            self._delta_hid = gobject.idle_add(self._emit_delta)
+
+    def _emit_delta(self):
+        delta = self._delta
+        self._delta = []
+        self._delta_hid = None
+        self._version += 1
+        self.emit('state-delta', self._version, delta)
+        return False
+
 _config = get_config()
 _insdir = _set_insdir()
 _user_insdir = _set_user_insdir()
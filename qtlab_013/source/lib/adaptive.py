@@ -0,0 +1,323 @@
+# adaptive.py, adaptive refinement of 1D and 2D sweeps
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Adaptive sweeps: measure a coarse grid first, then insert points where
+the measured value changes quickly (gradient) or deviates from a linear
+interpolation of its neighbours (curvature).
+
+All points lie on a lattice that is 2**max_level times finer than the
+coarse grid, so the refinement never produces points closer than that.
+
+Usage:
+    r = Refiner2D((0, 100, 21), (-50, 50, 21), threshold=0.05)
+    adaptive_sweep(r, measure_func, max_points=2000)
+    x, y, v, level = r.get_points()
+'''
+
+import time
+import numpy as np
+
+class _Refiner(object):
+
+    def __init__(self, threshold=0.05, curvature=None, max_level=4):
+        '''
+        Input:
+            threshold (float): refine where the value changes by more than
+                this fraction of the total value range between neighbours
+            curvature (float): refine where a point deviates by more than
+                this fraction of the value range from the linear
+                interpolation of its neighbours. None to disable.
+            max_level (int): maximum number of refinements of the coarse
+                grid
+        '''
+
+        self._threshold = threshold
+        self._curvature = curvature
+        self._max_level = int(max_level)
+        self._res = 2 ** self._max_level
+
+        self._values = {}
+        self._levels = {}
+        self._pending = set()
+        self._started = False
+
+    def _scale(self):
+        if len(self._values) < 2:
+            return 0
+        vals = np.fromiter(self._values.itervalues(), dtype=np.float64)
+        vals = vals[np.isfinite(vals)]
+        if len(vals) < 2:
+            return 0
+        return float(vals.max() - vals.min())
+
+    def _level(self, width):
+        '''Refinement level of points created by splitting width.'''
+        level = self._max_level + 1
+        while width > 1:
+            width /= 2
+            level -= 1
+        return level
+
+    def get_npoints(self):
+        return len(self._values)
+
+    def ask(self):
+        '''
+        Return the next points to measure as a list of (coords, level),
+        the most important points first. An empty list means the
+        refinement is complete.
+        '''
+
+        if not self._started:
+            self._started = True
+            keys = self._coarse_keys()
+            scores = [0] * len(keys)
+        else:
+            scale = self._scale()
+            if scale == 0:
+                return []
+            keys, scores = self._refine_keys(scale)
+
+        ret = []
+        seen = set()
+        order = np.argsort(-np.asarray(scores, dtype=np.float64),
+                kind='mergesort')
+        for i in order:
+            key, level = keys[i]
+            if key in self._values or key in self._pending or key in seen:
+                continue
+            seen.add(key)
+            self._pending.add(key)
+            self._levels[key] = level
+            ret.append((self._key_to_coords(key), level))
+
+        return ret
+
+    def tell(self, coords, value):
+        '''Store the measured value of a point returned by ask().'''
+        key = self._coords_to_key(coords)
+        self._pending.discard(key)
+        try:
+            self._values[key] = float(value)
+        except (TypeError, ValueError):
+            self._values[key] = np.nan
+
+    def _deviation(self, vm, v0, vp, dm, dp):
+        '''Deviation of v0 from the line through its two neighbours.'''
+        return abs(v0 - (vm + (vp - vm) * float(dm) / (dm + dp)))
+
+class Refiner1D(_Refiner):
+    '''Adaptive refinement of a sweep of a single coordinate.'''
+
+    def __init__(self, start, end, steps, **kwargs):
+        '''
+        Input:
+            start, end (float): sweep range
+            steps (int): number of points of the coarse grid
+            **kwargs: see _Refiner
+        '''
+
+        _Refiner.__init__(self, **kwargs)
+        if steps < 2:
+            raise ValueError('Refiner1D needs at least 2 coarse steps')
+        self._start = float(start)
+        self._delta = (float(end) - self._start) / (steps - 1) / self._res
+        self._nfine = (steps - 1) * self._res
+
+    def _coarse_keys(self):
+        return [(ix, 0) for ix in range(0, self._nfine + 1, self._res)]
+
+    def _key_to_coords(self, key):
+        return (self._start + key * self._delta, )
+
+    def _coords_to_key(self, coords):
+        return int(round((coords[0] - self._start) / self._delta))
+
+    def _refine_keys(self, scale):
+        xs = sorted(self._values.keys())
+        vs = [self._values[x] for x in xs]
+        n = len(xs)
+
+        curv = [0.0] * n
+        if self._curvature is not None:
+            for i in range(1, n - 1):
+                curv[i] = self._deviation(vs[i-1], vs[i], vs[i+1],
+                    xs[i] - xs[i-1], xs[i+1] - xs[i]) / scale
+
+        keys = []
+        scores = []
+        for i in range(n - 1):
+            width = xs[i+1] - xs[i]
+            if width < 2:
+                continue
+            grad = abs(vs[i+1] - vs[i]) / scale
+            refine = grad > self._threshold
+            score = grad / self._threshold
+            if self._curvature is not None:
+                c = max(curv[i], curv[i+1])
+                refine = refine or c > self._curvature
+                score = max(score, c / self._curvature)
+            if not refine and not np.isnan(grad):
+                continue
+            mid = xs[i] + width / 2
+            keys.append((mid, self._level(width)))
+            scores.append(score)
+
+        return keys, scores
+
+    def get_points(self):
+        '''Return sorted arrays (x, values, levels) of the measured points.'''
+        xs = sorted(self._values.keys())
+        x = np.array([self._key_to_coords(k)[0] for k in xs])
+        v = np.array([self._values[k] for k in xs])
+        lvl = np.array([self._levels.get(k, 0) for k in xs], dtype=np.int32)
+        return x, v, lvl
+
+class Refiner2D(_Refiner):
+    '''
+    Adaptive refinement of a 2D scan. The plane is divided in cells that
+    are split in four when the values at their corners differ too much.
+    '''
+
+    def __init__(self, xsweep, ysweep, **kwargs):
+        '''
+        Input:
+            xsweep, ysweep (tuple): (start, end, steps) of the coarse grid
+            **kwargs: see _Refiner
+        '''
+
+        _Refiner.__init__(self, **kwargs)
+        self._start = []
+        self._delta = []
+        self._nfine = []
+        for start, end, steps in (xsweep, ysweep):
+            if steps < 2:
+                raise ValueError('Refiner2D needs at least 2 coarse steps')
+            self._start.append(float(start))
+            self._delta.append((float(end) - start) / (steps - 1) / self._res)
+            self._nfine.append((steps - 1) * self._res)
+
+        # Cells as (ix, iy, size) in lattice units
+        res = self._res
+        self._cells = [(ix, iy, res)
+                for iy in range(0, self._nfine[1], res)
+                for ix in range(0, self._nfine[0], res)]
+
+    def _coarse_keys(self):
+        res = self._res
+        return [((ix, iy), 0)
+                for iy in range(0, self._nfine[1] + 1, res)
+                for ix in range(0, self._nfine[0] + 1, res)]
+
+    def _key_to_coords(self, key):
+        return (self._start[0] + key[0] * self._delta[0],
+                self._start[1] + key[1] * self._delta[1])
+
+    def _coords_to_key(self, coords):
+        return (int(round((coords[0] - self._start[0]) / self._delta[0])),
+                int(round((coords[1] - self._start[1]) / self._delta[1])))
+
+    def _point_curvature(self, key, size, scale):
+        vals = self._values
+        ix, iy = key
+        dev = 0.0
+        for dx, dy in ((size, 0), (0, size)):
+            m = (ix - dx, iy - dy)
+            p = (ix + dx, iy + dy)
+            if m in vals and p in vals:
+                dev = max(dev, self._deviation(vals[m], vals[key], vals[p],
+                    size, size))
+        return dev / scale
+
+    def _refine_keys(self, scale):
+        vals = self._values
+        keys = []
+        scores = []
+        remaining = []
+        for cell in self._cells:
+            ix, iy, size = cell
+            corners = ((ix, iy), (ix + size, iy), (ix, iy + size),
+                    (ix + size, iy + size))
+            if [c for c in corners if c not in vals]:
+                remaining.append(cell)
+                continue
+            if size < 2:
+                continue
+
+            cv = [vals[c] for c in corners]
+            grad = (max(cv) - min(cv)) / scale
+            refine = grad > self._threshold
+            score = grad / self._threshold
+            if self._curvature is not None:
+                c = max([self._point_curvature(k, size, scale)
+                    for k in corners])
+                refine = refine or c > self._curvature
+                score = max(score, c / self._curvature)
+            if not refine and not np.isnan(grad):
+                continue
+
+            h = size / 2
+            level = self._level(size)
+            for k in ((ix + h, iy), (ix, iy + h), (ix + h, iy + h),
+                    (ix + size, iy + h), (ix + h, iy + size)):
+                keys.append((k, level))
+                scores.append(score)
+            remaining.extend([(ix, iy, h), (ix + h, iy, h),
+                (ix, iy + h, h), (ix + h, iy + h, h)])
+
+        self._cells = remaining
+        return keys, scores
+
+    def get_points(self):
+        '''Return arrays (x, y, values, levels) of the measured points.'''
+        keys = sorted(self._values.keys(), key=lambda k: (k[1], k[0]))
+        xy = np.array([self._key_to_coords(k) for k in keys])
+        v = np.array([self._values[k] for k in keys])
+        lvl = np.array([self._levels.get(k, 0) for k in keys],
+                dtype=np.int32)
+        return xy[:, 0], xy[:, 1], v, lvl
+
+def adaptive_sweep(refiner, measure, max_points=None, max_time=None):
+    '''
+    Run an adaptive sweep.
+
+    Input:
+        refiner (Refiner1D or Refiner2D)
+        measure (function): called as measure(coords, level) for every
+            point, should return the value to refine on
+        max_points (int): stop after this many points
+        max_time (float): stop after this many seconds
+
+    Output:
+        number of measured points
+    '''
+
+    start = time.time()
+    n = 0
+    while True:
+        points = refiner.ask()
+        if len(points) == 0:
+            break
+        for coords, level in points:
+            if max_points is not None and n >= max_points:
+                return n
+            if max_time is not None and time.time() - start > max_time:
+                return n
+            refiner.tell(coords, measure(coords, level))
+            n += 1
+
+    return n
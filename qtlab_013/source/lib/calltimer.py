@@ -23,8 +23,9 @@ import gtk
 #gtk.gdk.threads_init()
 
 import threading
+import Queue
 import time
-from misc import exact_time
+from misc import exact_time, TimingStats
 
 class ThreadSafeGObject(gobject.GObject):
 
@@ -80,10 +81,122 @@ class ThreadVariable():
         self._value = value
         self._lock.release()
 
+class PeriodicSchedule(object):
+    '''
+    Absolute-deadline schedule shared by CallTimerThread and CallTimer.
+
+    Iteration i is due at t0 + i * delay (+ any extra delay requested by
+    the callback), so timing errors do not accumulate. When an iteration
+    is late by more than one period the policy decides what happens:
+        'catchup': run the missed iterations back to back
+        'skip': drop the missed slots and continue with the next one
+    The lateness of every iteration is recorded in a TimingStats object.
+    '''
+
+    CATCHUP = 'catchup'
+    SKIP = 'skip'
+
+    def __init__(self, delay, policy=CATCHUP, spin=0.0005):
+        '''
+        Input:
+            delay (float): period in seconds
+            policy (string): 'catchup' or 'skip'
+            spin (float): busy-wait for the last <spin> seconds before a
+                deadline
+        '''
+
+        if policy not in (self.CATCHUP, self.SKIP):
+            raise ValueError('Unknown overrun policy: %s' % policy)
+
+        self._delay = float(delay)
+        self._policy = policy
+        self._spin = spin
+        self._stats = TimingStats()
+        self.start()
+
+    def start(self, t0=None):
+        if t0 is None:
+            t0 = exact_time()
+        self._t0 = t0
+        self._slot = 0
+        self._extra = 0.0
+        self._overruns = 0
+        self._skipped = 0
+        self._stats.reset()
+
+    def get_deadline(self):
+        return self._t0 + self._extra + self._slot * self._delay
+
+    def add_delay(self, delay):
+        '''Shift all following deadlines by <delay> seconds.'''
+        self._extra += delay
+
+    def next(self):
+        '''Advance to the next slot, applying the overrun policy.'''
+        self._slot += 1
+        late = exact_time() - self.get_deadline()
+        if late > self._delay and self._delay > 0:
+            self._overruns += 1
+            if self._policy == self.SKIP:
+                n = int(late / self._delay)
+                self._slot += n
+                self._skipped += n
+
+    def wait(self, stop_event=None, sleep=None):
+        '''
+        Wait for the deadline of the current slot.
+
+        Input:
+            stop_event (threading.Event): return early when set
+            sleep (function): used for the coarse part of the wait,
+                called with the time in seconds. By default this waits on
+                stop_event or uses time.sleep.
+
+        Output:
+            False if stopped, True otherwise
+        '''
+
+        deadline = self.get_deadline()
+        remaining = deadline - exact_time()
+        if remaining > self._spin:
+            if sleep is not None:
+                sleep(remaining - self._spin)
+            elif stop_event is not None:
+                stop_event.wait(remaining - self._spin)
+            else:
+                time.sleep(remaining - self._spin)
+
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            now = exact_time()
+            if now >= deadline:
+                break
+
+        self._stats.add(now - deadline)
+        return True
+
+    def get_stats(self):
+        '''
+        Return lateness statistics (see lib.misc.TimingStats) with the
+        number of overruns and skipped slots added.
+        '''
+        ret = self._stats.get_stats()
+        ret['overruns'] = self._overruns
+        ret['skipped'] = self._skipped
+        return ret
+
+    def format_stats(self):
+        return '%s\noverruns=%d skipped=%d' % \
+            (self._stats.format(), self._overruns, self._skipped)
+
 class CallTimerThread(GObjectThread):
     '''
     Class to several times do a callback with a specified delay in a separate
     thread.
+
+    The callback is called as cb(i, *args, **kwargs) and may return an
+    extra delay in ms, which shifts all following calls.
     '''
 
     __gsignals__ = {
@@ -101,7 +214,9 @@ class CallTimerThread(GObjectThread):
             delay (float): time delay in ms
             n (int): number of times to call
             *args: optional arguments to the callback
-            **kwargs: optional named arguments to the callback
+            **kwargs: optional named arguments to the callback. The
+                keyword 'policy' ('catchup' or 'skip') sets the overrun
+                policy and is not passed on.
         '''
 
         GObjectThread.__init__(self)
@@ -110,60 +225,56 @@ class CallTimerThread(GObjectThread):
         self._delay = delay
         self._n = n
         self._args = args
+        self._schedule = PeriodicSchedule(delay / 1000.0,
+                policy=kwargs.pop('policy', PeriodicSchedule.CATCHUP))
         self._kwargs = kwargs
 
-        self._stop_lock = threading.Lock()
-        self._stop_requested = False
+        self._stop_event = threading.Event()
+        self._stop_message = None
 
     def run(self):
-        tstart = exact_time()
-        extra_delay = 0
+        schedule = self._schedule
+        schedule.start()
 
         i = 0
         while i < self._n:
-            f = self._cb
+            if not schedule.wait(self._stop_event):
+                break
 
             try:
-                extra_delay += f(i, *self._args, **self._kwargs)
+                extra_delay = self._cb(i, *self._args, **self._kwargs)
             except Exception, e:
-                self.emit('finished')
-                raise e
+                self.emit('finished', str(e))
+                raise
 
-            if self.get_stop_request():
-                logging.info('Stop requested')
-                self.emit('finished', self._stop_message)
-                return
+            if extra_delay:
+                schedule.add_delay(extra_delay / 1000.0)
 
-            i += 1
-            if i == self._n:
+            if self.get_stop_request():
                 break
 
-            # delay
-            tn = exact_time()
-            if 'time_exact' in self._kwargs:
-                req_delay = tstart + extra_delay / 1000.0 + float(i) * self._delay / 1000.0 - tn
-                if req_delay > 0:
-                    time.sleep(req_delay)
-            else:
-                time.sleep((extra_delay + self._delay) / 1000.0)
+            i += 1
+            schedule.next()
 
-        self.emit('finished', 'ok')
+        if self.get_stop_request():
+            logging.info('Stop requested')
+            self.emit('finished', self._stop_message)
+        else:
+            self.emit('finished', 'ok')
 
     def set_stop_request(self, msg):
-        self._stop_lock.acquire()
-        self._stop_requested = True
         self._stop_message = msg
-        self._stop_lock.release()
+        self._stop_event.set()
 
     def get_stop_request(self):
-        self._stop_lock.acquire()
-        ret = self._stop_requested
-        self._stop_lock.release()
-        return ret
+        return self._stop_event.is_set()
 
     def get_stop_message(self):
         return self._stop_message
 
+    def get_stats(self):
+        return self._schedule.get_stats()
+
 class CallTimer:
     '''
     Class to several times do a callback with a specified delay, blocking.
@@ -178,32 +289,87 @@ class CallTimer:
             delay (float): time delay in ms
             n (int): number of times to call
             *args: optional arguments to the callback
-            **kwargs: optional named arguments to the callback
+            **kwargs: optional named arguments to the callback. The
+                keyword 'policy' ('catchup' or 'skip') sets the overrun
+                policy and is not passed on.
         '''
 
         self._cb = cb
         self._delay = delay
         self._n = n
         self._args = args
+        self._schedule = PeriodicSchedule(delay / 1000.0,
+                policy=kwargs.pop('policy', PeriodicSchedule.CATCHUP))
         self._kwargs = kwargs
 
-    def start(self):
+    def _sleep(self, delay):
         import qt
-        tstart = exact_time()
+        qt.msleep(delay, exact=True)
+
+    def start(self):
+        schedule = self._schedule
+        schedule.start()
 
         i = 0
         while i < self._n:
+            schedule.wait(sleep=self._sleep)
             self._cb(i, *self._args, **self._kwargs)
 
             i += 1
-            if i == self._n:
-                break
+            schedule.next()
+
+    def get_stats(self):
+        return self._schedule.get_stats()
 
-            # delay
-            tn = exact_time()
-            req_delay = tstart + float(i) * self._delay / 1000.0 - tn
-            if req_delay > 0:
-                qt.msleep(req_delay)
+class Job(object):
+    '''A single call, executed by a LockClassWorker.'''
+
+    def __init__(self, func, args):
+        self._func = func
+        self._args = args
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.t_start = None
+        self.t_end = None
+
+    def run(self):
+        self.t_start = time.time()
+        self.started.set()
+        try:
+            self.result = self._func(*self._args)
+        except Exception, e:
+            self.error = e
+        self.t_end = time.time()
+        self.done.set()
+
+class LockClassWorker(threading.Thread):
+    '''
+    Executes the instrument calls for one lock class in the order in which
+    they were submitted. Different lock classes run concurrently.
+    '''
+
+    def __init__(self, lockclass, prefix='worker'):
+        threading.Thread.__init__(self, name='%s_%s' % (prefix, lockclass))
+        self.setDaemon(True)
+        self._queue = Queue.Queue()
+        self.start()
+
+    def submit(self, func, *args):
+        job = Job(func, args)
+        self._queue.put(job)
+        return job
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.run()
 
 class ThreadCall(threading.Thread):
     '''
@@ -1,15 +1,148 @@
 import os
 import re
+import time
+import logging
+
+try:
+    import json
+except:
+    import simplejson as json
+
+try:
+    import sqlite3
+except:
+    sqlite3 = None
+    logging.warning('sqlite3 not available, data browser will not use a catalog')
+
+RE_META = re.compile('\A\s*#\s*(\w+)\s*:\s*([\w\s,.:;]+)')
+RE_META_KEY = re.compile('\A\s*#\s*(\w+)\s*:')
+RE_COLUMN = re.compile('\A\s*#\s*Column\s*(\d+)', re.I)
+RE_COLUMN_OPT = re.compile('\A\s*#\t(\w+)\s*:\s*(.*)$')
+RE_SETTING = re.compile('\A\t(\w+)\s*:\s*(.*)$')
+
+def read_metadata(fn):
+    '''
+    Read the header of data file fn and its settings file, if any.
+    Returns a dict with the header lines ('header'), the header
+    'key: value' entries and the lines of the settings file ('settings').
+    '''
+
+    metadata = {}
+    metadata['header'] = []
+    f = open(fn, 'r')
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line.startswith('#') and line != '':
+            break
+        metadata['header'].append(line)
+
+        m = RE_META.search(line)
+        if m is not None:
+            g = m.groups()
+            metadata[g[0]] = g[1]
+            continue
+
+        m = RE_META_KEY.search(line)
+        if m is not None:
+            metadata[m.group(1)] = {}
+    f.close()
+
+    setfn = os.path.splitext(fn)[0] + '.set'
+    if os.path.exists(setfn):
+        metadata['settings'] = []
+        f = open(setfn)
+        for line in f:
+            line = line.rstrip('\r\n')
+            metadata['settings'].append(line)
+        f.close()
+
+    return metadata
+
+def parse_columns(header):
+    '''
+    Return a list of dicts with the options ('name', 'size', ...) of the
+    columns described in the header lines.
+    '''
+    columns = []
+    for line in header:
+        m = RE_COLUMN.search(line)
+        if m is not None:
+            columns.append({})
+            continue
+        m = RE_COLUMN_OPT.search(line)
+        if m is not None and len(columns) > 0:
+            columns[-1][m.group(1)] = m.group(2).strip()
+    return columns
+
+def parse_settings(lines):
+    '''Return a list of (instrument, parameter, value) from a settings file.'''
+    ret = []
+    ins = None
+    for line in lines:
+        if line.startswith('Instrument:'):
+            ins = line.split(':', 1)[1].strip()
+            continue
+        m = RE_SETTING.search(line)
+        if m is not None and ins is not None:
+            ret.append((ins, m.group(1), m.group(2).strip()))
+    return ret
+
+def _file_times(fn):
+    setfn = os.path.splitext(fn)[0] + '.set'
+    try:
+        set_mtime = os.path.getmtime(setfn)
+    except OSError:
+        set_mtime = 0
+    return os.path.getmtime(fn), set_mtime
+
+def scan_file(fn):
+    '''
+    Parse a data file for the catalog. Returns a dict, or None if the
+    file could not be read. This is a module level function so that it
+    can be run in a process pool.
+    '''
+
+    try:
+        mtime, set_mtime = _file_times(fn)
+        metadata = read_metadata(fn)
+    except Exception, e:
+        logging.warning('Unable to read %s: %s', fn, e)
+        return None
+
+    try:
+        t = time.mktime(time.strptime(metadata.get('Timestamp', '').strip()))
+    except ValueError:
+        t = mtime
+
+    columns = parse_columns(metadata['header'])
+    return {
+        'path': fn,
+        'mtime': mtime,
+        'set_mtime': set_mtime,
+        'name': os.path.basename(fn),
+        'time': t,
+        'columns': [col.get('name', '') for col in columns],
+        'dims': [col.get('size', '') for col in columns],
+        'settings': parse_settings(metadata.get('settings', [])),
+        'metadata': metadata,
+    }
 
 class DataInfo:
 
-    RE_META = re.compile('\A\s*#\s*(\w+)\s*:\s*([\w\s,.:;]+)')
-    RE_META_KEY = re.compile('\A\s*#\s*(\w+)\s*:')
+    RE_META = RE_META
+    RE_META_KEY = RE_META_KEY
 
-    def __init__(self, fn):
+    def __init__(self, fn, metadata=None):
+        '''
+        If metadata is given (e.g. from the catalog) the file is not read.
+        '''
         self._filename = None
         self._metadata = {}
-        self.set_filename(fn)
+        if metadata is None:
+            self.set_filename(fn)
+        else:
+            self._filename = fn
+            self._metadata = metadata
 
     def set_filename(self, fn):
         self._filename = fn
@@ -22,47 +155,294 @@ class DataInfo:
         return self._metadata
 
     def read_info(self):
-        self._metadata = {}
-        self._metadata['header'] = []
-        f = open(self._filename, 'r')
-        for line in f:
-            line = line.rstrip('\r\n')
-            if not line.startswith('#') and line != '':
-                break
-            self._metadata['header'].append(line)
-
-            m = self.RE_META.search(line)
-            if m is not None:
-                g = m.groups()
-                self._metadata[g[0]] = g[1]
-                continue
-
-            m = self.RE_META_KEY.search(line)
-            if m is not None:
-                self._metadata[g[0]] = {}
-
-        self._check_settings_file()
-
-    def _check_settings_file(self):
-        fn = os.path.splitext(self._filename)[0] + '.set'
-        if os.path.exists(fn):
-            self._metadata['settings'] = []
-            f = open(fn)
-            for line in f:
-                line = line.rstrip('\r\n')
-                self._metadata['settings'].append(line)
+        self._metadata = read_metadata(self._filename)
+
+class Catalog:
+    '''
+    Index of the data files in a directory tree, stored in an SQLite
+    database in that directory. update() only parses files that are new
+    or have been modified since the last update.
+    '''
+
+    FILENAME = 'qtlab_catalog.sqlite'
+    VERSION = 1
+
+    # Number of changed files above which a process pool is used
+    POOL_THRESHOLD = 50
+
+    def __init__(self, dir, filename=None):
+        self._dir = dir
+        if filename is None:
+            filename = os.path.join(dir, self.FILENAME)
+        try:
+            self._db = sqlite3.connect(filename)
+        except sqlite3.Error, e:
+            logging.warning('Unable to open catalog %s (%s), using memory',
+                filename, e)
+            self._db = sqlite3.connect(':memory:')
+        self._db.text_factory = str
+        self._create_tables()
+
+    def _create_tables(self):
+        c = self._db.cursor()
+        c.execute('PRAGMA user_version')
+        if c.fetchone()[0] != self.VERSION:
+            c.execute('DROP TABLE IF EXISTS files')
+            c.execute('DROP TABLE IF EXISTS settings')
+        c.execute('''CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE,
+            mtime REAL,
+            set_mtime REAL,
+            name TEXT,
+            timemark TEXT,
+            time REAL,
+            columns TEXT,
+            dims TEXT,
+            metadata TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS settings (
+            file_id INTEGER,
+            instrument TEXT,
+            parameter TEXT,
+            value TEXT,
+            numvalue REAL)''')
+        c.execute('CREATE INDEX IF NOT EXISTS files_time ON files (time)')
+        c.execute('CREATE INDEX IF NOT EXISTS files_timemark '
+            'ON files (timemark)')
+        c.execute('CREATE INDEX IF NOT EXISTS files_name ON files (name)')
+        c.execute('CREATE INDEX IF NOT EXISTS settings_file '
+            'ON settings (file_id)')
+        c.execute('CREATE INDEX IF NOT EXISTS settings_value '
+            'ON settings (instrument, parameter, value)')
+        c.execute('CREATE INDEX IF NOT EXISTS settings_numvalue '
+            'ON settings (instrument, parameter, numvalue)')
+        c.execute('PRAGMA user_version = %d' % self.VERSION)
+        self._db.commit()
+
+    def get_dir(self):
+        return self._dir
+
+    def _find_files(self):
+        ret = {}
+        for dirpath, dirnames, filenames in os.walk(self._dir):
+            for fn in filenames:
+                if os.path.splitext(fn)[1] == '.dat':
+                    fullfn = os.path.join(dirpath, fn)
+                    try:
+                        ret[fullfn] = _file_times(fullfn)
+                    except OSError:
+                        pass
+        return ret
+
+    def _scan(self, filenames, processes):
+        if processes != 1 and len(filenames) > self.POOL_THRESHOLD:
+            try:
+                import multiprocessing
+                pool = multiprocessing.Pool(processes)
+                try:
+                    return pool.map(scan_file, filenames, chunksize=16)
+                finally:
+                    pool.close()
+                    pool.join()
+            except Exception, e:
+                logging.warning('Parallel scan failed (%s), scanning serially',
+                    e)
+        return [scan_file(fn) for fn in filenames]
+
+    def update(self, processes=None):
+        '''
+        Bring the catalog up to date with the files on disk.
+
+        Input:
+            processes (int): number of worker processes to parse headers,
+                None for the number of cpus, 1 to not use a pool
+
+        Output:
+            (number of added or updated files, number of removed files)
+        '''
+
+        start = time.time()
+        files = self._find_files()
+        c = self._db.cursor()
+        c.execute('SELECT path, mtime, set_mtime FROM files')
+        known = {}
+        for path, mtime, set_mtime in c.fetchall():
+            known[path] = (mtime, set_mtime)
+
+        removed = [path for path in known if path not in files]
+        changed = [path for path, times in files.iteritems()
+                if known.get(path, None) != times]
+        changed.sort()
+
+        for path in removed + changed:
+            self._remove(c, path)
+        for info in self._scan(changed, processes):
+            if info is not None:
+                self._insert(c, info)
+        self._db.commit()
+
+        logging.debug('Catalog of %s updated in %.2fs: %d new or changed, '
+            '%d removed', self._dir, time.time() - start, len(changed),
+            len(removed))
+        return len(changed), len(removed)
+
+    def _remove(self, c, path):
+        c.execute('SELECT id FROM files WHERE path=?', (path, ))
+        row = c.fetchone()
+        if row is not None:
+            c.execute('DELETE FROM settings WHERE file_id=?', row)
+            c.execute('DELETE FROM files WHERE id=?', row)
+
+    def _insert(self, c, info):
+        c.execute('INSERT INTO files (path, mtime, set_mtime, name, '
+            'timemark, time, columns, dims, metadata) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (info['path'], info['mtime'], info['set_mtime'], info['name'],
+            info['name'][:6], info['time'], json.dumps(info['columns']),
+            json.dumps(info['dims']),
+            json.dumps(info['metadata'], encoding='latin-1')))
+        file_id = c.lastrowid
+        rows = []
+        for ins, param, value in info['settings']:
+            try:
+                numvalue = float(value)
+            except ValueError:
+                numvalue = None
+            rows.append((file_id, ins, param, value, numvalue))
+        c.executemany('INSERT INTO settings VALUES (?, ?, ?, ?, ?)', rows)
+
+    def find(self, match='', starttime=None, endtime=None, start=None,
+            end=None, settings=None):
+        '''
+        Return the sorted paths of files matching all given conditions.
+
+        Input:
+            match (string): substring of the file name
+            starttime, endtime (string): range of the 6-digit time mark
+                (HHMMSS) at the start of the file name
+            start, end (float): range of the file timestamp (seconds
+                since the epoch)
+            settings (dict): instrument settings, {'ins.param': value}.
+                A value can also be a (min, max) tuple.
+        '''
+
+        query = 'SELECT path FROM files WHERE 1'
+        args = []
+        if match != '':
+            # GLOB is case sensitive, unlike LIKE; the metacharacters are
+            # escaped by putting them in a character class.
+            query += ' AND name GLOB ?'
+            escaped = ''.join([c in '*?[' and '[%s]' % c or c for c in match])
+            args.append('*' + escaped + '*')
+        if starttime is not None:
+            query += ' AND timemark >= ?'
+            args.append(starttime)
+        if endtime is not None:
+            query += ' AND timemark <= ?'
+            args.append(endtime)
+        if start is not None:
+            query += ' AND time >= ?'
+            args.append(start)
+        if end is not None:
+            query += ' AND time <= ?'
+            args.append(end)
+
+        if settings is not None:
+            for key, val in settings.iteritems():
+                ins, param = key.split('.', 1)
+                query += ' AND id IN (SELECT file_id FROM settings ' \
+                    'WHERE instrument=? AND parameter=?'
+                args += [ins, param]
+                if type(val) is tuple:
+                    query += ' AND numvalue BETWEEN ? AND ?)'
+                    args += [val[0], val[1]]
+                else:
+                    query += ' AND value=?)'
+                    args.append(str(val))
+
+        query += ' ORDER BY path'
+        c = self._db.cursor()
+        c.execute(query, args)
+        return [row[0] for row in c.fetchall()]
+
+    def get_info(self, path):
+        '''
+        Return a dict with the catalog entry of path (name, time, columns,
+        dims and metadata), or None.
+        '''
+        c = self._db.cursor()
+        c.execute('SELECT name, time, columns, dims, metadata FROM files '
+            'WHERE path=?', (path, ))
+        row = c.fetchone()
+        if row is None:
+            return None
+        return {
+            'path': path,
+            'name': row[0],
+            'time': row[1],
+            'columns': json.loads(row[2]),
+            'dims': json.loads(row[3]),
+            'metadata': json.loads(row[4]),
+        }
+
+    def get_all_metadata(self):
+        '''Return a list of (path, metadata) of all files.'''
+        c = self._db.cursor()
+        c.execute('SELECT path, metadata FROM files ORDER BY path')
+        return [(path, json.loads(meta)) for path, meta in c.fetchall()]
+
+    def close(self):
+        self._db.close()
 
 class Browser:
 
-    def __init__(self, dir=None):
+    def __init__(self, dir=None, use_catalog=True, processes=None):
+        '''
+        Input:
+            dir (string): directory to browse
+            use_catalog (bool): keep an index of the files in the
+                directory, so that only new and modified files are read
+            processes (int): number of processes to parse files with,
+                see Catalog.update()
+        '''
         self._dir = None
         self._entries = []
+        self._entry_map = {}
+        self._catalog = None
+        self._use_catalog = use_catalog and sqlite3 is not None
+        self._processes = processes
         self.set_dir(dir)
 
     def set_dir(self, dir):
         self._dir = dir
         self._entries = []
-        self._walk_dir(self._dir, recurse=True)
+        self._entry_map = {}
+        if self._catalog is not None:
+            self._catalog.close()
+            self._catalog = None
+        if dir is None:
+            return
+
+        if self._use_catalog:
+            self._catalog = Catalog(dir)
+            self.refresh()
+        else:
+            self._walk_dir(self._dir, recurse=True)
+
+    def refresh(self):
+        '''Update the catalog and the entries.'''
+        if self._catalog is None:
+            self.set_dir(self._dir)
+            return
+
+        self._catalog.update(self._processes)
+        self._entries = []
+        self._entry_map = {}
+        for fn, metadata in self._catalog.get_all_metadata():
+            self._add_entry(DataInfo(fn, metadata))
+
+    def get_catalog(self):
+        return self._catalog
 
     def get_entries(self):
         return self._entries
@@ -85,6 +465,9 @@ class Browser:
             if endtime is None:
                 endtime = '240000'
 
+        if self._catalog is not None:
+            return self._catalog.find(match, starttime, endtime)
+
         ret = []
         for info in self._entries:
             fn = info.get_filename()
@@ -96,11 +479,17 @@ class Browser:
         ret.sort()
         return ret
 
+    def find(self, **kwargs):
+        '''
+        Return filenames matching a name substring, time range and / or
+        instrument settings, see Catalog.find().
+        '''
+        if self._catalog is None:
+            raise ValueError('find() requires the catalog')
+        return self._catalog.find(**kwargs)
+
     def get_entry(self, fn):
-        for i in self._entries:
-            if i.get_filename() == fn:
-                return i
-        return None
+        return self._entry_map.get(fn, None)
 
     def _walk_dir(self, dir, recurse=False):
         entries = os.listdir(dir)
@@ -108,12 +497,15 @@ class Browser:
             fullfn = os.path.join(dir, i)
             if os.path.isdir(fullfn):
                 if recurse:
-                    self._walk_dir(fullfn)
+                    self._walk_dir(fullfn, recurse=True)
             else:
                 fn, ext = os.path.splitext(i)
                 if ext == '.dat':
                     self._add_data_entry(fullfn)
 
-    def _add_data_entry(self, fn):
-        self._entries.append(DataInfo(fn))
+    def _add_entry(self, info):
+        self._entries.append(info)
+        self._entry_map[info.get_filename()] = info
 
+    def _add_data_entry(self, fn):
+        self._add_entry(DataInfo(fn))
@@ -0,0 +1,216 @@
+# decimate.py, reduce the number of points of large traces for plotting
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Decimation of traces for display. A screen can not show more points than
+it has pixels, so a trace is divided in buckets (about one per pixel) and
+only the minimum and maximum of every bucket are kept. Unlike skipping
+points, this keeps narrow peaks visible.
+
+minmax_indices() and lttb_indices() work on complete arrays, Decimator
+keeps a min/max decimation of a growing trace up to date incrementally.
+'''
+
+import numpy as np
+
+def minmax_indices(y, nbuckets):
+    '''
+    Return the sorted indices of the minimum and maximum of y in each of
+    <nbuckets> buckets with an equal number of points.
+    '''
+
+    y = np.asarray(y)
+    n = len(y)
+    if n <= 2 * nbuckets:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, nbuckets + 1).astype(np.int64)
+    return _bucket_minmax(y, edges)
+
+def minmax_indices_x(x, y, nbuckets, xmin=None, xmax=None):
+    '''
+    Return the sorted indices of the minimum and maximum of y in each of
+    <nbuckets> equally wide x intervals between xmin and xmax. Points
+    outside the range are not included. x should be monotonic.
+    '''
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if xmin is None:
+        xmin = np.nanmin(x)
+    if xmax is None:
+        xmax = np.nanmax(x)
+
+    if len(x) > 1 and x[-1] < x[0]:
+        order = slice(None, None, -1)
+    else:
+        order = slice(None)
+    xs = x[order]
+    start = np.searchsorted(xs, xmin, side='left')
+    end = np.searchsorted(xs, xmax, side='right')
+    if end - start <= 2 * nbuckets:
+        idx = np.arange(start, end)
+    else:
+        edges = np.searchsorted(xs, np.linspace(xmin, xmax, nbuckets + 1))
+        edges[0] = start
+        edges[-1] = end
+        idx = start + _bucket_minmax(y[order][start:end], edges - start)
+
+    if order.step == -1:
+        idx = np.sort(len(x) - 1 - idx)
+    return idx
+
+def _bucket_minmax(y, edges):
+    '''Indices of min and max of y between consecutive edges.'''
+    edges = np.unique(edges)
+    starts = edges[:-1]
+    starts = starts[starts < len(y)]
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    yf = np.where(np.isnan(y), np.inf, y)
+    imin = _reduceat_arg(yf, starts, np.minimum)
+    yf = np.where(np.isnan(y), -np.inf, y)
+    imax = _reduceat_arg(yf, starts, np.maximum)
+    return np.unique(np.concatenate((imin, imax)))
+
+def _reduceat_arg(y, starts, ufunc):
+    '''Index of the first extreme element in each segment.'''
+    ext = ufunc.reduceat(y, starts)
+    sizes = np.diff(np.append(starts, len(y)))
+    seg = np.repeat(np.arange(len(starts)), sizes)
+    hit = np.nonzero(y == ext[seg])[0]
+    first = np.searchsorted(seg[hit], np.arange(len(starts)))
+    return hit[first]
+
+def lttb_indices(x, y, n):
+    '''
+    Largest-Triangle-Three-Buckets downsampling to n points. Returns the
+    indices of the selected points. Gives a smoother result than min/max
+    decimation, but may miss single-point spikes.
+    '''
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    npoints = len(x)
+    if n >= npoints or n < 3:
+        return np.arange(npoints)
+
+    edges = np.linspace(1, npoints - 1, n - 1).astype(np.int64)
+    ret = np.zeros(n, dtype=np.int64)
+    ret[-1] = npoints - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+        else:
+            nlo, nhi = npoints - 1, npoints
+        cx = x[nlo:nhi].mean()
+        cy = y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) -
+                (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        ret[i + 1] = a
+
+    return ret
+
+class Decimator(object):
+    '''
+    Incremental min/max decimation of a growing trace.
+
+    Points are grouped in buckets of <bucketsize> consecutive points. When
+    there are more than 2 * width buckets, neighbouring buckets are merged
+    and the bucket size doubles, so the work per new point is constant and
+    the result has between width and 2 * width buckets.
+    '''
+
+    def __init__(self, width=1000):
+        self._width = int(width)
+        self.reset()
+
+    def reset(self):
+        self._bucketsize = 1
+        self._npoints = 0
+        self._imin = np.zeros(0, dtype=np.int64)
+        self._imax = np.zeros(0, dtype=np.int64)
+        self._vmin = np.zeros(0)
+        self._vmax = np.zeros(0)
+
+    def get_npoints(self):
+        '''Number of points processed.'''
+        return self._npoints
+
+    def get_width(self):
+        return self._width
+
+    def update(self, y):
+        '''
+        Process the new points of the trace y (the complete trace so far;
+        only the points after get_npoints() are looked at).
+        '''
+
+        y = np.asarray(y, dtype=np.float64)
+        k = self._bucketsize
+        ncomplete = len(self._imin) * k
+        end = len(y) - (len(y) - ncomplete) % k
+        if end > ncomplete:
+            self._add_buckets(y, ncomplete, end, k)
+        self._npoints = len(y)
+
+        while len(self._imin) > 2 * self._width:
+            self._merge()
+
+    def _add_buckets(self, y, start, end, k):
+        seg = y[start:end].reshape(-1, k)
+        lo = np.where(np.isnan(seg), np.inf, seg)
+        hi = np.where(np.isnan(seg), -np.inf, seg)
+        base = start + np.arange(len(seg)) * k
+        imin = lo.argmin(axis=1)
+        imax = hi.argmax(axis=1)
+        rows = np.arange(len(seg))
+        self._imin = np.append(self._imin, base + imin)
+        self._imax = np.append(self._imax, base + imax)
+        self._vmin = np.append(self._vmin, lo[rows, imin])
+        self._vmax = np.append(self._vmax, hi[rows, imax])
+
+    def _merge(self):
+        n = len(self._imin) // 2 * 2
+        imin, vmin = self._imin[:n], self._vmin[:n]
+        imax, vmax = self._imax[:n], self._vmax[:n]
+        pick = vmin[1::2] < vmin[0::2]
+        self._imin = np.where(pick, imin[1::2], imin[0::2])
+        self._vmin = np.where(pick, vmin[1::2], vmin[0::2])
+        pick = vmax[1::2] > vmax[0::2]
+        self._imax = np.where(pick, imax[1::2], imax[0::2])
+        self._vmax = np.where(pick, vmax[1::2], vmax[0::2])
+        self._bucketsize *= 2
+        # An odd last bucket can not be merged; it is processed again from
+        # the raw data on the next update.
+
+    def get_indices(self, y=None):
+        '''
+        Return the sorted indices of the points to show. If y is given the
+        incomplete last bucket is included with its min and max.
+        '''
+
+        idx = [self._imin, self._imax]
+        ncomplete = len(self._imin) * self._bucketsize
+        if y is not None and len(y) > ncomplete:
+            tail = np.asarray(y[ncomplete:], dtype=np.float64)
+            idx.append(ncomplete + _bucket_minmax(tail,
+                np.array([0, len(tail)])))
+        return np.unique(np.concatenate(idx))
@@ -3,9 +3,9 @@
 import ctypes
 import logging
 import numpy
-from time import sleep
-
-aapi = ctypes.cdll.ATSApi
+import threading
+import Queue
+from time import sleep, time
 
 HANDLE  = ctypes.c_void_p
 U8      = ctypes.c_ubyte
@@ -132,8 +132,40 @@ board_type_dict = {
                    24 : 'ATS9626',
                    25 : 'ATS9360'}
 
-aapi.AlazarGetBoardBySystemID.restype = HANDLE
-aapi.AlazarRead.restype = U32
+ApiSuccess      = 512
+ApiWaitTimeout  = 579
+
+# AutoDMA flags
+ADMA_TRADITIONAL_MODE       = 0x0
+ADMA_EXTERNAL_STARTCAPTURE  = 0x1
+ADMA_NPT                    = 0x200
+
+channel_mask_dict = {
+    'A' : 1,
+    'B' : 2,
+    'C' : 4,
+    'D' : 8,
+    }
+
+def _load_api():
+    try:
+        api = ctypes.cdll.ATSApi
+    except OSError:
+        logging.warning('alazar.py: ATSApi not found, use set_api()')
+        return None
+    api.AlazarGetBoardBySystemID.restype = HANDLE
+    api.AlazarRead.restype = U32
+    return api
+
+aapi = _load_api()
+
+def set_api(api):
+    '''
+    Replace the ATSApi dll by another object providing the same functions,
+    for example a software stand-in such as alazar_sim.SimulatedATSApi.
+    '''
+    global aapi
+    aapi = api
 
 def get_boardID():
     c_SystemId = ctypes.c_uint(1)
@@ -488,7 +520,7 @@ def read(ahandle,
             offset=0,
             ):
     '''
-    Read out one channel, return numpy array of bytes       
+    Read out one channel, return numpy array of uint16 samples
 
     U32
         AlazarRead (
@@ -542,8 +574,7 @@ def read(ahandle,
     if not (status == 512):
         raise RuntimeError('alazar failed with status: %i' % status)
 
-#    return numpy.array(c_DB[:] , dtype=numpy.uint16)
-    return c_buffer[:samples]
+    return numpy.ctypeslib.as_array(c_buffer)[:samples]
 
 def get_who_triggered(handle, board, record):
     '''Function to read out what the last trigger event was
@@ -562,3 +593,228 @@ def get_who_triggered(handle, board, record):
                                                       U32(record))
     return result
                                                       
+
+def before_async_read(ahandle, channels, pre_trig_samples, samples_per_record,
+                      records_per_buffer, records_per_acquisition, flags):
+    '''
+    Configure the board for an AutoDMA acquisition.
+
+    RETURN_CODE
+        AlazarBeforeAsyncRead (
+        HANDLE BoardHandle,
+        U32 ChannelSelect,
+        long TransferOffset,
+        U32 SamplesPerRecord,
+        U32 RecordsPerBuffer,
+        U32 RecordsPerAcquisition,
+        U32 Flags
+        );
+    '''
+    mask = 0
+    for channel in channels:
+        if channel not in channel_mask_dict:
+            raise ValueError('alazar.py: channel must be A, B, C or D')
+        mask |= channel_mask_dict[channel]
+
+    status = aapi.AlazarBeforeAsyncRead(ahandle,
+                                        U32(mask),
+                                        ctypes.c_long(-pre_trig_samples),
+                                        U32(samples_per_record),
+                                        U32(records_per_buffer),
+                                        U32(records_per_acquisition),
+                                        U32(flags))
+    if status == ApiSuccess:
+        return True
+    else:
+        raise RuntimeError('alazar failed with status: %i' % status)
+
+def post_async_buffer(ahandle, buf):
+    '''Hand the numpy array buf to the board to be filled by AutoDMA.'''
+    status = aapi.AlazarPostAsyncBuffer(ahandle,
+                                        buf.ctypes.data_as(ctypes.c_void_p),
+                                        U32(buf.nbytes))
+    if status == ApiSuccess:
+        return True
+    else:
+        raise RuntimeError('alazar failed with status: %i' % status)
+
+def wait_async_buffer_complete(ahandle, buf, timeout=1.0):
+    '''
+    Wait until the board has filled buf, at most timeout seconds.
+    Returns False if the wait timed out.
+    '''
+    status = aapi.AlazarWaitAsyncBufferComplete(ahandle,
+                                        buf.ctypes.data_as(ctypes.c_void_p),
+                                        U32(int(timeout * 1000)))
+    if status == ApiSuccess:
+        return True
+    elif status == ApiWaitTimeout:
+        return False
+    else:
+        raise RuntimeError('alazar failed with status: %i' % status)
+
+def abort_async_read(ahandle):
+    status = aapi.AlazarAbortAsyncRead(ahandle)
+    if status == ApiSuccess:
+        return True
+    else:
+        raise RuntimeError('alazar failed with status: %i' % status)
+
+class AsyncAcquisition(object):
+    '''
+    AutoDMA acquisition using a pool of numpy buffers posted to the board.
+
+    Every buffer holds records_per_buffer records of all selected channels.
+    When the board has filled a buffer it is handed to a consumer thread,
+    which calls consumer(data) with a uint16 array of shape
+    (records, channels, samples), while the remaining buffers keep
+    filling. The buffer is posted to the board again as soon as consumer
+    returns, so copy the data if it is needed afterwards.
+
+    Usage:
+        acq = AsyncAcquisition(handle, consumer, channels='AB',
+                samples_per_record=1024, records_per_buffer=100,
+                buffers_per_acquisition=10)
+        acq.start()
+        acq.wait()
+    '''
+
+    def __init__(self, ahandle, consumer, channels='ABCD',
+                 samples_per_record=1024, records_per_buffer=1,
+                 buffers_per_acquisition=None, buffer_count=4,
+                 pre_trig_samples=0, timeout=5.0):
+        if samples_per_record % 32 != 0:
+            raise ValueError('alazar.py: samples per record must be a '
+                             'multiple of 32')
+        if buffer_count < 2:
+            raise ValueError('alazar.py: at least 2 buffers are needed')
+
+        self._handle = ahandle
+        self._consumer = consumer
+        self._channels = channels
+        self._samples = samples_per_record
+        self._records = records_per_buffer
+        self._nbuffers = buffers_per_acquisition
+        self._pre_trig_samples = pre_trig_samples
+        self._timeout = timeout
+
+        # NPT mode stores all records of a channel contiguously, traditional
+        # mode stores all channels of a record contiguously.
+        if pre_trig_samples == 0:
+            self._flags = ADMA_EXTERNAL_STARTCAPTURE | ADMA_NPT
+            shape = (len(channels), records_per_buffer, samples_per_record)
+        else:
+            self._flags = ADMA_EXTERNAL_STARTCAPTURE | ADMA_TRADITIONAL_MODE
+            shape = (records_per_buffer, len(channels), samples_per_record)
+        self._buffers = [numpy.zeros(shape, dtype=numpy.uint16)
+                         for i in range(buffer_count)]
+
+        self._ready = Queue.Queue()
+        self._free = Queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self.error = None
+        self.buffers_completed = 0
+        self.consumer_time = 0.0
+
+    def _records_view(self, buf):
+        if self._flags & ADMA_NPT:
+            return buf.transpose(1, 0, 2)
+        return buf
+
+    def start(self):
+        '''Post all buffers, start the capture and the worker threads.'''
+        if self._nbuffers is None:
+            records_per_acquisition = 0x7FFFFFFF
+        else:
+            records_per_acquisition = self._records * self._nbuffers
+
+        before_async_read(self._handle, self._channels,
+                          self._pre_trig_samples, self._samples,
+                          self._records, records_per_acquisition,
+                          self._flags)
+        for buf in self._buffers:
+            post_async_buffer(self._handle, buf)
+        start_capture(self._handle)
+
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._acquire_loop),
+            threading.Thread(target=self._consume_loop),
+            ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _acquire_loop(self):
+        posted = [True] * len(self._buffers)
+        index = 0
+        try:
+            while not self._stop.is_set():
+                if self._nbuffers is not None and \
+                        self.buffers_completed >= self._nbuffers:
+                    break
+
+                # Return buffers released by the consumer to the board, the
+                # next buffer in line has to be posted before waiting on it.
+                while True:
+                    try:
+                        free = self._free.get(not posted[index], 0.1)
+                    except Queue.Empty:
+                        if posted[index] or self._stop.is_set():
+                            break
+                        continue
+                    post_async_buffer(self._handle, self._buffers[free])
+                    posted[free] = True
+                if not posted[index]:
+                    break
+
+                buf = self._buffers[index]
+                if not wait_async_buffer_complete(self._handle, buf,
+                                                  self._timeout):
+                    raise RuntimeError('alazar.py: timeout waiting for buffer')
+
+                posted[index] = False
+                self.buffers_completed += 1
+                self._ready.put(index)
+                index = (index + 1) % len(self._buffers)
+        except Exception, e:
+            logging.error('alazar.py: async acquisition failed: %s' % e)
+            self.error = e
+        finally:
+            abort_async_read(self._handle)
+            self._ready.put(None)
+
+    def _consume_loop(self):
+        while True:
+            index = self._ready.get()
+            if index is None:
+                break
+            if self._stop.is_set():
+                continue
+            start = time()
+            try:
+                self._consumer(self._records_view(self._buffers[index]))
+            except Exception, e:
+                logging.error('alazar.py: consumer failed: %s' % e)
+                self.error = e
+                self._stop.set()
+            self.consumer_time += time() - start
+            self._free.put(index)
+
+    def stop(self):
+        '''Abort the acquisition and wait for the threads to finish.'''
+        self._stop.set()
+        self.wait()
+
+    def wait(self, timeout=None):
+        '''Wait until all buffers have been acquired and consumed.'''
+        for thread in self._threads:
+            thread.join(timeout)
+        return not self.is_running()
+
+    def is_running(self):
+        for thread in self._threads:
+            if thread.is_alive():
+                return True
+        return False
@@ -0,0 +1,119 @@
+# alazar_sim.py software stand-in for the alazar ATSApi dll
+'''
+Usage:
+    from lib.dll_support import alazar, alazar_sim
+    alazar.set_api(alazar_sim.SimulatedATSApi())
+    ats = qt.instruments.create('ats', 'Alazar_ATS9440')
+'''
+import ctypes
+import numpy
+
+import alazar
+
+def _value(arg):
+    return getattr(arg, 'value', arg)
+
+def _set_ref(ref, value):
+    getattr(ref, '_obj', ref).value = value
+
+def ramp(channel, record, samples):
+    '''
+    Default record generator: a ramp whose offset encodes the channel
+    index and the record number.
+    '''
+    start = (channel * 4096 + record * 16) % 65536
+    return (numpy.arange(start, start + samples) % 65536).astype(numpy.uint16)
+
+class SimulatedATSApi(object):
+    '''
+    Mimics the ATSApi functions used by alazar.py. Register style calls
+    simply succeed, AutoDMA buffers are filled with generated records in
+    the order in which they were posted.
+    '''
+
+    def __init__(self, record=ramp, memory_size=134217728, bits=14):
+        self.record = record
+        self._memory_size = memory_size
+        self._bits = bits
+        self._posted = []
+        self._records_done = 0
+        self._config = None
+        self.record_size = 1024
+
+    def __getattr__(self, name):
+        if name.startswith('Alazar'):
+            return lambda *args: alazar.ApiSuccess
+        raise AttributeError(name)
+
+    def AlazarGetBoardBySystemID(self, system_id, board_id):
+        return 1
+
+    def AlazarGetChannelInfo(self, handle, p_samples, p_bits):
+        _set_ref(p_samples, self._memory_size)
+        _set_ref(p_bits, self._bits)
+        return alazar.ApiSuccess
+
+    def AlazarQueryCapability(self, handle, capability, reserved, p_value):
+        if _value(capability) == alazar.BOARD_TYPE.value:
+            _set_ref(p_value, 16)
+        elif _value(capability) == alazar.MEMORY_SIZE.value:
+            _set_ref(p_value, self._memory_size)
+        else:
+            _set_ref(p_value, 0)
+        return alazar.ApiSuccess
+
+    def AlazarSetRecordSize(self, handle, pre, post):
+        self.record_size = _value(pre) + _value(post)
+        return alazar.ApiSuccess
+
+    def AlazarBusy(self, handle):
+        return 0
+
+    def AlazarRead(self, handle, channel, p_buffer, element_size, record,
+                   offset, length):
+        n = _value(length)
+        data = self.record(_value(channel), _value(record) - 1, n)
+        ctypes.memmove(p_buffer, data.ctypes.data, data.nbytes)
+        return alazar.ApiSuccess
+
+    def AlazarBeforeAsyncRead(self, handle, mask, offset, samples, records,
+                              records_per_acquisition, flags):
+        mask = _value(mask)
+        self._config = {
+            'channels': [i for i in range(4) if mask & (1 << i)],
+            'samples': _value(samples),
+            'records': _value(records),
+            'npt': bool(_value(flags) & alazar.ADMA_NPT),
+            }
+        self._posted = []
+        self._records_done = 0
+        return alazar.ApiSuccess
+
+    def AlazarPostAsyncBuffer(self, handle, p_buffer, length):
+        self._posted.append((_value(p_buffer), _value(length)))
+        return alazar.ApiSuccess
+
+    def AlazarWaitAsyncBufferComplete(self, handle, p_buffer, timeout):
+        if not self._posted or self._posted[0][0] != _value(p_buffer):
+            return alazar.ApiWaitTimeout
+        address, length = self._posted.pop(0)
+
+        cfg = self._config
+        nch = len(cfg['channels'])
+        data = numpy.empty((cfg['records'], nch, cfg['samples']),
+                           dtype=numpy.uint16)
+        for r in range(cfg['records']):
+            for i, ch in enumerate(cfg['channels']):
+                data[r, i] = self.record(ch, self._records_done + r,
+                                         cfg['samples'])
+        if cfg['npt']:
+            data = data.transpose(1, 0, 2)
+        data = numpy.ascontiguousarray(data)
+        self._records_done += cfg['records']
+
+        ctypes.memmove(address, data.ctypes.data, min(length, data.nbytes))
+        return alazar.ApiSuccess
+
+    def AlazarAbortAsyncRead(self, handle):
+        self._posted = []
+        return alazar.ApiSuccess
@@ -22,13 +22,30 @@ import numpy
 import logging
 import time
 import os
+import threading
 
-if os.name == 'nt':
-    nidaq = ctypes.windll.nicaiu
-elif os.name == 'posix':
-    nidaq = ctypes.cdll.LoadLibrary("libnidaqmx.so")
-else:
-    print 'Operating system not supported.'
+def _load_library():
+    try:
+        if os.name == 'nt':
+            return ctypes.windll.nicaiu
+        elif os.name == 'posix':
+            return ctypes.cdll.LoadLibrary("libnidaqmx.so")
+        else:
+            print 'Operating system not supported.'
+    except OSError:
+        logging.warning('nidaq.py: DAQmx library not found, use set_library()')
+    return None
+
+nidaq = _load_library()
+
+def set_library(lib):
+    '''
+    Replace the DAQmx library by another object providing the same
+    functions, for example nidaq_sim.SimulatedDAQmx().
+    '''
+    global nidaq
+    clear_tasks()
+    nidaq = lib
 
 int32 = ctypes.c_long
 uInt32 = ctypes.c_ulong
@@ -55,6 +72,7 @@ DAQmx_Val_Volts             = 10348
 DAQmx_Val_Rising            = 10280
 DAQmx_Val_Falling           = 10171
 DAQmx_Val_FiniteSamps       = 10178
+DAQmx_Val_ContSamps         = 10123
 DAQmx_Val_GroupByChannel    = 0
 DAQmx_Val_GroupByScanNumber = 1
 
@@ -62,6 +80,9 @@ DAQmx_Val_CountUp           = 10128
 DAQmx_Val_CountDown         = 10124
 DAQmx_Val_ExtControlled     = 10326
 
+DAQmx_Val_Task_Commit       = 3
+DAQmx_Val_Task_Unreserve    = 5
+
 def CHK(err):
     '''Error checking routine'''
 
@@ -73,20 +94,8 @@ def CHK(err):
             (err, repr(buf.value)))
 
 def buf_to_list(buf):
-    name = ''
-    namelist = []
-    for ch in buf:
-        if ch in '\000 \t\n':
-            name = name.rstrip(',')
-            if len(name) > 0:
-                namelist.append(name)
-                name = ''
-            if ch == '\000':
-                break
-        else:
-            name += ch
-
-    return namelist
+    '''Split a comma separated list of names returned by DAQmx.'''
+    return buf.value.replace(',', ' ').split()
 
 def get_device_names():
     '''Return a list of available NIDAQ devices.'''
@@ -187,14 +196,152 @@ def get_physical_counter_channels(dev):
     nidaq.DAQmxGetDevCIPhysicalChans(dev, ctypes.byref(buf), bufsize)
     return buf_to_list(buf)
 
+def _get_device(devchan):
+    return devchan.lstrip('/').split('/')[0]
+
+def _get_config(config):
+    if type(config) is types.StringType:
+        config = _config_map.get(config.upper(), None)
+    if isinstance(config, int32):
+        config = config.value
+    if type(config) is not types.IntType:
+        raise ValueError('Invalid channel configuration')
+    return config
+
+# Committed task per device; only one analog input task can hold the
+# device resources at a time.
+_committed_tasks = {}
+_ai_tasks = {}
+
+class AITask(object):
+    '''
+    Analog input task that is created and configured once and re-armed for
+    every read, so that a read only pays for starting and stopping the
+    acquisition. The task is committed to the hardware; if another task
+    on the same device is used in between, that task is unreserved first.
+    '''
+
+    def __init__(self, devchan, samples=1, freq=10000.0, minv=-10.0,
+            maxv=10.0, config=DAQmx_Val_Cfg_Default, triggered=False,
+            trigger_slope='POS', pre_trig_samples=0,
+            trigger_source='/Dev1/PFI0'):
+        self.devchan = devchan
+        self.device = _get_device(devchan)
+        self.samples = samples
+        self.freq = freq
+        self.handle = TaskHandle(0)
+
+        try:
+            CHK(nidaq.DAQmxCreateTask("", ctypes.byref(self.handle)))
+            CHK(nidaq.DAQmxCreateAIVoltageChan(self.handle, devchan, "",
+                int32(_get_config(config)),
+                float64(minv), float64(maxv),
+                DAQmx_Val_Volts, None))
+
+            if samples > 1:
+                CHK(nidaq.DAQmxCfgSampClkTiming(self.handle, "", float64(freq),
+                    DAQmx_Val_Rising, DAQmx_Val_FiniteSamps,
+                    uInt64(samples)))
+
+                if triggered:
+                    if trigger_slope == 'POS':
+                        slope = DAQmx_Val_Rising
+                    elif trigger_slope == 'NEG':
+                        slope = DAQmx_Val_Falling
+                    else:
+                        raise ValueError('Use POS or NEG for the trigger slope')
+                    CHK(nidaq.DAQmxCfgDigEdgeRefTrig(self.handle,
+                        trigger_source, slope, uInt32(pre_trig_samples)))
+
+            nchans = uInt32(1)
+            CHK(nidaq.DAQmxGetTaskNumChans(self.handle, ctypes.byref(nchans)))
+            self.channels = nchans.value
+            self._commit()
+        except:
+            self.clear()
+            raise
+
+        self.data = numpy.zeros((self.channels, samples), dtype=numpy.float64)
+
+    def _commit(self):
+        other = _committed_tasks.get(self.device, None)
+        if other is self:
+            return
+        if other is not None and other.handle.value != 0:
+            nidaq.DAQmxTaskControl(other.handle, DAQmx_Val_Task_Unreserve)
+        CHK(nidaq.DAQmxTaskControl(self.handle, DAQmx_Val_Task_Commit))
+        _committed_tasks[self.device] = self
+
+    def read(self, timeout=10.0):
+        '''
+        Acquire the configured number of samples into self.data, an array
+        of shape (channels, samples) that is reused for every read.
+
+        Output:
+            the number of samples per channel read
+        '''
+        self._commit()
+        nread = int32(0)
+        if self.samples > 1:
+            timeout = timeout + self.samples / self.freq
+            CHK(nidaq.DAQmxStartTask(self.handle))
+            try:
+                CHK(nidaq.DAQmxReadAnalogF64(self.handle, int32(self.samples),
+                    float64(timeout), DAQmx_Val_GroupByChannel,
+                    self.data.ctypes.data, uInt32(self.data.size),
+                    ctypes.byref(nread), None))
+            finally:
+                nidaq.DAQmxStopTask(self.handle)
+        elif self.channels > 1:
+            # On demand read of one sample of every channel
+            CHK(nidaq.DAQmxReadAnalogF64(self.handle, int32(1),
+                float64(timeout), DAQmx_Val_GroupByChannel,
+                self.data.ctypes.data, uInt32(self.data.size),
+                ctypes.byref(nread), None))
+        else:
+            CHK(nidaq.DAQmxReadAnalogScalarF64(self.handle, float64(timeout),
+                self.data.ctypes.data, None))
+            nread = int32(1)
+        return nread.value
+
+    def clear(self):
+        '''Release the task.'''
+        if _committed_tasks.get(self.device, None) is self:
+            del _committed_tasks[self.device]
+        if self.handle.value != 0:
+            nidaq.DAQmxStopTask(self.handle)
+            nidaq.DAQmxClearTask(self.handle)
+            self.handle = TaskHandle(0)
+
+def get_ai_task(devchan, **kwargs):
+    '''
+    Return the AITask for a channel configuration, creating it the first
+    time. Keyword arguments are those of AITask.
+    '''
+    if 'config' in kwargs:
+        kwargs['config'] = _get_config(kwargs['config'])
+    key = (devchan, tuple(sorted(kwargs.items())))
+    task = _ai_tasks.get(key, None)
+    if task is None:
+        task = AITask(devchan, **kwargs)
+        _ai_tasks[key] = task
+    return task
+
+def clear_tasks(dev=None):
+    '''Clear the cached tasks of device dev, or of all devices.'''
+    for key, task in _ai_tasks.items():
+        if dev is None or task.device == dev:
+            task.clear()
+            del _ai_tasks[key]
+
 def read(devchan, samples=1, freq=10000.0, minv=-10.0, maxv=10.0,
             timeout=10.0, config=DAQmx_Val_Cfg_Default, 
             averaging=True, triggered = False,
             trigger_slope='POS',
             pre_trig_samples=0):
     '''
-    Read up to max_samples from a channel. Seems to have trouble reading
-    1 sample!
+    Read up to max_samples from a channel. The task for a channel
+    configuration is created on the first read and reused afterwards.
 
     Input:
         devchan (string): device/channel specifier, such as Dev1/ai0
@@ -209,81 +356,201 @@ def read(devchan, samples=1, freq=10000.0, minv=-10.0, maxv=10.0,
                                 slope for the trigger.
         
     Output:
-        A numpy.array with the data on success, None on error
+        The data on success, None on error. For a single channel this is
+        a value (one sample or averaging) or an array of samples. For
+        more channels (e.g. Dev1/ai0:3) there is one value or one row of
+        samples per channel.
 
     '''
-    timeout = timeout + samples/freq
-
-    if type(config) is types.StringType:
-        if config in _config_map:
-            config = _config_map[config]
-        else:
-            return None
-    if type(config) is not types.IntType:
+    try:
+        config = _get_config(config)
+    except ValueError:
         return None
-    
-    if samples == 1:
-        retsamples = 1
-        samples = 2
-    else:
-        retsamples = samples
-
-    data = numpy.zeros(samples, dtype=numpy.float64)
 
-    taskHandle = TaskHandle(0)
-    read = int32()
     try:
-        CHK(nidaq.DAQmxCreateTask("", ctypes.byref(taskHandle)))
-        CHK(nidaq.DAQmxCreateAIVoltageChan(taskHandle, devchan, "",
-            config,
-            float64(minv), float64(maxv),
-            DAQmx_Val_Volts, None))
-
-        if retsamples > 1:
-            CHK(nidaq.DAQmxCfgSampClkTiming(taskHandle, "", float64(freq),
-                DAQmx_Val_Rising, DAQmx_Val_FiniteSamps,
-                uInt64(samples)));
-            
-            if triggered:
-                if trigger_slope == 'POS':
-                    slope = DAQmx_Val_Rising
-                elif trigger_slope == 'NEG':
-                    slope = DAQmx_Val_Falling
-                else:
-                    raise ValueError('Use POS or NEG for the trigger slope')
-	        CHK(nidaq.DAQmxCfgDigEdgeRefTrig(taskHandle,
-                                "/Dev1/PFI0",slope,
-                                uInt32(pre_trig_samples)));
-                
-            CHK(nidaq.DAQmxStartTask(taskHandle))
-            CHK(nidaq.DAQmxReadAnalogF64(taskHandle, samples, float64(timeout),
-                DAQmx_Val_GroupByChannel, data.ctypes.data,
-                samples, ctypes.byref(read), None))
-        else:
-            CHK(nidaq.DAQmxReadAnalogScalarF64(taskHandle, float64(timeout),
-                data.ctypes.data, None))
-            read = int32(1)
-
+        task = get_ai_task(devchan, samples=samples, freq=freq,
+            minv=minv, maxv=maxv, config=config, triggered=triggered,
+            trigger_slope=trigger_slope, pre_trig_samples=pre_trig_samples)
+        nread = task.read(timeout)
     except Exception, e:
         logging.error('NI DAQ call failed: %s', str(e))
-    finally:
-        if taskHandle.value != 0:
-            nidaq.DAQmxStopTask(taskHandle)
-            nidaq.DAQmxClearTask(taskHandle)
+        # Recreate the task on the next read
+        clear_tasks(_get_device(devchan))
+        return None
 
-    if read > 0:
-        if retsamples == 1:
-            return data[0]
+    if nread > 0:
+        if task.channels == 1:
+            data = task.data[0]
         else:
-            #Jan added numpy.mean()
-            if averaging:
-                return numpy.mean(data)# Max added list() and removed numpy.mean()
-            else:
-                return data
-            #return list(data[:read.value])
+            data = task.data
+        if samples == 1:
+            return data[..., 0].copy() if data.ndim > 1 else data[0]
+        elif averaging:
+            return numpy.mean(data, axis=-1)
+        else:
+            return data.copy()
     else:
         return None
 
+class AIStream(object):
+    '''
+    Continuous analog input acquisition into a numpy ring buffer.
+
+    A polling thread reads blocks of 'chunk' samples per channel from the
+    DAQmx buffer. Each block is optionally decimated by averaging groups
+    of 'decimation' samples, passed to callback(block) and stored in a
+    ring buffer holding the last 'buffer_size' (decimated) samples of
+    every channel.
+
+    Usage:
+        stream = AIStream('Dev1/ai0:1', freq=100000, chunk=1000,
+                          decimation=10)
+        stream.start()
+        ...
+        print stream.get_average(500)
+        stream.stop()
+    '''
+
+    def __init__(self, devchan, freq=10000.0, buffer_size=100000,
+            chunk=1000, decimation=1, minv=-10.0, maxv=10.0,
+            config=DAQmx_Val_Cfg_Default, callback=None, timeout=10.0):
+        if chunk % decimation != 0:
+            raise ValueError('chunk must be a multiple of decimation')
+
+        self.devchan = devchan
+        self.device = _get_device(devchan)
+        self.freq = freq
+        self._chunk = chunk
+        self._decimation = decimation
+        self._callback = callback
+        self._timeout = timeout
+
+        self.handle = TaskHandle(0)
+        try:
+            CHK(nidaq.DAQmxCreateTask("", ctypes.byref(self.handle)))
+            CHK(nidaq.DAQmxCreateAIVoltageChan(self.handle, devchan, "",
+                int32(_get_config(config)),
+                float64(minv), float64(maxv),
+                DAQmx_Val_Volts, None))
+            # In continuous mode the sample count sets the DAQmx buffer size
+            CHK(nidaq.DAQmxCfgSampClkTiming(self.handle, "", float64(freq),
+                DAQmx_Val_Rising, DAQmx_Val_ContSamps,
+                uInt64(max(10 * chunk, int(freq)))))
+            nchans = uInt32(1)
+            CHK(nidaq.DAQmxGetTaskNumChans(self.handle, ctypes.byref(nchans)))
+            self.channels = nchans.value
+        except:
+            self.clear()
+            raise
+
+        self._block = numpy.zeros((self.channels, chunk), dtype=numpy.float64)
+        self._ring = numpy.zeros((self.channels, buffer_size),
+            dtype=numpy.float64)
+        self._pos = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.error = None
+
+    def start(self):
+        '''Start the acquisition and the polling thread.'''
+        # Release a finite task holding the device
+        other = _committed_tasks.pop(self.device, None)
+        if other is not None and other.handle.value != 0:
+            nidaq.DAQmxTaskControl(other.handle, DAQmx_Val_Task_Unreserve)
+
+        self._pos = 0
+        self._count = 0
+        self._stop.clear()
+        CHK(nidaq.DAQmxStartTask(self.handle))
+        self._thread = threading.Thread(target=self._poll)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the acquisition; the ring buffer keeps its contents.'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.handle.value != 0:
+            nidaq.DAQmxStopTask(self.handle)
+
+    def clear(self):
+        '''Stop the acquisition and release the task.'''
+        self.stop()
+        if self.handle.value != 0:
+            nidaq.DAQmxClearTask(self.handle)
+            self.handle = TaskHandle(0)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _poll(self):
+        nread = int32(0)
+        try:
+            while not self._stop.is_set():
+                CHK(nidaq.DAQmxReadAnalogF64(self.handle, int32(self._chunk),
+                    float64(self._timeout), DAQmx_Val_GroupByChannel,
+                    self._block.ctypes.data, uInt32(self._block.size),
+                    ctypes.byref(nread), None))
+                block = self._block[:, :nread.value]
+                if self._decimation > 1:
+                    n = nread.value / self._decimation
+                    block = block[:, :n * self._decimation].reshape(
+                        (self.channels, n, self._decimation)).mean(axis=2)
+                if self._callback is not None:
+                    self._callback(block)
+                self._append(block)
+        except Exception, e:
+            logging.error('NI DAQ stream failed: %s', str(e))
+            self.error = e
+
+    def _append(self, block):
+        n = block.shape[1]
+        size = self._ring.shape[1]
+        self._lock.acquire()
+        try:
+            if n >= size:
+                self._ring[:] = block[:, n - size:]
+                self._pos = 0
+            else:
+                end = self._pos + n
+                if end <= size:
+                    self._ring[:, self._pos:end] = block
+                else:
+                    k = size - self._pos
+                    self._ring[:, self._pos:] = block[:, :k]
+                    self._ring[:, :n - k] = block[:, k:]
+                self._pos = end % size
+            self._count += n
+        finally:
+            self._lock.release()
+
+    def get_count(self):
+        '''Total number of (decimated) samples per channel acquired.'''
+        return self._count
+
+    def get_data(self, n=None):
+        '''
+        Return a copy of the last n samples of every channel, oldest first,
+        as an array of shape (channels, n).
+        '''
+        self._lock.acquire()
+        try:
+            available = min(self._count, self._ring.shape[1])
+            if n is None or n > available:
+                n = available
+            idx = numpy.arange(self._pos - n, self._pos) % self._ring.shape[1]
+            return self._ring[:, idx]
+        finally:
+            self._lock.release()
+
+    def get_average(self, n=None):
+        '''Return the mean of the last n samples of every channel.'''
+        return self.get_data(n).mean(axis=1)
+
 def write(devchan, data, freq=10000.0, minv=-10.0, maxv=10.0,
                 timeout=10.0):
     '''
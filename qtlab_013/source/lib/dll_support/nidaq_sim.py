@@ -0,0 +1,244 @@
+# nidaq_sim.py, software stand-in for the NIDAQmx library
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Usage:
+    from lib.dll_support import nidaq, nidaq_sim
+    nidaq.set_library(nidaq_sim.SimulatedDAQmx())
+    qt.instruments.create('NIDev1', 'NI_DAQ', id='Dev1')
+'''
+
+import ctypes
+import time
+import numpy
+
+def _value(arg):
+    return getattr(arg, 'value', arg)
+
+def _set_ref(ref, value):
+    getattr(ref, '_obj', ref).value = value
+
+def _expand_channels(devchan):
+    '''Expand 'Dev1/ai0:2' to ['Dev1/ai0', 'Dev1/ai1', 'Dev1/ai2'].'''
+    chans = []
+    for part in devchan.split(','):
+        part = part.strip()
+        prefix = part.rstrip('0123456789:')
+        spec = part[len(prefix):]
+        if ':' in spec:
+            start, stop = [int(x) for x in spec.split(':')]
+            chans.extend(['%s%d' % (prefix, i) for i in range(start, stop + 1)])
+        else:
+            chans.append(part)
+    return chans
+
+def sine(channel, t):
+    '''Default signal: a 10 Hz sine with an amplitude of channel + 1 V.'''
+    return (channel + 1) * numpy.sin(2 * numpy.pi * 10 * t)
+
+class _Task(object):
+
+    def __init__(self):
+        self.channels = []
+        self.freq = 1000.0
+        self.samples = 1
+        self.continuous = False
+        self.state = 'unverified'
+        self.t0 = 0.0
+        self.position = 0
+
+class SimulatedDAQmx(object):
+    '''
+    Implements the DAQmx calls used by nidaq.py for a single device with
+    8 differential analog inputs, 2 outputs and 2 counters. Samples are
+    generated from signal(channel_index, t); with realtime=True reads
+    block until the samples would have been acquired.
+
+    The attribute 'calls' counts the calls per function, which allows to
+    check how many tasks are created and started.
+    '''
+
+    def __init__(self, device='Dev1', signal=sine, realtime=False):
+        self.device = device
+        self.signal = signal
+        self.realtime = realtime
+        self.calls = {}
+        self._tasks = {}
+        self._next_handle = 1
+
+    def __getattribute__(self, name):
+        if name.startswith('DAQmx'):
+            calls = object.__getattribute__(self, 'calls')
+            calls[name] = calls.get(name, 0) + 1
+        return object.__getattribute__(self, name)
+
+    def _string(self, buf, bufsize, text):
+        ctypes.memmove(buf, ctypes.c_char_p(text), min(len(text) + 1,
+            _value(bufsize)))
+        return 0
+
+    def DAQmxGetErrorString(self, err, buf, bufsize):
+        return self._string(buf, bufsize, 'Simulated error %d' % err)
+
+    def DAQmxGetSysDevNames(self, buf, bufsize):
+        return self._string(buf, bufsize, self.device)
+
+    def DAQmxGetDevProductType(self, dev, buf, bufsize):
+        return self._string(buf, bufsize, 'Simulated DAQ')
+
+    def _ranges(self, p_list, bufsize):
+        arr = getattr(p_list, '_obj', p_list)
+        for i, v in enumerate((-10.0, 10.0, -5.0, 5.0, -1.0, 1.0)):
+            arr[i] = v
+        return 0
+
+    def DAQmxGetDevAIVoltageRngs(self, dev, p_list, bufsize):
+        return self._ranges(p_list, bufsize)
+
+    def DAQmxGetDevAOVoltageRngs(self, dev, p_list, bufsize):
+        return self._ranges(p_list, bufsize)
+
+    def DAQmxGetDevAIMaxSingleChanRate(self, dev, p_rate):
+        _set_ref(p_rate, 1.25e6)
+        return 0
+
+    def DAQmxGetDevAIMinRate(self, dev, p_rate):
+        _set_ref(p_rate, 0.1)
+        return 0
+
+    def DAQmxGetDevAOMaxRate(self, dev, p_rate):
+        _set_ref(p_rate, 1e6)
+        return 0
+
+    def DAQmxGetDevAISimultaneousSamplingSupported(self, dev, p_val):
+        _set_ref(p_val, False)
+        return 0
+
+    def DAQmxResetDevice(self, dev):
+        return 0
+
+    def _chans(self, buf, bufsize, kind, n):
+        names = ', '.join(['%s/%s%d' % (self.device, kind, i)
+            for i in range(n)])
+        return self._string(buf, bufsize, names)
+
+    def DAQmxGetDevAIPhysicalChans(self, dev, buf, bufsize):
+        return self._chans(buf, bufsize, 'ai', 16)
+
+    def DAQmxGetDevAOPhysicalChans(self, dev, buf, bufsize):
+        return self._chans(buf, bufsize, 'ao', 2)
+
+    def DAQmxGetDevCIPhysicalChans(self, dev, buf, bufsize):
+        return self._chans(buf, bufsize, 'ctr', 2)
+
+    def DAQmxCreateTask(self, name, p_handle):
+        handle = self._next_handle
+        self._next_handle += 1
+        self._tasks[handle] = _Task()
+        _set_ref(p_handle, handle)
+        return 0
+
+    def _task(self, handle):
+        return self._tasks[_value(handle)]
+
+    def DAQmxCreateAIVoltageChan(self, handle, devchan, name, config,
+            minv, maxv, units, scale):
+        self._task(handle).channels.extend(_expand_channels(devchan))
+        return 0
+
+    def DAQmxCreateAOVoltageChan(self, handle, devchan, name, minv, maxv,
+            units, scale):
+        self._task(handle).channels.extend(_expand_channels(devchan))
+        return 0
+
+    def DAQmxCfgSampClkTiming(self, handle, source, freq, edge, mode,
+            samples):
+        task = self._task(handle)
+        task.freq = _value(freq)
+        task.samples = _value(samples)
+        task.continuous = (_value(mode) == 10123)
+        return 0
+
+    def DAQmxCfgDigEdgeRefTrig(self, handle, source, slope, pre):
+        return 0
+
+    def DAQmxGetTaskNumChans(self, handle, p_n):
+        _set_ref(p_n, len(self._task(handle).channels))
+        return 0
+
+    def DAQmxTaskControl(self, handle, action):
+        task = self._task(handle)
+        if _value(action) == 3:
+            task.state = 'committed'
+        elif _value(action) == 5:
+            task.state = 'verified'
+        return 0
+
+    def DAQmxStartTask(self, handle):
+        task = self._task(handle)
+        task.state = 'running'
+        task.t0 = time.time()
+        task.position = 0
+        return 0
+
+    def DAQmxStopTask(self, handle):
+        task = self._tasks.get(_value(handle), None)
+        if task is not None and task.state == 'running':
+            task.state = 'committed'
+        return 0
+
+    def DAQmxClearTask(self, handle):
+        self._tasks.pop(_value(handle), None)
+        return 0
+
+    def _generate(self, task, n):
+        t = (task.position + numpy.arange(n)) / float(task.freq)
+        task.position += n
+        if self.realtime:
+            delay = task.t0 + t[-1] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return numpy.array([self.signal(i, t)
+            for i in range(len(task.channels))], dtype=numpy.float64)
+
+    def DAQmxReadAnalogF64(self, handle, samples, timeout, fill, p_data,
+            size, p_read, reserved):
+        task = self._task(handle)
+        n = _value(samples)
+        if n < 0:
+            n = task.samples
+        data = self._generate(task, n)
+        if _value(fill) == 1:
+            data = data.T
+        data = numpy.ascontiguousarray(data)
+        ctypes.memmove(_value(p_data), data.ctypes.data, data.nbytes)
+        _set_ref(p_read, n)
+        return 0
+
+    def DAQmxReadAnalogScalarF64(self, handle, timeout, p_data, reserved):
+        task = self._task(handle)
+        value = numpy.array([self.signal(0, time.time())])
+        ctypes.memmove(_value(p_data), value.ctypes.data, value.nbytes)
+        return 0
+
+    def DAQmxWriteAnalogScalarF64(self, handle, autostart, timeout, value,
+            reserved):
+        return 0
+
+    def DAQmxWriteAnalogF64(self, handle, samples, autostart, timeout, fill,
+            p_data, p_written, reserved):
+        _set_ref(p_written, _value(samples))
+        return 0
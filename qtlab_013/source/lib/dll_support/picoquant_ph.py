@@ -18,8 +18,28 @@
 import ctypes
 import numpy as np
 import logging
+import threading
+import time
 
-phlib = ctypes.windll.phlib
+from lib.file_support import picoharp
+from lib.namedstruct import NamedStruct
+
+def _load_library():
+    try:
+        return ctypes.windll.phlib
+    except (AttributeError, OSError):
+        logging.warning('picoquant_ph.py: phlib not found, use set_library()')
+        return None
+
+phlib = _load_library()
+
+def set_library(lib):
+    '''
+    Replace phlib by another object providing the same functions, for
+    example picoquant_sim.SimulatedPHLib().
+    '''
+    global phlib
+    phlib = lib
 
 MAXDEVNUM = 8
 
@@ -73,6 +93,10 @@ class PHDevice():
     def __init__(self, devid, mode=MODE_HIST):
         self._devid = devid
         self._is_open = False
+        self._hist_buf = np.zeros((HISTCHAN,), dtype=np.int32)
+        self._hist_x = None
+        self._hist_x_resolution = None
+        self._tt_buf = np.zeros((TTREADMAX,), dtype=np.uint32)
 
         try:
             self.open()
@@ -191,11 +215,19 @@ class PHDevice():
         return ph_check(ret)
 
     def get_block(self, block=0, xdata=True):
-        buf = np.zeros((65536,), dtype=np.int32)
+        '''
+        Return the histogram of a memory block. The returned arrays are
+        reused by the next call, copy them to keep the data.
+        '''
+        buf = self._hist_buf
         ret = phlib.PH_GetBlock(self._devid, buf.ctypes.data, block)
+        ph_check(ret)
         if xdata:
-            xbuf = np.arange(65536) * self.get_resolution() / 1000
-            return xbuf, buf
+            resolution = self.get_resolution()
+            if resolution != self._hist_x_resolution:
+                self._hist_x = np.arange(HISTCHAN) * resolution / 1000
+                self._hist_x_resolution = resolution
+            return self._hist_x, buf
         return buf
         
     def get_resolution(self):
@@ -217,8 +249,17 @@ class PHDevice():
         ret = phlib.PH_GetElapsedMeasTime(self._devid)
         return ph_check(ret)
 
-    def tt_read_data(self, count):
-        buf = np.zeros(count, dtype=np.int32)
+    def tt_read_data(self, count=TTREADMAX, buf=None):
+        '''
+        Read at most count TTTR records from the FIFO into buf, by default
+        a buffer that is reused by the next call.
+
+        Output:
+            view on buf (uint32) with the records read
+        '''
+        if buf is None:
+            buf = self._tt_buf
+        count = min(count, len(buf))
         ret = phlib.PH_TTReadData(self._devid, buf.ctypes.data, count)
         ph_check(ret)
         return buf[:ret]
@@ -228,3 +269,207 @@ class PHDevice():
         return ph_check(ret)
 
     # FIXME: routing functions not yet wrapped
+
+
+class TTTRStream(object):
+    '''
+    Background reader for T2/T3 mode measurements.
+
+    A thread drains the FIFO into a pool of reusable buffers, optionally
+    writes the raw records to a PT2/PT3 file, and decodes them vectorized
+    to keep live statistics:
+        T2: counts per channel and the start-stop histogram (g2) between
+            channels g2_channels, within +/- g2_range ps
+        T3: dtime histogram per channel
+    Statistics are updated incrementally; get_g2 and get_histogram return
+    copies that can be polled while the measurement runs.
+
+    Usage:
+        dev.initialize(MODE_T2)
+        stream = TTTRStream(dev, MODE_T2, filename='run.pt2')
+        stream.start(60000)
+        stream.wait()
+        x, g2 = stream.get_g2()
+    '''
+
+    def __init__(self, dev, mode=MODE_T2, filename=None, g2_channels=(0, 1),
+            g2_range=100000, g2_bins=1000, nbuffers=4, callback=None):
+        if mode not in (MODE_T2, MODE_T3):
+            raise ValueError('TTTRStream needs T2 or T3 mode')
+
+        self._dev = dev
+        self._mode = mode
+        self._filename = filename
+        self._callback = callback
+        self._buffers = [np.zeros(TTREADMAX, dtype=np.uint32)
+            for i in range(nbuffers)]
+
+        self._g2_channels = g2_channels
+        self._g2_bins = g2_bins
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.error = None
+
+        if mode == MODE_T2:
+            resolution = float(picoharp._RESOLUTION * 1e12)
+        else:
+            resolution = 1.0
+        self._resolution = resolution
+        # correlation window in time tag units
+        self._g2_tmax = int(round(g2_range / resolution))
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._overflow = 0
+        self._tails = (np.zeros(0, np.int64), np.zeros(0, np.int64))
+        self.records = 0
+        self.counts = np.zeros(16, dtype=np.int64)
+        self._g2 = np.zeros(self._g2_bins, dtype=np.int64)
+        self._hist = np.zeros((16, 4096), dtype=np.int64)
+        self.fifo_full = False
+
+    def start(self, acq_time):
+        '''Start a measurement of acq_time ms and the reader thread.'''
+        if self.is_running():
+            raise RuntimeError('Stream already running')
+        self._reset_stats()
+        self._stop.clear()
+        self._file = None
+        if self._filename is not None:
+            self._file = open(self._filename, 'wb')
+            self._file_header_pos = self._write_header(acq_time)
+
+        self._dev.start(acq_time)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the measurement and wait for the reader thread.'''
+        self._stop.set()
+        self.wait()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_running()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _write_header(self, acq_time):
+        header = NamedStruct(picoharp.GENERAL_HEADER_INFO, alignment='<')
+        self._file.write(header.pack(Ident='PicoHarp 300',
+            FormatVersion='2.0', CreatorName='QTLab',
+            MeasurementMode=self._mode, AcquisitionTime=acq_time,
+            Resolution=self._dev.get_resolution() / 1000.0))
+        self._t2t3_info = {'StopAfter': acq_time}
+        pos = self._file.tell()
+        self._write_t2t3_info()
+        return pos
+
+    def _write_t2t3_info(self):
+        info = NamedStruct(picoharp.PT2File._T2T3INFO, alignment='<')
+        self._file.write(info.pack(**self._t2t3_info))
+
+    def _finish_file(self):
+        if self._file is None:
+            return
+        self._t2t3_info['NumRecords'] = self.records
+        self._file.seek(self._file_header_pos)
+        self._write_t2t3_info()
+        self._file.close()
+        self._file = None
+
+    def _run(self):
+        index = 0
+        try:
+            while True:
+                stopping = self._stop.is_set()
+                buf = self._buffers[index]
+                index = (index + 1) % len(self._buffers)
+                data = self._dev.tt_read_data(TTREADMAX, buf)
+                if len(data) > 0:
+                    if self._file is not None:
+                        data.tofile(self._file)
+                    self._process(data)
+                    if self._callback is not None:
+                        self._callback(data)
+                    continue
+
+                if self._dev.get_flags() & FLAG_FIFOFULL:
+                    logging.warning('PicoHarp FIFO full, data lost')
+                    self.fifo_full = True
+                if stopping or self._dev.get_status() > 0:
+                    break
+                time.sleep(0.005)
+        except Exception, e:
+            logging.error('PicoHarp stream failed: %s', str(e))
+            self.error = e
+        finally:
+            self._dev.stop()
+            self._finish_file()
+
+    def _process(self, records):
+        if self._mode == MODE_T2:
+            chans, times, self._overflow = picoharp.decode_t2(records,
+                self._overflow)
+        else:
+            chans, nsync, dtime, self._overflow = picoharp.decode_t3(records,
+                self._overflow)
+
+        self._lock.acquire()
+        try:
+            self.records += len(records)
+            self.counts += np.bincount(chans, minlength=16)[:16]
+            if self._mode == MODE_T2:
+                self._update_g2(chans, times)
+            else:
+                photons = chans < 15
+                idx = chans[photons].astype(np.intp) * 4096 + dtime[photons]
+                self._hist += np.bincount(idx,
+                    minlength=self._hist.size).reshape(self._hist.shape)
+        finally:
+            self._lock.release()
+
+    def _update_g2(self, chans, times):
+        ch_a, ch_b = self._g2_channels
+        tmax = self._g2_tmax
+        new_a = times[chans == ch_a]
+        new_b = times[chans == ch_b]
+        old_a, old_b = self._tails
+
+        # new starts against all stops, old starts against new stops only,
+        # so pairs from earlier blocks are not counted twice
+        all_b = np.concatenate((old_b, new_b))
+        picoharp.correlate(new_a, all_b, tmax, self._g2_bins, self._g2)
+        picoharp.correlate(old_a, new_b, tmax, self._g2_bins, self._g2)
+
+        if len(times) > 0:
+            limit = times[-1] - tmax
+            all_a = np.concatenate((old_a, new_a))
+            self._tails = (all_a[all_a >= limit], all_b[all_b >= limit])
+
+    def get_g2(self):
+        '''
+        Return (dt, counts) of the start-stop histogram; dt are the bin
+        centers in ps.
+        '''
+        width = 2.0 * self._g2_tmax / self._g2_bins
+        dt = (-self._g2_tmax + (np.arange(self._g2_bins) + 0.5) * width) * \
+            self._resolution
+        self._lock.acquire()
+        try:
+            return dt, self._g2.copy()
+        finally:
+            self._lock.release()
+
+    def get_histogram(self, channel=1):
+        '''Return the T3 dtime histogram of a channel.'''
+        self._lock.acquire()
+        try:
+            return self._hist[channel].copy()
+        finally:
+            self._lock.release()
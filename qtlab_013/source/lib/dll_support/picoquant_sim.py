@@ -0,0 +1,172 @@
+# picoquant_sim.py, synthetic stand-in for the picoquant picoharp library
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Usage:
+    from lib.dll_support import picoquant_ph, picoquant_sim
+    picoquant_ph.set_library(picoquant_sim.SimulatedPHLib())
+    dev = picoquant_ph.PHDevice(0, picoquant_ph.MODE_T2)
+'''
+
+import ctypes
+import time
+import numpy as np
+
+from lib.file_support import picoharp
+
+def encode_t2(chans, times, wraps=0):
+    '''
+    Encode photon records as PicoHarp T2 records, inserting overflow
+    records where the time tag wraps around.
+
+    Input:
+        chans (int array): channel of every photon
+        times (int64 array): sorted absolute times in units of 4 ps
+        wraps (int): number of wrap-arounds already written
+
+    Output:
+        (records, wraps)
+    '''
+    times = np.asarray(times, dtype=np.int64)
+    w = times // picoharp._T2WRAPAROUND
+    nov = np.diff(np.concatenate(([wraps], w)))
+    pos = np.arange(len(times)) + np.cumsum(nov)
+
+    records = np.empty(len(times) + nov.sum(), dtype=np.uint32)
+    records[:] = 0xf0000000
+    records[pos] = (np.asarray(chans, dtype=np.uint32) << 28) | \
+        (times % picoharp._T2WRAPAROUND).astype(np.uint32)
+    if len(w) > 0:
+        wraps = int(w[-1])
+    return records, wraps
+
+class T2Generator(object):
+    '''
+    Generates T2 records of Poissonian photons on channels 0 and 1.
+    A fraction 'coincidence' of the channel 0 photons is repeated on
+    channel 1 after 'delay' ps, which gives a peak in g2.
+    '''
+
+    def __init__(self, rates=(1e5, 1e5), coincidence=0.0, delay=10000,
+            seed=None):
+        self.rates = rates
+        self.coincidence = coincidence
+        self.delay = delay
+        self._random = np.random.RandomState(seed)
+        self._time = 0
+        self._wraps = 0
+
+    def advance(self, t_end):
+        '''Return the records for the time up to t_end (in 4 ps units).'''
+        t_end = int(t_end)
+        if t_end <= self._time:
+            return np.zeros(0, dtype=np.uint32)
+        dt = (t_end - self._time) * picoharp._RESOLUTION
+
+        chans = []
+        times = []
+        for ch, rate in enumerate(self.rates):
+            n = self._random.poisson(rate * dt)
+            t = self._random.randint(self._time, t_end, n)
+            chans.append(np.zeros(n, dtype=np.uint32) + ch)
+            times.append(t)
+            if ch == 0 and self.coincidence > 0:
+                copy = t[self._random.rand(n) < self.coincidence]
+                copy = copy + int(self.delay / 4)
+                copy = copy[copy < t_end]
+                chans.append(np.ones(len(copy), dtype=np.uint32))
+                times.append(copy)
+
+        chans = np.concatenate(chans)
+        times = np.concatenate(times)
+        order = np.argsort(times, kind='mergesort')
+        records, self._wraps = encode_t2(chans[order], times[order],
+            self._wraps)
+        self._time = t_end
+        return records
+
+class SimulatedPHLib(object):
+    '''
+    Implements the phlib calls used by picoquant_ph.py. In T2 mode the
+    FIFO is filled in real time from a T2Generator.
+    '''
+
+    def __init__(self, generator=None):
+        if generator is None:
+            generator = T2Generator()
+        self.generator = generator
+        self._pending = np.zeros(0, dtype=np.uint32)
+        self._t0 = None
+        self._acq_time = 0
+
+    def __getattr__(self, name):
+        if name.startswith('PH_'):
+            return lambda *args: 0
+        raise AttributeError(name)
+
+    def PH_GetLibraryVersion(self, buf):
+        buf.value = '2.3'
+        return 0
+
+    def PH_GetErrorString(self, buf, errcode):
+        buf.value = 'Simulated error %d' % errcode
+        return 0
+
+    def PH_OpenDevice(self, devid, buf):
+        buf.value = 'SIM%05d' % devid
+        return 0
+
+    def PH_GetResolution(self, devid):
+        return 4
+
+    def PH_GetBaseResolution(self, devid):
+        return 4
+
+    def PH_GetCountRate(self, devid, chan):
+        return int(self.generator.rates[chan])
+
+    def PH_StartMeas(self, devid, acq_time):
+        self._t0 = time.time()
+        self._acq_time = acq_time
+        self._pending = np.zeros(0, dtype=np.uint32)
+        return 0
+
+    def PH_StopMeas(self, devid):
+        if self._t0 is not None:
+            self._acq_time = min(self._acq_time,
+                (time.time() - self._t0) * 1000)
+        return 0
+
+    def _elapsed(self):
+        if self._t0 is None:
+            return 0
+        return min((time.time() - self._t0) * 1000, self._acq_time)
+
+    def PH_CTCStatus(self, devid):
+        return int(self._t0 is None or self._elapsed() >= self._acq_time)
+
+    def PH_GetElapsedMeasTime(self, devid):
+        return int(self._elapsed())
+
+    def PH_TTReadData(self, devid, address, count):
+        t_end = self._elapsed() * 1e-3 / picoharp._RESOLUTION
+        new = self.generator.advance(t_end)
+        if len(new) > 0:
+            self._pending = np.concatenate((self._pending, new))
+        n = min(count, len(self._pending))
+        ctypes.memmove(address, self._pending.ctypes.data, n * 4)
+        self._pending = self._pending[n:]
+        return n
@@ -18,12 +18,109 @@
 import numpy as np
 import struct
 import sys
+import os
 
 from lib.namedstruct import *
 
 _T2WRAPAROUND = 210698240
+_T3WRAPAROUND = 65536
 _RESOLUTION = 4e-12
 
+# Number of records processed at once by the chunked readers
+CHUNKSIZE = 2**22
+
+def decode_t2(records, overflow=0):
+    '''
+    Decode PicoHarp T2 records.
+
+    Input:
+        records (uint32 array): raw records
+        overflow (int): time offset accumulated by earlier records
+
+    Output:
+        (channels, times, overflow): channel (uint8) and absolute time tag in
+        units of the resolution (int64) of every photon or marker record,
+        and the time offset to pass with the next block of records.
+    '''
+    records = np.asarray(records, dtype=np.uint32)
+    chans = (records >> 28).astype(np.uint8)
+    tags = (records & 0x0fffffff).astype(np.int64)
+
+    special = (chans == 15)
+    wraps = special & ((tags & 0xf) == 0)
+    offsets = np.cumsum(wraps, dtype=np.int64)
+    offsets *= _T2WRAPAROUND
+    offsets += overflow
+    if len(offsets) > 0:
+        overflow = int(offsets[-1])
+
+    keep = ~wraps
+    return chans[keep], tags[keep] + offsets[keep], overflow
+
+def decode_t3(records, overflow=0):
+    '''
+    Decode PicoHarp T3 records.
+
+    Input:
+        records (uint32 array): raw records
+        overflow (int): sync count offset accumulated by earlier records
+
+    Output:
+        (channels, nsync, dtime, overflow): channel (uint8), absolute sync
+        count (int64) and start-stop time bin (uint16) of every record, and
+        the sync offset to pass with the next block of records.
+    '''
+    records = np.asarray(records, dtype=np.uint32)
+    chans = (records >> 28).astype(np.uint8)
+    dtime = ((records >> 16) & 0x0fff).astype(np.uint16)
+    nsync = (records & 0xffff).astype(np.int64)
+
+    wraps = (chans == 15) & (dtime == 0)
+    offsets = np.cumsum(wraps, dtype=np.int64)
+    offsets *= _T3WRAPAROUND
+    offsets += overflow
+    if len(offsets) > 0:
+        overflow = int(offsets[-1])
+
+    keep = ~wraps
+    return chans[keep], nsync[keep] + offsets[keep], dtime[keep], overflow
+
+def correlate(starts, stops, tmax, nbins, hist=None):
+    '''
+    Histogram all time differences stops - starts within [-tmax, tmax).
+
+    Input:
+        starts, stops (sorted arrays): event times
+        tmax (number): correlation window, in the units of the times
+        nbins (int): number of histogram bins
+        hist (int64 array): if given, the counts are added to it
+
+    Output:
+        hist (int64 array of length nbins)
+    '''
+    if hist is None:
+        hist = np.zeros(nbins, dtype=np.int64)
+    starts = np.asarray(starts)
+    stops = np.asarray(stops)
+    if len(starts) == 0 or len(stops) == 0:
+        return hist
+
+    lo = np.searchsorted(stops, starts - tmax, side='left')
+    hi = np.searchsorted(stops, starts + tmax, side='left')
+    counts = hi - lo
+    total = counts.sum()
+    if total == 0:
+        return hist
+
+    # Index of every (start, stop) pair without a python loop
+    first = np.cumsum(counts) - counts
+    idx = np.arange(total) - np.repeat(first - lo, counts)
+    dt = stops[idx] - np.repeat(starts, counts)
+
+    bins = ((dt + tmax) * nbins) // (2 * tmax)
+    hist += np.bincount(bins.astype(np.intp), minlength=nbins)[:nbins]
+    return hist
+
 GENERAL_HEADER_INFO = (
         ('Ident', S, 16),
         ('FormatVersion', S, 6),
@@ -176,26 +273,23 @@ class PHDFile:
 
     def load(self, filename):
         f = open(filename, 'rb')
-        data = f.read(692)
+        data = f.read(self._header_struct.size)
         self._header = self._header_struct.unpack(data)
 
         self._curve_info = []
         self._curve = []
         for i in range(self._header['NumberOfCurves']):
-            data = f.read(172)
+            data = f.read(self._curve_struct.size)
             curve = self._curve_struct.unpack(data)
             self._curve_info.append(curve)
+        f.close()
 
-        for curve in self._curve_info:
-            f.seek(curve['DataOffset'])
-            if self._header['BitsPerHistogBin'] != 32:
-                print 'Can only read 32 bit data'
-
-            ar = np.zeros(curve['Channels'])
-            for i in range(curve['Channels']):
-                data = f.read(4)
-                ar[i] = struct.unpack('<L', data)[0]
+        if self._header['BitsPerHistogBin'] != 32:
+            print 'Can only read 32 bit data'
 
+        for curve in self._curve_info:
+            ar = np.memmap(filename, dtype='<u4', mode='r',
+                offset=curve['DataOffset'], shape=(curve['Channels'],))
             self._curve.append(ar)
 
     def get_header(self):
@@ -207,7 +301,7 @@ class PHDFile:
     def get_curve(self, i, xdim=True):
         y = self._curve[i]
         if xdim:
-            x = [j * self._curve_info[i]['Resolution'] for j in range(len(y))]
+            x = np.arange(len(y)) * self._curve_info[i]['Resolution']
             return np.column_stack((x, y))
         else:
            return y
@@ -241,39 +335,73 @@ class PT2File:
             self.load(filename)
 
     def load(self, filename, progress=0):
+        '''
+        Read the headers and map the records into memory; records are only
+        read from disk when they are accessed.
+        '''
         f = open(filename, 'rb')
-        data = f.read(692)
+        data = f.read(self._header_struct.size)
         self._header = self._header_struct.unpack(data)
 
-        data = f.read(36)
+        data = f.read(self._t2t3_struct.size)
         self._t2t3 = self._t2t3_struct.unpack(data)
 
         data = f.read(self._t2t3['ImgHdrSize'])
-
-        self._data = np.fromfile(f, np.uint32, -1)
+        offset = f.tell()
+        f.close()
+
+        self._filename = filename
+        nrecords = (os.path.getsize(filename) - offset) / 4
+        if nrecords > 0:
+            self._data = np.memmap(filename, dtype='<u4', mode='r',
+                offset=offset, shape=(nrecords,))
+        else:
+            self._data = np.zeros(0, dtype=np.uint32)
 
     def get_data(self):
+        '''Return the raw records as a memory mapped uint32 array.'''
         return self._data
 
-    def get_ch_data(self, ch, progress=0):
-        chs = (self._data >> 28)
-        d = self._data.astype(np.float64)
-
-        # Add overflows
-        idx = np.where(d == 0xf0000000)[0]
-        add = 0
-        starti = 0
-        for endi in idx:
-            d[starti:endi] += add
-            starti = endi + 1
-            add += _T2WRAPAROUND
-        d[starti:] += add
-
-        # Convert to time
-        mask = (chs == ch)
-        d = d[mask] * _RESOLUTION
-
-        return d
+    def iter_chunks(self, chunksize=CHUNKSIZE):
+        '''
+        Iterate over the file in blocks of chunksize records, yielding
+        (channels, times) with times in units of the resolution.
+        Overflow correction is carried across the blocks.
+        '''
+        overflow = 0
+        for start in xrange(0, len(self._data), chunksize):
+            chans, times, overflow = decode_t2(
+                self._data[start:start+chunksize], overflow)
+            yield chans, times
+
+    def get_ch_data(self, ch, progress=0, chunksize=CHUNKSIZE):
+        '''
+        Return the arrival times (in seconds) of all photons on channel ch.
+        The file is processed in blocks of chunksize records and only the
+        times of channel ch are kept.
+        '''
+        parts = []
+        overflow = 0
+        for start in xrange(0, len(self._data), chunksize):
+            records = self._data[start:start+chunksize]
+            chans = records >> 28
+            wraps = (chans == 15) & ((records & 0xf) == 0)
+            offsets = np.cumsum(wraps, dtype=np.int64)
+
+            mask = (chans == ch)
+            times = (records[mask] & 0x0fffffff).astype(np.int64)
+            times += offsets[mask] * _T2WRAPAROUND + overflow
+            parts.append(times * _RESOLUTION)
+
+            if len(offsets) > 0:
+                overflow += int(offsets[-1]) * _T2WRAPAROUND
+            if progress:
+                print 'Processed %d of %d records' % \
+                    (start + len(records), len(self._data))
+
+        if len(parts) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return np.concatenate(parts)
 
     def get_header(self):
         return self._header
@@ -281,12 +409,66 @@ class PT2File:
     def get_t2t3(self):
         return self._t2t3
 
-    def get_data(self):
-        return self._data
-
 class PT3File(PT2File):
-    def __init__(self, filename=None):
-        PT2File.__init__(self, filename)
+    '''
+    T3 mode file: every record holds the sync count and the start-stop
+    time (dtime) of a photon.
+    '''
+
+    def iter_chunks(self, chunksize=CHUNKSIZE):
+        '''
+        Iterate over the file in blocks of chunksize records, yielding
+        (channels, nsync, dtime).
+        '''
+        overflow = 0
+        for start in xrange(0, len(self._data), chunksize):
+            chans, nsync, dtime, overflow = decode_t3(
+                self._data[start:start+chunksize], overflow)
+            yield chans, nsync, dtime
+
+    def get_ch_data(self, ch, progress=0, chunksize=CHUNKSIZE):
+        '''Return (nsync, dtime) of all photons on channel ch.'''
+        nsyncs = []
+        dtimes = []
+        for chans, nsync, dtime in self.iter_chunks(chunksize):
+            mask = (chans == ch)
+            nsyncs.append(nsync[mask])
+            dtimes.append(dtime[mask])
+        if len(nsyncs) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.uint16)
+        return np.concatenate(nsyncs), np.concatenate(dtimes)
+
+    def get_histogram(self, ch, chunksize=CHUNKSIZE):
+        '''Return the dtime histogram of channel ch.'''
+        hist = np.zeros(4096, dtype=np.int64)
+        for start in xrange(0, len(self._data), chunksize):
+            records = self._data[start:start+chunksize]
+            dtime = (records[(records >> 28) == ch] >> 16) & 0x0fff
+            hist += np.bincount(dtime.astype(np.intp), minlength=4096)
+        return hist
+
+def g2(t1, t2=None, tmax=10e-6, binsize=50e-9, chunksize=CHUNKSIZE):
+    '''
+    Start-stop correlation histogram of two sorted arrays of arrival times.
+    If t2 is not given the autocorrelation of t1 is computed, without the
+    zero delay pairs of each photon with itself.
+
+    Output:
+        (tau, counts): bin centers and counts for delays in [-tmax, tmax)
+    '''
+    nbins = int(round(2 * tmax / binsize))
+    auto = t2 is None
+    if auto:
+        t2 = t1
+
+    hist = np.zeros(nbins, dtype=np.int64)
+    for start in xrange(0, len(t1), chunksize):
+        correlate(t1[start:start+chunksize], t2, tmax, nbins, hist)
+    if auto and len(t1) > 0:
+        hist[int((tmax * nbins) // (2 * tmax))] -= len(t1)
+
+    tau = -tmax + (np.arange(nbins) + 0.5) * (2.0 * tmax / nbins)
+    return tau, hist
 
 def test_phd(fname):
     phd = PHDFile(fname)
@@ -350,23 +532,15 @@ def test_pt2(fname):
     plt.savefig('timebins.pdf')
 
     print 'Start-stop construction'
-    NDELTAS = 10
-    print 'NDELTAS = %s --> ok to %.03f us' % (NDELTAS, NDELTAS*avgdt*1e6)
-    deltas = np.array([])
-    for i in range(1, NDELTAS):
-        newdeltas = data[i:]-data[:-i]
-        deltas = np.concatenate((deltas, newdeltas), axis=0)
+    tau, counts = g2(data, tmax=10e-6, binsize=50e-9)
 
     plt.figure()
-    binsize = 0.05      # us
-    n, bins, patches = plt.hist(deltas*1e6, bins=10/binsize, range=(0,10), histtype='step')
+    plt.step(tau*1e6, counts, where='mid')
     plt.xlabel('dt (us)')
-    plt.ylabel('Events / %.03f us (start - %d stops)' % (binsize, NDELTAS))
+    plt.ylabel('Events / %.03f us' % (0.05, ))
     plt.savefig('dtbins.pdf')
 
 if __name__ == '__main__':
-    import os
-
     if len(sys.argv) == 2:
         fname = sys.argv[1]
     else:
@@ -15,6 +15,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import os
 import numpy as np
 from lib.namedstruct import *
 
@@ -40,6 +41,8 @@ class SPEFile:
         DTYPE_USHORT: (2, 'H', np.uint16)
     }
 
+    HEADER_SIZE = 4100
+
     _STRUCTINFO = [
         ('ControllerVersion', S16, 1), #0, Hardware Version
         ('LogicOutput', S16, 1), #2, Definition of Output BNC
@@ -236,7 +239,7 @@ class SPEFile:
         ('lastvalue', S16, 1), #4098, Always the LAST value in the header
     ]
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, **kwargs):
         self._info = {}
         self._filename = ''
         self._data = None
@@ -245,24 +248,108 @@ class SPEFile:
         self._struct = NamedStruct(self._STRUCTINFO, alignment='<')
 
         if filename:
-            self.load(filename)
+            self.load(filename, **kwargs)
+
+    def load(self, filename, frames=None, mmap=True):
+        '''
+        Load an SPE file. The data is memory mapped, so frames are only
+        read from disk when they are accessed.
+
+        Input:
+            filename (string)
+            frames (tuple): (start, stop) to load only part of the frames
+            mmap (bool): if False read the data into memory
+        '''
 
-    def load(self, filename):
         f = open(filename, 'rb')
-        header = f.read(4100)
+        header = f.read(self.HEADER_SIZE)
         info = self._struct.unpack(header)
         self._info = info
+        self._filename = filename
+
+        dtype = self.get_dtype()
+        framesize = info['xdim'] * info['ydim']
+        nframes = info['NumFrames']
+        datasize = os.fstat(f.fileno()).st_size - self.HEADER_SIZE
+        navail = datasize // (framesize * dtype.itemsize)
+        if navail < nframes:
+            print 'Error reading SPE-file: unexpected EOF'
+            nframes = navail
+
+        start, stop = 0, nframes
+        if frames is not None:
+            start, stop, step = slice(*frames).indices(nframes)
+            stop = max(start, stop)
+
+        shape = (stop - start, info['ydim'], info['xdim'])
+        offset = self.HEADER_SIZE + start * framesize * dtype.itemsize
+        if mmap and shape[0] > 0:
+            self._data = np.memmap(f, dtype=dtype, mode='r', offset=offset,
+                    shape=shape)
+        else:
+            f.seek(offset)
+            count = shape[0] * framesize
+            self._data = np.fromfile(f, dtype=dtype, count=count)
+            self._data = self._data.reshape(shape)
+        f.close()
+
+    def get_dtype(self):
+        '''Numpy data type of the pixels (little-endian).'''
+        nptype = self.DSIZE[self._info['datatype']][2]
+        return np.dtype(nptype).newbyteorder('<')
+
+    def get_frames(self):
+        '''
+        Return the data as a (frames, y, x) array. For a memory mapped
+        file, indexing it only reads the selected frames.
+        '''
+        return self._data
+
+    def get_nframes(self):
+        return self._data.shape[0]
+
+    def get_frame(self, i):
+        '''Return frame i (relative to the loaded range) as an array.'''
+        return np.array(self._data[i])
+
+    def iter_frames(self, chunksize=100):
+        '''
+        Iterate over the frames in chunks of at most chunksize frames, so
+        series larger than the memory can be processed.
+
+        Output:
+            (index of first frame, array of shape (n, y, x))
+        '''
+        for start in range(0, self.get_nframes(), chunksize):
+            yield start, np.array(self._data[start:start+chunksize])
+
+    def sum_frames(self, start=0, stop=None, chunksize=100):
+        '''Return the sum of frames start to stop as a float array.'''
+        if stop is None:
+            stop = self.get_nframes()
+        ret = np.zeros(self._data.shape[1:], dtype=np.float64)
+        for i in range(start, stop, chunksize):
+            chunk = self._data[i:min(i + chunksize, stop)]
+            ret += chunk.sum(axis=0, dtype=np.float64)
+        return ret
+
+    def bin_frames(self, nbin, chunksize=100):
+        '''
+        Average every nbin consecutive frames. Remaining frames that do
+        not fill a bin are dropped.
 
-        typesize, formatchr, nptype = self.DSIZE[info['datatype']]
-        formatstr = '%s%s' % (formatchr, formatchr)
-        entries = info['xdim'] * info['ydim'] * info['NumFrames']
-        self._data = np.zeros(entries, dtype=nptype)
-        for i in range(entries):
-            elem = f.read(typesize)
-            if elem == '':
-                print 'Error reading SPE-file: unexpected EOF'
-                break
-            self._data[i] = struct.unpack(formatchr, elem)[0]
+        Output:
+            array of shape (frames / nbin, y, x)
+        '''
+        nout = self.get_nframes() // nbin
+        ret = np.zeros((nout,) + self._data.shape[1:], dtype=np.float64)
+        step = max(1, chunksize // nbin) * nbin
+        for i in range(0, nout * nbin, step):
+            chunk = np.asarray(self._data[i:min(i + step, nout * nbin)],
+                    dtype=np.float64)
+            chunk = chunk.reshape((-1, nbin) + chunk.shape[1:])
+            ret[i // nbin:i // nbin + len(chunk)] = chunk.mean(axis=1)
+        return ret
 
     def convert_value(self, axis, value):
         if not self._info['%scalib_valid' % axis]:
@@ -280,10 +367,9 @@ class SPEFile:
         return self._info
 
     def get_data(self):
-        xvals = np.array(
-                [self.convert_value('x', i) for i in range(len(self._data))])
-        yvals = np.array(
-                [self.convert_value('y', i) for i in self._data])
+        data = np.asarray(self._data, dtype=np.float64).ravel()
+        xvals = self.convert_value('x', np.arange(len(data), dtype=np.float64))
+        yvals = self.convert_value('y', data)
         return np.column_stack((xvals, yvals))
 
 if __name__ == '__main__':
@@ -63,23 +63,21 @@ class InstrumentDropdown(QTComboBox):
 
         self._types = types
         self._ins_list.append([TEXT_NONE])
-        self._instruments = qt.instruments
-        for insname in self._instruments.get_instrument_names():
-            # This should perhaps go through qt.get_instrument_proxy()
-            ins = helper.find_object('instrument_%s' % insname)
-            if len(types) == 0 or ins.has_tag(types):
+        self._mirror = qt.mirror
+        for insname in self._mirror.get_instrument_names():
+            if len(types) == 0 or self._mirror.has_tag(insname, types):
                 self._ins_list.append([insname])
 
-        self._instruments.connect('instrument-added', self._instrument_added_cb)
-        self._instruments.connect('instrument-removed', self._instrument_removed_cb)
-        self._instruments.connect('instrument-changed', self._instrument_changed_cb)
+        self._mirror.connect('instrument-added', self._instrument_added_cb)
+        self._mirror.connect('instrument-removed', self._instrument_removed_cb)
+        self._mirror.connect('instrument-changed', self._instrument_changed_cb)
 
     def _instrument_added_cb(self, sender, insname):
-        ins = qt.get_instrument_proxy(insname)
-        if ins is None:
+        if not self._mirror.has_instrument(insname):
             return
-        if len(self._types) == 0 or ins.has_tag(self._types):
-            self._ins_list.append([ins.get_name()])
+        if len(self._types) == 0 or self._mirror.has_tag(insname, self._types):
+            self.remove_item_from(insname, self._ins_list)
+            self._ins_list.append([insname])
 
     def _instrument_removed_cb(self, sender, insname):
         logging.debug('Instrument removed: %s', insname)
@@ -132,14 +130,14 @@ class InstrumentParameterDropdown(QTComboBox):
 
         self._instrument = None
         self._insname = ''
-        self.set_instrument(instrument)
-        self._param_list.set_sort_column_id(0, gtk.SORT_ASCENDING)
-
         self._flags = flags
         self._types = types
+        self.set_instrument(instrument)
+        self._param_list.set_sort_column_id(0, gtk.SORT_ASCENDING)
 
-        self._instruments = qt.instruments
-        self._instruments.connect('instrument-removed', self._instrument_removed_cb)
+        self._mirror = qt.mirror
+        self._mirror.connect('instrument-removed', self._instrument_removed_cb)
+        self._mirror.connect('parameter-added', self._parameter_added_cb)
 
     def set_flags(self, flags):
         if flags != self._flags:
@@ -153,11 +151,13 @@ class InstrumentParameterDropdown(QTComboBox):
             return self.update_list()
 
     def _instrument_removed_cb(self, sender, insname):
-        if insname == self._instrument:
-            logging.debug('Instrument for dropdown removed: %s', instrument)
+        if insname == self._insname:
+            logging.debug('Instrument for dropdown removed: %s', insname)
             self.set_instrument(None)
 
-    def _parameter_added_cb(self, sender, param):
+    def _parameter_added_cb(self, sender, insname, param):
+        if insname != self._insname:
+            return
         #FIXME: this needs to be improved
         ins = self._instrument
         self.set_instrument(None)
@@ -165,8 +165,7 @@ class InstrumentParameterDropdown(QTComboBox):
 
     def set_instrument(self, ins):
         if type(ins) == types.StringType:
-            # This should perhaps go through qt.get_instrument_proxy()
-            ins = helper.find_object('instruments_%s' % ins)
+            ins = qt.get_instrument_proxy(ins)
 
         if self._instrument == ins:
             return True
@@ -181,9 +180,8 @@ class InstrumentParameterDropdown(QTComboBox):
         if ins is not None:
             self._param_list.append([TEXT_NONE])
 
-            self._instrument.connect('parameter-added', self._parameter_added_cb)
-
-            for (name, options) in misc.dict_to_ordered_tuples(ins.get_shared_parameters()):
+            params = qt.mirror.get_parameters(self._insname)
+            for (name, options) in misc.dict_to_ordered_tuples(params):
                 if len(self._types) > 0 and options['type'] not in self._types:
                     continue
 
@@ -213,8 +211,7 @@ class InstrumentFunctionDropdown(QTComboBox):
         self.set_instrument(instrument)
         self._func_list.set_sort_column_id(0, gtk.SORT_ASCENDING)
 
-        self._instruments = qt.instruments
-        self._instruments.connect('instrument-removed', self._instrument_removed_cb)
+        qt.mirror.connect('instrument-removed', self._instrument_removed_cb)
 
     def _instrument_removed_cb(self, sender, insname):
         if insname == self._insname:
@@ -241,7 +238,7 @@ class InstrumentFunctionDropdown(QTComboBox):
         if ins is not None:
             self._func_list.append([TEXT_NONE, '<Nothing>'])
 
-            funcs = ins.get_functions()
+            funcs = qt.mirror.get_functions(self._insname)
             for (name, options) in misc.dict_to_ordered_tuples(funcs):
                 if 'doc' in options:
                     doc = options['doc']
@@ -279,15 +276,17 @@ class AllParametersDropdown(QTComboBox):
 
         self._param_list.set_sort_column_id(0, gtk.SORT_ASCENDING)
 
-        self._instruments = qt.instruments
-        self._instruments.connect('instrument-added', self._instrument_added_cb)
-        self._instruments.connect('instrument-removed', self._instrument_removed_cb)
-        self._instruments.connect('instrument-changed', self._instrument_changed_cb)
+        self._mirror = qt.mirror
+        self._mirror.connect('instrument-added', self._instrument_added_cb)
+        self._mirror.connect('instrument-removed', self._instrument_removed_cb)
+        self._mirror.connect('instrument-changed', self._instrument_changed_cb)
+        self._mirror.connect('parameter-added', self._parameter_added_cb)
 
     def _instrument_added_cb(self, sender, insname):
-        ins = qt.get_instrument_proxy(insname)
-        if ins is not None:
-            self.add_instrument(ins)
+        if insname in self._ins_names:
+            self.remove_instrument(insname)
+        self.add_instrument(insname)
+        self.update_list()
 
     def _instrument_removed_cb(self, sender, name):
         self.remove_instrument(name)
@@ -296,28 +295,30 @@ class AllParametersDropdown(QTComboBox):
         return
 
     def add_instruments(self):
-        inslist = qt.instruments.get_instrument_names()
-        inslist.sort()
-        for insname in inslist:
-            # This should perhaps go through qt.get_instrument_proxy()
-            ins = helper.find_object('instrument_%s' % insname)
-            self.add_instrument(ins)
+        for insname in qt.mirror.get_instrument_names():
+            self.add_instrument(insname)
 
     def add_instrument(self, ins):
-        insname = ins.get_name()
-        if ins.get_name() in self._ins_names:
+        '''Add the parameters of an instrument (name or proxy).'''
+        if type(ins) is types.StringType:
+            insname = ins
+        else:
+            insname = ins.get_name()
+        if insname in self._ins_names:
             return
 
         self._ins_names.append(insname)
-        ins.connect('parameter-added', self._parameter_added_cb)
-        params = misc.dict_to_ordered_tuples(ins.get_shared_parameters())
-        for param, options in params:
-            self.add_parameter(ins, param, options=options)
+        params = qt.mirror.get_parameters(insname)
+        for param, options in misc.dict_to_ordered_tuples(params):
+            self.add_parameter(insname, param, options=options)
 
     def add_parameter(self, ins, param, options=None):
+        if type(ins) is types.StringType:
+            insname = ins
+        else:
+            insname = ins.get_name()
         if options is None:
-            options = ins.get_shared_parameter_options(param)
-        insname = ins.get_name()
+            options = qt.mirror.get_parameter_options(insname, param)
 
         add_name = '%s.%s' % (insname, param)
         if add_name in self._param_info:
@@ -328,6 +329,8 @@ class AllParametersDropdown(QTComboBox):
             }
 
     def remove_instrument(self, name):
+        if name in self._ins_names:
+            self._ins_names.remove(name)
         remove_list = []
         for add_name, opts in self._param_info.iteritems():
             if opts['insname'] == name:
@@ -397,8 +400,10 @@ class AllParametersDropdown(QTComboBox):
         except Exception, e:
             return None
 
-    def _parameter_added_cb(self, sender, param):
-        self.update_list()
+    def _parameter_added_cb(self, sender, insname, param):
+        if insname in self._ins_names:
+            self.add_parameter(insname, param)
+            self.update_list()
 
 class TagsDropdown(QTComboBox):
 
@@ -406,12 +411,12 @@ class TagsDropdown(QTComboBox):
         self._tags = gtk.ListStore(gobject.TYPE_STRING)
         QTComboBox.__init__(self, model=self._tags)
 
-        self._instruments = qt.instruments
-        self._instruments.connect('tags-added', self._tags_added_cb)
+        self._mirror = qt.mirror
+        self._mirror.connect('tags-added', self._tags_added_cb)
 
         self._tags.append([TEXT_ALL])
         self._tags.append([TEXT_NONE])
-        for i in self._instruments.get_tags():
+        for i in self._mirror.get_tags():
             self._tags.append([i])
 
         self._tags.set_sort_column_id(0, gtk.SORT_ASCENDING)
@@ -38,11 +38,12 @@ class StringLabel(gtk.Label):
         gtk.Label.__init__(self)
         self._instrument = ins
         self._parameter = param
-        self._param_opts = ins.get_shared_parameter_options(param)
+        self._param_opts = opts
 
         self._autoupdate = autoupdate
         if self._autoupdate:
-            ins.connect('changed', self._parameter_changed_cb)
+            ins.connect('changed::%s' % param,
+                    self._parameter_changed_cb)
 
     def _update_value(self, val, widget=None):
         _enable_widget(widget)
@@ -57,9 +58,8 @@ class StringLabel(gtk.Label):
     def do_set(self):
         return
 
-    def _parameter_changed_cb(self, sender, params):
-        if self._parameter in params:
-            self._update_value(params[self._parameter])
+    def _parameter_changed_cb(self, sender, val):
+        self._update_value(val)
 
 
 class MultiStringEntry(gtk.TextView):
@@ -105,7 +105,8 @@ class StringEntry(gtk.Entry):
 
         self._autoupdate = autoupdate
         if self._autoupdate:
-            ins.connect('changed', self._parameter_changed_cb)
+            ins.connect('changed::%s' % param,
+                    self._parameter_changed_cb)
 
         self.connect('changed', self._entry_changed_cb)
 
@@ -126,9 +127,9 @@ class StringEntry(gtk.Entry):
         self._instrument.set(self._parameter, val, \
             callback=lambda x: _enable_widget(widget))
 
-    def _parameter_changed_cb(self, sender, params):
-        if self._parameter in params and not self._dirty:
-            self._update_value(params[self._parameter])
+    def _parameter_changed_cb(self, sender, val):
+        if not self._dirty:
+            self._update_value(val)
 
     def _entry_changed_cb(self, sender, *args):
         # FIXME: how to detect whether we're dirty?
@@ -160,7 +161,8 @@ class NumberEntry(gtk.SpinButton):
 
         self._autoupdate = autoupdate
         if self._autoupdate:
-            ins.connect('changed', self._parameter_changed_cb)
+            ins.connect('changed::%s' % param,
+                    self._parameter_changed_cb)
 
         self.connect('changed', self._spin_changed_cb)
 
@@ -181,9 +183,9 @@ class NumberEntry(gtk.SpinButton):
         self._instrument.set(self._parameter, val, \
             callback=lambda *x: _enable_widget(widget))
 
-    def _parameter_changed_cb(self, sender, params):
-        if self._parameter in params and not self._dirty:
-            self._update_value(params[self._parameter])
+    def _parameter_changed_cb(self, sender, val):
+        if not self._dirty:
+            self._update_value(val)
 
     def _spin_changed_cb(self, sender, *args):
         pass
@@ -213,7 +215,8 @@ class ComboEntry(gtk.ComboBox):
 
         self._autoupdate = autoupdate
         if self._autoupdate:
-            ins.connect('changed', self._parameter_changed_cb)
+            ins.connect('changed::%s' % param,
+                    self._parameter_changed_cb)
 
         self.connect('changed', self._combo_changed_cb)
 
@@ -253,9 +256,9 @@ class ComboEntry(gtk.ComboBox):
             self._instrument.set(self._parameter, val, \
                 callback=lambda *x: _enable_widget(widget))
 
-    def _parameter_changed_cb(self, sender, params):
-        if self._parameter in params and not self._dirty:
-            self._update_value(params[self._parameter])
+    def _parameter_changed_cb(self, sender, val):
+        if not self._dirty:
+            self._update_value(val)
 
     def _combo_changed_cb(self, sender, *args):
         pass
@@ -271,6 +274,7 @@ class FrontPanel(qtwindow.QTWindow):
             name = ins.get_name()
         else:
             name = 'Instrument undefined'
+        self._name = name
 
         title = _L('Instrument: %s') % name
         qtwindow.QTWindow.__init__(self, name, title, add_to_main=False)
@@ -314,20 +318,21 @@ class FrontPanel(qtwindow.QTWindow):
         else:
             entry = StringEntry(self._instrument, param, opts)
 
-        entry.do_get(query=False)
+        # Initial value from the local mirror, no remote call needed
+        entry._update_value(qt.mirror.get_value(self._name, param))
 
         return entry
 
     def _add_parameters(self):
         rows = 0
-        parameters = self._instrument.get_shared_parameters()
+        parameters = qt.mirror.get_parameters(self._name)
         for name, opts in dict_to_ordered_tuples(parameters):
             self._table.resize(rows + 1, 2)
 
             label = gtk.Label(name)
             self._table.attach(label, 0, 1, rows, rows + 1)
 
-            entry = self._create_entry(name, opts)
+            entry = self._create_entry(name, dict(opts))
             self._table.attach(entry, 1, 2, rows, rows + 1)
 
             self._param_info[name] = {
@@ -368,7 +373,7 @@ class FrontPanel(qtwindow.QTWindow):
     def _add_functions(self):
         self._func_buttons = {}
         rows = self._table.props.n_rows
-        functions = self._instrument.get_functions()
+        functions = qt.mirror.get_functions(self._name)
         for fname, fopts in dict_to_ordered_tuples(functions):
             anames = fopts['argspec']['args']
             adefaults = fopts['argspec']['defaults']
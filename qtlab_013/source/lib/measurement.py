@@ -19,8 +19,13 @@ import time
 import gtk
 import gobject
 import logging
+import numpy
 import qt
 from data import Data
+from lib.calltimer import Job, LockClassWorker
+from lib.adaptive import Refiner1D, Refiner2D, adaptive_sweep
+from lib.sweepplan import SweepPlan, CanonicalWriter, axis_values, \
+        ramp_cost, choose_order, estimate_dead_time
 
 class Measurement(gobject.GObject):
 
@@ -44,8 +49,11 @@ class Measurement(gobject.GObject):
         self._coords = []
         self._measurements = []
 
+        self._workers = {}
+        self._timing = []
+
         if name in qt.data:
-            self._data = qt.data['name']
+            self._data = qt.data[name]
         else:
             self._data = Data()
 
@@ -53,36 +61,69 @@ class Measurement(gobject.GObject):
         return self._data
 
     def _add_coordinate_options(self, coord, **kwargs):
-        if 'steps' in kwargs:
-            if kwargs['steps'] == 0:
-                logging.warning('Unable to add coordinate with 0 steps')
-                return False
-
-            coord['steps'] = kwargs['steps']
-            coord['stepsize'] = float(coord['end'] - coord['start']) / (kwargs['steps'] - 1.0)
-        elif 'stepsize' in kwargs:
-            if kwargs['stepsize'] == 0:
-                logging.warning('Unable to add coordinate with 0 stepsize')
-                return False
-
-            if start < end:
-                coord['stepsize'] = kwargs['stepsize']
+        '''
+        Determine the values of a coordinate and add it to the list.
+
+        Output:
+            dict of Data metadata (size, start, end, stepsize), or None
+            if the options are invalid
+        '''
+
+        try:
+            if 'values' in kwargs:
+                values = numpy.asarray(kwargs['values'], dtype=numpy.float64)
+                if len(values) == 0:
+                    raise ValueError('Unable to add coordinate without values')
+            elif 'steps' in kwargs or 'stepsize' in kwargs:
+                values = axis_values(coord['start'], coord['end'],
+                    steps=kwargs.get('steps', None),
+                    stepsize=kwargs.get('stepsize', None))
             else:
-                coord['stepsize'] = -kwargs['stepsize']
-            coord['steps'] = math.ceil((coord['end'] - coord['start']) / kwargs['stepsize'])
+                raise ValueError('_add_coordinate_options requires steps, '
+                    'stepsize or values argument')
+        except ValueError, e:
+            logging.warning(str(e))
+            return None
+
+        coord['values'] = values
+        coord['steps'] = len(values)
+        coord['start'] = float(values[0])
+        coord['end'] = float(values[-1])
+        if len(values) > 1:
+            coord['stepsize'] = (coord['end'] - coord['start']) / \
+                    (len(values) - 1)
         else:
-            logging.warning('_add_coordinate_options requires steps or stepsize argument')
+            coord['stepsize'] = 0.0
 
-        if 'delay' in kwargs:
-            coord['delay'] = kwargs['delay']
+        for key in ('delay', 'maxstep', 'stepdelay', 'rate'):
+            if key in kwargs:
+                coord[key] = kwargs[key]
 
         self._coords.append(coord)
 
-    def add_coordinate(self, ins, var, start, end, **kwargs):
+        meta = {
+            'size': coord['steps'],
+            'start': coord['start'],
+            'end': coord['end'],
+        }
+        if 'values' not in kwargs:
+            meta['stepsize'] = coord['stepsize']
+        return meta
+
+    def _coordinate_data_options(self, meta, kwargs):
+        opts = dict(kwargs)
+        for key in ('steps', 'stepsize', 'values', 'delay', 'maxstep',
+                'stepdelay', 'rate'):
+            opts.pop(key, None)
+        opts.update(meta)
+        return opts
+
+    def add_coordinate(self, ins, var, start=None, end=None, **kwargs):
         '''
         Add a loop coordinate to the internal list. The first coordinate is
-        the outer part of the loop, the last coordinate the inner part. The
-        measurement loop will set the value of instrument ins, variable var.
+        the inner (fastest) part of the loop, the last coordinate the outer
+        part, as in the column order of the data file. The measurement loop
+        will set the value of instrument ins, variable var.
 
         Input:
             ins (Instrument): the instrument
@@ -90,45 +131,59 @@ class Measurement(gobject.GObject):
             start (float): start value
             end (float): end value
             **kwargs: options:
-                steps (int) or stepsize (float). One of these is required.
+                steps (int) or stepsize (float): linear sweep from start
+                    to end
+                values (array): arbitrary list of values, replaces start,
+                    end and steps
+                One of these is required.
                 delay (float): delay after setting value, in ms
 
         Output:
             None
         '''
 
-        coord = {'start': float(start), 'end': float(end),
-                'ins': ins, 'var': var}
+        coord = {'start': start, 'end': end, 'ins': ins, 'var': var}
+        meta = self._add_coordinate_options(coord, **kwargs)
+        if meta is None:
+            return
 
-        self._add_coordinate_options(coord, **kwargs)
+        opts = self._coordinate_data_options(meta, kwargs)
+        opts['instrument'] = ins.get_name()
+        opts['parameter'] = var
+        self._data.add_coordinate(var, **opts)
 
-        kwargs['instrument'] = ins.get_name()
-        kwargs['parameter'] = var
-        kwargs['size'] = kwargs['steps']
-        self._data.add_coordinate(var, **kwargs)
-
-    def add_coordinate_func(self, func, start, end, **kwargs):
+    def add_coordinate_func(self, func, start=None, end=None, **kwargs):
         '''
         Add a loop coordinate to the internal list. The first coordinate is
-        the outer part of the loop, the last coordinate the inner part. The
-        measurement loop will call function func with the variable value.
+        the inner (fastest) part of the loop, the last coordinate the outer
+        part. The measurement loop will call function func with the variable
+        value.
 
         Input:
             func (function): the function to call
             start (float): start value
             end (float): end value
             **kwargs: options:
-                steps (int) or stepsize (float). One of these is required.
+                steps (int), stepsize (float) or values (array). One of
+                    these is required.
                 delay (float): delay after setting value, in ms
+                maxstep, stepdelay (ms) or rate (units / s): ramp speed
+                    of the function, used by order='auto'
 
         Output:
             None
         '''
 
-        coord = {'start': float(start), 'end': float(end), 'func': func}
-        self._add_coordinate_options(coord, **kwargs)
-        kwargs['size'] = kwargs['steps']
-        self._data.add_coordinate(func, **kwargs)
+        coord = {'start': start, 'end': end, 'func': func}
+        if kwargs.pop('lockclass', None) is not None:
+            logging.warning('Coordinates are always set from the '
+                'measurement thread, ignoring lockclass')
+        meta = self._add_coordinate_options(coord, **kwargs)
+        if meta is None:
+            return
+
+        opts = self._coordinate_data_options(meta, kwargs)
+        self._data.add_coordinate(func.__name__, **opts)
 
     def get_ncoordinates(self):
         return len(self._coords)
@@ -140,6 +195,14 @@ class Measurement(gobject.GObject):
         Input:
             ins (Instrument): the instrument to use
             var (string): the variable to measure
+            **kwargs: options:
+                concurrent (bool): read in a worker thread of the lock
+                    class of the instrument, concurrently with the reads
+                    of other lock classes. Only for drivers that do not
+                    call qt.msleep() or otherwise use the main loop.
+                latched (bool): the instrument latches its value when the
+                    query is issued (e.g. a triggered DMM), so the next
+                    coordinate may be set while the readback completes.
 
         Output:
             None
@@ -150,13 +213,20 @@ class Measurement(gobject.GObject):
             meas[key] = val
         self._measurements.append(meas)
 
-        kwargs['instrument'] = ins
+        kwargs['instrument'] = ins.get_name()
         kwargs['parameter'] = var
         self._data.add_value(var, **kwargs)
 
     def add_measurement_func(self, func, **kwargs):
+        '''
+        Add a measurement function to the internal list. The function is
+        called from the measurement thread, unless a 'lockclass' option is
+        given; it is then executed by the worker of that lock class, so it
+        should not call qt.msleep() or otherwise use the main loop.
+        '''
+
         meas = {'func': func}
-        for key, val in kwargs.iter_items():
+        for key, val in kwargs.iteritems():
             meas[key] = val
         self._measurements.append(meas)
 
@@ -169,93 +239,157 @@ class Measurement(gobject.GObject):
     def emit(self, *args):
         gobject.idle_add(gobject.GObject.emit, self, *args)
 
+    def _get_worker(self, lockclass):
+        if lockclass not in self._workers:
+            self._workers[lockclass] = LockClassWorker(lockclass, 'measurement')
+        return self._workers[lockclass]
+
+    def _stop_workers(self):
+        for worker in self._workers.values():
+            worker.stop()
+        for worker in self._workers.values():
+            worker.join(1.0)
+        self._workers = {}
+
+    def _get_lockclass(self, item):
+        '''
+        Return the lock class of the worker for a measurement item, or None
+        to read it from the measurement thread. Workers are only used when
+        asked for explicitly.
+        '''
+        if 'ins' in item:
+            if item.get('concurrent', False):
+                return item['ins'].get_lock_class()
+            return None
+        return item.get('lockclass', None)
+
+    def _submit(self, item, func, *args):
+        '''
+        Submit a call for a measurement item to the worker of its lock
+        class, see _get_lockclass(). Other calls are executed directly.
+        '''
+        lockclass = self._get_lockclass(item)
+        if lockclass is None:
+            job = Job(func, args)
+            job.run()
+            return job
+        return self._get_worker(lockclass).submit(func, *args)
+
+    def _set_coord(self, func, *args):
+        '''Set a coordinate, always from the measurement thread.'''
+        job = Job(func, args)
+        job.run()
+        return job
+
+    def _wait_jobs(self, jobs, event='done'):
+        '''Wait until all jobs have started or finished, keep gui alive.'''
+        for job in jobs:
+            ev = getattr(job, event)
+            while not ev.isSet():
+                ev.wait(0.01)
+                if not ev.isSet():
+                    qt.msleep(0)
+
+        for job in jobs:
+            if job.error is not None and job.done.isSet():
+                raise job.error
+
     def _do_set_values(self, iter):
         '''
+        Start setting the coordinates of iteration iter + 1.
+
         Input:
             iter (int): iteration number, -1 to set starting values
 
         Output:
-            float: extra delay required
+            (jobs, extra_delay): the pending set jobs and the extra settling
+            time in seconds
         '''
 
         extra_delay = 0
-        index = self.iter_to_index(iter + 1)
-        coords = self.index_to_coords(index)
-        self._current_coords = coords
-        delta = []
-
-        for i in xrange(len(coords)):
-            delta.append(index[i] - self._last_index[i])
-
-        if iter != -1:
-            set_all = False
-        else:
-            set_all = True
-
-        self._last_index = index
-        self._new_data_block = False
-
-        # Set loop variables
-        for i in xrange(len(coords)):
-            if delta[i] != 0:
+        point = iter + 1
+        plan = self._plan
+
+        # Only the axes that change are set
+        coords = list(self._current_coords)
+        jobs = []
+        for i in plan.get_changed_axes(point):
+            val = plan.get_coord(point, i)
+            coords[i] = val
+            coord = self._coords[i]
+            if 'ins' in coord:
+                jobs.append(self._set_coord(coord['ins'].set,
+                    coord['var'], val))
+            elif 'func' in coord:
+                jobs.append(self._set_coord(coord['func'], val))
+
+            if 'delay' in coord:
+                extra_delay += coord['delay'] / 1000.0
 
-                if i != 0:
-                    self._new_data_block = True
-
-                try:
-                    val = coords[i]
-                    if 'ins' in self._coords[i]:
-                        ins = self._coords[i]['ins']
-                        ins.set(self._coords[i]['var'], val)
-                    elif 'func' in self._coords[i]:
-                        func = self._coords[i]['func']
-                        func(val)
-                except Exception, e:
-                    self.stop(str(e))
-                    return False
-
-                if 'delay' in self._coords[i]:
-                    extra_delay += self._coords[i]['delay'] / 1000.0
-
-        return extra_delay
+        self._current_coords = coords
+        return jobs, extra_delay
 
     def _do_measurements(self):
-        data = []
+        '''Submit the reads of all measurements, return the jobs.'''
+        jobs = []
         for m in self._measurements:
             if 'ins' in m:
-                ins = m['ins']
-                data.append(ins.get(m['var']))
+                jobs.append(self._submit(m, m['ins'].get, m['var']))
             elif 'func' in m:
-                func = m['func']
-                data.append(func())
+                jobs.append(self._submit(m, m['func']))
             else:
                 logging.warning('Measurement action undefined')
-
-        return data
+        return jobs
 
     def _measure(self, iter):
         '''
-        The main measurement function. Convert iter to coordinates and
-        set parameters accordingly. Then measure the required variables.
+        The main measurement function. The coordinates of iteration iter
+        have been set and have settled. Read all measurements, in workers
+        for the 'concurrent' ones; as soon as the latched readouts have been issued and the others
+        have completed, start setting the next coordinates while the
+        latched readouts finish.
 
         Input:
             iter (int): the iteration number
 
         Output:
-            float: extra requested timeout in ms
+            None
         '''
 
         coords = self._current_coords
-        data = self._do_measurements()
+        t_read = time.time()
+        jobs = self._do_measurements()
+
+        latched = [job for job, m in zip(jobs, self._measurements) \
+                if m.get('latched', False)]
+        normal = [job for job in jobs if job not in latched]
+        self._wait_jobs(latched, 'started')
+        self._wait_jobs(normal)
 
         if iter != self._ntotal - 1:
-            extra_delay = self._do_set_values(iter)
+            setjobs, extra_delay = self._do_set_values(iter)
+            t_set = time.time()
+            self._wait_jobs(setjobs)
+            self._set_done = time.time()
+            self._settle = self._delay / 1000.0 + extra_delay
         else:
-            extra_delay = 0
+            t_set = self._set_done = time.time()
+
+        self._wait_jobs(latched)
+        t_end = time.time()
 
-        cols = coords + data
-        nb = {'newblock': self._new_data_block}
-        self._data.add_data_point(*cols, **nb)
+        data = [job.result for job in jobs]
+        timing = self._point_timing
+        timing['read'] = (max([job.t_end for job in jobs] + [t_read]) - \
+                t_read) * 1000
+        self._timing.append(timing)
+        self._point_timing = {
+            'set': (self._set_done - t_set) * 1000,
+        }
+
+        if self._options.get('timing', False):
+            data += [timing['set'], timing['settle'], timing['read']]
+        self._writer.add(iter, data, coords)
 
         if (iter % self._PROGRESS_STEPS) == 0:
             self.emit('progress', {
@@ -263,11 +397,104 @@ class Measurement(gobject.GObject):
                 'total': self._ntotal,
                 })
 
-        return extra_delay
+    def _get_ramp_cost(self, coord):
+        if 'ins' in coord:
+            opts = coord['ins'].get_parameter_options(coord['var'])
+        else:
+            opts = coord
+        return ramp_cost(opts)
+
+    def _compile_plan(self):
+        axes = [c['values'] for c in self._coords]
+        order = self._options.get('order', None)
+        if order is None:
+            if self._options.get('serpentine', False):
+                order = 'serpentine'
+            else:
+                order = 'raster'
+
+        serpentine = False
+        loop_order = None
+        if order == 'serpentine':
+            serpentine = True
+        elif order == 'auto':
+            costs = [self._get_ramp_cost(c) for c in self._coords]
+            best = choose_order(axes, costs,
+                    reorder=self._options.get('reorder', False))
+            serpentine = best['serpentine']
+            loop_order = best['loop_order']
+            raster = estimate_dead_time(axes, costs)
+            self._data.add_comment('Sweep order: serpentine %s, loops %s, '
+                'estimated ramp time %.1f s (raster %.1f s)' % \
+                (serpentine, loop_order, best['dead_time'], raster))
+        elif order != 'raster':
+            logging.warning('Unknown sweep order %r, using raster', order)
+
+        return SweepPlan(axes, serpentine=serpentine, loop_order=loop_order)
+
+    def _wait_settled(self):
+        '''Wait until the settling time after the last set has passed.'''
+        t_start = time.time()
+        remaining = self._set_done + self._settle - t_start
+        if remaining > 0:
+            qt.msleep(remaining, exact=True)
+        else:
+            qt.msleep(0)
+        self._point_timing['settle'] = (time.time() - t_start) * 1000
+
+    def get_timing(self):
+        '''
+        Return the timing of every measured point as a list of dicts with
+        keys 'set', 'settle' and 'read', in ms. 'settle' is the time waited
+        after the set completed, 'read' the time until all readouts of the
+        point had completed.
+        '''
+        return self._timing
+
+    def _add_timing_header(self):
+        self._data.add_comment('Timing: settle time is counted from the '
+            'completion of the set, delay = %s ms' % self._delay)
+        lockclasses = {}
+        for m in self._measurements:
+            lc = self._get_lockclass(m)
+            if 'ins' in m:
+                name = '%s.%s' % (m['ins'].get_name(), m['var'])
+            else:
+                name = str(m['func'])
+            lockclasses.setdefault(str(lc), []).append(name)
+        for lc, names in sorted(lockclasses.items()):
+            self._data.add_comment('Lock class %s: %s' % \
+                (lc, ', '.join(names)))
+
+        if self._options.get('timing', False):
+            for name in ('set', 'settle', 'read'):
+                self._data.add_value('t_%s' % name, units='ms')
+
+    def _add_timing_summary(self):
+        if len(self._timing) == 0:
+            return
+        for name in ('set', 'settle', 'read'):
+            vals = [t.get(name, 0) for t in self._timing]
+            self._data.add_comment('Timing %s: mean %.3f ms, max %.3f ms' % \
+                (name, sum(vals) / len(vals), max(vals)))
 
     def start(self):
         '''
         Start measurement loop.
+
+        Options (given to the constructor):
+            delay (float): settling time after setting a point, in ms
+            order (string): 'raster' (default) restarts every axis at its
+                first value, 'serpentine' sweeps every axis back and forth
+                and 'auto' picks the ordering with the least ramp time,
+                estimated from the maxstep / stepdelay or rate options of
+                the swept parameters.
+            reorder (bool): with order='auto', also consider changing the
+                nesting of the loops.
+            Points are always stored in the data file in the canonical
+            order, the first coordinate changing fastest.
+            timing (bool): store the per point timing in three extra value
+                columns t_set, t_settle and t_read (ms).
         '''
 
         if len(self._coords) == 0:
@@ -275,37 +502,51 @@ class Measurement(gobject.GObject):
             self.emit('finished', 'ok')
             return False
 
-        # determine loop delay
+        # determine loop delay; the coordinate delays are added for every
+        # coordinate that changes, see _do_set_values()
         last_coord = self._coords[len(self._coords) - 1]
         if 'delay' in self._options:
             self._delay = self._options['delay']
         elif 'delay' in last_coord:
-            self._delay = last_coord['delay']
+            self._delay = 0
         else:
             logging.warning('measurement delay undefined')
             return False
 
-        # determine loop steps
-        self._ntotal = 1
-        for coord in self._coords:
-            self._ntotal *= coord['steps']
+        # compile the sweep plan
+        self._plan = self._compile_plan()
+        self._ntotal = self._plan.get_npoints()
+        self._data.reserve(self._ntotal)
+        self._writer = CanonicalWriter(self._data, self._plan)
 
         # Create file
+        self._add_timing_header()
         self._data.create_file(self._name)
 
-        # Set starting values and sleep
-        self._last_index = [-1 for i in xrange(len(self._coords))]
-        self._do_set_values(-1)
-        time.sleep(self._delay / 1000.0)
-
-        for i in range(self._ntotal):
-            self._measure()
-            try:
-                qt.msleep(self._delay / 1000.0)
-            except:
-                self.emit('finished', 'Interrupted')
-
-        self.emit('finished', 'Ok')
+        # Set starting values
+        self._timing = []
+        self._current_coords = [None] * len(self._coords)
+        msg = 'Ok'
+        try:
+            t_set = time.time()
+            jobs, extra_delay = self._do_set_values(-1)
+            self._wait_jobs(jobs)
+            self._set_done = time.time()
+            self._settle = self._delay / 1000.0 + extra_delay
+            self._point_timing = {'set': (self._set_done - t_set) * 1000}
+
+            for i in xrange(self._ntotal):
+                self._wait_settled()
+                self._measure(i)
+        except Exception, e:
+            logging.warning('Measurement stopped: %s', e)
+            msg = str(e)
+
+        self._stop_workers()
+        self._writer.flush()
+        self._add_timing_summary()
+        self._data.close_file()
+        self.emit('finished', msg)
 
     def _finished_cb(self, sender, msg):
         logging.debug('Measurement finished: %s', msg)
@@ -316,23 +557,141 @@ class Measurement(gobject.GObject):
         self.emit('new-data', data)
 
     def iter_to_index(self, iter):
-        ret = []
-        for opts in self._coords:
-            v = iter % opts['steps']
-            ret.append(v)
-            iter = (iter - v) / opts['steps']
-
-        return ret
+        return self._plan.get_index(iter)
 
     def index_to_coords(self, index):
-        ret = []
-        i = 0
-        for opts in self._coords:
-            v = opts['start'] + index[i] * opts['stepsize']
-            ret.append(v)
-            i += 1
+        return [float(c['values'][i]) for c, i in zip(self._coords, index)]
+
+class AdaptiveMeasurement(Measurement):
+    '''
+    Measurement of one or two coordinates that first measures the coarse
+    grid given with add_coordinate(), and then adds points where the
+    measured value changes quickly, see lib/adaptive.py.
+
+    The data file contains the points in the order in which they were
+    measured (scattered coordinates), followed by the measurements and a
+    'refinement level' column (0 for the coarse grid). Plot 2D data with
+    a Plot3D in the 'scatter' or 'points' style.
+
+    Options (given to the constructor), in addition to 'delay':
+        threshold (float): refine where neighbouring values differ by more
+            than this fraction of the value range, default 0.05
+        curvature (float): refine where a value deviates this much from
+            the linear interpolation of its neighbours, default off
+        max_level (int): number of times the coarse grid can be halved,
+            default 4
+        max_points (int), max_time (float, s): measurement budget
+        refine_on (int): index of the measurement to refine on, default 0
+    '''
+
+    def _coordinate_data_options(self, meta, kwargs):
+        opts = Measurement._coordinate_data_options(self, meta, kwargs)
+        opts['size'] = 0
+        opts.pop('stepsize', None)
+        return opts
+
+    def _create_refiner(self):
+        opts = {}
+        for key in ('threshold', 'curvature', 'max_level'):
+            if key in self._options:
+                opts[key] = self._options[key]
+
+        sweeps = [(c['start'], c['end'], c['steps']) for c in self._coords]
+        if len(sweeps) == 1:
+            return Refiner1D(*sweeps[0], **opts)
+        else:
+            return Refiner2D(sweeps[0], sweeps[1], **opts)
+
+    def _measure_point(self, coords, level):
+        extra_delay = 0
+        jobs = []
+        t_set = time.time()
+        for i, val in enumerate(coords):
+            if val == self._current_coords[i]:
+                continue
+            coord = self._coords[i]
+            if 'ins' in coord:
+                jobs.append(self._set_coord(coord['ins'].set,
+                    coord['var'], val))
+            elif 'func' in coord:
+                jobs.append(self._set_coord(coord['func'], val))
+            if 'delay' in coord:
+                extra_delay += coord['delay'] / 1000.0
+
+        self._current_coords = list(coords)
+        self._wait_jobs(jobs)
+        self._set_done = time.time()
+        self._settle = self._delay / 1000.0 + extra_delay
+        self._point_timing = {'set': (self._set_done - t_set) * 1000}
+        self._wait_settled()
+
+        t_read = time.time()
+        jobs = self._do_measurements()
+        self._wait_jobs(jobs)
+        self._point_timing['read'] = (time.time() - t_read) * 1000
+        self._timing.append(self._point_timing)
+
+        data = [job.result for job in jobs]
+        cols = list(coords) + data + [level]
+        self._data.add_data_point(*cols)
+
+        npoints = len(self._timing)
+        if (npoints % self._PROGRESS_STEPS) == 0:
+            self.emit('progress', {
+                'current': npoints,
+                'total': self._options.get('max_points', 0),
+                })
+
+        return data[self._options.get('refine_on', 0)]
 
-        return ret
+    def get_refiner(self):
+        '''Return the refiner, which holds the measured points.'''
+        return self._refiner
+
+    def start(self):
+        '''
+        Start the adaptive measurement.
+
+        Output:
+            number of measured points
+        '''
+
+        if len(self._coords) not in (1, 2):
+            logging.warning('Adaptive measurement needs 1 or 2 coordinates')
+            return False
+        if len(self._measurements) == 0:
+            logging.warning('Adaptive measurement needs a measurement')
+            return False
+
+        # Coordinate delays are added in _measure_point()
+        self._delay = self._options.get('delay', 0)
+
+        self._refiner = self._create_refiner()
+        self._data.add_value('refinement level')
+        self._data.add_comment('Adaptive sweep: coarse grid %s, options %s' % \
+            ([c['steps'] for c in self._coords],
+            dict([(k, v) for k, v in self._options.iteritems() \
+                if k != 'delay'])))
+        self._data.create_file(self._name)
+
+        self._timing = []
+        self._current_coords = [None] * len(self._coords)
+        msg = 'Ok'
+        n = 0
+        try:
+            n = adaptive_sweep(self._refiner, self._measure_point,
+                max_points=self._options.get('max_points', None),
+                max_time=self._options.get('max_time', None))
+        except Exception, e:
+            logging.warning('Measurement stopped: %s', e)
+            msg = str(e)
+
+        self._stop_workers()
+        self._data.add_comment('Adaptive sweep: %d points' % \
+            len(self._timing))
+        self._data.close_file()
+        self.emit('finished', msg)
+        return n
 
 #FIXME: Change to NamedList
 class Measurements(gobject.GObject):
@@ -342,42 +701,58 @@ class Measurements(gobject.GObject):
 
 measurements = None
 
+def _axis_kwargs(prefix, kwargs):
+    '''Pick <prefix>steps, <prefix>stepsize or <prefix>values from kwargs.'''
+    for key in ('values', 'steps', 'stepsize'):
+        if prefix + key in kwargs:
+            return {key: kwargs[prefix + key]}
+    return None
+
 def measure1d(
         read_ins, read_var,
         sweep_ins, sweep_var, start, end, **kwargs):
 
-    m = Measurement()
-    m.add_coordinate(start, end, sweep_ins, sweep_var, **kwargs)
+    m = Measurement(kwargs.pop('name', 'measure1d'),
+            delay=kwargs.pop('delay', 0))
+    m.add_coordinate(sweep_ins, sweep_var, start, end, **kwargs)
     m.add_measurement(read_ins, read_var)
 
+    m.start()
+    return m
+
 def measure2d(
         read_ins, read_var,
         xsweep_ins, xsweep_var, xstart, xend,
         ysweep_ins, ysweep_var, ystart, yend,
         delay,
         **kwargs):
-
-    m = Measurement(delay=delay)
-
-    if 'ysteps' in kwargs:
-        m.add_coordinate(ysweep_ins, ysweep_var, ystart, yend,
-            steps=kwargs['ysteps'])
-    elif 'ystepsize' in kwargs:
-        m.add_coordinate(ysweep_ins, ysweep_var, xstart, xend,
-            stepsize=kwargs['ystepsize'])
-    else:
-        print 'measure2d() needs ysteps or ystepsize argument'
-
-    if 'xsteps' in kwargs:
-        m.add_coordinate(xsweep_ins, xsweep_var, xstart, xend,
-            steps=kwargs['xsteps'])
-    elif 'xstepsize' in kwargs:
-        m.add_coordinate(xsweep_ins, xsweep_var, xstart, xend,
-            stepsize=kwargs['xstepsize'])
-    else:
-        print 'measure2d() needs xsteps or xstepsize argument'
+    '''
+    Measure read_var on a 2D grid, with x as the inner loop.
+    Both axes need one of <x/y>steps, <x/y>stepsize or <x/y>values.
+    The order option ('raster', 'serpentine' or 'auto') sets the sweep
+    ordering, see Measurement.start(); serpentine=True is short for
+    order='serpentine'.
+    '''
+
+    opts = {'delay': delay}
+    for key in ('order', 'reorder', 'serpentine'):
+        if key in kwargs:
+            opts[key] = kwargs[key]
+    m = Measurement(kwargs.get('name', 'measure2d'), **opts)
+
+    xopts = _axis_kwargs('x', kwargs)
+    if xopts is None:
+        print 'measure2d() needs xsteps, xstepsize or xvalues argument'
+        return None
+    m.add_coordinate(xsweep_ins, xsweep_var, xstart, xend, **xopts)
+
+    yopts = _axis_kwargs('y', kwargs)
+    if yopts is None:
+        print 'measure2d() needs ysteps, ystepsize or yvalues argument'
+        return None
+    m.add_coordinate(ysweep_ins, ysweep_var, ystart, yend, **yopts)
 
     m.add_measurement(read_ins, read_var)
 
     m.start()
-
+    return m
@@ -95,6 +95,82 @@ def usleep(usec):
     while (exact_time() - start) * 1e6 < usec:
         pass
 
+class TimingStats(object):
+    '''
+    Collect statistics of timing errors (in seconds), such as the lateness
+    of a wake-up compared to its deadline.
+
+    The histogram bins are given by their upper edges; the last bin
+    counts everything larger.
+    '''
+
+    BINS = (1e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 1e-1)
+
+    def __init__(self, bins=None):
+        if bins is None:
+            bins = self.BINS
+        self._bins = np.asarray(bins, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self._count = 0
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._min = None
+        self._max = None
+        self._hist = np.zeros(len(self._bins) + 1, dtype=np.int64)
+
+    def add(self, value):
+        self._count += 1
+        self._sum += value
+        self._sumsq += value * value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+        self._hist[np.searchsorted(self._bins, value)] += 1
+
+    def get_count(self):
+        return self._count
+
+    def get_stats(self):
+        '''
+        Return a dict with count, mean, std, min, max and the histogram as
+        a list of (upper bin edge, count); the last edge is None.
+        '''
+
+        if self._count == 0:
+            mean = std = 0.0
+        else:
+            mean = self._sum / self._count
+            std = np.sqrt(max(self._sumsq / self._count - mean * mean, 0))
+        edges = list(self._bins) + [None]
+        return {
+            'count': self._count,
+            'mean': mean,
+            'std': std,
+            'min': self._min,
+            'max': self._max,
+            'histogram': zip(edges, self._hist.tolist()),
+        }
+
+    def format(self, unit=1e-3, unitname='ms'):
+        '''Return a short text report.'''
+        st = self.get_stats()
+        if st['count'] == 0:
+            return 'no data'
+        lines = ['n=%d mean=%.3f%s std=%.3f%s min=%.3f%s max=%.3f%s' % \
+            (st['count'], st['mean'] / unit, unitname, st['std'] / unit,
+            unitname, st['min'] / unit, unitname, st['max'] / unit,
+            unitname)]
+        for edge, n in st['histogram']:
+            if edge is None:
+                lines.append('  > %.3f%s: %d' % (self._bins[-1] / unit,
+                    unitname, n))
+            else:
+                lines.append('  <= %.3f%s: %d' % (edge / unit, unitname, n))
+        return '\n'.join(lines)
+
 #def get_ipython():
 #    import IPython
 #    if ipython_is_newer((0, 11)):
@@ -107,8 +107,7 @@ def unpack(buf, format, alignment='='):
 
     return ret
 
-# FIXME: add alignment flag in a proper way
-def pack(format, **kwargs):
+def _pack_values(format, kwargs):
     list = []
     for line in format:
         name, dtype, dlen = line
@@ -124,6 +123,12 @@ def pack(format, **kwargs):
         elif dtype in (U8, S8, U16, S16, U32, S32, U64, S64):
             for i in range(dlen):
                 list.append(0)
+        elif dtype in (FLOAT, DOUBLE):
+            for i in range(dlen):
+                list.append(0.0)
+        elif dtype == C:
+            for i in range(dlen):
+                list.append('\x00')
         else:
             for i in range(dlen):
                 list.append(None)
@@ -131,11 +136,13 @@ def pack(format, **kwargs):
     if len(kwargs.keys()) > 0:
         print 'namedstruct.pack(): arguments not converted: %r' % kwargs.keys()
 
-    if isinstance(format, struct.Struct):
-        return format.pack(*list)
-    else:
-        structstr = format_to_structstr(format)
-        return struct.pack(structstr, *list)
+    return list
+
+# FIXME: add alignment flag in a proper way
+def pack(format, **kwargs):
+    list = _pack_values(format, kwargs)
+    structstr = format_to_structstr(format)
+    return struct.pack(structstr, *list)
 
 def calcsize(format, alignment='='):
     structstr = format_to_structstr(format, alignment=alignment)
@@ -151,7 +158,7 @@ class NamedStruct:
         self.size = self.struct.size
 
     def pack(self, **kwargs):
-        return pack(self.struct, **kwargs)
+        return self.struct.pack(*_pack_values(self._format, kwargs))
 
     def unpack(self, buf):
         return unpack(buf, self._format, alignment=self._alignment)
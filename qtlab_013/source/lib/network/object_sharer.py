@@ -62,6 +62,11 @@ class ObjectSharer():
         self._callbacks_name = {}
         self._event_callbacks = {}
 
+        # Connections subscribed to detailed signals ('signal::detail'),
+        # indexed on objname__signame
+        self._subscribers = {}
+        self._calling_conn = None
+
         # Buffers to store partly received packets
         self._buffers = {}
         self._send_queue = {}
@@ -122,6 +127,12 @@ class ObjectSharer():
         if conn in self._send_queue:
             del self._send_queue[conn]
 
+        for name, conns in self._subscribers.items():
+            if conn in conns:
+                conns.remove(conn)
+            if len(conns) == 0:
+                del self._subscribers[name]
+
     def get_clients(self):
         return self._clients
 
@@ -347,12 +358,15 @@ class ObjectSharer():
 
         obj = self._objects[objname]
         func = getattr(obj, funcname)
+        prev_conn = self._calling_conn
+        self._calling_conn = conn
         try:
             ret = func(*args, **kwargs)
         except Exception, e:
             import traceback
             tb = traceback.format_exc(15)
             ret = RemoteException('%s\n%s' % (e, tb))
+        self._calling_conn = prev_conn
 
         if info[0] == 'signal':
             # No need to send return
@@ -527,6 +541,31 @@ class ObjectSharer():
                     del self._callbacks_name[name][index]
                     break
 
+    def get_calling_connection(self):
+        '''
+        Return the connection of the remote call being handled, or None
+        when not called remotely.
+        '''
+        return self._calling_conn
+
+    def subscribe(self, conn, objname, signame):
+        '''
+        Send detailed signal 'signame' of object 'objname' to the client
+        at connection 'conn'.
+        '''
+        name = '%s__%s' % (objname, signame)
+        conns = self._subscribers.setdefault(name, [])
+        if conn not in conns:
+            conns.append(conn)
+
+    def unsubscribe(self, conn, objname, signame):
+        name = '%s__%s' % (objname, signame)
+        conns = self._subscribers.get(name, [])
+        if conn in conns:
+            conns.remove(conn)
+        if len(conns) == 0 and name in self._subscribers:
+            del self._subscribers[name]
+
     def emit_signal(self, objname, signame, *args, **kwargs):
         logging.debug('Emitting %s(%r, %r) for %s to %d clients',
                 signame, args, kwargs, objname, len(self._clients))
@@ -535,6 +574,19 @@ class ObjectSharer():
         for client in self._clients:
             client.receive_signal(objname, signame, *args, **kwargs)
 
+    def emit_signal_subscribers(self, objname, signame, *args, **kwargs):
+        '''
+        Emit a signal only to the clients subscribed to it.
+        '''
+        conns = self._subscribers.get('%s__%s' % (objname, signame), None)
+        if not conns:
+            return
+
+        kwargs['signal'] = True
+        for client in self._clients:
+            if client.get_connection() in conns:
+                client.receive_signal(objname, signame, *args, **kwargs)
+
     def receive_signal(self, objname, signame, *args, **kwargs):
         logging.debug('Received signal %s(%r, %r) from %s',
                 signame, args, kwargs, objname)
@@ -572,6 +624,10 @@ class SharedObject():
     Server side object that can be shared and emit signals.
     '''
 
+    # Signals that are only sent to clients that connected to them, like
+    # detailed signals ('signal::detail')
+    _subscribed_signals = ()
+
     def __init__(self, name, replace=False):
         '''
         Create SharedObject, arguments:
@@ -590,6 +646,13 @@ class SharedObject():
     def emit(self, signal, *args, **kwargs):
         helper.emit_signal(self.__name, signal, *args, **kwargs)
 
+    def emit_subscribed(self, signal, *args, **kwargs):
+        '''
+        Emit a detailed signal, e.g. 'changed::value', only to the clients
+        that connected to it.
+        '''
+        helper.emit_signal_subscribers(self.__name, signal, *args, **kwargs)
+
     def connect(self, signame, callback, *args):
         self.__last_hid += 1
         self.__callbacks[self.__last_hid] = {
@@ -626,12 +689,19 @@ class SharedGObject(gobject.GObject, SharedObject):
 
     def emit(self, signal, *args, **kwargs):
         # The 'None' here is the 'sender'
-        SharedObject.emit(self, signal, None, *args, **kwargs)
+        if signal in self._subscribed_signals:
+            SharedObject.emit_subscribed(self, signal, None, *args, **kwargs)
+        else:
+            SharedObject.emit(self, signal, None, *args, **kwargs)
         if self._do_idle_emit:
             gobject.idle_add(self._idle_emit, signal, *args, **kwargs)
         else:
             return gobject.GObject.emit(self, signal, *args, **kwargs)
 
+    def emit_subscribed(self, signal, *args, **kwargs):
+        # The 'None' here is the 'sender'
+        SharedObject.emit_subscribed(self, signal, None, *args, **kwargs)
+
     def disconnect(self, ghid):
         if ghid not in self.__hid_map:
             return
@@ -674,6 +744,8 @@ class ObjectProxy():
         self.__name = info['name']
         self.__new_hid = 1
         self.__callbacks = {}
+        self.__subscriptions = {}
+        self.__subscribed_signals = info.get('subscribed_signals', ())
 
         for funcname, share_options in info['functions']:
             setattr(self, funcname, _FunctionCall(self.__conn, self.__name, funcname, share_options))
@@ -684,10 +756,30 @@ class ObjectProxy():
     def get_connection(self):
         return self.__conn
 
-    def connect(self, signame, func):
-        return helper.connect(self.__name, signame, func)
+    def connect(self, signame, func, *args):
+        '''
+        Connect func to a signal of the remote object. Detailed signals,
+        such as 'changed::value', and the signals listed in the object's
+        _subscribed_signals are only sent by the remote side after
+        subscribing to them, which is done on the first connect.
+        '''
+        hid = helper.connect(self.__name, signame, func, *args)
+        if '::' in signame or signame in self.__subscribed_signals:
+            hids = self.__subscriptions.setdefault(signame, [])
+            if len(hids) == 0:
+                helper.call(self.__conn, 'root', 'subscribe_signal',
+                        self.__name, signame, signal=True)
+            hids.append(hid)
+        return hid
 
     def disconnect(self, hid):
+        for signame, hids in self.__subscriptions.items():
+            if hid in hids:
+                hids.remove(hid)
+                if len(hids) == 0:
+                    del self.__subscriptions[signame]
+                    helper.call(self.__conn, 'root', 'unsubscribe_signal',
+                            self.__name, signame, signal=True)
         return helper.disconnect(hid)
 
 def cache_result(f):
@@ -731,7 +823,9 @@ class RootObject(SharedObject):
         info = {
             'name': objname,
             'properties': props,
-            'functions': funcs
+            'functions': funcs,
+            'subscribed_signals': tuple(getattr(obj,
+                '_subscribed_signals', ())),
         }
 
         return info
@@ -739,6 +833,16 @@ class RootObject(SharedObject):
     def receive_signal(self, objname, signame, *args, **kwargs):
         helper.receive_signal(objname, signame, *args, **kwargs)
 
+    def subscribe_signal(self, objname, signame):
+        conn = helper.get_calling_connection()
+        if conn is not None:
+            helper.subscribe(conn, objname, signame)
+
+    def unsubscribe_signal(self, objname, signame):
+        conn = helper.get_calling_connection()
+        if conn is not None:
+            helper.unsubscribe(conn, objname, signame)
+
     def list_objects(self):
         return self._objects.keys()
 
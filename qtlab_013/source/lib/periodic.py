@@ -0,0 +1,314 @@
+# periodic.py, single-timer service for periodic tasks
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Run many periodic tasks from a single gobject timer.
+
+Tasks are kept in a heap ordered by deadline. Deadlines are aligned to
+multiples of the task period since a common epoch, so tasks with the same
+(or commensurate) period are run in the same main loop wake-up instead of
+at arbitrary phases.
+
+Tasks that talk to instruments can be given a lock class; they are then
+executed on a worker thread per lock class (see calltimer.LockClassWorker)
+so that a slow instrument does not block the GUI or other instruments.
+
+Usage:
+    service = PeriodicService(flow)
+    h = service.add(ins.get_temperature, 5, lockclass=ins.get_lock_class())
+    service.print_stats()
+    service.remove(h)
+'''
+
+import gobject
+import heapq
+import logging
+
+from misc import exact_time
+from calltimer import LockClassWorker
+
+class _Task(object):
+
+    def __init__(self, handle, func, period, name, lockclass, pause, args):
+        self.handle = handle
+        self.func = func
+        self.period = float(period)
+        self.name = name
+        self.lockclass = lockclass
+        self.pause = pause
+        self.args = args
+
+        self.deadline = None
+        self.job = None
+        self.runs = 0
+        self.missed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add_runtime(self, dt):
+        self.runs += 1
+        self.total_time += dt
+        if dt > self.max_time:
+            self.max_time = dt
+
+class PeriodicService(object):
+    '''
+    Scheduler for periodic tasks using one gobject timeout.
+    '''
+
+    def __init__(self, flow=None, tolerance=0.002):
+        '''
+        Input:
+            flow (FlowControl): if given, tasks added with pause=True are
+                not run while a measurement is in progress
+            tolerance (float): tasks due within this many seconds are run
+                in the same wake-up
+        '''
+
+        self._tasks = {}
+        self._heap = []
+        self._workers = {}
+        self._epoch = exact_time()
+        self._tolerance = tolerance
+        self._next_handle = 1
+
+        self._timer_hid = None
+        self._timer_deadline = None
+
+        self._paused = False
+        self._measuring = False
+        self._flow = flow
+        if flow is not None:
+            self._measuring = flow.get_status() == 'running'
+            flow.connect('measurement-start', self._measurement_start_cb)
+            flow.connect('measurement-end', self._measurement_end_cb)
+
+    def _measurement_start_cb(self, sender):
+        self._measuring = True
+
+    def _measurement_end_cb(self, sender):
+        self._measuring = False
+
+    def set_paused(self, paused):
+        '''Pause / unpause all tasks.'''
+        self._paused = paused
+
+    def get_paused(self):
+        return self._paused
+
+    def _next_deadline(self, period, now):
+        '''First multiple of period since the epoch after now.'''
+        # Small offset so that a deadline itself maps to the next slot
+        n = int((now - self._epoch) / period + 1e-6) + 1
+        return self._epoch + n * period
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (task.deadline, task.handle))
+
+    def _reschedule(self):
+        while len(self._heap) > 0 and self._heap[0][1] not in self._tasks:
+            heapq.heappop(self._heap)
+
+        if len(self._heap) == 0:
+            if self._timer_hid is not None:
+                gobject.source_remove(self._timer_hid)
+                self._timer_hid = None
+                self._timer_deadline = None
+            return
+
+        deadline = self._heap[0][0]
+        if self._timer_hid is not None:
+            if self._timer_deadline == deadline:
+                return
+            gobject.source_remove(self._timer_hid)
+
+        delay = max(0, int((deadline - exact_time()) * 1000 + 0.5))
+        self._timer_deadline = deadline
+        self._timer_hid = gobject.timeout_add(delay, self._timer_cb)
+
+    def add(self, func, period, name=None, lockclass=None, pause=True,
+            args=()):
+        '''
+        Add a periodic task.
+
+        Input:
+            func (function): called as func(*args); returning False
+                removes the task (like gobject.timeout_add)
+            period (float): period in seconds
+            name (string): name used in the statistics
+            lockclass (string): run the task on the worker thread of this
+                instrument lock class instead of in the main loop
+            pause (bool): do not run the task during measurements
+            args (tuple): arguments to func
+
+        Output:
+            handle to use with remove() and set_period()
+        '''
+
+        if period <= 0:
+            raise ValueError('Period should be positive')
+        if name is None:
+            name = getattr(func, '__name__', 'task')
+
+        handle = self._next_handle
+        self._next_handle += 1
+        task = _Task(handle, func, period, name, lockclass, pause, args)
+        task.deadline = self._next_deadline(task.period, exact_time())
+        self._tasks[handle] = task
+        self._push(task)
+        self._reschedule()
+        return handle
+
+    def remove(self, handle):
+        '''Remove a task, returns False if it does not exist.'''
+        if handle not in self._tasks:
+            return False
+        del self._tasks[handle]
+        self._reschedule()
+        return True
+
+    def set_period(self, handle, period):
+        task = self._tasks[handle]
+        task.period = float(period)
+        task.deadline = self._next_deadline(task.period, exact_time())
+        self._push(task)
+        self._reschedule()
+
+    def get_period(self, handle):
+        return self._tasks[handle].period
+
+    def get_tasks(self):
+        return self._tasks.keys()
+
+    def _collect_job(self, task):
+        '''Process the result of a finished worker job.'''
+        job = task.job
+        task.job = None
+        task.add_runtime(job.t_end - job.t_start)
+        if job.error is not None:
+            logging.warning(__name__ + ' : task %s failed: %s',
+                task.name, job.error)
+        elif job.result is False:
+            self._tasks.pop(task.handle, None)
+
+    def _run_task(self, task):
+        if task.lockclass is None:
+            start = exact_time()
+            try:
+                ret = task.func(*task.args)
+            except Exception, e:
+                logging.warning(__name__ + ' : task %s failed: %s',
+                    task.name, e)
+                ret = None
+            task.add_runtime(exact_time() - start)
+            if ret is False:
+                self._tasks.pop(task.handle, None)
+            return
+
+        if task.job is not None:
+            if not task.job.done.isSet():
+                task.missed += 1
+                return
+            self._collect_job(task)
+            if task.handle not in self._tasks:
+                return
+
+        if task.lockclass not in self._workers:
+            self._workers[task.lockclass] = LockClassWorker(task.lockclass,
+                'periodic')
+        task.job = self._workers[task.lockclass].submit(task.func,
+                *task.args)
+
+    def _timer_cb(self):
+        self._timer_hid = None
+        self._timer_deadline = None
+
+        now = exact_time()
+        while len(self._heap) > 0 and \
+                self._heap[0][0] <= now + self._tolerance:
+            deadline, handle = heapq.heappop(self._heap)
+            task = self._tasks.get(handle, None)
+            if task is None or task.deadline != deadline:
+                continue
+
+            if task.pause and (self._measuring or self._paused):
+                pass
+            else:
+                late = now - deadline
+                if late > task.period:
+                    task.missed += int(late / task.period)
+                self._run_task(task)
+
+            if handle in self._tasks:
+                task.deadline = self._next_deadline(task.period,
+                    max(deadline, exact_time()))
+                self._push(task)
+
+        self._reschedule()
+        return False
+
+    def get_task_stats(self, handle):
+        '''
+        Return a dict with the period, lock class, number of runs, number
+        of missed deadlines and mean and max runtime (in seconds) of a task.
+        '''
+
+        task = self._tasks[handle]
+        if task.job is not None and task.job.done.isSet():
+            self._collect_job(task)
+        if task.runs > 0:
+            mean = task.total_time / task.runs
+        else:
+            mean = 0.0
+        return {
+            'name': task.name,
+            'period': task.period,
+            'lockclass': task.lockclass,
+            'runs': task.runs,
+            'missed': task.missed,
+            'mean_time': mean,
+            'max_time': task.max_time,
+        }
+
+    def get_stats(self):
+        '''Return a dict with the stats of all tasks, keyed by handle.'''
+        ret = {}
+        for handle in self._tasks.keys():
+            if handle in self._tasks:
+                ret[handle] = self.get_task_stats(handle)
+        return ret
+
+    def print_stats(self):
+        stats = self.get_stats()
+        handles = stats.keys()
+        handles.sort()
+        print '%-30s %8s %6s %6s %10s %10s' % \
+            ('task', 'period', 'runs', 'missed', 'mean (ms)', 'max (ms)')
+        for handle in handles:
+            st = stats[handle]
+            print '%-30s %8.3f %6d %6d %10.3f %10.3f' % (st['name'],
+                st['period'],
+                st['runs'], st['missed'], st['mean_time'] * 1000,
+                st['max_time'] * 1000)
+
+    def stop(self):
+        '''Remove all tasks and stop the worker threads.'''
+        self._tasks = {}
+        self._heap = []
+        self._reschedule()
+        for worker in self._workers.values():
+            worker.stop()
+        self._workers = {}
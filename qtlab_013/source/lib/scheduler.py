@@ -15,7 +15,6 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import gobject
 import types
 
 from qtflow import get_flowcontrol
@@ -25,10 +24,16 @@ class Scheduler():
     '''
     Schedule a certain task to run either periodically on a 'timeout', or
     when receiving a 'measurement-idle' signal (or both).
+
+    Periodic tasks are run by the periodic service of the flow control
+    (see lib.periodic), which runs all tasks from a single timer and pauses
+    them during measurements. If <lockclass> is specified the task is run
+    on the worker thread of that instrument lock class.
     '''
 
     def __init__(self, function, timeout=1, idle_mintime=1,
-                 timeout_mode=True, idle_mode=False, start=True):
+                 timeout_mode=True, idle_mode=False, start=True,
+                 lockclass=None):
         self._function = function
         self._flow = get_flowcontrol()
         self._timeout_mode = timeout_mode
@@ -40,76 +45,43 @@ class Scheduler():
         self._idle_lasttime = 0
 
         ## TIMEOUT SPECIFIC INIT
-        self._timer_hid = None
-        self._mstart_hid = None
-        self._mend_hid = None
+        self._task = None
         self._timeout = timeout
+        self._lockclass = lockclass
 
         if start is True:
             self.start()
 
     ### START CODE TIMEOUT MODE
 
-    def _measurement_connect(self):
-        if self._mstart_hid is None:
-            self._mstart_hid = self._flow.connect("measurement-start",
-                    self._measurement_start_cb)
-        if self._mend_hid is None:
-            self._mend_hid = self._flow.connect("measurement-end",
-                    self._measurement_end_cb)
-
-    def _measurement_disconnect(self):
-        if self._mstart_hid is not None:
-            self._flow.disconnect(self._mstart_hid)
-            self._mstart_hid = None
-        if self._mend_hid is not None:
-            self._flow.disconnect(self._mend_hid)
-            self._mend_hid = None
-
-    def _measurement_start_cb(self, widget):
-        self._stop_timeout()
-
-    def _measurement_end_cb(self, widget):
-        self._start_timeout()
-
     def _timeout_cb(self):
+        # The periodic service drops tasks that return False
         self._function()
         return True
 
     def _start_timeout(self):
-        if self._timer_hid is None:
-            self._timer_hid = gobject.timeout_add(int(self._timeout*1000),
-                    self._timeout_cb)
+        if self._task is None:
+            name = getattr(self._function, '__name__', 'scheduler')
+            self._task = self._flow.get_periodic_service().add(
+                    self._timeout_cb, self._timeout, name=name,
+                    lockclass=self._lockclass, pause=True)
         else:
             print 'timer already started'
 
-    def _start_timeout_and_connect(self):
-        meas_status = self._flow.get_status()
-        if (meas_status == 'stopped'):
-            self._start_timeout()
-            self._measurement_connect()
-        elif (meas_status == 'running'):
-            self._measurement_connect()
-
     def _stop_timeout(self):
-        if self._timer_hid is not None:
-            gobject.source_remove(self._timer_hid)
-            self._timer_hid = None
+        if self._task is not None:
+            self._flow.get_periodic_service().remove(self._task)
+            self._task = None
         else:
             print 'timer already stopped'
 
-    def _stop_timeout_and_disconnect(self):
-        self._stop_timeout()
-        self._measurement_disconnect()
-
     def set_timeout(self, timeout):
         '''
         Set the time interval for the periodic task.
         '''
         self._timeout = timeout
-        if self._timer_hid is not None:
-            self._stop_timeout()
-            self._start_timeout()
+        if self._task is not None:
+            self._flow.get_periodic_service().set_period(self._task, timeout)
 
     def get_timeout(self):
         '''
@@ -117,6 +89,14 @@ class Scheduler():
         '''
         return self._timeout
 
+    def get_stats(self):
+        '''
+        Get runtime and missed-deadline statistics of the periodic task.
+        '''
+        if self._task is None:
+            return None
+        return self._flow.get_periodic_service().get_task_stats(self._task)
+
     def set_timeout_mode(self, val, restart=True):
         '''
         (De)Activate timeout mode. If restart=True the scheduler will be
@@ -205,15 +185,15 @@ class Scheduler():
         if self._idle_mode:
             self._start_idle()
         if self._timeout_mode:
-            self._start_timeout_and_connect()
+            self._start_timeout()
 
     def stop(self):
         '''
         Stop the scheduled task. If running both in 'timeout' and 'idle' mode,
         then both will be stopped.
         '''
-        if self._timer_hid is not None:
-            self._stop_timeout_and_disconnect()
+        if self._task is not None:
+            self._stop_timeout()
         if self._idle_hid is not None:
             self._stop_idle()
 
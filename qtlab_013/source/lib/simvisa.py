@@ -0,0 +1,638 @@
+# simvisa.py, simulated VISA transport for testing and benchmarking drivers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Simulated VISA transport.
+
+This module can stand in for the 'visa' and 'pyvisa.vpp43' modules, so
+that unmodified drivers talk to a simulated device instead of a real one.
+Devices answer with scripted responses; latency, bandwidth and jitter of
+the connection are simulated so that the time spent in the driver, the
+transport and the rest of QTLab can be measured reproducibly.
+
+Usage:
+    from lib import simvisa
+    dev = simvisa.add_instrument('GPIB::8', latency=0.002, bandwidth=1e5)
+    dev.get_responder().add(r'OUTP\?(\d)', lambda m: '%e' % random())
+    simvisa.set_visa('sim')
+    lockin = qt.instruments.create('lockin', 'SRS_SR830', address='GPIB::8')
+    simvisa.print_stats()
+    simvisa.set_visa('pyvisa')
+
+Instruments can also be created with the 'visa' keyword argument, e.g.
+qt.instruments.create(..., visa='sim'), which selects the provider only
+while that instrument is created.
+
+Devices that are not added explicitly are created on first use with a
+SCPIResponder and the default timing, see set_defaults().
+'''
+
+import logging
+import random
+import re
+import sys
+import time
+import types
+
+from misc import exact_time
+
+class VisaIOError(Exception):
+    pass
+
+CR = '\r'
+LF = '\n'
+
+no_parity = 0
+odd_parity = 1
+even_parity = 2
+one_stop_bit = 10
+two_stop_bits = 20
+
+# interface types, as in VISA
+VI_INTF_GPIB = 1
+VI_INTF_ASRL = 4
+VI_INTF_TCPIP = 6
+VI_INTF_USB = 7
+
+class Responder(object):
+    '''
+    Base class for simulated devices. handle() gets the raw bytes written
+    to the device and returns the raw reply, which can be empty.
+    '''
+
+    def handle(self, data):
+        return ''
+
+    def get_latency(self, data):
+        '''Processing time for data, None for the transport default.'''
+        return None
+
+class SCPIResponder(Responder):
+    '''
+    Line based device. Commands are separated by ';' and terminated with
+    a newline. Replies to several queries in one message are joined with
+    ';', as SCPI instruments do.
+
+    Rules added with add() are tried first, in order. Without a matching
+    rule, 'HEADER value' stores value and 'HEADER?' returns the stored
+    value (or '0'), so settings read back what was written.
+    '''
+
+    def __init__(self, rules=None, termination='\n'):
+        self._rules = []
+        self._values = {}
+        self._termination = termination
+        if rules is not None:
+            for pattern, reply in rules:
+                self.add(pattern, reply)
+
+    def add(self, pattern, reply, latency=None):
+        '''
+        Add a rule.
+
+        Input:
+            pattern (string): regular expression, matched against the
+                whole command (case insensitive)
+            reply: string, optionally with %s formats for the groups, or a
+                function taking the match object. None for no reply.
+            latency (float): processing time of this command in seconds
+        '''
+        regex = re.compile(pattern + '$', re.IGNORECASE)
+        self._rules.append((regex, reply, latency))
+
+    def _key(self, header):
+        '''Key of a setting, the same for 'VOLT 1' and 'VOLT?'.'''
+        return header.strip().upper().rstrip('?')
+
+    def set_value(self, header, value):
+        self._values[self._key(header)] = str(value)
+
+    def get_value(self, header, default='0'):
+        return self._values.get(self._key(header), default)
+
+    def _split(self, data):
+        '''Every write is handled as a complete message.'''
+        cmds = re.split('[\r\n;]+', data)
+        return [c.strip() for c in cmds if c.strip() != '']
+
+    def _find_rule(self, cmd):
+        for regex, reply, latency in self._rules:
+            m = regex.match(cmd)
+            if m is not None:
+                return m, reply, latency
+        return None, None, None
+
+    def command(self, cmd):
+        '''Execute a single command, return the reply or None.'''
+        m, reply, latency = self._find_rule(cmd)
+        if m is not None:
+            if callable(reply):
+                reply = reply(m)
+            elif reply is not None and '%' in reply and m.groups():
+                reply = reply % m.groups()
+            if reply is None:
+                return None
+            return str(reply)
+
+        parts = cmd.split(None, 1)
+        header = parts[0].upper()
+        if '?' in header:
+            return self.get_value(cmd)
+        if len(parts) > 1:
+            self.set_value(header, parts[1])
+        return None
+
+    def handle(self, data):
+        replies = []
+        for cmd in self._split(data):
+            reply = self.command(cmd)
+            if reply is not None:
+                replies.append(reply)
+        if len(replies) == 0:
+            return ''
+        return ';'.join(replies) + self._termination
+
+    def get_latency(self, data):
+        total = None
+        for cmd in self._split(data):
+            m, reply, latency = self._find_rule(cmd)
+            if latency is not None:
+                total = (total or 0) + latency
+        return total
+
+class IVVIResponder(Responder):
+    '''
+    IVVI rack protocol: messages are [length, 0, reply length, command,
+    ...], command 1 sets a dac, command 2 reads all dacs.
+    '''
+
+    def __init__(self, numdacs=16):
+        self._dacs = [32768] * numdacs
+
+    def handle(self, data):
+        reply = ''
+        i = 0
+        while i < len(data):
+            n = ord(data[i])
+            msg = [ord(c) for c in data[i:i+n]]
+            i += n
+            if msg[3] == 1:
+                self._dacs[msg[4] - 1] = msg[5] * 256 + msg[6]
+                reply += chr(2) + chr(0)
+            elif msg[3] == 2:
+                reply += chr(msg[2]) + chr(0)
+                for val in self._dacs[:(msg[2] - 2) / 2]:
+                    reply += chr(val >> 8) + chr(val & 0xff)
+        return reply
+
+class Timing(object):
+    '''
+    Timing of a connection: a fixed latency per message, a bandwidth in
+    bytes / second and a random jitter (uniform between 0 and jitter
+    seconds). A seed makes the jitter reproducible.
+    '''
+
+    def __init__(self, latency=0.0, bandwidth=None, jitter=0.0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def transfer_time(self, nbytes):
+        if not self.bandwidth:
+            return 0.0
+        return float(nbytes) / self.bandwidth
+
+    def delay(self, nbytes, latency=None):
+        '''Time until a reply of nbytes is received.'''
+        if latency is None:
+            latency = self.latency
+        ret = latency + self.transfer_time(nbytes)
+        if self.jitter > 0:
+            ret += self._random.uniform(0, self.jitter)
+        return ret
+
+class SimDevice(object):
+    '''
+    Connection to a simulated device. Written data is handled by the
+    responder immediately, the reply becomes available after the delay
+    given by the timing.
+    '''
+
+    def __init__(self, address, responder=None, timing=None):
+        if responder is None:
+            responder = SCPIResponder()
+        if timing is None:
+            timing = Timing()
+        self._address = address
+        self._responder = responder
+        self._timing = timing
+        self._replies = []
+        self.reset_stats()
+
+    def get_address(self):
+        return self._address
+
+    def get_responder(self):
+        return self._responder
+
+    def get_timing(self):
+        return self._timing
+
+    def set_timing(self, latency=None, bandwidth=None, jitter=None):
+        if latency is not None:
+            self._timing.latency = latency
+        if bandwidth is not None:
+            self._timing.bandwidth = bandwidth
+        if jitter is not None:
+            self._timing.jitter = jitter
+
+    def reset_stats(self):
+        self._stats = {'writes': 0, 'reads': 0, 'bytes_written': 0,
+                'bytes_read': 0, 'wait_time': 0.0}
+
+    def get_stats(self):
+        '''
+        Return a dict with the number of writes and reads, the bytes
+        transferred and the time spent waiting for the device.
+        '''
+        return dict(self._stats)
+
+    def _sleep(self, dt):
+        if dt > 0:
+            self._stats['wait_time'] += dt
+            time.sleep(dt)
+
+    def write(self, data):
+        self._stats['writes'] += 1
+        self._stats['bytes_written'] += len(data)
+        # Sending takes time too
+        self._sleep(self._timing.transfer_time(len(data)))
+        reply = self._responder.handle(data)
+        if reply:
+            delay = self._timing.delay(len(reply),
+                    self._responder.get_latency(data))
+            self._replies.append([exact_time() + delay, reply])
+
+    def get_navail(self):
+        '''Number of bytes received so far.'''
+        now = exact_time()
+        n = 0
+        for ready, reply in self._replies:
+            if ready > now:
+                break
+            n += len(reply)
+        return n
+
+    def clear(self):
+        self._replies = []
+
+    def read(self, n=None, timeout=None):
+        '''
+        Read up to n bytes (one reply if n is None), waiting for the
+        reply to arrive. Raises VisaIOError after timeout seconds.
+        '''
+        self._stats['reads'] += 1
+        if n == 0:
+            return ''
+        if len(self._replies) == 0:
+            if timeout is not None:
+                self._sleep(timeout)
+            raise VisaIOError('Timeout expired before operation completed')
+
+        ready, reply = self._replies[0]
+        self._sleep(ready - exact_time())
+        if n is None or n >= len(reply):
+            self._replies.pop(0)
+            if n is not None and n > len(reply) and len(self._replies) > 0:
+                # Read on into the next reply, like a serial port would
+                return reply + self.read(n - len(reply), timeout)
+        else:
+            reply, self._replies[0][1] = reply[:n], reply[n:]
+        self._stats['bytes_read'] += len(reply)
+        return reply
+
+_defaults = {'latency': 0.0, 'bandwidth': None, 'jitter': 0.0, 'seed': None}
+_devices = {}
+
+def set_defaults(**kwargs):
+    '''Set the default latency, bandwidth, jitter and seed.'''
+    for key in kwargs:
+        if key not in _defaults:
+            raise ValueError('Unknown timing parameter %s' % key)
+    _defaults.update(kwargs)
+
+def add_instrument(address, responder=None, latency=None, bandwidth=None,
+        jitter=None, seed=None):
+    '''
+    Add a simulated device at address, replacing an existing one.
+    Parameters that are not given are taken from the defaults.
+
+    Output:
+        SimDevice
+    '''
+    timing = dict(_defaults)
+    for key, val in (('latency', latency), ('bandwidth', bandwidth),
+            ('jitter', jitter), ('seed', seed)):
+        if val is not None:
+            timing[key] = val
+    dev = SimDevice(address, responder, Timing(**timing))
+    _devices[address.upper()] = dev
+    return dev
+
+def get_instrument(address):
+    '''Return the SimDevice at address, creating it if necessary.'''
+    dev = _devices.get(address.upper(), None)
+    if dev is None:
+        logging.info(__name__ + ' : creating default device at %s', address)
+        dev = add_instrument(address)
+    return dev
+
+def remove_instrument(address):
+    _devices.pop(address.upper(), None)
+
+def get_stats():
+    '''Return the stats of all devices, keyed by address.'''
+    ret = {}
+    for dev in _devices.values():
+        ret[dev.get_address()] = dev.get_stats()
+    return ret
+
+def reset_stats():
+    for dev in _devices.values():
+        dev.reset_stats()
+
+def print_stats():
+    stats = get_stats()
+    addresses = stats.keys()
+    addresses.sort()
+    print '%-25s %8s %8s %10s %10s %10s' % ('address', 'writes', 'reads',
+        'bytes out', 'bytes in', 'wait (s)')
+    for address in addresses:
+        st = stats[address]
+        print '%-25s %8d %8d %10d %10d %10.3f' % (address, st['writes'],
+            st['reads'], st['bytes_written'], st['bytes_read'],
+            st['wait_time'])
+
+def _interface_type(address):
+    address = address.upper()
+    if address.startswith('ASRL') or address.startswith('COM'):
+        return VI_INTF_ASRL
+    if address.startswith('TCPIP'):
+        return VI_INTF_TCPIP
+    if address.startswith('USB'):
+        return VI_INTF_USB
+    return VI_INTF_GPIB
+
+class Instrument(object):
+    '''
+    Simulated version of the pyvisa Instrument class.
+    '''
+
+    def __init__(self, resource_name, timeout=5, term_chars=None,
+            chunk_size=20*1024, delay=0.0, send_end=True, values_format=None,
+            **kwargs):
+        self.resource_name = resource_name
+        self.timeout = timeout
+        self.term_chars = term_chars
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.send_end = send_end
+        self.values_format = values_format
+        self.interface_type = _interface_type(resource_name)
+        self.baud_rate = kwargs.get('baud_rate', 9600)
+        self.data_bits = kwargs.get('data_bits', 8)
+        self.stop_bits = kwargs.get('stop_bits', 1)
+        self.parity = kwargs.get('parity', no_parity)
+        self._device = get_instrument(resource_name)
+        self.vi = vpp43._register(self._device)
+
+    def __repr__(self):
+        return 'SimInstrument("%s")' % self.resource_name
+
+    def get_device(self):
+        return self._device
+
+    def write_raw(self, message):
+        self._device.write(message)
+
+    def write(self, message):
+        if self.term_chars is None:
+            term = '\n'
+        else:
+            term = self.term_chars
+        if not message.endswith(term):
+            message += term
+        self._device.write(message)
+
+    def read_raw(self):
+        return self._device.read(timeout=self.timeout)
+
+    def read(self):
+        reply = self.read_raw()
+        if self.term_chars and reply.endswith(self.term_chars):
+            return reply[:-len(self.term_chars)]
+        return reply.rstrip('\r\n')
+
+    def ask(self, message):
+        self.write(message)
+        if self.delay > 0:
+            time.sleep(self.delay)
+        return self.read()
+
+    def read_values(self, format=None):
+        return [float(v) for v in self.read().split(',') if v.strip() != '']
+
+    def ask_for_values(self, message, format=None):
+        self.write(message)
+        if self.delay > 0:
+            time.sleep(self.delay)
+        return self.read_values(format)
+
+    def clear(self):
+        self._device.clear()
+
+    def trigger(self):
+        self.write('*TRG')
+
+    def close(self):
+        vpp43.close(self.vi)
+
+class GpibInstrument(Instrument):
+    pass
+
+class SerialInstrument(Instrument):
+    pass
+
+def instrument(resource_name, **kwargs):
+    if _interface_type(resource_name) == VI_INTF_ASRL:
+        return SerialInstrument(resource_name, **kwargs)
+    return GpibInstrument(resource_name, **kwargs)
+
+class _ResourceManager(object):
+
+    def list_resources(self, query=None):
+        return [dev.get_address() for dev in _devices.values()]
+
+    def get_instrument(self, resource_name, **kwargs):
+        return instrument(resource_name, **kwargs)
+
+resource_manager = _ResourceManager()
+
+class _Vpp43(object):
+    '''
+    Simulated version of the pyvisa.vpp43 module, for drivers that use
+    the low level functions (mostly serial devices).
+    '''
+
+    VI_ATTR_ASRL_AVAIL_NUM = 0x3FFF00AC
+    VI_ATTR_ASRL_BAUD = 0x3FFF0021
+    VI_ATTR_ASRL_DATA_BITS = 0x3FFF0022
+    VI_ATTR_ASRL_PARITY = 0x3FFF0023
+    VI_ATTR_ASRL_STOP_BITS = 0x3FFF0024
+    VI_ATTR_ASRL_END_IN = 0x3FFF00B3
+    VI_ATTR_TMO_VALUE = 0x3FFF001A
+    VI_ASRL_STOP_ONE = 10
+    VI_ASRL_STOP_TWO = 20
+    VI_ASRL_PAR_NONE = 0
+    VI_ASRL_PAR_ODD = 1
+    VI_ASRL_PAR_EVEN = 2
+    VI_ASRL_END_NONE = 0
+
+    def __init__(self):
+        self._sessions = {}
+        self._attributes = {}
+        # Away from the session numbers of a real VISA library, see
+        # _Vpp43Router
+        self._next_vi = 0x53490001
+
+    def _register(self, device):
+        vi = self._next_vi
+        self._next_vi += 1
+        self._sessions[vi] = device
+        self._attributes[vi] = {self.VI_ATTR_TMO_VALUE: 2000}
+        return vi
+
+    def has_session(self, vi):
+        return vi in self._sessions
+
+    def _get_device(self, vi):
+        if vi not in self._sessions:
+            raise VisaIOError('Invalid session %r' % vi)
+        return self._sessions[vi]
+
+    def open_default_resource_manager(self):
+        return 0
+
+    def open(self, session, resource_name, *args):
+        return self._register(get_instrument(resource_name))
+
+    def close(self, vi):
+        self._sessions.pop(vi, None)
+        self._attributes.pop(vi, None)
+
+    def set_attribute(self, vi, attribute, value):
+        self._get_device(vi)
+        self._attributes[vi][attribute] = value
+        if attribute == self.VI_ATTR_ASRL_BAUD:
+            # 10 bits per byte, with start and stop bit
+            self._sessions[vi].set_timing(bandwidth=value / 10.0)
+
+    def get_attribute(self, vi, attribute):
+        dev = self._get_device(vi)
+        if attribute == self.VI_ATTR_ASRL_AVAIL_NUM:
+            return dev.get_navail()
+        return self._attributes[vi].get(attribute, 0)
+
+    def write(self, vi, message):
+        self._get_device(vi).write(message)
+        return len(message)
+
+    def read(self, vi, count):
+        timeout = self._attributes[vi][self.VI_ATTR_TMO_VALUE] / 1000.0
+        return self._get_device(vi).read(count, timeout)
+
+    def clear(self, vi):
+        self._get_device(vi).clear()
+
+vpp43 = _Vpp43()
+
+class _Vpp43Router(object):
+    '''
+    Stand-in for the vpp43 module in lib/visafunc.py, which is shared by
+    all drivers. Calls for simulated sessions go to the simulated vpp43
+    and all other calls to the real one, so simulated and real instruments
+    can be used side by side.
+    '''
+
+    def __init__(self, real):
+        self._real = real
+
+    def __getattr__(self, name):
+        if not hasattr(vpp43, name):
+            return getattr(self._real, name)
+        func = getattr(vpp43, name)
+        if not callable(func):
+            return func
+
+        def call(vi, *args):
+            if self._real is None or vpp43.has_session(vi):
+                return func(vi, *args)
+            return getattr(self._real, name)(vi, *args)
+        return call
+
+_provider = 'pyvisa'
+_saved_modules = {}
+
+def get_visa():
+    return _provider
+
+def set_visa(provider):
+    '''
+    Select the VISA provider used by drivers that are loaded after this
+    call: 'pyvisa' for real instruments or 'sim' for simulated ones.
+    Drivers are reloaded by qt.instruments.create(), so the choice applies
+    to instruments created afterwards. Instruments keep the provider they
+    were created with; lib/visafunc.py handles both.
+    '''
+
+    global _provider
+    if provider not in ('pyvisa', 'sim'):
+        raise ValueError('Unknown VISA provider %s' % provider)
+    if provider == _provider:
+        return
+
+    import visafunc
+    if provider == 'sim':
+        for name in ('visa', 'pyvisa', 'pyvisa.vpp43'):
+            _saved_modules[name] = sys.modules.get(name, None)
+        pyvisa = types.ModuleType('pyvisa')
+        pyvisa.vpp43 = vpp43
+        sys.modules['visa'] = sys.modules[__name__]
+        sys.modules['pyvisa'] = pyvisa
+        sys.modules['pyvisa.vpp43'] = vpp43
+        if not isinstance(getattr(visafunc, 'vpp43', None), _Vpp43Router):
+            visafunc.vpp43 = _Vpp43Router(getattr(visafunc, 'vpp43', None))
+    else:
+        for name in ('visa', 'pyvisa', 'pyvisa.vpp43'):
+            mod = _saved_modules.pop(name, None)
+            if mod is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = mod
+
+    logging.info(__name__ + ' : using VISA provider %s', provider)
+    _provider = provider
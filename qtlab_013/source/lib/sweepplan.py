@@ -0,0 +1,458 @@
+# sweepplan.py, compiled coordinate plans for nested sweeps
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import time
+import numpy as np
+
+def axis_values(start, end, steps=None, stepsize=None):
+    '''
+    Return the values of a linear sweep axis.
+
+    Input:
+        start (float): first value
+        end (float): last value
+        steps (int) or stepsize (float): number of points or the distance
+            between points. With stepsize the end value is included if it
+            lies on the grid.
+
+    Output:
+        numpy array of floats
+    '''
+
+    start = float(start)
+    end = float(end)
+    if steps is not None:
+        if steps < 1:
+            raise ValueError('Number of steps should be at least 1')
+        return np.linspace(start, end, int(steps))
+
+    if stepsize is None or stepsize == 0:
+        raise ValueError('axis_values() requires steps or a non-zero stepsize')
+
+    stepsize = float(np.copysign(abs(stepsize), end - start))
+    nsteps = int(np.floor((end - start) / stepsize + 1e-9)) + 1
+    return start + np.arange(nsteps) * stepsize
+
+def _index_dtype(maxsize):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if maxsize <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+def _serpentine_flags(serpentine, ndim):
+    if serpentine in (True, False, None):
+        return [bool(serpentine)] * ndim
+    flags = [bool(f) for f in serpentine]
+    if len(flags) != ndim:
+        raise ValueError('Need a serpentine flag for every axis')
+    return flags
+
+class SweepPlan(object):
+    '''
+    A nested sweep compiled into numpy arrays. Axis 0 is the fastest
+    (inner) axis, as in the column order of Data files.
+
+    For every point the plan holds the index along each axis and a bit
+    mask of the axes that change when stepping to that point, so a
+    measurement loop only has to touch the axes that actually change.
+
+    With serpentine=True every axis reverses direction after each pass
+    (boustrophedon order), so exactly one axis changes per step. A list
+    of flags makes only some axes serpentine. loop_order changes the
+    nesting of the loops, e.g. loop_order=(1, 0) makes axis 1 the fast
+    loop; the axis numbers, and so the canonical (Data) order of the
+    points, stay the same.
+    '''
+
+    def __init__(self, axes, serpentine=False, loop_order=None):
+        '''
+        Input:
+            axes (list of arrays): values of each axis, fastest axis first
+            serpentine (bool or list of bools): sweep back and forth
+            loop_order (list of ints): axes from the fastest to the
+                slowest loop, default is the axis order
+        '''
+
+        if len(axes) == 0:
+            raise ValueError('SweepPlan needs at least one axis')
+        if len(axes) > 32:
+            raise ValueError('SweepPlan supports at most 32 axes')
+
+        self._values = [np.atleast_1d(np.asarray(v, dtype=np.float64))
+                for v in axes]
+        self._shape = tuple([len(v) for v in self._values])
+        if 0 in self._shape:
+            raise ValueError('SweepPlan axes should not be empty')
+
+        ndim = len(self._shape)
+        if loop_order is None:
+            loop_order = range(ndim)
+        if sorted(loop_order) != range(ndim):
+            raise ValueError('loop_order should be a permutation of the axes')
+        self._loop_order = tuple(loop_order)
+        self._serpentine = _serpentine_flags(serpentine, ndim)
+
+        self._npoints = int(np.prod(self._shape, dtype=np.int64))
+        self._strides = np.cumprod((1,) + self._shape[:-1], dtype=np.int64)
+        self._axes_cache = {}
+        self._compile()
+
+    def _compile(self):
+        n = self._npoints
+        ndim = len(self._shape)
+
+        self._index = np.empty((n, ndim), dtype=_index_dtype(max(self._shape)))
+        it = np.arange(n, dtype=np.int64)
+        period = 1
+        for k in self._loop_order:
+            size = self._shape[k]
+            digit = it // period
+            if self._serpentine[k]:
+                odd = (digit // size) & 1
+                digit %= size
+                digit += odd * (size - 1 - 2 * digit)
+            else:
+                digit %= size
+            self._index[:, k] = digit
+            period *= size
+        del it
+
+        if ndim <= 8:
+            maskdtype = np.uint8
+        else:
+            maskdtype = np.uint32
+        self._changed = np.zeros(n, dtype=maskdtype)
+        self._changed[0] = (1 << ndim) - 1
+        for k in range(ndim):
+            col = self._index[:, k]
+            diff = (col[1:] != col[:-1]).astype(maskdtype)
+            diff <<= k
+            self._changed[1:] |= diff
+
+        # A new data block starts when any axis but the fastest changes
+        fastmask = 1 << self._loop_order[0]
+        self._newblock = np.zeros(n, dtype=np.bool_)
+        self._newblock[:-1] = (self._changed[1:] & ~fastmask) != 0
+        self._block_ends = np.flatnonzero(self._newblock)
+
+    def is_canonical(self):
+        '''Whether the points are measured in canonical (Data) order.'''
+        if self._loop_order != tuple(range(len(self._shape))):
+            return False
+        for k in range(len(self._shape) - 1):
+            if self._serpentine[k] and self._shape[k] > 1:
+                return False
+        return True
+
+    def get_loop_order(self):
+        return self._loop_order
+
+    def get_serpentine(self):
+        return list(self._serpentine)
+
+    def get_canonical_index(self, i):
+        '''Return the position of point i in canonical order.'''
+        return int(np.dot(self._index[i].astype(np.int64), self._strides))
+
+    def canonical_to_index(self, c):
+        '''Return the axis indices of canonical position c.'''
+        return [int(c // st) % size for st, size in \
+                zip(self._strides, self._shape)]
+
+    def __len__(self):
+        return self._npoints
+
+    def get_npoints(self):
+        return self._npoints
+
+    def get_shape(self):
+        '''Return the number of points per axis, fastest axis first.'''
+        return self._shape
+
+    def get_ndimensions(self):
+        return len(self._shape)
+
+    def get_axis_values(self, axis):
+        return self._values[axis]
+
+    def get_axis_info(self, axis):
+        '''Return size, start and end of an axis as Data metadata.'''
+        vals = self._values[axis]
+        return {
+            'size': len(vals),
+            'start': float(vals[0]),
+            'end': float(vals[-1]),
+        }
+
+    def get_index(self, i):
+        '''Return the index along every axis of point i.'''
+        return self._index[i].tolist()
+
+    def get_coords(self, i):
+        '''Return the coordinates of point i.'''
+        idx = self._index[i]
+        return [float(self._values[k][idx[k]]) for k in range(len(idx))]
+
+    def get_coord(self, i, axis):
+        return float(self._values[axis][self._index[i, axis]])
+
+    def get_changed_axes(self, i):
+        '''Return the axes that change when stepping to point i.'''
+        mask = int(self._changed[i])
+        axes = self._axes_cache.get(mask, None)
+        if axes is None:
+            axes = tuple([k for k in range(len(self._shape)) \
+                    if mask & (1 << k)])
+            self._axes_cache[mask] = axes
+        return axes
+
+    def is_block_end(self, i):
+        '''Whether a new data block starts after point i.'''
+        return bool(self._newblock[i])
+
+    def get_block_ends(self):
+        '''Return the indices of the last point of every block but the last.'''
+        return self._block_ends
+
+    def get_indices(self, start=0, stop=None):
+        '''Return the (npoints, naxes) index array, or a slice of it.'''
+        return self._index[start:stop]
+
+    def get_coordinates(self, start=0, stop=None):
+        '''Return the coordinates of a range of points as a 2d array.'''
+        idx = self._index[start:stop]
+        coords = np.empty(idx.shape, dtype=np.float64)
+        for k in range(len(self._shape)):
+            coords[:, k] = self._values[k][idx[:, k]]
+        return coords
+
+    def get_changed_masks(self):
+        '''Return the bit masks of changed axes for every point.'''
+        return self._changed
+
+def ramp_cost(options):
+    '''
+    Return a function that estimates the dead time (in seconds) spent
+    ramping a parameter by a given amount, from the 'maxstep' and
+    'stepdelay' (ms) or 'rate' (units / s) parameter options as used by
+    Instrument.set(). Returns None when the parameter is not rate limited.
+    '''
+
+    if options is None:
+        return None
+
+    maxstep = options.get('maxstep', None)
+    if maxstep is not None and maxstep > 0:
+        stepdelay = options.get('stepdelay', 50) / 1000.0
+        def cost(delta):
+            nsteps = np.ceil(np.abs(delta) / float(maxstep))
+            return np.maximum(nsteps - 1, 0) * stepdelay
+        return cost
+
+    rate = options.get('rate', None)
+    if rate is not None and rate > 0:
+        def cost(delta):
+            return np.abs(delta) / float(rate)
+        return cost
+
+    return None
+
+def estimate_dead_time(axes, costs, serpentine=False, loop_order=None):
+    '''
+    Estimate the total ramp time of a sweep without compiling it.
+
+    Input:
+        axes (list of arrays): values of each axis, fastest first
+        costs (list): per axis a function as returned by ramp_cost(), or
+            None for axes that can be set immediately
+        serpentine (bool or list of bools): as for SweepPlan
+        loop_order (list of ints): as for SweepPlan
+
+    Output:
+        estimated dead time in seconds
+    '''
+
+    ndim = len(axes)
+    if loop_order is None:
+        loop_order = range(ndim)
+    flags = _serpentine_flags(serpentine, ndim)
+    sizes = [len(a) for a in axes]
+    total = 0.0
+    period = 1
+    npoints = int(np.prod(sizes))
+    for k in loop_order:
+        vals = np.asarray(axes[k], dtype=np.float64)
+        period *= sizes[k]
+        cost = costs[k]
+        if cost is None or len(vals) < 2:
+            continue
+
+        # Every pass ramps through all values; between passes a raster
+        # axis flies back to its first value, a serpentine one stays.
+        passes = npoints / period
+        total += passes * float(np.sum(cost(np.diff(vals))))
+        if not flags[k]:
+            total += (passes - 1) * float(cost(vals[-1] - vals[0]))
+
+    return total
+
+def _permutations(items):
+    if len(items) <= 1:
+        yield list(items)
+        return
+    for i in range(len(items)):
+        for rest in _permutations(items[:i] + items[i+1:]):
+            yield [items[i]] + rest
+
+def choose_order(axes, costs, reorder=False):
+    '''
+    Pick the sweep ordering with the lowest estimated dead time. Every
+    combination of raster and serpentine axes is considered, with
+    reorder=True also every nesting of the loops. On equal cost the
+    canonical order without serpentine axes is preferred.
+
+    Output:
+        dict with keys 'serpentine', 'loop_order' and 'dead_time'
+    '''
+
+    ndim = len(axes)
+    if reorder:
+        orders = list(_permutations(range(ndim)))
+    else:
+        orders = [range(ndim)]
+
+    best = None
+    for order in orders:
+        # The direction of the slowest loop does not matter
+        free = order[:-1]
+        for bits in range(1 << len(free)):
+            flags = [False] * ndim
+            for j, k in enumerate(free):
+                flags[k] = bool(bits & (1 << j))
+            t = estimate_dead_time(axes, costs, flags, order)
+            if best is None or t < best['dead_time'] - 1e-9:
+                best = {
+                    'serpentine': flags,
+                    'loop_order': order,
+                    'dead_time': t,
+                }
+
+    return best
+
+class CanonicalWriter(object):
+    '''
+    Adds the points of a SweepPlan to a Data object in canonical order,
+    whatever the order in which they are measured. Points that arrive
+    early are kept until all points before them are known, so a
+    serpentine sweep buffers at most one pass of its slower axes.
+    '''
+
+    def __init__(self, data, plan):
+        self._data = data
+        self._plan = plan
+        self._pending = {}
+        self._next = 0
+        self._passthrough = plan.is_canonical()
+
+    def add(self, i, values, coords=None):
+        '''
+        Add the values measured at point i of the plan. coords, if given,
+        are written instead of the plan coordinates.
+
+        Output:
+            number of points written to the data object
+        '''
+
+        plan = self._plan
+        if self._passthrough:
+            if coords is None:
+                coords = plan.get_coords(i)
+            self._write(i, coords, values)
+            return 1
+
+        c = plan.get_canonical_index(i)
+        self._pending[c] = (coords, values)
+        n = 0
+        while self._next in self._pending:
+            coords, values = self._pending.pop(self._next)
+            self._write_canonical(self._next, coords, values)
+            self._next += 1
+            n += 1
+        return n
+
+    def _write(self, i, coords, values):
+        cols = list(coords) + list(values)
+        self._data.add_data_point(*cols,
+            **{'newblock': self._plan.is_block_end(i)})
+
+    def _write_canonical(self, c, coords, values):
+        plan = self._plan
+        index = plan.canonical_to_index(c)
+        if coords is None:
+            coords = [float(plan.get_axis_values(k)[index[k]]) \
+                    for k in range(len(index))]
+        newblock = index[0] == plan.get_shape()[0] - 1 and \
+                c != plan.get_npoints() - 1
+        cols = list(coords) + list(values)
+        self._data.add_data_point(*cols, **{'newblock': newblock})
+
+    def get_npending(self):
+        return len(self._pending)
+
+    def flush(self):
+        '''
+        Write the points that are still kept back, in canonical order.
+        Only needed when a measurement stops before it is complete.
+        '''
+        for c in sorted(self._pending.keys()):
+            coords, values = self._pending.pop(c)
+            self._write_canonical(c, coords, values)
+        self._next = self._plan.get_npoints()
+
+def benchmark(shape=(1000, 100, 100), serpentine=False, repeat=3):
+    '''
+    Time the compilation of a plan with the given shape (default a 3D
+    grid of 10^7 points) and the per point overhead of stepping through it.
+    '''
+
+    axes = [np.linspace(0, 1, n) for n in shape]
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        plan = SweepPlan(axes, serpentine=serpentine)
+        dt = time.time() - start
+        if best is None or dt < best:
+            best = dt
+
+    nstep = min(plan.get_npoints(), 100000)
+    start = time.time()
+    for i in xrange(nstep):
+        for axis in plan.get_changed_axes(i):
+            plan.get_coord(i, axis)
+        plan.is_block_end(i)
+    steptime = (time.time() - start) / nstep
+
+    print 'Plan %s (%d points, serpentine=%s)' % \
+        (shape, plan.get_npoints(), serpentine)
+    print '  compile: %.3f s' % best
+    print '  memory: %.1f MB' % ((plan._index.nbytes + plan._changed.nbytes +
+        plan._newblock.nbytes) / 1e6)
+    print '  per point: %.2f us' % (steptime * 1e6)
+    return best, steptime
+
+if __name__ == '__main__':
+    benchmark()
+    benchmark(serpentine=True)
@@ -18,6 +18,8 @@
 import time
 import logging
 import warnings
+import struct
+import numpy as np
 
 try:
     from visa import *
@@ -70,3 +72,153 @@ def read_all(visains):
 
     return buf
 
+
+def block_size(data):
+    '''
+    Return the total size in bytes (header included) of the binary block
+    at the start of data, None if the header is not complete yet or -1 for
+    an indefinite length block.
+
+    Supported are IEEE 488.2 definite length blocks ('#<n><length>'),
+    indefinite length blocks ('#0') and HP FORM2/3 blocks ('#A' followed
+    by a 2 byte big endian length).
+    '''
+
+    if len(data) < 2:
+        return None
+    if data[0] != '#':
+        raise ValueError('Not a binary block: %r' % data[:10])
+
+    if data[1] == 'A':
+        if len(data) < 4:
+            return None
+        return 4 + struct.unpack('>H', data[2:4])[0]
+
+    ndigits = int(data[1])
+    if ndigits == 0:
+        return -1
+    if len(data) < 2 + ndigits:
+        return None
+    return 2 + ndigits + int(data[2:2+ndigits])
+
+def parse_block(data, nbytes=None):
+    '''
+    Return the payload of the binary block at the start of data.
+
+    The length of an indefinite length block is not known; if nbytes is
+    given that many bytes are returned, otherwise everything up to the
+    final termination.
+    '''
+
+    size = block_size(data)
+    if size is None:
+        raise ValueError('Incomplete block header')
+    if size == -1:
+        if nbytes is not None:
+            if len(data) < 2 + nbytes:
+                raise ValueError('Incomplete block, %d of %d bytes' % \
+                        (len(data), 2 + nbytes))
+            return data[2:2+nbytes]
+        if data.endswith('\r\n'):
+            return data[2:-2]
+        elif data.endswith('\n'):
+            return data[2:-1]
+        return data[2:]
+
+    if data[1] == 'A':
+        start = 4
+    else:
+        start = 2 + int(data[1])
+    if len(data) < size:
+        raise ValueError('Incomplete block, %d of %d bytes' % \
+                (len(data), size))
+    return data[start:size]
+
+def read_block(read_func, nbytes=None, maxtries=1000):
+    '''
+    Read a complete binary block by calling read_func() (for example the
+    read_raw method of a visa instrument or the recv method of a socket)
+    until all data has arrived. A read can return early when the
+    termination character occurs in the binary data, or when the
+    transfer is split in chunks.
+
+    Input:
+        read_func (function)
+        nbytes (int): expected payload size. Only used for indefinite
+            length blocks, which are otherwise assumed to be complete
+            after the first read.
+        maxtries (int): maximum number of reads
+
+    Output:
+        payload (string)
+    '''
+
+    buf = ''
+    for i in range(maxtries):
+        # Skip a termination left over from a previous reply
+        buf = (buf + read_func()).lstrip('\r\n')
+        size = block_size(buf)
+        if size == -1:
+            if nbytes is None or len(buf) >= 2 + nbytes:
+                return parse_block(buf, nbytes)
+        elif size is not None and len(buf) >= size:
+            return parse_block(buf)
+
+    raise ValueError('Incomplete block after %d reads' % maxtries)
+
+def decode_values(payload, dtype='<f4'):
+    '''
+    Convert the payload of a binary block to a float64 numpy array.
+
+    Input:
+        payload (string)
+        dtype (string): numpy dtype of the data, e.g. '<f4' for little
+            endian REAL,32 or '>f8' for big endian REAL,64
+    '''
+
+    dtype = np.dtype(dtype)
+    n = len(payload) // dtype.itemsize
+    return np.frombuffer(payload, dtype=dtype, count=n).astype(np.float64)
+
+def parse_ascii_values(data, sep=','):
+    '''
+    Convert a separated list of numbers to a float64 numpy array. A
+    binary block header in front of the list (as some instruments send
+    even in ASCII mode) is skipped.
+    '''
+
+    if data.startswith('#'):
+        if data[1] == 'A':
+            data = data[4:]
+        else:
+            data = data[2+int(data[1]):]
+    return np.fromstring(data.strip(), dtype=np.float64, sep=sep)
+
+def read_binary_values(visains, cmd, dtype='<f4', count=None):
+    '''
+    Send query cmd to visains and read the reply as a binary block.
+
+    Input:
+        visains: visa instrument (needs write() and read_raw())
+        cmd (string): query
+        dtype (string): data type, see decode_values()
+        count (int): number of values expected, needed for instruments
+            that send indefinite length ('#0') blocks
+
+    Output:
+        values (numpy array)
+    '''
+
+    if count is not None:
+        nbytes = count * np.dtype(dtype).itemsize
+    else:
+        nbytes = None
+    visains.write(cmd)
+    return decode_values(read_block(visains.read_raw, nbytes), dtype)
+
+def read_ascii_values(visains, cmd, sep=','):
+    '''
+    Send query cmd to visains and parse the reply as a list of numbers.
+    '''
+
+    return parse_ascii_values(visains.ask(cmd), sep)
@@ -0,0 +1,284 @@
+# wait.py, wait for an instrument to reach a condition
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Wait until an instrument reaches a target, such as a magnet ramping to
+a field or a stage moving to a position, without polling at a fixed
+rate.
+
+The poll interval is adapted to the observed rate of change: when the
+target is still far away the next poll is scheduled at a fraction of the
+predicted arrival time, close to the target it is polled at the base
+interval. When the value does not change the interval backs off, and it
+is never shorter than a few times the duration of a poll, so slow
+devices are not kept busy. The time in between is spent in qt.msleep(),
+which keeps the GUI responsive and allows aborting the measurement.
+
+Usage:
+    wait_until(ips.get_field, 1.5, 1e-5, timeout=3600)
+    wait_until(esp.get_ismoving, False)
+
+    # Or without blocking, to do other work in the mean time:
+    w = Waiter((ins, 'position'), 10.0, 0.001)
+    while not w.check():
+        do_something_else()
+
+The total time waited and the number of polls saved compared to polling
+at the base interval are recorded, see get_wait_stats().
+'''
+
+import logging
+import numbers
+
+from misc import exact_time
+
+class WaitTimeout(Exception):
+    pass
+
+_stats = {}
+
+def _add_stats(name, waited, polls, fixed_polls):
+    if name not in _stats:
+        _stats[name] = {'waits': 0, 'time': 0.0, 'polls': 0,
+                'polls_saved': 0}
+    st = _stats[name]
+    st['waits'] += 1
+    st['time'] += waited
+    st['polls'] += polls
+    st['polls_saved'] += max(0, fixed_polls - polls)
+
+def get_wait_stats():
+    '''
+    Return a dict, keyed by name, with the number of waits, the total
+    time waited (seconds), the number of polls and the number of polls
+    saved compared to polling at the base interval.
+    '''
+    ret = {}
+    for name, st in _stats.iteritems():
+        ret[name] = dict(st)
+    return ret
+
+def reset_wait_stats():
+    _stats.clear()
+
+def print_wait_stats():
+    names = _stats.keys()
+    names.sort()
+    print '%-30s %6s %10s %8s %8s' % \
+        ('name', 'waits', 'time (s)', 'polls', 'saved')
+    for name in names:
+        st = _stats[name]
+        print '%-30s %6d %10.1f %8d %8d' % (name, st['waits'], st['time'],
+            st['polls'], st['polls_saved'])
+
+def _make_getter(param):
+    '''Return (function, name) for a function or (instrument, parameter).'''
+    if type(param) is tuple:
+        ins, parname = param
+        func = lambda: ins.get(parname)
+        return func, '%s.%s' % (ins.get_name(), parname)
+    name = getattr(param, '__name__', 'wait')
+    ins = getattr(param, 'im_self', None)
+    if ins is not None and hasattr(ins, 'get_name'):
+        name = '%s.%s' % (ins.get_name(), name)
+    return param, name
+
+class Waiter(object):
+    '''
+    Non-blocking wait for a condition, see wait_until().
+    '''
+
+    def __init__(self, param, target=True, tolerance=0, timeout=None,
+            interval=0.1, max_interval=10.0, stable=0, name=None):
+        '''
+        Input:
+            param (function or (instrument, parameter name)): returns the
+                current value
+            target: value to reach. For numbers the condition is
+                abs(value - target) <= tolerance, otherwise value == target
+            tolerance (float)
+            timeout (float): seconds, None for no limit
+            interval (float): base poll interval, used near the target
+            max_interval (float): longest poll interval
+            stable (float): the condition should hold for this many
+                seconds
+            name (string): name used in the statistics
+        '''
+
+        self._get, defname = _make_getter(param)
+        if name is None:
+            name = defname
+        self._name = name
+        self._target = target
+        self._tolerance = tolerance
+        self._timeout = timeout
+        self._interval = interval
+        self._max_interval = max(interval, max_interval)
+        self._stable = stable
+
+        self._start = exact_time()
+        self._next_poll = self._start
+        self._polls = 0
+        self._poll_time = 0.0
+        self._last = None
+        self._rate = None
+        self._backoff = interval
+        self._stable_since = None
+        self._done = False
+        self._value = None
+
+    def get_value(self):
+        '''Last value read.'''
+        return self._value
+
+    def get_polls(self):
+        return self._polls
+
+    def _numeric(self, value):
+        for v in (value, self._target):
+            if not isinstance(v, numbers.Real) or isinstance(v, bool):
+                return False
+        return True
+
+    def _reached(self, value):
+        if self._numeric(value):
+            return abs(value - self._target) <= self._tolerance
+        return value == self._target
+
+    def _schedule(self, now, value):
+        '''Determine the time of the next poll.'''
+        interval = self._interval
+        if self._numeric(value) and self._last is not None:
+            lastt, lastv = self._last
+            if now > lastt:
+                rate = (value - lastv) / (now - lastt)
+                if self._rate is None:
+                    self._rate = rate
+                else:
+                    self._rate = 0.5 * self._rate + 0.5 * rate
+            distance = abs(self._target - value) - self._tolerance
+            towards = self._rate is not None and \
+                self._rate * (self._target - value) > 0
+            if distance > 0 and towards:
+                # Poll again halfway to the predicted arrival
+                interval = 0.5 * distance / abs(self._rate)
+                self._backoff = self._interval
+            elif distance > 0:
+                # Not moving (yet): back off
+                self._backoff = min(self._backoff * 1.5, self._max_interval)
+                interval = self._backoff
+        elif not self._numeric(value) and not self._reached(value):
+            self._backoff = min(self._backoff * 1.2, self._max_interval)
+            interval = self._backoff
+
+        if self._stable_since is not None:
+            interval = self._interval
+
+        # Do not spend more than ~10% of the time talking to the device
+        if self._polls > 0:
+            interval = max(interval, 10 * self._poll_time / self._polls)
+        interval = min(max(interval, self._interval), self._max_interval)
+
+        if self._timeout is not None:
+            interval = min(interval, self._start + self._timeout - now)
+        self._next_poll = now + max(interval, 0)
+
+    def poll(self):
+        '''
+        Read the value and update the state. Returns True when the
+        condition is met.
+        '''
+        t0 = exact_time()
+        value = self._get()
+        now = exact_time()
+        self._polls += 1
+        self._poll_time += now - t0
+        self._value = value
+
+        if self._reached(value):
+            if self._stable_since is None:
+                self._stable_since = now
+            if now - self._stable_since >= self._stable:
+                self._finish(now)
+                return True
+        else:
+            self._stable_since = None
+
+        if self._timeout is not None and now - self._start >= self._timeout:
+            self._finish(now)
+            raise WaitTimeout('%s did not reach %r within %s s (value %r)' % \
+                (self._name, self._target, self._timeout, value))
+
+        self._schedule(now, value)
+        self._last = (now, value)
+        return False
+
+    def _finish(self, now):
+        self._done = True
+        waited = now - self._start
+        fixed_polls = int(waited / self._interval) + 1
+        _add_stats(self._name, waited, self._polls, fixed_polls)
+        logging.debug(__name__ + ' : %s reached after %.1f s, %d polls',
+            self._name, waited, self._polls)
+
+    def check(self):
+        '''
+        Non-blocking check: polls the device only when a poll is due.
+        Returns True when the condition is met.
+        '''
+        if self._done:
+            return True
+        if exact_time() < self._next_poll:
+            return False
+        return self.poll()
+
+    def get_remaining(self):
+        '''Time until the next poll is due.'''
+        return max(0, self._next_poll - exact_time())
+
+    def wait(self, sleep=None):
+        '''
+        Block until the condition is met, sleeping with qt.msleep() (or
+        sleep(seconds) if given) between polls.
+
+        Output:
+            the last value read
+        '''
+        if sleep is None:
+            import qt
+            sleep = qt.msleep
+        while not self.check():
+            sleep(self.get_remaining())
+        return self._value
+
+def wait_until(param, target=True, tolerance=0, timeout=None, **kwargs):
+    '''
+    Wait until param reaches target within tolerance.
+
+    Input:
+        param (function or (instrument, parameter name)): returns the
+            current value
+        target: value to reach
+        tolerance (float)
+        timeout (float): seconds, raise WaitTimeout when exceeded
+        **kwargs: interval, max_interval, stable, name; see Waiter.
+            sleep: function to sleep with, default qt.msleep
+
+    Output:
+        the last value read
+    '''
+    sleep = kwargs.pop('sleep', None)
+    return Waiter(param, target, tolerance, timeout, **kwargs).wait(sleep)
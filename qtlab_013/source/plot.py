@@ -114,6 +114,11 @@ class Plot(SharedGObject):
         self._last_update = 0
         self._update_hid = None
 
+        # Adaptive update interval, see get_update_interval()
+        self._dirty = True
+        self._render_time = 0.0
+        self._cpu_budget = config.get('plot_cpu_budget', 0.25)
+
         data_args = get_dict_keys(kwargs, ('coorddim', 'coorddims', 'valdim',
             'title', 'offset', 'ofs', 'traceofs', 'surfofs'))
         data_args['update'] = False
@@ -161,6 +166,17 @@ class Plot(SharedGObject):
         kwargs['file'] = filename
         self._data.append(kwargs)
 
+    def set_file_options(self, filename, update=True, **kwargs):
+        '''
+        Change the options, e.g. 'every', of the traces plotted from file
+        <filename>.
+        '''
+        for datadict in self._data:
+            if datadict.get('file', None) == filename:
+                datadict.update(kwargs)
+        if update:
+            self.update()
+
     def set_mintime(self, t):
         self._mintime = t
 
@@ -311,14 +327,20 @@ class Plot(SharedGObject):
 
         Input:
             force (bool): if True force an update, else check whether we
-                would like to autoupdate and whether the last update is longer
-                than 'mintime' ago.
+                would like to autoupdate, whether the data changed and
+                whether the last update is longer than the update interval
+                ago (see get_update_interval()).
+
+        Updates requested while one is pending are coalesced, and no update
+        is sent while the plot engine is still busy with the previous one.
         '''
 
         dt = time.time() - self._last_update
 
         if not force and self._autoupdate is not None and not self._autoupdate:
             return
+        if not force and not self._dirty:
+            return
 
         if self._update_hid is not None:
             if force:
@@ -328,22 +350,24 @@ class Plot(SharedGObject):
                 return
 
         cfgau = config.get('live-plot', True)
-        if force or (cfgau and dt > self._mintime):
+        interval = self.get_update_interval()
+        if force or (cfgau and dt > interval):
             if self.is_busy():
-                self._queue_update(force=force, **kwargs)
+                self._queue_update(0.05, force=force, **kwargs)
                 return
 
             self._last_update = time.time()
+            self._dirty = False
             self._do_update(**kwargs)
 
         # Auto-update later
         elif cfgau:
-            self._queue_update(force=force, **kwargs)
+            self._queue_update(interval - dt, force=force, **kwargs)
 
-    def _queue_update(self, force=False, **kwargs):
+    def _queue_update(self, delay, force=False, **kwargs):
         if self._update_hid is not None:
             return
-        self._update_hid = gobject.timeout_add(int(self._mintime * 1000),
+        self._update_hid = gobject.timeout_add(int(max(delay, 0.01) * 1000),
                 self._delayed_update, force, **kwargs)
 
     def _delayed_update(self, force=True, **kwargs):
@@ -351,13 +375,42 @@ class Plot(SharedGObject):
         self.update(force=force, **kwargs)
         return False
 
+    def _add_render_time(self, dt):
+        '''Record the time the plot engine needed for an update.'''
+        self._render_time = 0.7 * self._render_time + 0.3 * dt
+
+    def get_render_time(self):
+        '''Return the (averaged) time the last updates took to render.'''
+        return self._render_time
+
+    def set_cpu_budget(self, frac):
+        '''
+        Set the maximum fraction of the time the plot engine should spend
+        on updating this plot during automatic updates.
+        '''
+        self._cpu_budget = frac
+
+    def get_cpu_budget(self):
+        return self._cpu_budget
+
+    def get_update_interval(self):
+        '''
+        Return the minimum time between automatic updates: 'mintime', or
+        longer if rendering takes more than the cpu budget.
+        '''
+        if self._cpu_budget > 0:
+            return max(self._mintime, self._render_time / self._cpu_budget)
+        return self._mintime
+
     def _new_data_point_cb(self, sender):
+        self._dirty = True
         try:
             self.update(force=False)
         except Exception, e:
             logging.warning('Failed to update plot %s: %s', self._name, str(e))
 
     def _new_data_block_cb(self, sender):
+        self._dirty = True
         self.update(force=False)
 
     def set_maxpoints(self, val):
@@ -780,13 +833,36 @@ def plot3(*args, **kwargs):
     if ret:
         return graph
 
+_replot_queue = []
+
+def _replot_next():
+    while len(_replot_queue) > 0:
+        name = _replot_queue.pop(0)
+        p = Plot.get_named_list().get(name)
+        if p is None:
+            continue
+        if p.is_busy():
+            # Try again later, without spinning in the idle handler
+            _replot_queue.append(name)
+            gobject.timeout_add(50, _replot_next)
+            return False
+        p.update()
+        return len(_replot_queue) > 0
+    return False
+
 def replot_all():
     '''
-    replot all plots in the plot-list
+    replot all plots in the plot-list.
+
+    The plots are updated one per main loop iteration, so that the gui
+    stays responsive; plots that are still busy are retried later.
     '''
-    plots = Plot.get_named_list()
-    for p in plots:
-        plots[p].update()
+    start = len(_replot_queue) == 0
+    for name in Plot.get_named_list():
+        if name not in _replot_queue:
+            _replot_queue.append(name)
+    if start and len(_replot_queue) > 0:
+        gobject.idle_add(_replot_next)
 
 if config.get('plot_type', 'gnuplot') == 'matplotlib':
     from plot_engines.qtmatplotlib import Plot2D, Plot3D
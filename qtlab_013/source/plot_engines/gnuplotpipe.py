@@ -26,8 +26,10 @@ import logging
 import sys
 import types
 import os
+import gobject
 
 DEFAULT_TIMEOUT = 0.1
+MARKER_POLL_INTERVAL = 10   # ms, Windows only
 
 def on_windows():
     return sys.platform in ('win32', 'cygwin')
@@ -109,6 +111,13 @@ class GnuplotPipe():
         self._reopen_cb = None
         self._popen = None
 
+        self._marker_sent = 0
+        self._marker_seen = 0
+        self._marker_time = None
+        self._marker_reply = None
+        self._marker_hid = None
+        self._last_poll = 0
+
         if type(default_terminal) in (types.StringType, types.UnicodeType):
             self._default_terminal = (default_terminal, '')
         elif default_terminal is not None:
@@ -125,6 +134,7 @@ class GnuplotPipe():
         self._reopen_cb = cb
 
     def close_gnuplot(self):
+        self._stop_marker_watch()
         if self._popen is None:
             return
         try:
@@ -139,6 +149,8 @@ class GnuplotPipe():
 
     def _open_gnuplot(self):
         self.close_gnuplot()
+        self._marker_seen = self._marker_sent
+        self._marker_time = None
 
         args = ['gnuplot']
         if self._persist:
@@ -213,7 +225,8 @@ class GnuplotPipe():
             line = self.readline(timeout)
             if line is None:
                 break
-            ret += line
+            if not self._check_marker(line):
+                ret += line
             i += 1
 
         return ret
@@ -247,6 +260,89 @@ class GnuplotPipe():
 
         return None
 
+    _MARKER = '__qtlab_marker'
+
+    def _check_marker(self, line):
+        '''Return True if line is a reply to send_marker().'''
+        if not line.startswith(self._MARKER):
+            return False
+        try:
+            self._marker_seen = max(self._marker_seen, int(line.split()[1]))
+            self._marker_reply = time.time()
+        except (IndexError, ValueError):
+            pass
+        return True
+
+    def send_marker(self):
+        '''
+        Ask gnuplot to print a marker after processing all earlier commands.
+        Use poll_marker() to see whether it has arrived, without blocking.
+        '''
+        self._marker_sent += 1
+        self._marker_time = time.time()
+        self.cmd('print "%s %d"' % (self._MARKER, self._marker_sent))
+        self._start_marker_watch()
+        return self._marker_sent
+
+    def _start_marker_watch(self):
+        '''
+        Read the marker reply as soon as gnuplot sends it, so that its
+        time stamp is the time gnuplot finished, not the next poll.
+        '''
+        if self._marker_hid is not None or self._popen is None:
+            return
+        if subprocess.mswindows:
+            self._marker_hid = gobject.timeout_add(MARKER_POLL_INTERVAL,
+                    self._marker_watch_cb)
+        else:
+            self._marker_hid = gobject.io_add_watch(self._popen.stderr,
+                    gobject.IO_IN | gobject.IO_HUP, self._marker_watch_cb)
+
+    def _stop_marker_watch(self):
+        if self._marker_hid is not None:
+            gobject.source_remove(self._marker_hid)
+            self._marker_hid = None
+
+    def _marker_watch_cb(self, *args):
+        if self._popen is not None and self._marker_time is not None and \
+                self._marker_seen < self._marker_sent:
+            self.get_output(0)
+        if (len(args) > 1 and args[1] & gobject.IO_HUP) or \
+                self._marker_time is None or \
+                self._marker_seen >= self._marker_sent:
+            self._marker_hid = None
+            return False
+        return True
+
+    def poll_marker(self, timeout=10):
+        '''
+        Check whether gnuplot replied to the last marker. Returns the time
+        gnuplot took to reply if it did (0 if no marker was sent), None if
+        it is still pending.
+        A marker that is not answered within <timeout> seconds is given up.
+        '''
+
+        if self._marker_time is None:
+            return 0
+        if self._marker_seen < self._marker_sent:
+            self.get_output(0)
+            if self._marker_seen >= self._marker_sent:
+                # Not seen by the watch: the reply arrived after the
+                # previous poll at the latest.
+                self._marker_reply = min(self._marker_reply,
+                        max(self._last_poll, self._marker_time))
+        self._last_poll = time.time()
+        if self._marker_seen >= self._marker_sent:
+            dt = self._marker_reply - self._marker_time
+            self._marker_time = None
+            return dt
+        if time.time() - self._marker_time > timeout:
+            logging.warning('Gnuplot did not reply in %d seconds', timeout)
+            self._marker_seen = self._marker_sent
+            self._marker_time = None
+            return timeout
+        return None
+
     def is_responding(self, timeout=DEFAULT_TIMEOUT):
         '''Check whether gnuplot is responding within <timeout> seconds.'''
         self.flush_output()
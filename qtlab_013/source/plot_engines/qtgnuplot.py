@@ -27,6 +27,8 @@ from lib.config import get_config
 config = get_config()
 from lib.namedlist import NamedList
 from lib.network.object_sharer import cache_result
+from lib import temp
+from lib.decimate import Decimator, minmax_indices_x, lttb_indices
 import plot
 
 import gnuplotpipe
@@ -56,6 +58,258 @@ class _GnuPlotList(NamedList):
 
         return item
 
+class _TailWindow():
+    '''
+    Keep a small temporary file with only the visible part of a growing
+    data file: the last <maxtraces> blocks and the last <maxpoints> points
+    of each block.
+
+    The source file is read incrementally; the byte offset up to which it
+    has been processed is remembered, so every update only reads the newly
+    written lines. As long as the visible window only grows, the new lines
+    are appended to the window file, otherwise it is rewritten (which
+    only costs the size of the window).
+    '''
+
+    def __init__(self, filepath):
+        self._src = filepath
+        self._file = temp.File(mode='w')
+        self._file.close()
+        self.reset()
+
+    def reset(self):
+        self._offset = 0
+        self._blocks = [[]]
+        self._trimmed = [0]
+        self._dropped = 0
+        self._written = None
+        self._maxpoints = 0
+        self._maxtraces = 0
+
+    def get_filepath(self):
+        return self._file.name.replace('\\', '/')
+
+    def get_source(self):
+        return self._src
+
+    def get_first_block(self):
+        '''Index in the source of the first block in the window file.'''
+        if self._written is None:
+            return 0
+        return self._written[0][0]
+
+    def _read_new(self):
+        '''Read complete new lines from the source file.'''
+        try:
+            f = open(self._src, 'r')
+        except IOError:
+            return []
+        try:
+            # Start again if the source file was rewritten
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self._offset:
+                self.reset()
+            f.seek(self._offset)
+            buf = f.read()
+        finally:
+            f.close()
+
+        end = buf.rfind('\n')
+        if end == -1:
+            return []
+        self._offset += end + 1
+        return buf[:end + 1].splitlines(True)
+
+    def update(self, maxpoints, maxtraces):
+        '''
+        Process new data and update the window file.
+        Returns the number of new lines.
+        '''
+
+        # Points that were dropped earlier might become visible
+        if self._written is not None and (maxpoints > self._maxpoints or
+                maxtraces > self._maxtraces):
+            self.reset()
+        self._maxpoints = maxpoints
+        self._maxtraces = maxtraces
+
+        lines = self._read_new()
+        for line in lines:
+            if line.startswith('#'):
+                continue
+            if line.strip() == '':
+                if len(self._blocks[-1]) > 0:
+                    self._blocks.append([])
+                    self._trimmed.append(0)
+                continue
+            self._blocks[-1].append(line)
+
+        # Drop blocks that can no longer become visible; keep one extra
+        # since an almost empty last block is not shown.
+        ndrop = len(self._blocks) - maxtraces - 1
+        if ndrop > 0:
+            del self._blocks[:ndrop]
+            del self._trimmed[:ndrop]
+            self._dropped += ndrop
+        for i, block in enumerate(self._blocks):
+            if len(block) > maxpoints:
+                self._trimmed[i] += len(block) - maxpoints
+                del block[:len(block) - maxpoints]
+
+        self._write(maxpoints, maxtraces)
+        return len(lines)
+
+    def _visible(self, maxpoints, maxtraces):
+        '''
+        Return (first block, number of blocks, start point) of the visible
+        part, like the 'every' clause of a full plot command.
+        '''
+        nblocks = len(self._blocks)
+        if nblocks > 1 and len(self._blocks[-1]) + self._trimmed[-1] < 2:
+            nblocks -= 1
+        last = len(self._blocks[nblocks - 1]) + self._trimmed[nblocks - 1]
+        startpoint = max(0, last - maxpoints)
+        startblock = max(0, nblocks - maxtraces)
+        return startblock, nblocks, startpoint
+
+    def _write(self, maxpoints, maxtraces):
+        startblock, nblocks, startpoint = self._visible(maxpoints, maxtraces)
+        key = (self._dropped + startblock, startpoint, sum(self._trimmed))
+
+        # Append if the window still starts at the same place, otherwise
+        # rewrite it.
+        first = startblock
+        mode = 'w'
+        if self._written is not None and self._written[0] == key:
+            lastblock, npoints = self._written[1:]
+            r = lastblock - self._dropped
+            if r < nblocks and npoints >= self._trimmed[r]:
+                first = r
+                mode = 'a'
+
+        self._file.reopen(mode)
+        f = self._file.get_file()
+        try:
+            for i in range(first, nblocks):
+                if mode == 'a' and i == first:
+                    skip = npoints - self._trimmed[i]
+                else:
+                    if i > startblock:
+                        f.write('\n')
+                    skip = max(0, startpoint - self._trimmed[i])
+                f.writelines(self._blocks[i][skip:])
+        finally:
+            self._file.close()
+
+        i = nblocks - 1
+        self._written = (key, self._dropped + i,
+                len(self._blocks[i]) + self._trimmed[i])
+
+    def remove(self):
+        self._file.remove()
+
+class _DecimatedFile():
+    '''
+    Keep a temporary file with a decimated version of the last
+    <maxtraces> blocks of a Data object, see lib.decimate.
+
+    In the full view every block has an incremental Decimator, so new
+    points only cost the time to process those points. When an x range is
+    set only the visible part is decimated again (with buckets equally
+    wide in x); those results are cached until the block or range changes.
+    '''
+
+    def __init__(self, width, method='minmax'):
+        self._width = width
+        self._method = method
+        self._decimators = {}
+        self._cache = {}
+        self._file = temp.File(mode='w')
+        self._file.close()
+        self._first_block = 0
+
+    def get_filepath(self):
+        return self._file.name.replace('\\', '/')
+
+    def get_first_block(self):
+        return self._first_block
+
+    def _block_indices(self, block, x, y, xrange):
+        if xrange is not None and x is not None:
+            key = (block, len(y), xrange)
+            if key not in self._cache:
+                self._cache[key] = minmax_indices_x(x, y, self._width,
+                    xrange[0], xrange[1])
+            return self._cache[key]
+
+        if self._method == 'lttb':
+            key = (block, len(y), None)
+            if key not in self._cache:
+                if x is None:
+                    x = np.arange(len(y))
+                self._cache[key] = lttb_indices(x, y, 2 * self._width)
+            return self._cache[key]
+
+        if block not in self._decimators:
+            self._decimators[block] = Decimator(self._width)
+        dec = self._decimators[block]
+        dec.update(y)
+        return dec.get_indices(y)
+
+    def update(self, data, xcol, ycol, maxtraces, xrange=None):
+        '''
+        Update the decimated file. Returns False if decimation is not
+        useful (too few points) or not possible (data not in memory).
+        '''
+
+        values = data.get_data()
+        if values is None or len(values) == 0 or values.ndim != 2:
+            return False
+
+        nblocks = data.get_nblocks()
+        sizes = [data.get_block_size(i) for i in range(nblocks)]
+        if nblocks > 1 and sizes[-1] < 2:
+            nblocks -= 1
+        startblock = max(0, nblocks - maxtraces)
+        if sum(sizes[startblock:nblocks]) <= 4 * self._width and \
+                xrange is None:
+            return False
+
+        offsets = np.cumsum([0] + sizes)
+        blocks = []
+        for b in range(startblock, nblocks):
+            rows = values[offsets[b]:offsets[b] + sizes[b]]
+            if xcol is None:
+                x = None
+            else:
+                x = rows[:, xcol]
+            idx = self._block_indices(b, x, rows[:, ycol], xrange)
+            blocks.append(rows[idx])
+
+        for b in self._decimators.keys():
+            if b < startblock:
+                del self._decimators[b]
+        for key in self._cache.keys():
+            if key[0] < startblock or (key[0] == nblocks - 1 and
+                    key[1] != sizes[nblocks - 1]):
+                del self._cache[key]
+
+        self._file.reopen('w')
+        f = self._file.get_file()
+        try:
+            for i, rows in enumerate(blocks):
+                if i > 0:
+                    f.write('\n')
+                np.savetxt(f, rows, fmt='%.12g', delimiter='\t')
+        finally:
+            self._file.close()
+
+        self._first_block = startblock
+        return True
+
+    def remove(self):
+        self._file.remove()
+
 class _QTGnuPlot():
     """
     Base class for 2D/3D QT gnuplot classes.
@@ -187,8 +441,32 @@ class _QTGnuPlot():
     def clear(self):
         '''Clear the plot.'''
         self.cmd('clear')
+        for datadict in self._data:
+            for key in ('_tail', '_decimated'):
+                if key in datadict:
+                    datadict.pop(key).remove()
         plot.Plot.clear(self)
 
+    def _get_tail_window(self, datadict, filepath):
+        '''
+        Return the _TailWindow for a data item, or None if the full file
+        should be plotted (binary data, or disabled with the config
+        option 'gnuplot_tail').
+        '''
+
+        if not config.get('gnuplot_tail', True):
+            return None
+        if datadict.get('binary', False) or not os.path.isfile(filepath):
+            return None
+
+        tail = datadict.get('_tail', None)
+        if tail is None or tail.get_source() != filepath:
+            if tail is not None:
+                tail.remove()
+            tail = _TailWindow(filepath)
+            datadict['_tail'] = tail
+        return tail
+
     def quit(self):
         self.cmd('quit')
         self._gnuplot.close_gnuplot()
@@ -348,10 +626,13 @@ class _QTGnuPlot():
 
     def _do_update(self):
         '''
-        Perform an update of the plot.
+        Perform an update of the plot. A marker is sent after the plot
+        command to find out when gnuplot has finished rendering.
         '''
         cmd = self.create_plot_command()
         self.cmd(cmd)
+        if self._gnuplot is not None and cmd != '':
+            self._gnuplot.send_marker()
         return True
 
     def cmd(self, cmdstr):
@@ -363,7 +644,18 @@ class _QTGnuPlot():
         self._gnuplot.live()
 
     def is_busy(self):
-        return not self._gnuplot.is_responding()
+        '''
+        Return whether gnuplot is still rendering the last update. This
+        does not block; the render time is recorded when it has finished.
+        '''
+        if self._gnuplot is None:
+            return False
+        dt = self._gnuplot.poll_marker()
+        if dt is None:
+            return True
+        if dt > 0:
+            self._add_render_time(dt)
+        return False
 
     def set_grid(self, on=True, update=True):
         self.set_property('grid', on, update=update)
@@ -483,6 +775,10 @@ def _parse_style_string(spec, opts):
 class Plot2D(plot.Plot2DBase, _QTGnuPlot):
     '''
     Class to create line plots.
+
+    Large traces can be decimated before they are sent to gnuplot by
+    passing decimate=<width> or with set_decimation(); the default is
+    taken from the config option 'gnuplot_decimate'.
     '''
 
     _STYLES = {
@@ -497,6 +793,9 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
     def __init__(self, *args, **kwargs):
         kwargs['needtempfile'] = True
         kwargs['supportbin'] = config.get('gnuplot_binary', True)
+        self._decimate = kwargs.get('decimate',
+                config.get('gnuplot_decimate', None))
+        self._decimate_method = 'minmax'
         plot.Plot2DBase.__init__(self, *args, **kwargs)
         _QTGnuPlot.__init__(self)
 
@@ -568,6 +867,8 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
                 coorddim = datadict.get('coorddim', 0)
                 valdim = datadict.get('valdim', 1)
                 s += ' using %d:%d' % (coorddim + 1, valdim + 1)
+                if 'every' in datadict:
+                    s += ' every %s' % datadict['every']
                 continue
 
             data = datadict['data']
@@ -584,16 +885,6 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
                 filepath = data.get_filename()
             filepath = filepath.replace('\\','/')
 
-            if len(coorddims) == 0:
-                using = '($%d+%f+%f*column(-1))' % (valdim + 1, ofs, traceofs)
-            elif len(coorddims) == 1:
-                using = '%d:($%d+%f+%f*column(-1))' % (coorddims[0] + 1, valdim + 1, ofs, traceofs)
-            else:
-                logging.error('Need 0 or 1 coordinate dimensions!')
-                continue
-            if yerrdim is not None:
-                using += ':%d' % (yerrdim+1)
-
             npoints = data.get_npoints()
             if datadict.get('with', None) in ['lines']:
                 min_npoints = 2
@@ -608,12 +899,40 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
                 nblocks -= 1
                 npoints_last_block = data.get_block_size(nblocks - 1)
 
-            startpoint = max(0, npoints_last_block - self._maxpoints)
-            startblock = max(0, nblocks - self._maxtraces)
+            tail = None
+            decimated = None
+            if fullpath:
+                decimated = self._get_decimated_file(datadict)
+                if decimated is None:
+                    tail = self._get_tail_window(datadict, filepath)
+            if decimated is not None:
+                filepath = decimated.get_filepath()
+                block = '(column(-1)+%d)' % decimated.get_first_block()
+                every = None
+            elif tail is not None:
+                # The window file contains only the visible points
+                tail.update(self._maxpoints, self._maxtraces)
+                filepath = tail.get_filepath()
+                block = '(column(-1)+%d)' % tail.get_first_block()
+                every = None
+            else:
+                startpoint = max(0, npoints_last_block - self._maxpoints)
+                startblock = max(0, nblocks - self._maxtraces)
+                block = 'column(-1)'
+                if len(coorddims) == 0:
+                    every = "::%d" % (startpoint)
+                else:
+                    every = '::%d:%d' % (startpoint, startblock)
+
             if len(coorddims) == 0:
-                every = "::%d" % (startpoint)
+                using = '($%d+%f+%f*%s)' % (valdim + 1, ofs, traceofs, block)
+            elif len(coorddims) == 1:
+                using = '%d:($%d+%f+%f*%s)' % (coorddims[0] + 1, valdim + 1, ofs, traceofs, block)
             else:
-                every = '::%d:%d' % (startpoint, startblock)
+                logging.error('Need 0 or 1 coordinate dimensions!')
+                continue
+            if yerrdim is not None:
+                using += ':%d' % (yerrdim+1)
 
             if 'top' in datadict:
                 axes = 'x2'
@@ -629,8 +948,9 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
             else:
                 first = False
 
-            s += '"%s" using %s every %s' % \
-                (str(filepath), using, every)
+            s += '"%s" using %s' % (str(filepath), using)
+            if every is not None:
+                s += ' every %s' % every
             s += self._get_trace_options(datadict)
             s += ' axes %s' % axes
 
@@ -639,6 +959,72 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
         else:
             return s
 
+    def set_decimation(self, width=1000, method='minmax', update=True):
+        '''
+        Show large traces decimated to about <width> buckets, keeping the
+        minimum and maximum of every bucket.
+
+        Input:
+            width (int): number of buckets, about the plot width in pixels.
+                None or 0 to disable decimation.
+            method (string): 'minmax' (default) or 'lttb'
+            update (bool): whether to update the plot
+        '''
+
+        if method not in ('minmax', 'lttb'):
+            logging.warning('Unknown decimation method: %s', method)
+            return
+        self._decimate = width
+        self._decimate_method = method
+        for datadict in self._data:
+            if '_decimated' in datadict:
+                datadict.pop('_decimated').remove()
+        if update:
+            self.update()
+
+    def get_decimation(self):
+        return self._decimate
+
+    def _get_xrange(self, datadict):
+        '''Return the numeric range of the x axis of a data item or None.'''
+        if 'top' in datadict:
+            xrange = self.get_property('x2range', None)
+        else:
+            xrange = self.get_property('xrange', None)
+        if xrange is None:
+            return None
+        try:
+            return (float(xrange[0]), float(xrange[1]))
+        except (TypeError, ValueError):
+            return None
+
+    def _get_decimated_file(self, datadict):
+        '''
+        Return an up to date _DecimatedFile for a data item, or None if it
+        should not be decimated.
+        '''
+
+        if not self._decimate or datadict.get('binary', False) or \
+                datadict.get('yerrdim', None) is not None:
+            return None
+
+        coorddims = datadict['coorddims']
+        if len(coorddims) == 1:
+            xcol = coorddims[0]
+            xrange = self._get_xrange(datadict)
+        else:
+            xcol = None
+            xrange = None
+
+        dec = datadict.get('_decimated', None)
+        if dec is None:
+            dec = _DecimatedFile(self._decimate, self._decimate_method)
+            datadict['_decimated'] = dec
+        if not dec.update(datadict['data'], xcol, datadict['valdim'],
+                self._maxtraces, xrange):
+            return None
+        return dec
+
     def save_gp(self, filepath=None, **kwargs):
         '''Save file that can be opened with gnuplot.'''
         s = self.get_commands()
@@ -685,6 +1071,13 @@ class Plot3D(plot.Plot3DBase, _QTGnuPlot):
             ],
             'splotopt': 'with points',
         },
+        'scatter': {
+            'style': [
+                'unset pm3d',
+                'set view map',
+            ],
+            'splotopt': 'with points pointtype 5 palette',
+        },
         'lines': {
             'style': [
                 'unset pm3d',
@@ -788,7 +1181,8 @@ class Plot3D(plot.Plot3DBase, _QTGnuPlot):
     def set_property(self, prop, val, **kwargs):
         if prop == 'style':
             try:
-                self._default_with = self._STYLES[val]['splotopt'].split(' ')[1]
+                self._default_with = ' '.join(
+                    self._STYLES[val]['splotopt'].split(' ')[1:])
             except:
                 self._default_with = ''
 
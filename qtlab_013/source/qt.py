@@ -8,6 +8,7 @@ from lib import config as _config
 from data import Data
 from plot import Plot, plot, plot3, replot_all
 from scripts import Scripts, Script
+from lib.wait import wait_until
 
 config = _config.get_config()
 
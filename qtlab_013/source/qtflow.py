@@ -20,8 +20,10 @@ import gobject
 import gtk
 import logging
 import time
+import threading
 from gettext import gettext as _L
-from lib.misc import exact_time, get_traceback
+from lib.misc import exact_time, get_traceback, TimingStats
+from lib.periodic import PeriodicService
 from lib.network.object_sharer import SharedGObject
 import os
 
@@ -56,6 +58,14 @@ class FlowControl(SharedGObject):
         self._pause = False
         self._exit_handlers = []
         self._callbacks = {}
+        self._periodic = None
+
+        # Set on abort / pause changes to wake up measurement_idle
+        self._wake = threading.Event()
+        self._idle_stats = TimingStats()
+        self._gui_interval = 0.01
+        self._gui_budget = 0.005
+        self._spin = 0.0005
 
     #########
     ### signals
@@ -102,23 +112,86 @@ class FlowControl(SharedGObject):
             # Handle callbacks
             self.run_mainloop(1, wait=False)
 
-    def run_mainloop(self, delay, wait=True, exact=False):
+    def _process_events(self, budget):
         '''
-        Run mainloop for a maximum of <delay> seconds.
-        If wait is True (default), sleep until <delay> seconds have passed.
+        Handle pending GUI events, but stop after <budget> seconds.
+        Returns the time spent.
         '''
         start = exact_time()
         dt = 0
 	# TODO possibly this implementation of event handling using threads
 	# can be done in a better way using ipython-0.11 inputhook support?
         gtk.gdk.threads_enter()
-        while gtk.events_pending() and (not exact or (dt + 0.001) < delay):
-            gtk.main_iteration_do(False)
-            dt = exact_time() - start
-        gtk.gdk.threads_leave()
+        try:
+            while dt < budget and gtk.events_pending():
+                gtk.main_iteration_do(False)
+                dt = exact_time() - start
+        finally:
+            gtk.gdk.threads_leave()
+        return dt
+
+    def _wait_until(self, deadline, spin):
+        '''
+        Wait until <deadline>, waking up early when an abort or pause is
+        requested. The last <spin> seconds are spent busy-waiting, which
+        is more accurate than the OS scheduler.
+        Returns False if the wait was interrupted.
+        '''
+        remaining = deadline - exact_time()
+        if remaining > spin:
+            if self._wake.wait(remaining - spin):
+                self._wake.clear()
+                return False
+        while exact_time() < deadline:
+            pass
+        return True
+
+    def run_mainloop(self, delay, wait=True, exact=False):
+        '''
+        Run mainloop for a maximum of <delay> seconds.
+        If wait is True (default), sleep until <delay> seconds have passed.
+        '''
+        start = exact_time()
+        if exact:
+            budget = delay - self._spin
+        else:
+            budget = delay
+        self._process_events(max(budget, 0))
 
-        if delay > dt and wait:
-            time.sleep(delay - dt)
+        if wait:
+            self._wait_until(start + delay, self._spin)
+
+    def set_idle_options(self, gui_interval=None, gui_budget=None, spin=None):
+        '''
+        Set the timing options of measurement_idle.
+
+        Input:
+            gui_interval (float): maximum time between handling GUI events
+                while waiting, in seconds (default 0.01)
+            gui_budget (float): maximum time spent handling GUI events at
+                once, in seconds (default 0.005)
+            spin (float): busy-wait for the last <spin> seconds of a
+                delay (default 0.0005)
+        '''
+        if gui_interval is not None:
+            self._gui_interval = gui_interval
+        if gui_budget is not None:
+            self._gui_budget = gui_budget
+        if spin is not None:
+            self._spin = spin
+
+    def get_idle_stats(self):
+        '''
+        Return statistics of the lateness (in seconds) of measurement_idle
+        with respect to the requested delay, see lib.misc.TimingStats.
+        '''
+        return self._idle_stats.get_stats()
+
+    def print_idle_stats(self):
+        print self._idle_stats.format()
+
+    def reset_idle_stats(self):
+        self._idle_stats.reset()
 
     def measurement_idle(self, delay=0.0, exact=False, emit_interval=1):
         '''
@@ -129,21 +202,34 @@ class FlowControl(SharedGObject):
 
         It starts by emitting the 'measurement-idle' signal to allow callbacks
         to be executed by the time this function handles the event queue.
-        After that it handles events and sleeps for periods of 10msec. Every
-        <emit_interval> seconds it will emit another measurement-idle signal.
+        Every <emit_interval> seconds it will emit another measurement-idle
+        signal.
 
-        If exact=True, timing should be a bit more precise, but in this case
-        a delay <= 1msec will result in NO gui interaction.
+        Waiting is done until the next deadline: the end of the delay or
+        the next moment GUI events should be handled (see
+        set_idle_options()); an abort or pause request wakes it up
+        immediately. GUI event handling is limited in time so that it does
+        not run past the end of the delay, and the last part of the delay
+        is spent busy-waiting.
+
+        If exact=True the busy-wait period is extended to 2 msec.
+        The lateness of every call is recorded, see get_idle_stats().
         '''
 
         start = exact_time()
+        deadline = start + delay
+        if exact:
+            spin = max(self._spin, 0.002)
+        else:
+            spin = self._spin
 
         self.emit('measurement-idle')
         lastemit = exact_time()
 
         while self._pause:
             self.check_abort()
-            self.run_mainloop(0.01)
+            self._process_events(self._gui_budget)
+            self._wait_until(exact_time() + self._gui_interval, 0)
 
         while True:
             self.check_abort()
@@ -153,15 +239,21 @@ class FlowControl(SharedGObject):
                 self.emit('measurement-idle')
                 lastemit = curtime
 
-            dt = exact_time() - start
-            self.run_mainloop(delay-dt, wait=False, exact=exact)
+            remaining = deadline - exact_time()
+            if delay == 0:
+                self._process_events(self._gui_budget)
+                return
+            self._process_events(min(self._gui_budget, remaining - spin))
 
-            dt = exact_time() - start
-            if dt + 0.01 < delay:
-                time.sleep(0.01)
+            remaining = deadline - exact_time()
+            if remaining <= self._gui_interval + spin:
+                if self._wait_until(deadline, spin):
+                    break
             else:
-                time.sleep(max(0, delay - dt))
-                return
+                self._wait_until(exact_time() + self._gui_interval, 0)
+
+        self._idle_stats.add(exact_time() - deadline)
+        self.check_abort()
 
     def _run_script(self, scriptfile):
         return execfile(scriptfile)
@@ -181,7 +273,17 @@ class FlowControl(SharedGObject):
             except Exception, e:
                 print 'Error in func %s: %s' % (func.__name__, str(e))
 
-    def register_callback(self, time_msec, func, handle=None):
+    def get_periodic_service(self):
+        '''
+        Return the PeriodicService that runs periodic tasks in this
+        process, see lib.periodic.
+        '''
+        if self._periodic is None:
+            self._periodic = PeriodicService(self)
+        return self._periodic
+
+    def register_callback(self, time_msec, func, handle=None, lockclass=None,
+            pause=False):
         '''
         Register a function to be called every time_msec miliseconds.
 
@@ -189,10 +291,15 @@ class FlowControl(SharedGObject):
         callback using 'remove_callback'. If you don't specify a specific
         name, a handle will be generated.
 
+        The callbacks are run by the periodic service. If <lockclass> is
+        given the function is run on the worker thread of that instrument
+        lock class, if <pause> is True it is not run during measurements.
+
         Returns: callback handle
         '''
 
-        hid = gobject.timeout_add(time_msec, func)
+        hid = self.get_periodic_service().add(func, time_msec / 1000.0,
+                lockclass=lockclass, pause=pause)
         if handle is None:
             handle = hid
         self._callbacks[handle] = hid
@@ -203,13 +310,17 @@ class FlowControl(SharedGObject):
         Remove a callback that was created with 'register_callback'
         '''
         if handle not in self._callbacks:
-            logging.warning('Callback %s not found')
+            logging.warning('Callback %s not found', handle)
             return False
 
-        gobject.source_remove(self._callbacks[handle])
+        self.get_periodic_service().remove(self._callbacks[handle])
         del self._callbacks[handle]
         return True
 
+    def get_callback_stats(self):
+        '''Return runtime and missed-deadline stats of periodic tasks.'''
+        return self.get_periodic_service().get_stats()
+
     ############
     ### status
     ############
@@ -250,6 +361,7 @@ class FlowControl(SharedGObject):
     def set_abort(self):
         '''Request an abort.'''
         self._abort = True
+        self._wake.set()
 
     def is_paused(self):
         return self._pause
@@ -257,6 +369,7 @@ class FlowControl(SharedGObject):
     def set_pause(self, pause):
         '''Set / unset pause state.'''
         self._pause = pause
+        self._wake.set()
 
     def start_gui(self):
         import qt